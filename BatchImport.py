@@ -0,0 +1,504 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import importlib
+
+if __name__ == "__main__" and not __package__:
+    # Run directly (blender -b -P BatchImport.py -- ...). Import the add-on
+    # package this file is in, and run the package's copy of this module.
+    _addon_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.dirname(_addon_dir))
+    _module = importlib.import_module(os.path.basename(_addon_dir) + ".BatchImport")
+    sys.exit(_module.main(_module.get_script_args()))
+
+import json
+import time
+import types
+import argparse
+import traceback
+import collections
+import concurrent.futures
+import bpy
+from .MeshCache import MeshCache
+from .PDBDownload import PDBMirror
+from . import Importer
+from . import VMDSession
+from .Profiling import ImportProfile, stage
+from . import FileBasedPreferences
+
+# Headless batch import, without the import dialog. Run it with Blender:
+#
+#     blender -b -P /path/to/blendmol/BatchImport.py -- manifest.txt --out-dir out
+#
+# The manifest is a text file with one PDB ID (downloaded) or filename per
+# line, or a JSON file like this:
+#
+#     {
+#         "settings": {"protein_surface": false, "protein_sticks": true},
+#         "entries": [
+#             "1XDN",
+#             {"input": "/data/my.pdb", "name": "my", "settings": {...}}
+#         ]
+#     }
+#
+# Settings not in the manifest (or given with --set) take the import dialog's
+# defaults, and the VMD path comes from the saved BlendMol preferences (or
+# --vmd). Each structure is saved to its own .blend (or .glb) file. The VMD
+# stage of several structures runs at the same time (--jobs), while the main
+# thread adds the objects of finished ones. A JSON report with the timing of
+# every structure, and the error of any that failed, is updated as the batch
+# goes. Open a template .blend file first (blender -b template.blend -P ...) to
+# keep its camera, lights, etc. in every output file.
+
+
+def get_script_args():
+    """
+    The command-line arguments meant for this script (after "--").
+
+    :returns: The arguments.
+    :rtype: :class:`list`
+    """
+
+    if "--" in sys.argv:
+        return sys.argv[sys.argv.index("--") + 1 :]
+    return []
+
+
+def get_default_settings():
+    """
+    The settings the import dialog starts with, read from the definitions of
+    its properties.
+
+    :returns: A dictionary of the settings.
+    :rtype: :class:`dict`
+    """
+
+    from . import ImportVMD
+
+    settings = {}
+    for name, prop in ImportVMD.__annotations__.items():
+        # Blender 2.93+ defers properties. Older versions use tuples.
+        keywords = getattr(prop, "keywords", None)
+        if keywords is None:
+            keywords = prop[1]
+        if "default" in keywords:
+            settings[name] = keywords["default"]
+
+    # Like the import dialog, take the VMD settings from the preferences.
+    prefs = FileBasedPreferences.read_preferences_file()
+    for name in ["vmd_exec_path", "vmd_msms_repr", "vmd_processes"]:
+        settings[name] = prefs[name]
+
+    return settings
+
+
+def read_manifest(filename):
+    """
+    Read a manifest of structures to import.
+
+    :param str filename: The manifest (JSON, or text with one PDB ID or
+                filename per line).
+
+    :returns: The settings shared by all the entries, and a list of entries
+              (dictionaries with "input", "name" and "settings" keys).
+    :rtype: :class:`tuple`
+    """
+
+    if filename.lower().endswith(".json"):
+        manifest = json.load(open(filename, "r"))
+        shared_settings = manifest.get("settings", {})
+        raw_entries = manifest.get("entries", [])
+    else:
+        shared_settings = {}
+        raw_entries = [
+            line.strip()
+            for line in open(filename, "r")
+            if line.strip() != "" and not line.strip().startswith("#")
+        ]
+
+    manifest_dir = os.path.dirname(os.path.abspath(filename))
+    entries = []
+    for raw_entry in raw_entries:
+        if not isinstance(raw_entry, dict):
+            raw_entry = {"input": raw_entry}
+        entry = {
+            "input": raw_entry["input"],
+            "name": raw_entry.get(
+                "name", os.path.splitext(os.path.basename(raw_entry["input"]))[0]
+            ),
+            "settings": raw_entry.get("settings", {}),
+        }
+        if not Importer.is_pdb_id(entry["input"]):
+            # Relative paths are relative to the manifest.
+            entry["input"] = os.path.join(manifest_dir, entry["input"])
+        entries.append(entry)
+
+    return shared_settings, entries
+
+
+def parse_setting(text):
+    """
+    Parse a --set argument.
+
+    :param str text: The argument (e.g., "protein_surface=false").
+
+    :returns: The setting name and value.
+    :rtype: :class:`tuple`
+    """
+
+    name, value = text.split("=", 1)
+    try:
+        value = json.loads(value)
+    except ValueError:
+        # Not JSON, so just a string (e.g., a path).
+        pass
+    return name.strip(), value
+
+
+def run_entry_vmd_stage(
+    entry,
+    settings,
+    mesh_cache,
+    downloads,
+    session_pool,
+    profile=None,
+    mesh_format=None,
+):
+    """
+    The part of importing one structure that can run in a thread: wait for
+    its download if it is a PDB ID, and have VMD make its meshes.
+
+    :param dict entry: The manifest entry.
+    :param types.SimpleNamespace settings: The import settings.
+    :param MeshCache mesh_cache: The mesh cache, or None.
+    :param dict downloads: The prefetched PDB IDs (futures of filenames, by
+                uppercase ID).
+    :param VMDSessionPool session_pool: Persistent VMD processes, or None.
+    :param ImportProfile profile: Times the stages of the import, or None.
+    :param MeshFormat mesh_format: How to save the meshes, or None for the
+                default.
+
+    :returns: The VMD interface, the absolute filename, and the seconds spent
+              waiting for the download and in VMD.
+    :rtype: :class:`tuple`
+    """
+
+    start = time.time()
+    filepath = entry["input"]
+    if Importer.is_pdb_id(filepath):
+        with stage(profile, "download"):
+            filepath = downloads[os.path.basename(filepath).upper()].result()
+    download_seconds = time.time() - start
+
+    if not os.path.exists(filepath):
+        raise IOError(filepath + " does not exist!")
+    filepath = os.path.abspath(filepath)
+    settings.filepath = filepath
+
+    start = time.time()
+    if session_pool is not None and session_pool.exec_path != settings.vmd_exec_path:
+        # This entry asks for a different VMD.
+        session_pool = None
+    vmd = Importer.run_vmd_stage(
+        settings,
+        filepath,
+        settings.vmd_exec_path,
+        mesh_cache,
+        session_pool,
+        profile,
+        mesh_format,
+    )
+    vmd_seconds = time.time() - start
+
+    return vmd, filepath, download_seconds, vmd_seconds
+
+
+def clear_objects(obj_names):
+    """
+    Remove the objects a structure added, and the data nothing uses anymore,
+    so the next structure starts from the same scene.
+
+    :param list obj_names: The names of the objects.
+    """
+
+    for obj_name in obj_names:
+        if obj_name in bpy.data.objects:
+            bpy.data.objects.remove(bpy.data.objects[obj_name], do_unlink=True)
+
+    for collection in [bpy.data.meshes, bpy.data.materials, bpy.data.node_groups]:
+        for block in list(collection):
+            if block.users == 0:
+                collection.remove(block)
+
+
+def save_output(out_dir, name, output_format):
+    """
+    Save the scene.
+
+    :param str out_dir: The output directory.
+    :param str name: The name of the structure.
+    :param str output_format: "blend" or "gltf".
+
+    :returns: The output filename.
+    :rtype: :class:`str`
+    """
+
+    if output_format == "gltf":
+        filename = os.path.join(out_dir, name + ".glb")
+        bpy.ops.export_scene.gltf(filepath=filename)
+    else:
+        filename = os.path.join(out_dir, name + ".blend")
+        bpy.ops.wm.save_as_mainfile(filepath=filename, copy=True)
+    return filename
+
+
+def finish_entry(entry, future, out_dir, output_format):
+    """
+    Wait for the VMD stage of one structure, then add its objects, save them
+    and remove them again. Runs on the main thread.
+
+    :param dict entry: The manifest entry.
+    :param concurrent.futures.Future future: The VMD stage.
+    :param str out_dir: The output directory.
+    :param str output_format: "blend" or "gltf".
+
+    :returns: The report of this structure.
+    :rtype: :class:`dict`
+    """
+
+    report = {"name": entry["name"], "input": entry["input"], "status": "ok"}
+    existing_obj_names = set([obj.name for obj in bpy.data.objects])
+    try:
+        settings = entry["settings_obj"]
+        vmd, filepath, download_seconds, vmd_seconds = future.result()
+        report["download_seconds"] = download_seconds
+        report["vmd_seconds"] = vmd_seconds
+
+        start = time.time()
+        new_obj_names = Importer.run_blender_stage(
+            vmd, settings, filepath, settings.vmd_exec_path
+        )
+        report["blender_seconds"] = time.time() - start
+        report["num_objects"] = len(new_obj_names)
+
+        start = time.time()
+        report["output"] = save_output(out_dir, entry["name"], output_format)
+        report["save_seconds"] = time.time() - start
+
+        if vmd.profile is not None:
+            vmd.profile.finish()
+            report["profile"] = vmd.profile.to_dict()
+    except Exception as e:
+        report["status"] = "failed"
+        report["error"] = str(e)
+        report["traceback"] = traceback.format_exc()
+        print("FAILED: " + entry["input"] + ": " + str(e))
+    finally:
+        # Also catches the objects of a structure that failed halfway.
+        clear_objects(
+            [obj.name for obj in bpy.data.objects if not obj.name in existing_obj_names]
+        )
+
+    return report
+
+
+def write_report(filename, reports, start):
+    """
+    Write the batch report.
+
+    :param str filename: The JSON filename.
+    :param list reports: The reports of the structures done so far.
+    :param float start: When the batch started (time.time()).
+    """
+
+    num_failed = len([r for r in reports if r["status"] != "ok"])
+    json.dump(
+        {
+            "total_seconds": time.time() - start,
+            "num_ok": len(reports) - num_failed,
+            "num_failed": num_failed,
+            "entries": reports,
+        },
+        open(filename, "w"),
+        indent=2,
+    )
+
+
+def main(args):
+    """
+    Run a batch import.
+
+    :param list args: The command-line arguments (after "--").
+
+    :returns: The exit code (0 if every structure was imported, else 1).
+    :rtype: :class:`int`
+    """
+
+    parser = argparse.ArgumentParser(
+        prog="blender -b -P BatchImport.py --",
+        description="Import many PDB IDs/files with BlendMol, without the UI.",
+    )
+    parser.add_argument("manifest", help="JSON or text manifest of structures.")
+    parser.add_argument("--out-dir", default=".", help="Where to save the files.")
+    parser.add_argument(
+        "--format", default="blend", choices=["blend", "gltf"], help="Output format."
+    )
+    parser.add_argument("--vmd", default=None, help="The VMD executable.")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=2,
+        help="How many structures VMD works on at the same time.",
+    )
+    parser.add_argument("--report", default=None, help="The JSON report file.")
+    parser.add_argument(
+        "--no-mesh-cache", action="store_true", help="Don't use the mesh cache."
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Add the timings of every import stage to the report.",
+    )
+    parser.add_argument(
+        "--no-reuse-vmd",
+        action="store_true",
+        help="Start a new VMD for every structure.",
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="An import setting for every structure (e.g., protein_ribbon=false).",
+    )
+    args = parser.parse_args(args)
+
+    # The trajectory and level-of-detail properties must exist, even if the
+    # add-on isn't enabled.
+    if not hasattr(bpy.types.Object, "blendmol_trajectory_base"):
+        from . import register
+
+        register()
+
+    shared_settings, entries = read_manifest(args.manifest)
+    defaults = get_default_settings()
+    defaults.update(shared_settings)
+    defaults.update(dict(parse_setting(text) for text in args.set))
+    if args.vmd is not None:
+        defaults["vmd_exec_path"] = args.vmd
+
+    prefs = FileBasedPreferences.read_preferences_file()
+    mesh_cache = None
+    if prefs["use_mesh_cache"] and not args.no_mesh_cache:
+        from . import get_mesh_cache_dir
+
+        mesh_cache = MeshCache(
+            get_mesh_cache_dir(), prefs["mesh_cache_size_mb"] * 1024 * 1024
+        )
+
+    mesh_format = Importer.get_mesh_format(
+        prefs["mesh_compression"], prefs["quantize_meshes"]
+    )
+
+    # Keep VMD running between structures. Each structure can use
+    # vmd_processes of them at once.
+    session_pool = None
+    if prefs["reuse_vmd"] and not args.no_reuse_vmd:
+        session_pool = VMDSession.get_pool(
+            defaults["vmd_exec_path"],
+            args.jobs * defaults["vmd_processes"],
+            prefs["vmd_session_jobs"],
+        )
+
+    # Start every download now, so structures never wait on each other's.
+    # The files are kept in the local mirror for next time.
+    from . import get_pdb_mirror_dir
+
+    pdb_mirror = PDBMirror(
+        get_pdb_mirror_dir(),
+        prefs["pdb_mirror_size_mb"] * 1024 * 1024,
+        prefs["pdb_mirror_source"],
+    )
+    pdb_ids = [
+        os.path.basename(entry["input"])
+        for entry in entries
+        if Importer.is_pdb_id(entry["input"])
+    ]
+    downloads, download_executor = pdb_mirror.prefetch(pdb_ids)
+
+    if not os.path.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+    report_filename = args.report
+    if report_filename is None:
+        report_filename = os.path.join(args.out_dir, "blendmol_batch_report.json")
+
+    start = time.time()
+    reports = []
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        for entry in entries:
+            settings = dict(defaults)
+            settings.update(entry["settings"])
+            entry["settings_obj"] = types.SimpleNamespace(filepath="", **settings)
+            profile = None
+            if args.profile or prefs["profile_imports"]:
+                profile = ImportProfile(entry["name"])
+            pending.append(
+                (
+                    entry,
+                    executor.submit(
+                        run_entry_vmd_stage,
+                        entry,
+                        entry["settings_obj"],
+                        mesh_cache,
+                        downloads,
+                        session_pool,
+                        profile,
+                        mesh_format,
+                    ),
+                )
+            )
+
+            # Don't let VMD get too far ahead of Blender, so the meshes
+            # waiting to be imported don't pile up on disk.
+            while len(pending) >= 2 * args.jobs:
+                reports.append(
+                    finish_entry(*pending.popleft(), args.out_dir, args.format)
+                )
+                write_report(report_filename, reports, start)
+
+        while len(pending) > 0:
+            reports.append(finish_entry(*pending.popleft(), args.out_dir, args.format))
+            write_report(report_filename, reports, start)
+    download_executor.shutdown()
+    pdb_mirror.unpin(pdb_ids)
+
+    write_report(report_filename, reports, start)
+    num_failed = len([r for r in reports if r["status"] != "ok"])
+    print(
+        "Imported "
+        + str(len(reports) - num_failed)
+        + " of "
+        + str(len(reports))
+        + " structures. Report: "
+        + report_filename
+    )
+
+    return 0 if num_failed == 0 else 1
@@ -0,0 +1,364 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import zlib
+import lzma
+import struct
+import numpy
+from .MeshArrays import MeshArrays
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# A compact binary file for the meshes VMD makes. VMD writes ASCII Wavefront
+# OBJ files, several times bigger than the geometry they describe and slow to
+# parse. Each one is converted to a BlendMol mesh (.bmm) file as soon as it is
+# read, and the mesh caches (MeshCache.py, TrajectoryCache.py) store those
+# instead.
+#
+# A file is a short header, then one block per array: float32 vertices (or
+# 16-bit integers, if quantized), uint32 polygon corners, the material of each
+# polygon (the smallest unsigned type that fits) and the RGBA color of each
+# material. Arrays that are the same number throughout (e.g., every polygon is
+# a triangle) aren't stored at all. Uncompressed blocks are aligned, so they
+# are memory-mapped (numpy.memmap) instead of read, and can go straight to
+# foreach_set(). Compressed blocks are byte-shuffled first (like Blosc), which
+# makes float data compress much better. zlib and lzma come with Python; zstd
+# and lz4 are used if the zstandard or lz4 modules are installed.
+#
+#     magic (8 bytes) | header length (uint32) | header (JSON) | arrays
+
+MAGIC = b"BLNDMSH1"
+MESH_EXT = ".bmm"
+
+# Array blocks start at multiples of this (in bytes), so they can be
+# memory-mapped.
+ALIGNMENT = 64
+
+# The number of bits of quantized vertex coordinates.
+QUANTIZE_BITS = 16
+
+
+def zstd_compress(data):
+    """
+    Compress bytes with zstd.
+
+    :param bytes data: The bytes.
+
+    :returns: The compressed bytes.
+    :rtype: :class:`bytes`
+    """
+
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+def zstd_decompress(data):
+    """
+    Decompress bytes compressed with zstd_compress().
+
+    :param bytes data: The compressed bytes.
+
+    :returns: The bytes.
+    :rtype: :class:`bytes`
+    """
+
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+# The compression methods: (compress, decompress), or None if the module
+# isn't installed.
+COMPRESSIONS = {
+    "NONE": (None, None),
+    "ZLIB": (lambda data: zlib.compress(data, 6), zlib.decompress),
+    "LZMA": (lambda data: lzma.compress(data, preset=1), lzma.decompress),
+    "ZSTD": (zstd_compress, zstd_decompress) if zstandard is not None else None,
+    "LZ4": (lz4.frame.compress, lz4.frame.decompress) if lz4 is not None else None,
+}
+
+
+def get_available_compressions():
+    """
+    The compression methods that can be used here.
+
+    :returns: Their names.
+    :rtype: :class:`list`
+    """
+
+    return [name for name, methods in COMPRESSIONS.items() if methods is not None]
+
+
+def get_uint_dtype(max_value):
+    """
+    The smallest unsigned integer type that can hold a value.
+
+    :param int max_value: The value.
+
+    :returns: The type (little endian).
+    :rtype: :class:`str`
+    """
+
+    for dtype in ["<u1", "<u2", "<u4"]:
+        if max_value <= numpy.iinfo(dtype).max:
+            return dtype
+    return "<u8"
+
+
+def shuffle_bytes(array):
+    """
+    Group the first bytes of every item, then the second bytes, etc.
+    Neighboring floats share their high bytes, so this compresses better.
+
+    :param numpy.ndarray array: The array.
+
+    :returns: The shuffled bytes.
+    :rtype: :class:`bytes`
+    """
+
+    itemsize = array.dtype.itemsize
+    raw = numpy.ascontiguousarray(array).view(numpy.uint8).reshape(-1, itemsize)
+    return raw.T.tobytes()
+
+
+def unshuffle_bytes(data, dtype, shape):
+    """
+    Undo shuffle_bytes().
+
+    :param bytes data: The shuffled bytes.
+    :param str dtype: The type of the items.
+    :param list shape: The shape of the array.
+
+    :returns: The array.
+    :rtype: :class:`numpy.ndarray`
+    """
+
+    itemsize = numpy.dtype(dtype).itemsize
+    raw = numpy.frombuffer(data, dtype=numpy.uint8).reshape(itemsize, -1)
+    return raw.T.copy().view(dtype).reshape(shape)
+
+
+def save_mesh(filename, mesh_arrays, compression="NONE", quantize_bits=None):
+    """
+    Save a mesh to a binary mesh file. The file is written under a temporary
+    name and then renamed, so a half-written file is never seen.
+
+    :param str filename: The filename.
+    :param MeshArrays mesh_arrays: The mesh.
+    :param str compression: "NONE", "ZLIB", "LZMA", "ZSTD" or "LZ4".
+               Defaults to "NONE" (the file can be memory-mapped). Falls back
+               to "ZLIB" if the module isn't installed.
+    :param int quantize_bits: Store vertex coordinates as integers with this
+               many bits (8 or 16) on a grid spanning the mesh, or None
+               (the default) to store float32.
+    """
+
+    if COMPRESSIONS.get(compression) is None:
+        print(compression + " compression is not available. Using ZLIB.")
+        compression = "ZLIB"
+    compress = COMPRESSIONS[compression][0]
+
+    header = {
+        "version": 1,
+        "compression": compression,
+        "num_vertices": mesh_arrays.num_vertices,
+        "num_polygons": mesh_arrays.num_polygons,
+        "material_names": mesh_arrays.material_names,
+        "smooth": bool(mesh_arrays.smooth),
+        "constants": {},
+        "quantization": None,
+        "arrays": {},
+    }
+
+    arrays = {}
+    vertices = mesh_arrays.vertices
+    if quantize_bits is not None and len(vertices) > 0:
+        low = vertices.min(axis=0).astype(numpy.float64)
+        step = (vertices.max(axis=0) - low) / float(2**quantize_bits - 1)
+        step[step == 0] = 1.0
+        arrays["vertices"] = numpy.round((vertices - low) / step).astype(
+            get_uint_dtype(2**quantize_bits - 1)
+        )
+        header["quantization"] = {"origin": low.tolist(), "step": step.tolist()}
+    else:
+        arrays["vertices"] = vertices.astype("<f4")
+    arrays["loop_vertex_indices"] = mesh_arrays.loop_vertex_indices.astype("<u4")
+    arrays["material_colors"] = mesh_arrays.material_colors.astype("<f4")
+
+    for name in ["loop_totals", "material_indices"]:
+        values = getattr(mesh_arrays, name)
+        if len(values) > 0 and (values == values[0]).all():
+            header["constants"][name] = int(values[0])
+        elif len(values) > 0:
+            arrays[name] = values.astype(get_uint_dtype(int(values.max())))
+        else:
+            arrays[name] = values.astype("<u1")
+
+    # Lay out the blocks.
+    blocks = []
+    offset = 0
+    for name, array in arrays.items():
+        if compress is None:
+            data = numpy.ascontiguousarray(array).tobytes()
+        else:
+            data = compress(shuffle_bytes(array))
+        header["arrays"][name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+            "nbytes": len(data),
+        }
+        padding = -len(data) % ALIGNMENT
+        blocks.append(data + b"\0" * padding)
+        offset = offset + len(data) + padding
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    prefix = MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes
+    prefix = prefix + b"\0" * (-len(prefix) % ALIGNMENT)
+
+    tmp_filename = filename + ".partial"
+    with open(tmp_filename, "wb") as f:
+        f.write(prefix)
+        for block in blocks:
+            f.write(block)
+    os.replace(tmp_filename, filename)
+
+
+def read_header(filename):
+    """
+    Read the header of a binary mesh file.
+
+    :param str filename: The filename.
+
+    :returns: The header, and where the array blocks start (in bytes).
+    :rtype: :class:`tuple`
+    """
+
+    with open(filename, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(filename + " is not a BlendMol mesh file.")
+        (header_length,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(header_length).decode("utf-8"))
+    data_start = len(MAGIC) + 4 + header_length
+    return header, data_start + (-data_start % ALIGNMENT)
+
+
+def load_mesh(filename, mmap=True):
+    """
+    Load a binary mesh file.
+
+    :param str filename: The filename.
+    :param bool mmap: Memory-map uncompressed arrays instead of reading them.
+               Defaults to True.
+
+    :returns: The mesh.
+    :rtype: :class:`MeshArrays`
+    """
+
+    header, data_start = read_header(filename)
+    decompress = None
+    if header["compression"] != "NONE":
+        if COMPRESSIONS.get(header["compression"]) is None:
+            raise ValueError(
+                filename + " needs " + header["compression"] + " to be installed."
+            )
+        decompress = COMPRESSIONS[header["compression"]][1]
+
+    arrays = {}
+    with open(filename, "rb") as f:
+        for name, info in header["arrays"].items():
+            shape = tuple(info["shape"])
+            if info["nbytes"] == 0:
+                arrays[name] = numpy.zeros(shape, dtype=info["dtype"])
+            elif decompress is None and mmap:
+                arrays[name] = numpy.memmap(
+                    filename,
+                    dtype=info["dtype"],
+                    mode="r",
+                    offset=data_start + info["offset"],
+                    shape=shape,
+                )
+            else:
+                f.seek(data_start + info["offset"])
+                data = f.read(info["nbytes"])
+                if decompress is None:
+                    arrays[name] = numpy.frombuffer(data, dtype=info["dtype"])
+                    arrays[name] = arrays[name].reshape(shape)
+                else:
+                    arrays[name] = unshuffle_bytes(
+                        decompress(data), info["dtype"], shape
+                    )
+
+    for name, value in header["constants"].items():
+        arrays[name] = numpy.full(header["num_polygons"], value, dtype=numpy.int32)
+
+    vertices = arrays["vertices"]
+    if header["quantization"] is not None:
+        vertices = numpy.array(
+            header["quantization"]["origin"], dtype=numpy.float32
+        ) + vertices.astype(numpy.float32) * numpy.array(
+            header["quantization"]["step"], dtype=numpy.float32
+        )
+
+    return MeshArrays(
+        vertices=vertices,
+        # The same bytes (no copy), since indices are far below 2**31.
+        loop_vertex_indices=arrays["loop_vertex_indices"].view("<i4"),
+        loop_totals=arrays["loop_totals"],
+        material_indices=arrays["material_indices"],
+        material_names=header["material_names"],
+        material_colors=arrays["material_colors"],
+        smooth=header["smooth"],
+    )
+
+
+class MeshFormat:
+    """
+    How meshes are saved: the compression, and whether the vertices are
+    quantized.
+    """
+
+    def __init__(self, compression="NONE", quantize_bits=None):
+        """
+        Initialize the format.
+
+        :param str compression: "NONE", "ZLIB", "LZMA", "ZSTD" or "LZ4".
+                   Defaults to "NONE".
+        :param int quantize_bits: The number of bits of quantized vertex
+                   coordinates, or None (the default) not to quantize them.
+        """
+
+        self.compression = compression
+        self.quantize_bits = quantize_bits
+
+    def save(self, filename, mesh_arrays):
+        """
+        Save a mesh in this format.
+
+        :param str filename: The filename.
+        :param MeshArrays mesh_arrays: The mesh.
+        """
+
+        save_mesh(filename, mesh_arrays, self.compression, self.quantize_bits)
@@ -0,0 +1,145 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import heapq
+import numpy
+from .SpatialGrid import SpatialGrid
+
+# Batches of chains. VMD renders every representation once per chain, so a
+# structure with hundreds of chains (ribosomes, cryo-EM assemblies) makes
+# thousands of small mesh files. Past a limit, the chains are instead merged
+# into batches with about the same number of atoms (largest chain first, each
+# into the lightest batch), and each batch is rendered as one mesh. The chain
+# of every polygon is kept as a face attribute, found from the nearest atom.
+
+# What the name of a batch starts with (e.g., "batch1"). The mesh files of
+# a batch are named like those of a chain, e.g., "prot_nuc_ribb_batch1".
+BATCH_PREFIX = "batch"
+
+# Polygons farther than this (Angstroms) from every atom of their batch get
+# no chain (-1).
+CHAIN_LABEL_CUTOFF = 6.0
+
+
+def make_chain_batches(chain_atoms, max_batches, keep_separate=()):
+    """
+    Group chains into batches with about the same number of atoms, if there
+    are more than max_batches of them.
+
+    :param dict chain_atoms: The number of atoms of each chain.
+    :param int max_batches: The most batches (or single chains) to make.
+    :param list keep_separate: Chains that must stay on their own (e.g.,
+                copies of another chain). Optional.
+
+    :returns: Maps the name of each batch to its chains. Chains that aren't
+              batched are their own batch, named after the chain.
+    :rtype: :class:`dict`
+    """
+
+    batches = {}
+    rest = []
+    for chain in sorted(chain_atoms):
+        if chain in keep_separate:
+            batches[chain] = [chain]
+        else:
+            rest.append(chain)
+
+    if len(rest) <= max_batches:
+        for chain in rest:
+            batches[chain] = [chain]
+        return batches
+
+    # Largest chain first, each into the batch with the fewest atoms so far.
+    members = [[] for _ in range(max_batches)]
+    heap = [(0, i) for i in range(max_batches)]
+    for chain in sorted(rest, key=lambda c: (-chain_atoms[c], c)):
+        num_atoms, i = heapq.heappop(heap)
+        members[i].append(chain)
+        heapq.heappush(heap, (num_atoms + chain_atoms[chain], i))
+
+    for i, chains in enumerate(members):
+        batches[BATCH_PREFIX + str(i + 1)] = sorted(chains)
+    return batches
+
+
+def assign_batches(batches, chain_atoms, num_processes):
+    """
+    Split batches between VMD processes, so each renders about the same
+    number of atoms.
+
+    :param dict batches: What make_chain_batches() returned.
+    :param dict chain_atoms: The number of atoms of each chain.
+    :param int num_processes: The number of VMD processes.
+
+    :returns: The names of the batches of each process.
+    :rtype: :class:`list`
+    """
+
+    sizes = {
+        name: sum([chain_atoms[chain] for chain in chains])
+        for name, chains in batches.items()
+    }
+    assigned = [[] for _ in range(num_processes)]
+    heap = [(0, i) for i in range(num_processes)]
+    for name in sorted(batches, key=lambda n: (-sizes[n], n)):
+        num_atoms, i = heapq.heappop(heap)
+        assigned[i].append(name)
+        heapq.heappush(heap, (num_atoms + sizes[name], i))
+    return [sorted(names) for names in assigned]
+
+
+class ChainLabeler:
+    """
+    Finds the chain of every polygon of a batch's meshes.
+    """
+
+    def __init__(self, structure, chains):
+        """
+        Index the atoms of a batch.
+
+        :param PDBStructure structure: The structure.
+        :param list chains: The chains of the batch.
+        """
+
+        self.chains = list(chains)
+        chain_idxs = {chain: i for i, chain in enumerate(self.chains)}
+        atom_chain_idxs = numpy.array(
+            [chain_idxs.get(chain, -1) for chain in structure.chains.tolist()],
+            dtype=numpy.int32,
+        )
+        in_batch = atom_chain_idxs >= 0
+        self.atom_chain_idxs = atom_chain_idxs[in_batch]
+        self.grid = SpatialGrid(structure.coords[in_batch], CHAIN_LABEL_CUTOFF)
+
+    def label(self, mesh_arrays):
+        """
+        Set the chain of every polygon of a mesh.
+
+        :param MeshArrays mesh_arrays: The mesh, in Angstroms. Its chains and
+                   polygon_chains are set.
+        """
+
+        polygon_chains = numpy.full(mesh_arrays.num_polygons, -1, dtype=numpy.int32)
+        if mesh_arrays.num_polygons > 0:
+            centers = mesh_arrays.get_polygon_centers()
+            nearest = self.grid.nearest(centers, CHAIN_LABEL_CUTOFF)
+            found = nearest >= 0
+            polygon_chains[found] = self.atom_chain_idxs[nearest[found]]
+
+        mesh_arrays.chains = self.chains
+        mesh_arrays.polygon_chains = polygon_chains
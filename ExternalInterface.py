@@ -20,8 +20,23 @@ import os
 import tempfile
 import shutil
 import glob
+import math
 import bpy
+import bmesh
 import mathutils
+import numpy
+from .ObjParser import parse_obj
+from .BinaryMesh import MESH_EXT, MeshFormat, load_mesh
+from .MeshArrays import REMOVE_DOUBLES_THRESHOLD, MeshArrays, concatenate_meshes
+from .Symmetry import split_object_name
+from .LevelOfDetail import LOD_TIERS, LOD_SUFFIX, split_lod_name, link_lod_meshes
+from .SurfaceTiles import (
+    DEFAULT_TILE_SIZE,
+    SEAM_WELD_DISTANCE,
+    split_tile_name,
+    stitch_tiles,
+)
+from .Profiling import stage
 
 
 class ExternalInterface:
@@ -30,6 +45,31 @@ class ExternalInterface:
     programs (VMD).
     """
 
+    # The ImportProfile that times the stages of the import, or None.
+    profile = None
+
+    # How the OBJ files are converted to binary mesh files.
+    mesh_format = MeshFormat()
+
+    # Whether the meshes of a representation's chains are merged into one
+    # object, and the chains that are kept on their own anyway.
+    join_chains = False
+    separate_chains = ()
+
+    # How the meshes are colored: "SHARED" (one material per color, shared
+    # by every mesh), "COLOR_ATTRIBUTE" (one material for everything, with
+    # the colors in the "blendmol_color" attribute) or "PER_MESH" (new
+    # materials for every mesh).
+    material_mode = "SHARED"
+
+    # The edge length (Angstroms) of the tiles large surfaces are made in
+    # (see SurfaceTiles.py).
+    surface_tile_size = DEFAULT_TILE_SIZE
+
+    # The mesh cache entry being imported (a MeshCache and key), pinned so
+    # it isn't evicted meanwhile, or None. del_tmp_dir() unpins it.
+    mesh_cache_entry = None
+
     def make_tmp_dir(self):
         """
         Make a temporary directory.
@@ -57,172 +97,883 @@ class ExternalInterface:
         ext = ext.upper()
         return ext
 
-    def run_external_program(self, exec_path):
+    def run_external_program(self, exec_path, on_output=None):
         """
         Runs an executable. This will be overwritten by child classes that
         inherit this one.
 
         :param str exec_path: The path to the executable.
+        :param function on_output: Called with each line the executable
+                    prints. Optional.
         """
 
         pass
 
-    def import_all_mesh_files(self, my_operator):
+    def import_all_mesh_files(self, my_operator, mesh_dir=None):
         """
         Import all the meshes produced by the external visualization program
         (VMD), saved to the temporary directory.
 
         :param ??? my_operator: The operator, used to access user-parameter
                     variables.
+        :param str mesh_dir: The directory with the mesh files. Defaults to
+                   the temporary directory.
 
         :returns: List of the names of the added meshes.
         :rtype: :class:`str[]`
         """
 
+        self.begin_mesh_import()
+
+        # Import the objs
+        if mesh_dir is None:
+            mesh_dir = self.tmp_dir
+        mask1 = mesh_dir + "*.obj"
+        mask2 = mesh_dir + "*.wrl"
+        mask3 = mesh_dir + "*" + MESH_EXT
+        for filename in glob.glob(mask1) + glob.glob(mask2) + glob.glob(mask3):
+            self.import_mesh_file(filename, my_operator)
+
+        return self.finish_mesh_import(my_operator)
+
+    def begin_mesh_import(self):
+        """
+        Get ready to import mesh files one at a time (with
+        import_mesh_file()).
+        """
+
         try:
             bpy.ops.object.mode_set(mode="OBJECT")
         except:
             pass
 
-        meshes_to_join = {}
+        self.meshes_to_join = {}
+        self.initial_rotations = {}
+        self.processed_filenames = set()
+        self.lod_meshes = {}
+        self.meshes_to_merge = {}
+        self.tiles_to_stitch = {}
+
+        # The objects this import adds, by pointer. The user can rename
+        # them, or add objects of their own while a background import runs.
+        self.new_object_pointers = set()
 
-        # Import the objs, keeping track of existing ones
-        orig_existing_obj_names = set([obj.name for obj in bpy.data.objects])
-        mask1 = self.tmp_dir + "*.obj"
-        mask2 = self.tmp_dir + "*.wrl"
-        for filename in glob.glob(mask1) + glob.glob(mask2):
-            print("Importing " + filename + "...")
+    def get_new_objects(self):
+        """
+        The objects added since begin_mesh_import() that still exist.
 
-            # Keep track of existing objects.
-            exist_obj_names_tmp = set([obj.name for obj in bpy.data.objects])
+        :returns: The objects.
+        :rtype: :class:`list`
+        """
 
-            # Load in new objects.
-            if filename.upper().endswith(".OBJ"):
-                bpy.ops.import_scene.obj(filepath=filename)
-                # Not sure why OBJ imported from VMD are rotated.
-                initial_rotation = (90, 0, 0)
-            else:
-                bpy.ops.import_scene.x3d(filepath=filename)
-                # Not sure why WRL imported from PyMol are rotated.
-                initial_rotation = (270, 0, 180)
+        return [
+            obj
+            for obj in bpy.data.objects
+            if obj.as_pointer() in self.new_object_pointers
+        ]
+
+    def load_mesh_file(self, filename, my_operator):
+        """
+        Read an OBJ file (converting it to a binary mesh file) or a binary
+        mesh file into NumPy arrays, and prepare them (remove doubles and
+        scale). Doesn't touch Blender's data, so it is safe to run in a
+        thread.
+
+        :param str filename: The mesh filename.
+        :param ??? my_operator: The operator, used to access user-parameter
+                    variables.
+
+        :returns: The prepared geometry, or None if the file is neither
+                  (Blender must import it itself).
+        :rtype: :class:`MeshArrays`
+        """
+
+        ext = self.get_ext(filename)
+        if ext == ".OBJ" and filename.startswith(self.tmp_dir):
+            mesh_arrays = self.convert_obj(filename)
+        elif ext == ".OBJ":
+            # E.g., from a mesh cache made by an older BlendMol.
+            mesh_arrays = self.parse_obj(filename)
+        elif ext == MESH_EXT.upper():
+            with stage(self.profile, "load mesh", mesh_bytes=os.path.getsize(filename)):
+                mesh_arrays = load_mesh(filename)
+        else:
+            return None
+        self.label_chains(filename, mesh_arrays)
+        return self.prepare_mesh_arrays(mesh_arrays, my_operator)
+
+    def label_chains(self, filename, mesh_arrays):
+        """
+        Set the chain of every polygon of a mesh that covers several chains.
+        The definition will be overwritten in the child classes that inherit
+        this one.
+
+        :param str filename: The mesh filename.
+        :param MeshArrays mesh_arrays: The geometry, in Angstroms.
+        """
+
+        pass
+
+    def convert_obj(self, filename):
+        """
+        Convert an OBJ file (and its MTL file) to a binary mesh file next to
+        it, and delete them. Safe to run in a thread.
+
+        :param str filename: The OBJ filename.
+
+        :returns: The geometry.
+        :rtype: :class:`MeshArrays`
+        """
+
+        mesh_arrays = self.parse_obj(filename)
+        base_filename = os.path.splitext(filename)[0]
+        with stage(self.profile, "save mesh"):
+            self.mesh_format.save(base_filename + MESH_EXT, mesh_arrays)
+        os.remove(filename)
+        if os.path.exists(base_filename + ".mtl"):
+            os.remove(base_filename + ".mtl")
+        return mesh_arrays
+
+    def convert_mesh_files(self, mesh_dir):
+        """
+        Convert all the OBJ files in a directory to binary mesh files.
 
-            # Get new objects.
-            new_obj_names_tmp = (
-                set([obj.name for obj in bpy.data.objects]) - exist_obj_names_tmp
+        :param str mesh_dir: The directory.
+        """
+
+        for filename in glob.glob(os.path.join(mesh_dir, "*.obj")):
+            self.convert_obj(filename)
+
+    def import_mesh_file(self, filename, my_operator, mesh_arrays=None):
+        """
+        Import one of the meshes produced by the external visualization
+        program. Call begin_mesh_import() first, and finish_mesh_import()
+        once every file is imported.
+
+        :param str filename: The mesh filename.
+        :param ??? my_operator: The operator, used to access user-parameter
+                    variables.
+        :param MeshArrays mesh_arrays: What load_mesh_file() returned, if the
+                    file was already read. Optional.
+        """
+
+        print("Importing " + filename + "...")
+        if mesh_arrays is None:
+            mesh_arrays = self.load_mesh_file(filename, my_operator)
+        name = os.path.basename(os.path.splitext(filename)[0])
+
+        # Keep track of existing objects.
+        exist_obj_names_tmp = set([obj.name for obj in bpy.data.objects])
+
+        # Load in new objects.
+        base_name, tier = split_lod_name(name)
+        base_name, tile = split_tile_name(base_name)
+        if tile is not None and mesh_arrays is not None:
+            # Stitched to the other tiles in finish_mesh_import().
+            self.tiles_to_stitch.setdefault((base_name, tier), []).append(
+                (tile, mesh_arrays)
+            )
+            return
+
+        join_name = self.get_join_name(base_name)
+        if join_name is not None and mesh_arrays is not None:
+            # Merged with the other chains in finish_mesh_import().
+            self.meshes_to_merge.setdefault((join_name, tier), []).append(
+                (base_name, mesh_arrays)
             )
+            return
 
-            new_objs_tmp = [
-                bpy.data.objects[obj_name]
-                for obj_name in new_obj_names_tmp
-                if bpy.data.objects[obj_name].type == "MESH"
-            ]
-            meshes_to_join[filename] = new_objs_tmp
+        if tier != "final":
+            # The cheaper level-of-detail tiers become meshes without
+            # objects. They are linked to the final tier's object below.
+            self.lod_meshes[(base_name, tier)] = self.new_mesh(
+                "BldMl__" + name, mesh_arrays
+            )
+            return
+
+        if mesh_arrays is not None:
+            # VMD's OBJ files are read directly, without any axis
+            # conversion, so no rotation needs to be undone. They were
+            # scaled (and welded) while still NumPy arrays.
+            self.new_mesh_object("BldMl__" + name, mesh_arrays)
+            self.processed_filenames.add(filename)
+            initial_rotation = (0, 0, 0)
+        else:
+            with stage(self.profile, "import wrl", wrl_bytes=os.path.getsize(filename)):
+                bpy.ops.import_scene.x3d(filepath=filename)
+            # Not sure why WRL imported from PyMol are rotated.
+            initial_rotation = (270, 0, 180)
 
-        # Get a list of the names of objects just added.
-        new_obj_names = (
-            set([obj.name for obj in bpy.data.objects]) - orig_existing_obj_names
+        # Get new objects.
+        new_obj_names_tmp = (
+            set([obj.name for obj in bpy.data.objects]) - exist_obj_names_tmp
         )
+        new_objs_tmp = []
+        for obj_name in new_obj_names_tmp:
+            obj = bpy.data.objects[obj_name]
+            if obj.type == "MESH":
+                self.new_object_pointers.add(obj.as_pointer())
+                new_objs_tmp.append(obj)
+            else:
+                # The X3D importer's cameras and lights. Go through the data
+                # API, not bpy.ops.object.delete(), which updates the scene
+                # every call.
+                bpy.data.objects.remove(obj, do_unlink=True)
+        self.meshes_to_join[filename] = new_objs_tmp
+        self.initial_rotations[filename] = initial_rotation
+
+    def finish_mesh_import(self, my_operator):
+        """
+        Finish importing the mesh files: join, transform and remove doubles
+        where that wasn't done when they were read, and link the
+        level-of-detail meshes to their objects.
 
-        # Keep the ones that are meshes
-        new_objs = [
-            bpy.data.objects[obj_name]
-            for obj_name in new_obj_names
-            if bpy.data.objects[obj_name].type == "MESH"
-        ]
+        :param ??? my_operator: The operator, used to access user-parameter
+                    variables.
 
-        # Delete the ones that aren't meshes
-        # See https://blender.stackexchange.com/questions/27234/python-how-to-completely-remove-an-object
-        for obj_name in new_obj_names:
-            obj = bpy.data.objects[obj_name]
-            if obj.type != "MESH":
-                bpy.ops.object.select_all(action="DESELECT")
-                obj.select_set(state=True)
-                bpy.ops.object.delete()
-        new_obj_names = [o.name for o in new_objs]
-
-        # Apply the rotations of all meshes
-        for obj in new_objs:
-            bpy.ops.object.select_all(action="DESELECT")
-            # bpy.context.scene.objects.active = obj
-            bpy.context.view_layer.objects.active = obj
-            obj.select_set(state=True)
-            bpy.ops.object.transform_apply(location=False, scale=False, rotation=True)
+        :returns: List of the names of the added meshes.
+        :rtype: :class:`str[]`
+        """
+
+        meshes_to_join = self.meshes_to_join
+        initial_rotations = self.initial_rotations
+        processed_filenames = self.processed_filenames
+        lod_meshes = self.lod_meshes
+        scale = self.get_scale(my_operator)
+
+        # Surfaces made in tiles (see SurfaceTiles.py). Once stitched, each
+        # is imported like any other mesh.
+        for (base_name, tier), tiles in sorted(self.tiles_to_stitch.items()):
+            with stage(self.profile, "stitch", tiles=len(tiles)):
+                mesh_arrays = stitch_tiles(
+                    sorted(tiles, key=lambda tile: tile[0]),
+                    self.surface_tile_size * scale,
+                    SEAM_WELD_DISTANCE * scale,
+                )
+            suffix = "" if tier == "final" else LOD_SUFFIX + tier
+            self.import_mesh_file(
+                base_name + suffix + MESH_EXT, my_operator, mesh_arrays
+            )
+        self.tiles_to_stitch = {}
+
+        # One object per representation, if the chains are joined. Named
+        # like a mesh file, so they are handled like the others below.
+        for (join_name, tier), meshes in sorted(self.meshes_to_merge.items()):
+            meshes = sorted(meshes, key=lambda mesh: mesh[0])
+            with stage(self.profile, "merge", meshes=len(meshes)):
+                mesh_arrays = concatenate_meshes(
+                    [mesh_arrays for _, mesh_arrays in meshes],
+                    [split_object_name(name)[1] for name, _ in meshes],
+                )
+            if tier != "final":
+                lod_meshes[(join_name, tier)] = self.new_mesh(
+                    "BldMl__" + join_name + LOD_SUFFIX + tier, mesh_arrays
+                )
+                continue
+            filename = join_name + MESH_EXT
+            obj = self.new_mesh_object("BldMl__" + join_name, mesh_arrays)
+            self.new_object_pointers.add(obj.as_pointer())
+            meshes_to_join[filename] = [obj]
+            initial_rotations[filename] = (0, 0, 0)
+            processed_filenames.add(filename)
 
         # Join some of the objects
+        new_objs = []
         for filename in meshes_to_join.keys():
             objs_to_merge = meshes_to_join[filename]
             if len(objs_to_merge) > 1:
-                bpy.ops.object.select_all(action="DESELECT")
-                for obj in objs_to_merge:
-                    obj.select_set(state=True)
-                bpy.context.view_layer.objects.active = objs_to_merge[0]
-                bpy.ops.object.join()
+                with stage(self.profile, "join"):
+                    for obj in objs_to_merge:
+                        self.new_object_pointers.discard(obj.as_pointer())
+                    objs_to_merge = [self.merge_objects(objs_to_merge)]
+                    self.new_object_pointers.add(objs_to_merge[0].as_pointer())
             if len(objs_to_merge) > 0:
                 objs_to_merge[0].name = "BldMl__" + os.path.basename(filename)[:-4]
+                new_objs.append((objs_to_merge[0], filename))
             else:
                 # Sometimes PyMol (at least) doesn't save a file at all,
                 # perhaps because the selection was empty?
                 pass
 
-        # Make sure origins of all new meshes is 0, 0, 0
-        # See https://blender.stackexchange.com/questions/35825/changing-object-origin-to-arbitrary-point-without-origin-set
-        for obj in bpy.data.objects:
-            if obj.name.startswith("BldMl__"):
-                loc = obj.location
-                obj.data.transform(mathutils.Matrix.Translation(loc))
-                obj.matrix_world.translation -= loc
-
-        # Now rotate appropriately and apply
-        # Reset rotation. Weird that this is imported wrong...
-        for obj in new_objs:
-            for i in range(3):
-                obj.rotation_euler[i] = (
-                    obj.rotation_euler[i] - initial_rotation[i] / 180 * 3.1416
+        # Bake the object transform (so the origin is 0, 0, 0), the rotation
+        # correction and the scale into the mesh with one matrix per mesh.
+        # This avoids bpy.ops.object.transform_apply(), which updates the
+        # whole scene every time it is called.
+        for obj, filename in new_objs:
+            if filename in processed_filenames:
+                continue
+            correction = (
+                mathutils.Euler(
+                    [-math.radians(angle) for angle in initial_rotations[filename]],
+                    "XYZ",
+                )
+                .to_matrix()
+                .to_4x4()
+            )
+            with stage(self.profile, "transform"):
+                obj.data.transform(
+                    mathutils.Matrix.Scale(scale, 4) @ correction @ obj.matrix_basis
                 )
-            bpy.ops.object.select_all(action="DESELECT")
-            bpy.context.view_layer.objects.active = obj
-            obj.select_set(state=True)
-            bpy.ops.object.transform_apply(location=False, scale=False, rotation=True)
+                obj.matrix_basis = mathutils.Matrix.Identity(4)
+
+        # Also go through and remove doubles, for meshes that weren't welded
+        # when they were loaded. Use a single bmesh rather than edit mode.
+        if my_operator.remove_doubles == True:
+            for obj, filename in new_objs:
+                if not filename in processed_filenames:
+                    with stage(self.profile, "remove doubles"):
+                        self.remove_doubles_bmesh(
+                            obj.data, REMOVE_DOUBLES_THRESHOLD * scale
+                        )
+
+        # Link the level-of-detail meshes to their objects.
+        for obj, filename in new_objs:
+            base_name = os.path.basename(filename)[:-4]
+            tier_meshes = {
+                tier: lod_meshes[(base_name, tier)]
+                for tier in LOD_TIERS
+                if (base_name, tier) in lod_meshes
+            }
+            if len(tier_meshes) > 0:
+                # Tiers VMD didn't render (the same as the next tier) share
+                # the next tier's mesh.
+                for tier, next_tier in reversed(list(zip(LOD_TIERS, LOD_TIERS[1:]))):
+                    if not tier in tier_meshes and next_tier in tier_meshes:
+                        tier_meshes[tier] = tier_meshes[next_tier]
+                link_lod_meshes(obj, tier_meshes)
+
+        new_objs = [obj for obj, _ in new_objs]
+        new_obj_names = [obj.name for obj in new_objs]
+
+        return new_obj_names
+
+    def get_join_name(self, name):
+        """
+        The name of the object a chain's mesh is merged into, if the chains
+        are joined.
+
+        :param str name: The name of the mesh file, without its extension
+                   or level-of-detail suffix (e.g., "prot_nuc_surf_A").
+
+        :returns: The name of the merged object without the "BldMl__" prefix
+                  (e.g., "prot_nuc_surf"), or None if the mesh isn't merged.
+        :rtype: :class:`str`
+        """
+
+        if self.join_chains == False:
+            return None
+        name_parts = split_object_name(name)
+        if name_parts is None or name_parts[1] in self.separate_chains:
+            return None
+        return name_parts[0]
+
+    def get_object_chains(self, obj_name):
+        """
+        The chains a BlendMol object shows.
+
+        :param str obj_name: The name of the object.
+
+        :returns: The chain IDs. Empty if they aren't known.
+        :rtype: :class:`list`
+        """
+
+        obj = bpy.data.objects[obj_name]
+        if obj.type == "MESH" and "blendmol_chains" in obj.data:
+            return obj.data["blendmol_chains"].split()
+        name_parts = split_object_name(obj_name)
+        return [] if name_parts is None else [name_parts[1]]
+
+    def get_object_mesh_arrays(self, obj):
+        """
+        Copy the geometry of a mesh object into NumPy arrays, with its
+        transform applied.
+
+        :param bpy.types.Object obj: The object.
+
+        :returns: The geometry. Its material names are the names of the
+                  object's materials.
+        :rtype: :class:`MeshArrays`
+        """
+
+        mesh = obj.data
+        vertices = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+        mesh.vertices.foreach_get("co", vertices)
+        loop_vertex_indices = numpy.empty(len(mesh.loops), dtype=numpy.int32)
+        mesh.loops.foreach_get("vertex_index", loop_vertex_indices)
+        loop_totals = numpy.empty(len(mesh.polygons), dtype=numpy.int32)
+        mesh.polygons.foreach_get("loop_total", loop_totals)
+        material_indices = numpy.empty(len(mesh.polygons), dtype=numpy.int32)
+        mesh.polygons.foreach_get("material_index", material_indices)
+
+        matrix = numpy.array(obj.matrix_world, dtype=numpy.float32)
+        vertices = vertices.reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3]
+
+        materials = [mat for mat in mesh.materials if mat is not None]
+        return MeshArrays(
+            vertices=vertices,
+            loop_vertex_indices=loop_vertex_indices,
+            loop_totals=loop_totals,
+            material_indices=numpy.minimum(
+                material_indices, max(len(materials) - 1, 0)
+            ),
+            material_names=[mat.name for mat in materials],
+            material_colors=[list(mat.diffuse_color) for mat in materials],
+            smooth=len(mesh.polygons) > 0 and mesh.polygons[0].use_smooth,
+        )
+
+    def merge_objects(self, objs):
+        """
+        Merge mesh objects into one new object, without bpy.ops.object.join()
+        (which is slow on large selections). The materials are kept.
+
+        :param list objs: The objects. They are removed.
+
+        :returns: The merged object.
+        :rtype: :class:`bpy.types.Object`
+        """
+
+        name = objs[0].name
+        mesh_arrays = concatenate_meshes(
+            [self.get_object_mesh_arrays(obj) for obj in objs]
+        )
+        materials = [bpy.data.materials[n] for n in mesh_arrays.material_names]
+
+        meshes = [obj.data for obj in objs]
+        for obj in objs:
+            bpy.data.objects.remove(obj, do_unlink=True)
+        for mesh in meshes:
+            if mesh.users == 0:
+                bpy.data.meshes.remove(mesh)
+
+        obj = bpy.data.objects.new(name, self.new_mesh(name, mesh_arrays, materials))
+        bpy.context.collection.objects.link(obj)
+        return obj
+
+    def cancel_mesh_import(self):
+        """
+        Remove the objects imported since begin_mesh_import() (e.g., because
+        the import was cancelled). Objects the user added in the meantime
+        are kept.
+        """
+
+        meshes = list(self.lod_meshes.values())
+        for obj in self.get_new_objects():
+            if obj.type == "MESH":
+                meshes.append(obj.data)
+            bpy.data.objects.remove(obj, do_unlink=True)
+        for mesh in meshes:
+            if mesh.users == 0:
+                bpy.data.meshes.remove(mesh)
+
+    def parse_obj(self, filename):
+        """
+        Read an OBJ file (and its MTL file) into NumPy arrays.
+
+        :param str filename: The OBJ filename.
+
+        :returns: The geometry.
+        :rtype: :class:`MeshArrays`
+        """
+
+        with stage(self.profile, "parse obj", obj_bytes=os.path.getsize(filename)):
+            return parse_obj(filename)
+
+    def get_scale(self, my_operator):
+        """
+        The scale of the imported meshes.
+
+        :param ??? my_operator: The operator, used to access user-parameter
+                    variables.
+
+        :returns: The scale factor.
+        :rtype: :class:`float`
+        """
 
         # Scale 0.1. VMD output is huge. So units are nm, not Angstroms.
         # Scale to nanometers if necessary.
-        if my_operator.nanometers == True:
-            for obj in bpy.data.objects:
-                if obj.name.startswith("BldMl__"):
-                    obj.scale = [0.1, 0.1, 0.1]
+        return 0.1 if my_operator.nanometers == True else 1.0
+
+    def add_mesh_arrays(self, name, mesh_arrays, my_operator):
+        """
+        Add a BlendMol object made from NumPy arrays in Angstroms (from an
+        OBJ file, or built by BlendMol itself). Doubles are removed and the
+        mesh is scaled before it is handed to Blender.
+
+        :param str name: The name of the object, without the "BldMl__"
+                   prefix.
+        :param MeshArrays mesh_arrays: The geometry.
+        :param ??? my_operator: The operator, used to access user-parameter
+                    variables.
+
+        :returns: The new object.
+        :rtype: :class:`bpy.types.Object`
+        """
+
+        return self.new_mesh_object(
+            "BldMl__" + name, self.prepare_mesh_arrays(mesh_arrays, my_operator)
+        )
+
+    def add_linked_copy(self, obj_name, name, matrix, my_operator):
+        """
+        Add a linked duplicate of a BlendMol object (sharing its mesh), moved
+        by a rigid transform. Used for copies of chains and for biological
+        assemblies (see Symmetry.py).
+
+        :param str obj_name: The name of the object to copy.
+        :param str name: The name of the copy, without the "BldMl__" prefix.
+        :param numpy.ndarray matrix: The 4x4 transform, in Angstroms.
+        :param ??? my_operator: The operator, used to access user-parameter
+                    variables.
+
+        :returns: The new object.
+        :rtype: :class:`bpy.types.Object`
+        """
+
+        obj = bpy.data.objects[obj_name]
+        transform = mathutils.Matrix(matrix.tolist())
+        transform.translation = transform.translation * self.get_scale(my_operator)
+
+        copy = obj.copy()
+        copy.name = "BldMl__" + name
+        copy.matrix_world = transform @ obj.matrix_world
+        for collection in obj.users_collection:
+            collection.objects.link(copy)
+        return copy
+
+    def prepare_mesh_arrays(self, mesh_arrays, my_operator):
+        """
+        Remove doubles (if the user asked for that) and scale a mesh that is
+        still NumPy arrays in Angstroms.
+
+        :param MeshArrays mesh_arrays: The geometry.
+        :param ??? my_operator: The operator, used to access user-parameter
+                    variables.
+
+        :returns: The prepared geometry.
+        :rtype: :class:`MeshArrays`
+        """
 
-        # Also go through and remove doubles
         if my_operator.remove_doubles == True:
-            for obj in bpy.data.objects:
-                if obj.name.startswith("BldMl__"):
-                    bpy.ops.object.select_all(action="DESELECT")
-                    bpy.context.view_layer.objects.active = obj
-                    obj.select_set(state=True)
+            # Weld on the NumPy arrays, before the mesh even exists, and then
+            # make the normals consistent (as normals_make_consistent did in
+            # edit mode).
+            with stage(self.profile, "weld"):
+                mesh_arrays = mesh_arrays.weld(REMOVE_DOUBLES_THRESHOLD)
+                mesh_arrays = mesh_arrays.make_normals_consistent()
+        mesh_arrays.vertices = mesh_arrays.vertices * self.get_scale(my_operator)
+        return mesh_arrays
+
+    def add_sphere_instances(self, name, sphere_points, my_operator):
+        """
+        Add a BlendMol object that is just points, one per sphere, with
+        "radius" and "blendmol_color" attributes. A geometry-nodes modifier
+        puts one shared sphere on every point, so memory grows with the
+        number of atoms, not the number of triangles. Blender versions
+        without geometry-node instancing get a regular mesh instead.
+
+        :param str name: The name of the object, without the "BldMl__"
+                   prefix.
+        :param SpherePoints sphere_points: The spheres, in Angstroms.
+        :param ??? my_operator: The operator, used to access user-parameter
+                    variables.
 
-                    bpy.ops.object.mode_set(mode="EDIT")
+        :returns: The new object.
+        :rtype: :class:`bpy.types.Object`
+        """
 
-                    bpy.ops.mesh.select_all(action="SELECT")
+        if bpy.app.version < (3, 0, 0):
+            return self.add_mesh_arrays(
+                name, sphere_points.to_mesh_arrays(), my_operator
+            )
 
-                    # Remove doubles. Note that doesn't always fully work with
-                    # PyMol sticks.
-                    # bpy.ops.mesh.remove_doubles(threshold=0.000001)
-                    bpy.ops.mesh.remove_doubles(threshold=0.0001)
+        scale = self.get_scale(my_operator)
+        mesh = bpy.data.meshes.new("BldMl__" + name)
+        mesh.vertices.add(len(sphere_points.centers))
+        mesh.vertices.foreach_set("co", (sphere_points.centers * scale).ravel())
 
-                    # Recalculate normals
-                    bpy.ops.mesh.normals_make_consistent()
+        radius = mesh.attributes.new("radius", "FLOAT", "POINT")
+        radius.data.foreach_set("value", sphere_points.radii * scale)
+        color = mesh.attributes.new("blendmol_color", "FLOAT_COLOR", "POINT")
+        color.data.foreach_set("color", sphere_points.colors.ravel())
+        mesh.update()
 
-                    bpy.ops.object.mode_set(mode="OBJECT")
+        obj = bpy.data.objects.new("BldMl__" + name, mesh)
+        bpy.context.collection.objects.link(obj)
+        modifier = obj.modifiers.new("BlendMol Spheres", "NODES")
+        modifier.node_group = self.get_sphere_instance_node_group()
 
-                    # obj.name = obj.name[5:]
+        return obj
 
-        return new_obj_names
+    def get_sphere_instance_node_group(self):
+        """
+        The geometry-nodes group that instances a sphere on every point,
+        scaled by the "radius" attribute. It is made once and shared by all
+        BlendMol objects.
+
+        :returns: The node group.
+        :rtype: :class:`bpy.types.GeometryNodeTree`
+        """
+
+        group_name = "BlendMol Sphere Instances"
+        if group_name in bpy.data.node_groups:
+            return bpy.data.node_groups[group_name]
+
+        group = bpy.data.node_groups.new(group_name, "GeometryNodeTree")
+        if hasattr(group, "interface"):
+            # Blender 4.0+
+            group.interface.new_socket(
+                name="Geometry", in_out="INPUT", socket_type="NodeSocketGeometry"
+            )
+            group.interface.new_socket(
+                name="Geometry", in_out="OUTPUT", socket_type="NodeSocketGeometry"
+            )
+        else:
+            group.inputs.new("NodeSocketGeometry", "Geometry")
+            group.outputs.new("NodeSocketGeometry", "Geometry")
+
+        nodes = group.nodes
+        links = group.links
+        group_input = nodes.new("NodeGroupInput")
+        group_output = nodes.new("NodeGroupOutput")
+
+        sphere = nodes.new("GeometryNodeMeshIcoSphere")
+        sphere.inputs["Radius"].default_value = 1.0
+        sphere.inputs["Subdivisions"].default_value = 2
+        smooth = nodes.new("GeometryNodeSetShadeSmooth")
+        set_material = nodes.new("GeometryNodeSetMaterial")
+        set_material.inputs["Material"].default_value = self.get_instance_material()
+
+        radius = nodes.new("GeometryNodeInputNamedAttribute")
+        radius.data_type = "FLOAT"
+        radius.inputs["Name"].default_value = "radius"
+        # Older versions have one output per data type; use the enabled one.
+        radius_output = [o for o in radius.outputs if o.enabled][0]
+
+        instance = nodes.new("GeometryNodeInstanceOnPoints")
+
+        links.new(sphere.outputs["Mesh"], smooth.inputs["Geometry"])
+        links.new(smooth.outputs["Geometry"], set_material.inputs["Geometry"])
+        links.new(group_input.outputs[0], instance.inputs["Points"])
+        links.new(set_material.outputs["Geometry"], instance.inputs["Instance"])
+        links.new(radius_output, instance.inputs["Scale"])
+        links.new(instance.outputs["Instances"], group_output.inputs[0])
+
+        return group
+
+    def get_instance_material(self):
+        """
+        The material of instanced spheres. It takes its color from the
+        "blendmol_color" attribute of the point each sphere sits on.
+
+        :returns: The material.
+        :rtype: :class:`bpy.types.Material`
+        """
+
+        mat_name = "BlendMol Instanced Spheres"
+        if mat_name in bpy.data.materials:
+            return bpy.data.materials[mat_name]
+
+        mat = bpy.data.materials.new(mat_name)
+        mat.use_nodes = True
+        nodes = mat.node_tree.nodes
+        principled = nodes.get("Principled BSDF")
+        attribute = nodes.new("ShaderNodeAttribute")
+        attribute.attribute_type = "INSTANCER"
+        attribute.attribute_name = "blendmol_color"
+        mat.node_tree.links.new(
+            attribute.outputs["Color"], principled.inputs["Base Color"]
+        )
+        return mat
+
+    def get_color_material(self, mat_name, color):
+        """
+        The material of a color. Unless material_mode is "PER_MESH", every
+        mesh of that color (from this import or an earlier one) shares it,
+        so there are only as many materials as colors.
+
+        :param str mat_name: The name of the material in the mesh file, used
+                   if it isn't shared.
+        :param numpy.ndarray color: The RGBA color.
+
+        :returns: The material.
+        :rtype: :class:`bpy.types.Material`
+        """
+
+        color = [float(c) for c in color]
+        if self.material_mode != "PER_MESH":
+            # Named after the color, so it is found again.
+            mat_name = "BlendMol Color " + "".join(
+                ["%02X" % int(round(min(max(c, 0.0), 1.0) * 255)) for c in color]
+            )
+            if mat_name in bpy.data.materials:
+                return bpy.data.materials[mat_name]
+
+        mat = bpy.data.materials.new(mat_name)
+        mat.diffuse_color = color
+        return mat
+
+    def get_color_attribute_material(self):
+        """
+        The material of meshes colored by their "blendmol_color" attribute.
+        It is made once and shared by all BlendMol objects.
+
+        :returns: The material.
+        :rtype: :class:`bpy.types.Material`
+        """
+
+        mat_name = "BlendMol Color Attribute"
+        if mat_name in bpy.data.materials:
+            return bpy.data.materials[mat_name]
+
+        mat = bpy.data.materials.new(mat_name)
+        mat.use_nodes = True
+        nodes = mat.node_tree.nodes
+        principled = nodes.get("Principled BSDF")
+        attribute = nodes.new("ShaderNodeAttribute")
+        attribute.attribute_type = "GEOMETRY"
+        attribute.attribute_name = "blendmol_color"
+        mat.node_tree.links.new(
+            attribute.outputs["Color"], principled.inputs["Base Color"]
+        )
+        return mat
+
+    def remove_doubles_bmesh(self, mesh, threshold):
+        """
+        Remove duplicate vertices from a mesh with bmesh, without entering
+        edit mode.
+
+        :param bpy.types.Mesh mesh: The mesh.
+        :param float threshold: The merge distance.
+        """
+
+        bm = bmesh.new()
+        bm.from_mesh(mesh)
+        bmesh.ops.remove_doubles(bm, verts=bm.verts, dist=threshold)
+        bmesh.ops.recalc_face_normals(bm, faces=bm.faces)
+        bm.to_mesh(mesh)
+        bm.free()
+        mesh.update()
+
+    def new_mesh_object(self, name, mesh_arrays):
+        """
+        Create a new mesh object from NumPy arrays, without going through
+        Blender's import operators.
+
+        :param str name: The name of the new object (and its mesh).
+        :param MeshArrays mesh_arrays: The geometry.
+
+        :returns: The new object.
+        :rtype: :class:`bpy.types.Object`
+        """
+
+        obj = bpy.data.objects.new(name, self.new_mesh(name, mesh_arrays))
+        bpy.context.collection.objects.link(obj)
+
+        return obj
+
+    def new_mesh(self, name, mesh_arrays, materials=None):
+        """
+        Create a new mesh from NumPy arrays.
+
+        :param str name: The name of the new mesh.
+        :param MeshArrays mesh_arrays: The geometry.
+        :param list materials: Existing materials to use, one per material
+                    slot (None to make a new one). Optional.
+
+        :returns: The new mesh.
+        :rtype: :class:`bpy.types.Mesh`
+        """
+
+        with stage(
+            self.profile,
+            "create mesh",
+            vertices=mesh_arrays.num_vertices,
+            faces=mesh_arrays.num_polygons,
+        ):
+            return self.fill_mesh(bpy.data.meshes.new(name), mesh_arrays, materials)
+
+    def fill_mesh(self, mesh, mesh_arrays, materials=None):
+        """
+        Fill an empty mesh with the geometry of NumPy arrays.
+
+        :param bpy.types.Mesh mesh: The empty mesh.
+        :param MeshArrays mesh_arrays: The geometry.
+        :param list materials: Existing materials to use, one per material
+                    slot (None to make a new one). Optional. Not used if
+                    the colors go in a color attribute.
+
+        :returns: The mesh.
+        :rtype: :class:`bpy.types.Mesh`
+        """
+
+        mesh.vertices.add(mesh_arrays.num_vertices)
+        mesh.vertices.foreach_set("co", mesh_arrays.vertices.ravel())
+
+        mesh.loops.add(len(mesh_arrays.loop_vertex_indices))
+        mesh.loops.foreach_set("vertex_index", mesh_arrays.loop_vertex_indices)
+
+        mesh.polygons.add(mesh_arrays.num_polygons)
+        mesh.polygons.foreach_set("loop_start", mesh_arrays.loop_starts)
+        try:
+            mesh.polygons.foreach_set("loop_total", mesh_arrays.loop_totals)
+        except (AttributeError, TypeError):
+            # Read only (and derived from loop_start) in newer Blender
+            # versions.
+            pass
+        mesh.polygons.foreach_set(
+            "use_smooth", [mesh_arrays.smooth] * mesh_arrays.num_polygons
+        )
+
+        if self.material_mode == "COLOR_ATTRIBUTE" and hasattr(mesh, "attributes"):
+            # One material, colored by the attribute (Blender 2.91+).
+            if len(mesh_arrays.material_colors) > 0:
+                polygon_colors = mesh_arrays.material_colors[
+                    mesh_arrays.material_indices
+                ]
+                attribute = mesh.attributes.new(
+                    "blendmol_color", "BYTE_COLOR", "CORNER"
+                )
+                attribute.data.foreach_set(
+                    "color",
+                    numpy.repeat(
+                        polygon_colors, mesh_arrays.loop_totals, axis=0
+                    ).ravel(),
+                )
+            mesh.materials.append(self.get_color_attribute_material())
+        else:
+            # One material per OBJ material, colored like the MTL file says.
+            if materials is None:
+                materials = [None] * len(mesh_arrays.material_names)
+            for mat_name, color, mat in zip(
+                mesh_arrays.material_names, mesh_arrays.material_colors, materials
+            ):
+                if mat is None:
+                    mat = self.get_color_material(mat_name, color)
+                mesh.materials.append(mat)
+            mesh.polygons.foreach_set("material_index", mesh_arrays.material_indices)
+
+        # The chain of every polygon, for meshes of several chains (Blender
+        # 2.91+).
+        if mesh_arrays.polygon_chains is not None:
+            mesh["blendmol_chains"] = " ".join(mesh_arrays.chains)
+            if hasattr(mesh, "attributes"):
+                attribute = mesh.attributes.new("blendmol_chain", "INT", "FACE")
+                attribute.data.foreach_set("value", mesh_arrays.polygon_chains)
+
+        mesh.update(calc_edges=True)
+
+        return mesh
 
     def del_tmp_dir(self):
         """
-        Delete tmp directory.
+        Delete tmp directory, and unpin the mesh cache entry (if any).
         """
 
         shutil.rmtree(self.tmp_dir)
+        if self.mesh_cache_entry is not None:
+            mesh_cache, key = self.mesh_cache_entry
+            mesh_cache.unpin(key)
+            self.mesh_cache_entry = None
 
     def make_vis_script(self, my_operator):
         """
@@ -19,6 +19,7 @@ this program.  If not, see <http://www.gnu.org/licenses/>.
 import bpy
 import os
 import json
+from .PDBDownload import DEFAULT_SOURCE
 
 """
 This module includes functions for saving and loading user preferences to the
@@ -28,14 +29,16 @@ disk.
 prefs_path = bpy.utils.user_resource("CONFIG") + os.sep + "vmd_import_config.json"
 
 
-def load_preferences_from_file():
+def read_preferences_file():
     """
-    Load the user preferences from a file.
+    Read the user preferences from the file, filling in defaults for anything
+    missing. Unlike load_preferences_from_file(), this doesn't need the
+    add-on's preferences to be registered (e.g., for batch imports).
 
-    :returns: The loaded user preferences.
-    :rtype: :class:`???`
+    :returns: The user preferences.
+    :rtype: :class:`dict`
     """
-    # Get the preferences
+
     if not os.path.exists(prefs_path):
         # Never saved before, so go with defaults.
         prefs = {
@@ -43,8 +46,19 @@ def load_preferences_from_file():
             # NO MORE PYMOL: "pymol_exec_path": "/PATH/TO/PYMOL/EXECUTABLE",
             # NO MORE PYMOL: "prefer_vmd": True,
             "vmd_msms_repr": False,
+            "vmd_processes": 1,
+            "reuse_vmd": True,
+            "vmd_session_jobs": 50,
+            "stream_meshes": True,
+            "use_mesh_cache": True,
+            "mesh_cache_size_mb": 2048,
+            "mesh_compression": "NONE",
+            "quantize_meshes": False,
+            "pdb_mirror_source": DEFAULT_SOURCE,
+            "pdb_mirror_size_mb": 1024,
+            "profile_imports": False,
+            "profiler": "NONE",
         }
-        json.dump(prefs, open(prefs_path, "w"))
     else:
         # Load previously saved values
         prefs = json.load(open(prefs_path, "r"))
@@ -56,6 +70,47 @@ def load_preferences_from_file():
         # NO MORE PYMOL:     prefs["prefer_vmd"] = True
         if not "vmd_msms_repr" in prefs.keys():
             prefs["vmd_msms_repr"] = False
+        if not "vmd_processes" in prefs.keys():
+            prefs["vmd_processes"] = 1
+        if not "reuse_vmd" in prefs.keys():
+            prefs["reuse_vmd"] = True
+        if not "vmd_session_jobs" in prefs.keys():
+            prefs["vmd_session_jobs"] = 50
+        if not "stream_meshes" in prefs.keys():
+            prefs["stream_meshes"] = True
+        if not "use_mesh_cache" in prefs.keys():
+            prefs["use_mesh_cache"] = True
+        if not "mesh_cache_size_mb" in prefs.keys():
+            prefs["mesh_cache_size_mb"] = 2048
+        if not "mesh_compression" in prefs.keys():
+            prefs["mesh_compression"] = "NONE"
+        if not "quantize_meshes" in prefs.keys():
+            prefs["quantize_meshes"] = False
+        if not "pdb_mirror_source" in prefs.keys():
+            prefs["pdb_mirror_source"] = DEFAULT_SOURCE
+        if not "pdb_mirror_size_mb" in prefs.keys():
+            prefs["pdb_mirror_size_mb"] = 1024
+        if not "profile_imports" in prefs.keys():
+            prefs["profile_imports"] = False
+        if not "profiler" in prefs.keys():
+            prefs["profiler"] = "NONE"
+
+    return prefs
+
+
+def load_preferences_from_file():
+    """
+    Load the user preferences from a file.
+
+    :returns: The loaded user preferences.
+    :rtype: :class:`???`
+    """
+    # Get the preferences
+    never_saved = not os.path.exists(prefs_path)
+    prefs = read_preferences_file()
+    if never_saved:
+        # Never saved before, so save the defaults.
+        json.dump(prefs, open(prefs_path, "w"))
 
     # Set user preferences according to those defaults.
     addon_prefs = bpy.context.preferences.addons[__package__].preferences
@@ -63,6 +118,18 @@ def load_preferences_from_file():
     # NO MORE PYMOL: addon_prefs.pymol_exec_path = prefs["pymol_exec_path"]
     # NO MORE PYMOL: addon_prefs.prefer_vmd = prefs["prefer_vmd"]
     addon_prefs.vmd_msms_repr = prefs["vmd_msms_repr"]
+    addon_prefs.vmd_processes = prefs["vmd_processes"]
+    addon_prefs.reuse_vmd = prefs["reuse_vmd"]
+    addon_prefs.vmd_session_jobs = prefs["vmd_session_jobs"]
+    addon_prefs.stream_meshes = prefs["stream_meshes"]
+    addon_prefs.use_mesh_cache = prefs["use_mesh_cache"]
+    addon_prefs.mesh_cache_size_mb = prefs["mesh_cache_size_mb"]
+    addon_prefs.mesh_compression = prefs["mesh_compression"]
+    addon_prefs.quantize_meshes = prefs["quantize_meshes"]
+    addon_prefs.pdb_mirror_source = prefs["pdb_mirror_source"]
+    addon_prefs.pdb_mirror_size_mb = prefs["pdb_mirror_size_mb"]
+    addon_prefs.profile_imports = prefs["profile_imports"]
+    addon_prefs.profiler = prefs["profiler"]
 
     return prefs
 
@@ -78,5 +145,17 @@ def save_preferences_to_file():
         # NO MORE PYMOL: "pymol_exec_path": addon_prefs.pymol_exec_path,
         # NO MORE PYMOL: "prefer_vmd": addon_prefs.prefer_vmd,
         "vmd_msms_repr": addon_prefs.vmd_msms_repr,
+        "vmd_processes": addon_prefs.vmd_processes,
+        "reuse_vmd": addon_prefs.reuse_vmd,
+        "vmd_session_jobs": addon_prefs.vmd_session_jobs,
+        "stream_meshes": addon_prefs.stream_meshes,
+        "use_mesh_cache": addon_prefs.use_mesh_cache,
+        "mesh_cache_size_mb": addon_prefs.mesh_cache_size_mb,
+        "mesh_compression": addon_prefs.mesh_compression,
+        "quantize_meshes": addon_prefs.quantize_meshes,
+        "pdb_mirror_source": addon_prefs.pdb_mirror_source,
+        "pdb_mirror_size_mb": addon_prefs.pdb_mirror_size_mb,
+        "profile_imports": addon_prefs.profile_imports,
+        "profiler": addon_prefs.profiler,
     }
     json.dump(prefs, open(prefs_path, "w"))
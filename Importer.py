@@ -0,0 +1,645 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import time
+import threading
+from .VMD import VMD
+from .MeshStream import MeshStream
+from .MeshCache import MeshCache
+from .BinaryMesh import MeshFormat, QUANTIZE_BITS
+from .MeshArrays import concatenate_meshes
+from .NativeGeometry import get_native_representations, SpherePoints
+from .Symmetry import (
+    find_chain_copies,
+    get_assembly_operators,
+    split_object_name,
+    depends_on_other_chains,
+)
+from . import Trajectory
+from .Profiling import stage
+
+# The import itself, apart from any user interface. The import dialog
+# (ImportVMD in __init__.py) and the headless batch importer (BatchImport.py)
+# both use these functions. The settings can be the operator, or any object
+# with the same attributes.
+#
+# An import has two stages. The VMD stage makes the meshes and does not touch
+# Blender's data, so several can run at the same time (in threads). The Blender
+# stage turns the meshes into objects, and must run on the main thread. A
+# StreamingImport overlaps the two: the meshes are read and turned into objects
+# while VMD is still rendering.
+
+
+def is_pdb_id(filepath):
+    """
+    Whether a "filename" is really a 4-letter PDB ID (no period).
+
+    :param str filepath: The filename.
+
+    :returns: True if it is a PDB ID, False otherwise.
+    :rtype: :class:`bool`
+    """
+
+    pdb_id = os.path.basename(filepath)
+    return len(pdb_id) == 4 and not "." in pdb_id
+
+
+def download_pdb(pdb_id, pdb_mirror):
+    """
+    Get a PDB ID from the local mirror, downloading it if necessary.
+
+    :param str pdb_id: The 4-letter PDB ID.
+    :param PDBMirror pdb_mirror: The mirror.
+
+    :returns: The filename of the PDB (or, if there is no PDB-format file,
+              mmCIF) file. It belongs to the mirror, so don't delete it.
+    :rtype: :class:`str`
+    """
+
+    return pdb_mirror.get(os.path.basename(pdb_id))
+
+
+def needs_vmd(settings, filepath):
+    """
+    Whether VMD is needed to import a file. It isn't if BlendMol can build
+    all the requested representations itself.
+
+    :param ??? settings: The import settings (e.g., the operator).
+    :param str filepath: The file to import.
+
+    :returns: True if VMD is needed, False otherwise.
+    :rtype: :class:`bool`
+    """
+
+    _, ext = os.path.splitext(filepath)
+    if ext.upper() != ".PDB" or settings.import_trajectory:
+        return True
+    if settings.protein_ribbon:
+        return True
+    if not settings.native_surfaces:
+        if (
+            settings.protein_surface
+            or settings.ligand_surface
+            or settings.near_ligand_surface
+        ):
+            return True
+    if not settings.native_geometry:
+        if (
+            settings.protein_sticks
+            or settings.ligand_sticks
+            or settings.near_ligand_sticks
+        ):
+            return True
+        if not settings.instance_spheres:
+            return (
+                settings.protein_balls
+                or settings.protein_vdw
+                or settings.ligand_balls
+                or settings.ligand_vdw
+                or settings.near_ligand_balls
+                or settings.near_ligand_vdw
+                or settings.metals_vdw
+            )
+    return False
+
+
+def is_trajectory(settings, filepath):
+    """
+    Whether a file should be imported as a trajectory.
+
+    :param ??? settings: The import settings (e.g., the operator).
+    :param str filepath: The file to import.
+
+    :returns: True if it should, False otherwise.
+    :rtype: :class:`bool`
+    """
+
+    _, ext = os.path.splitext(filepath)
+    return ext.upper() == ".PDB" and settings.import_trajectory == True
+
+
+def get_mesh_format(compression, quantize):
+    """
+    How to save the meshes VMD makes, from the user preferences.
+
+    :param str compression: The "Mesh Compression" preference.
+    :param bool quantize: The "Quantize Meshes" preference.
+
+    :returns: The mesh format.
+    :rtype: :class:`MeshFormat`
+    """
+
+    return MeshFormat(compression, QUANTIZE_BITS if quantize == True else None)
+
+
+def make_vmd(session_pool=None, profile=None, mesh_format=None):
+    """
+    Make a VMD interface, with its temporary directory.
+
+    :param VMDSessionPool session_pool: Persistent VMD processes to use, or
+                None to start a new VMD.
+    :param ImportProfile profile: Times the stages of the import, or None.
+    :param MeshFormat mesh_format: How to save the meshes, or None for the
+                default.
+
+    :returns: The VMD interface.
+    :rtype: :class:`VMD`
+    """
+
+    vmd = VMD()
+    vmd.make_tmp_dir()
+    vmd.mesh_dir = None
+    vmd.session_pool = session_pool
+    vmd.profile = profile
+    if mesh_format is not None:
+        vmd.mesh_format = mesh_format
+    return vmd
+
+
+def uses_symmetry(settings, filepath):
+    """
+    Whether copies of chains, or the biological assembly, can be added as
+    linked duplicates. Only for PDB files that aren't trajectories.
+
+    :param ??? settings: The import settings (e.g., the operator).
+    :param str filepath: The file to import.
+
+    :returns: True if they can, False otherwise.
+    :rtype: :class:`bool`
+    """
+
+    _, ext = os.path.splitext(filepath)
+    return ext.upper() == ".PDB" and not settings.import_trajectory
+
+
+def set_chain_copies(vmd, settings, filepath):
+    """
+    Find the chains that are copies of another (if the user asked for
+    that), so neither VMD nor BlendMol makes their meshes.
+
+    :param VMD vmd: The VMD interface. Its chain_copies are set.
+    :param ??? settings: The import settings.
+    :param str filepath: The absolute path of the file to import.
+    """
+
+    vmd.chain_copies = {}
+    if settings.instance_chains == True and uses_symmetry(settings, filepath):
+        structure = vmd.get_structure(filepath)
+        with stage(vmd.profile, "find chain copies"):
+            vmd.chain_copies = find_chain_copies(
+                structure, settings.instance_chains_rmsd
+            )
+        print(
+            "Chains that are copies of another: "
+            + str(len(vmd.chain_copies))
+            + " of "
+            + str(len(structure.unique_chains))
+        )
+
+
+def make_vis_script(vmd, settings, filepath, vmd_exec_path, mesh_cache=None):
+    """
+    Write the VMD scripts, and look for their meshes in the mesh cache. If
+    they are there, vmd.mesh_dir is set to their directory, which stays
+    pinned in the cache until vmd.del_tmp_dir().
+
+    :param VMD vmd: The VMD interface.
+    :param ??? settings: The import settings.
+    :param str filepath: The absolute path of the file to import.
+    :param str vmd_exec_path: The path to the VMD executable.
+    :param MeshCache mesh_cache: The mesh cache, or None not to use one.
+
+    :returns: The mesh cache key, or None if there is no mesh cache.
+    :rtype: :class:`str`
+    """
+
+    with stage(vmd.profile, "make tcl"):
+        vmd.make_vis_script(settings)
+
+    # If VMD already made these meshes, don't run it again. VMD state and
+    # TCL files load other files, which aren't part of the key, so their
+    # meshes are never cached.
+    cache_key = None
+    _, ext = os.path.splitext(filepath)
+    if mesh_cache is not None and ext.upper() in MeshCache.CACHED_INPUT_EXTS:
+        with stage(vmd.profile, "mesh cache lookup"):
+            cache_key = mesh_cache.make_key(
+                filepath,
+                [open(f, "r").read() for f in vmd.vis_script_filenames],
+                vmd_exec_path,
+                vmd.tmp_dir,
+            )
+            vmd.mesh_dir = mesh_cache.lookup(cache_key, pin=True)
+            if vmd.mesh_dir is not None:
+                vmd.mesh_cache_entry = (mesh_cache, cache_key)
+    return cache_key
+
+
+def run_vmd_stage(
+    settings,
+    filepath,
+    vmd_exec_path,
+    mesh_cache=None,
+    session_pool=None,
+    profile=None,
+    mesh_format=None,
+):
+    """
+    Make the meshes of a file with VMD (or find them in the mesh cache).
+    Doesn't touch Blender's data, so it is safe to run in a thread.
+    Trajectories are left to the Blender stage, which stores each chunk of
+    frames before VMD renders the next.
+
+    :param ??? settings: The import settings. settings.filepath must be the
+                file to import.
+    :param str filepath: The absolute path of the file to import.
+    :param str vmd_exec_path: The path to the VMD executable.
+    :param MeshCache mesh_cache: The mesh cache, or None not to use one.
+    :param VMDSessionPool session_pool: Persistent VMD processes to use, or
+                None to start a new VMD.
+    :param ImportProfile profile: Times the stages of the import, or None.
+    :param MeshFormat mesh_format: How to save the meshes (binary mesh
+                files), or None for the default.
+
+    :returns: The VMD interface, with a mesh_dir attribute (the directory
+              with the meshes, or None for the temporary directory).
+    :rtype: :class:`VMD`
+    """
+
+    vmd = make_vmd(session_pool, profile, mesh_format)
+    set_chain_copies(vmd, settings, filepath)
+
+    if is_trajectory(settings, filepath) or not needs_vmd(settings, filepath):
+        return vmd
+
+    try:
+        cache_key = make_vis_script(vmd, settings, filepath, vmd_exec_path, mesh_cache)
+        if vmd.mesh_dir is None:
+            with stage(profile, "vmd"):
+                vmd.run_external_program(vmd_exec_path)
+            # Read (and shrink) VMD's OBJ files here, off the main thread.
+            vmd.convert_mesh_files(vmd.tmp_dir)
+            if cache_key is not None:
+                with stage(profile, "mesh cache store"):
+                    vmd.mesh_dir = mesh_cache.store(cache_key, vmd.tmp_dir, pin=True)
+                vmd.mesh_cache_entry = (mesh_cache, cache_key)
+        else:
+            print("Using cached meshes from " + vmd.mesh_dir)
+    except:
+        vmd.del_tmp_dir()
+        raise
+
+    return vmd
+
+
+def run_blender_stage(vmd, settings, filepath, vmd_exec_path):
+    """
+    Add the objects of a file to the scene, from the meshes the VMD stage
+    made and the representations BlendMol builds itself. Deletes the
+    temporary directory. Must run on the main thread.
+
+    :param VMD vmd: What run_vmd_stage() returned.
+    :param ??? settings: The import settings.
+    :param str filepath: The absolute path of the file to import.
+    :param str vmd_exec_path: The path to the VMD executable.
+
+    :returns: List of the names of the added objects.
+    :rtype: :class:`str[]`
+    """
+
+    new_obj_names = []
+
+    try:
+        if is_trajectory(settings, filepath):
+            # VMD renders every frame, a chunk at a time.
+            new_obj_names = Trajectory.import_trajectory(vmd, settings, vmd_exec_path)
+        elif needs_vmd(settings, filepath):
+            new_obj_names = vmd.import_all_mesh_files(settings, vmd.mesh_dir)
+
+        new_obj_names = new_obj_names + add_native_representations(
+            vmd, settings, filepath
+        )
+        new_obj_names = new_obj_names + add_linked_copies(
+            vmd, settings, filepath, new_obj_names
+        )
+    finally:
+        vmd.del_tmp_dir()
+
+    return new_obj_names
+
+
+def add_native_representations(vmd, settings, filepath):
+    """
+    Add the sticks, balls, VDW spheres and surfaces that BlendMol builds
+    itself (if the user asked for them). Must run on the main thread.
+
+    :param VMD vmd: The VMD interface.
+    :param ??? settings: The import settings.
+    :param str filepath: The absolute path of the file to import.
+
+    :returns: List of the names of the added objects.
+    :rtype: :class:`str[]`
+    """
+
+    _, ext = os.path.splitext(filepath)
+    if (
+        ext.upper() != ".PDB"
+        or settings.import_trajectory
+        or not (
+            settings.native_geometry
+            or settings.instance_spheres
+            or settings.native_surfaces
+        )
+    ):
+        return []
+
+    structure = vmd.get_structure(filepath)
+    with stage(vmd.profile, "native geometry"):
+        native_representations = get_native_representations(
+            structure,
+            settings,
+            sticks_too=settings.native_geometry,
+            spheres_too=settings.native_geometry or settings.instance_spheres,
+            instanced=settings.instance_spheres,
+            skip_chains=vmd.chain_copies,
+            surfaces_too=settings.native_surfaces,
+        )
+
+    # Merge the meshes of every chain into one object per representation,
+    # like the meshes VMD makes.
+    if vmd.join_chains == True:
+        to_join = {}
+        others = []
+        for name, mesh in native_representations:
+            filename_id, chain = split_object_name(name)
+            if isinstance(mesh, SpherePoints) or chain in vmd.separate_chains:
+                others.append((name, mesh))
+            else:
+                to_join.setdefault(filename_id, []).append((chain, mesh))
+        native_representations = others + [
+            (
+                filename_id,
+                concatenate_meshes(
+                    [mesh for _, mesh in meshes], [chain for chain, _ in meshes]
+                ),
+            )
+            for filename_id, meshes in sorted(to_join.items())
+        ]
+
+    new_obj_names = []
+    for name, mesh in native_representations:
+        if isinstance(mesh, SpherePoints):
+            obj = vmd.add_sphere_instances(name, mesh, settings)
+        else:
+            obj = vmd.add_mesh_arrays(name, mesh, settings)
+        new_obj_names.append(obj.name)
+    return new_obj_names
+
+
+def add_linked_copies(vmd, settings, filepath, new_obj_names):
+    """
+    Add the copies of chains whose meshes weren't made, and the other copies
+    of the biological assembly (if the user asked for it), as linked
+    duplicates of the objects already added. Must run on the main thread.
+
+    :param VMD vmd: The VMD interface.
+    :param ??? settings: The import settings.
+    :param str filepath: The absolute path of the file to import.
+    :param list new_obj_names: The names of the objects added so far.
+
+    :returns: List of the names of the added objects.
+    :rtype: :class:`str[]`
+    """
+
+    if not uses_symmetry(settings, filepath):
+        return []
+
+    # The objects, with their names (without the "BldMl__" prefix) and
+    # chains. Batched or joined objects show several chains.
+    objs = []
+    for obj_name in new_obj_names:
+        chains = vmd.get_object_chains(obj_name)
+        if len(chains) > 0:
+            name = obj_name.split(".")[0][len("BldMl__") :]
+            objs.append((obj_name, name, chains))
+
+    new_copy_names = []
+    with stage(vmd.profile, "linked copies"):
+        # The chains they copy are always objects of their own.
+        for chain, (ref_chain, matrix) in sorted(vmd.chain_copies.items()):
+            for obj_name, name, chains in list(objs):
+                if chains != [ref_chain]:
+                    continue
+                filename_id = split_object_name(name)[0]
+                if depends_on_other_chains(filename_id):
+                    # Made for every chain.
+                    continue
+                obj = vmd.add_linked_copy(
+                    obj_name, filename_id + "_" + chain, matrix, settings
+                )
+                objs.append((obj.name, filename_id + "_" + chain, [chain]))
+                new_copy_names.append(obj.name)
+
+        if settings.build_assembly == True:
+            operators = get_assembly_operators(vmd.get_structure(filepath))
+            for i, (op_chains, matrix) in enumerate(operators):
+                for obj_name, name, chains in objs:
+                    if not set(chains) <= set(op_chains):
+                        continue
+                    obj = vmd.add_linked_copy(
+                        obj_name, name + "_asm" + str(i + 1), matrix, settings
+                    )
+                    new_copy_names.append(obj.name)
+
+    return new_copy_names
+
+
+def can_stream(settings, filepath):
+    """
+    Whether a file can be imported with a StreamingImport. Trajectories, and
+    files that don't need VMD, can't.
+
+    :param ??? settings: The import settings (e.g., the operator).
+    :param str filepath: The file to import.
+
+    :returns: True if it can, False otherwise.
+    :rtype: :class:`bool`
+    """
+
+    return needs_vmd(settings, filepath) and not is_trajectory(settings, filepath)
+
+
+class StreamingImport:
+    """
+    An import whose meshes are read (in threads) and turned into objects
+    while VMD is still rendering the rest. Call step() on the main thread
+    until it returns True.
+    """
+
+    def __init__(
+        self,
+        settings,
+        filepath,
+        vmd_exec_path,
+        mesh_cache=None,
+        session_pool=None,
+        profile=None,
+        mesh_format=None,
+        max_workers=2,
+    ):
+        """
+        Start the import: write the VMD scripts and start VMD (or read the
+        cached meshes). Must run on the main thread.
+
+        :param ??? settings: The import settings.
+        :param str filepath: The absolute path of the file to import.
+        :param str vmd_exec_path: The path to the VMD executable.
+        :param MeshCache mesh_cache: The mesh cache, or None not to use one.
+        :param VMDSessionPool session_pool: Persistent VMD processes to use,
+                    or None to start a new VMD.
+        :param ImportProfile profile: Times the stages of the import, or
+                    None.
+        :param MeshFormat mesh_format: How to save the meshes (binary mesh
+                    files), or None for the default.
+        :param int max_workers: How many mesh files to read at the same
+                   time. Defaults to 2.
+        """
+
+        self.settings = settings
+        self.filepath = filepath
+        self.vmd_exec_path = vmd_exec_path
+        self.mesh_cache = mesh_cache
+        self.new_obj_names = None
+
+        self.vmd = make_vmd(session_pool, profile, mesh_format)
+        self.vmd.cancel_event = threading.Event()
+
+        try:
+            set_chain_copies(self.vmd, settings, filepath)
+            self.cache_key = make_vis_script(
+                self.vmd, settings, filepath, vmd_exec_path, mesh_cache
+            )
+            self.vmd.begin_mesh_import()
+        except:
+            self.vmd.del_tmp_dir()
+            raise
+
+        self.stream = MeshStream(
+            lambda filename: self.vmd.load_mesh_file(filename, settings), max_workers
+        )
+        self.stream.start(self.make_meshes)
+
+    def make_meshes(self):
+        """
+        Run VMD, or find the cached meshes (runs in a thread).
+        """
+
+        if self.vmd.mesh_dir is not None:
+            print("Using cached meshes from " + self.vmd.mesh_dir)
+            self.stream.add_directory(self.vmd.mesh_dir)
+            return
+
+        with stage(self.vmd.profile, "vmd"):
+            self.vmd.run_external_program(
+                self.vmd_exec_path, on_output=self.stream.watch_output
+            )
+
+        # Files VMD didn't announce (e.g., from the user's own scripts).
+        self.stream.add_directory(self.vmd.tmp_dir)
+
+    def step(self, max_seconds=0.1):
+        """
+        Add the meshes that are ready to the scene, for up to max_seconds.
+        Must run on the main thread.
+
+        :param float max_seconds: How long to spend (or wait for meshes).
+                     Defaults to 0.1.
+
+        :returns: True once the import is done (see new_obj_names), False
+                  otherwise.
+        :rtype: :class:`bool`
+        """
+
+        deadline = time.perf_counter() + max_seconds
+        try:
+            while not self.stream.is_done():
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return False
+                mesh = self.stream.get_next(remaining)
+                if mesh is not None:
+                    filename, mesh_arrays = mesh
+                    self.vmd.import_mesh_file(filename, self.settings, mesh_arrays)
+
+            self.finish()
+        except:
+            self.close()
+            raise
+        return True
+
+    def finish(self):
+        """
+        Finish the import, once every mesh is in the scene.
+        """
+
+        new_obj_names = self.vmd.finish_mesh_import(self.settings)
+        if self.cache_key is not None and self.vmd.mesh_dir is None:
+            with stage(self.vmd.profile, "mesh cache store"):
+                self.mesh_cache.store(self.cache_key, self.vmd.tmp_dir)
+        new_obj_names = new_obj_names + add_native_representations(
+            self.vmd, self.settings, self.filepath
+        )
+        new_obj_names = new_obj_names + add_linked_copies(
+            self.vmd, self.settings, self.filepath, new_obj_names
+        )
+        self.close()
+        self.new_obj_names = new_obj_names
+
+    def get_progress(self):
+        """
+        How far along the import is.
+
+        :returns: The number of meshes done, and the total (None if it isn't
+                  known yet).
+        :rtype: :class:`tuple`
+        """
+
+        return self.stream.get_progress()
+
+    def cancel(self):
+        """
+        Cancel the import: stop VMD, and remove the objects added so far.
+        Must run on the main thread.
+        """
+
+        self.close()
+        self.vmd.cancel_mesh_import()
+
+    def close(self):
+        """
+        Stop VMD (if it is still running) and the reading of meshes, and
+        delete the temporary directory.
+        """
+
+        self.vmd.cancel_event.set()
+        self.stream.cancel()
+        self.stream.producer.join()
+        self.stream.close()
+        if os.path.exists(self.vmd.tmp_dir):
+            self.vmd.del_tmp_dir()
@@ -0,0 +1,379 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import bpy
+from mathutils import Vector
+from bpy.app.handlers import persistent
+from bpy.types import Operator, Panel
+from bpy.props import BoolProperty, EnumProperty, FloatProperty, PointerProperty
+
+# Level-of-detail (LOD) tiers. VMD can render each representation several
+# times, from a cheap draft mesh to the full-resolution final one. Every tier
+# is kept as its own mesh datablock, linked to the BlendMol object, and the
+# object shows one of them at a time. Renders always use the final tier.
+
+# The tiers, from cheapest to most detailed. "final" is the resolution
+# BlendMol has always used.
+LOD_TIERS = ["draft", "preview", "final"]
+
+# The mesh files (and meshes) of the cheaper tiers end in this, plus the tier
+# name (e.g., "prot_nuc_surf_A__lod_draft.obj").
+LOD_SUFFIX = "__lod_"
+
+LOD_TIER_ITEMS = [
+    ("DRAFT", "Draft", "The cheapest mesh, for viewport work"),
+    ("PREVIEW", "Preview", "A medium-resolution mesh, for test renders"),
+    ("FINAL", "Final", "The full-resolution mesh"),
+]
+
+# The tier each object showed before a render switched it to final, by the
+# object's pointer (its name can change while rendering).
+_tiers_before_render = {}
+
+
+def split_lod_name(name):
+    """
+    Split a mesh name into the name of its representation and its tier.
+
+    :param str name: The name (e.g., "prot_nuc_surf_A__lod_draft").
+
+    :returns: The representation name and the tier ("final" if the name has
+              no LOD suffix).
+    :rtype: :class:`tuple`
+    """
+
+    if LOD_SUFFIX in name:
+        base, tier = name.rsplit(LOD_SUFFIX, 1)
+        if tier in LOD_TIERS:
+            return base, tier
+    return name, "final"
+
+
+def get_lod_mesh(obj, tier):
+    """
+    The mesh of one tier of an object.
+
+    :param bpy.types.Object obj: The object.
+    :param str tier: The tier ("draft", "preview" or "final").
+
+    :returns: The mesh, or None if the object doesn't have that tier.
+    :rtype: :class:`bpy.types.Mesh`
+    """
+
+    return getattr(obj, "blendmol_lod_" + tier, None)
+
+
+def has_lod(obj):
+    """
+    Whether an object has level-of-detail tiers.
+
+    :param bpy.types.Object obj: The object.
+
+    :returns: True if it does, False otherwise.
+    :rtype: :class:`bool`
+    """
+
+    return obj.type == "MESH" and get_lod_mesh(obj, "final") is not None
+
+
+def link_lod_meshes(obj, tier_meshes):
+    """
+    Link the tier meshes to an object. The object keeps showing its final
+    mesh.
+
+    :param bpy.types.Object obj: The object. Its current mesh is the final
+                tier.
+    :param dict tier_meshes: Maps the other tiers to their meshes.
+    """
+
+    obj.blendmol_lod_final = obj.data
+    for tier, mesh in tier_meshes.items():
+        setattr(obj, "blendmol_lod_" + tier, mesh)
+    obj["blendmol_lod_tier"] = "final"
+
+
+def set_lod(obj, tier):
+    """
+    Show one tier of an object. Objects without that tier are left alone.
+
+    :param bpy.types.Object obj: The object.
+    :param str tier: The tier ("draft", "preview" or "final").
+    """
+
+    mesh = get_lod_mesh(obj, tier)
+    if mesh is not None and obj.data != mesh:
+        obj.data = mesh
+        obj["blendmol_lod_tier"] = tier
+
+        if tier != "final":
+            # Renders will switch the object back to its final mesh, which
+            # is only safe if the interface is locked while rendering.
+            # Blender reads this setting before the render handlers run, so
+            # it must be set now.
+            for scene in obj.users_scene:
+                scene.render.use_lock_interface = True
+
+
+def get_camera_tier(obj, scene):
+    """
+    The tier an object should show, given its distance from the scene
+    camera.
+
+    :param bpy.types.Object obj: The object.
+    :param bpy.types.Scene scene: The scene.
+
+    :returns: The tier.
+    :rtype: :class:`str`
+    """
+
+    if scene.camera is None:
+        return "final"
+
+    # The distance to the center of the (final) bounding box.
+    corners = [obj.matrix_world @ Vector(corner) for corner in obj.bound_box]
+    center = sum(corners, Vector()) / len(corners)
+    distance = (center - scene.camera.matrix_world.translation).length
+
+    if distance >= scene.blendmol_lod_draft_distance:
+        return "draft"
+    if distance >= scene.blendmol_lod_preview_distance:
+        return "preview"
+    return "final"
+
+
+def update_from_camera(scene, objs=None):
+    """
+    Set the tier of every LOD object from its distance to the camera.
+
+    :param bpy.types.Scene scene: The scene.
+    :param list objs: The objects. Defaults to all the objects in the scene.
+    """
+
+    if objs is None:
+        objs = scene.objects
+    for obj in objs:
+        if has_lod(obj):
+            set_lod(obj, get_camera_tier(obj, scene))
+
+
+class SetLevelOfDetail(Operator):
+    """
+    Switch BlendMol objects between their level-of-detail meshes.
+    """
+
+    bl_idname = "object.blendmol_set_lod"
+    bl_label = "Set BlendMol Level of Detail"
+    bl_options = {"REGISTER", "UNDO"}
+
+    tier: EnumProperty(
+        name="Level of Detail",
+        items=LOD_TIER_ITEMS
+        + [("CAMERA", "Camera Distance", "Choose by distance from the camera")],
+        default="DRAFT",
+    )
+    selected_only: BoolProperty(
+        name="Selected Only",
+        default=True,
+        description="Only change the selected objects (otherwise, all of them)?",
+    )
+
+    def execute(self, context):
+        """
+        Switch the tiers.
+
+        :param ??? context: The context.
+        """
+
+        if self.selected_only == True:
+            objs = context.selected_objects
+        else:
+            objs = context.scene.objects
+
+        if self.tier == "CAMERA":
+            update_from_camera(context.scene, objs)
+        else:
+            for obj in objs:
+                set_lod(obj, self.tier.lower())
+
+        return {"FINISHED"}
+
+
+class OBJECT_PT_blendmol_lod(Panel):
+    """
+    Level-of-detail controls in the object properties.
+    """
+
+    bl_label = "BlendMol Level of Detail"
+    bl_space_type = "PROPERTIES"
+    bl_region_type = "WINDOW"
+    bl_context = "object"
+
+    @classmethod
+    def poll(cls, context):
+        """
+        Only show the panel for objects with LOD tiers.
+
+        :param ??? context: The context.
+        """
+
+        return context.object is not None and has_lod(context.object)
+
+    def draw(self, context):
+        """
+        Layout (draw) the panel.
+
+        :param ??? context: The context.
+        """
+
+        layout = self.layout
+        obj = context.object
+        scene = context.scene
+
+        layout.label(text="Showing: " + obj.get("blendmol_lod_tier", "final"))
+        row = layout.row(align=True)
+        for tier, label, _ in LOD_TIER_ITEMS:
+            if get_lod_mesh(obj, tier.lower()) is not None:
+                row.operator(SetLevelOfDetail.bl_idname, text=label).tier = tier
+        layout.operator(
+            SetLevelOfDetail.bl_idname, text="From Camera Distance"
+        ).tier = "CAMERA"
+
+        layout.prop(scene, "blendmol_lod_auto")
+        column = layout.column()
+        column.active = scene.blendmol_lod_auto
+        column.prop(scene, "blendmol_lod_preview_distance")
+        column.prop(scene, "blendmol_lod_draft_distance")
+
+
+@persistent
+def lod_frame_change(scene, *args):
+    """
+    Update the tiers from the camera distance when the frame changes, if the
+    scene asks for it. Not while rendering, which always uses final meshes.
+
+    :param bpy.types.Scene scene: The scene.
+    """
+
+    if scene.blendmol_lod_auto == True and len(_tiers_before_render) == 0:
+        update_from_camera(scene)
+
+
+@persistent
+def lod_render_pre(scene, *args):
+    """
+    Switch every LOD object to its final mesh before rendering.
+
+    :param bpy.types.Scene scene: The scene.
+    """
+
+    for obj in scene.objects:
+        if has_lod(obj) and obj.data != obj.blendmol_lod_final:
+            _tiers_before_render.setdefault(
+                obj.as_pointer(), obj.get("blendmol_lod_tier", "final")
+            )
+            set_lod(obj, "final")
+
+
+@persistent
+def lod_render_post(scene, *args):
+    """
+    Switch objects back to the tiers they showed before the render.
+
+    :param bpy.types.Scene scene: The scene.
+    """
+
+    for obj in bpy.data.objects:
+        tier = _tiers_before_render.get(obj.as_pointer())
+        if tier is not None:
+            set_lod(obj, tier)
+    _tiers_before_render.clear()
+
+
+classes = (SetLevelOfDetail, OBJECT_PT_blendmol_lod)
+
+
+def register():
+    """
+    Register the LOD properties, operator, panel and handlers.
+    """
+
+    from bpy.utils import register_class
+
+    for tier in LOD_TIERS:
+        setattr(
+            bpy.types.Object,
+            "blendmol_lod_" + tier,
+            PointerProperty(type=bpy.types.Mesh, name="BlendMol " + tier + " mesh"),
+        )
+
+    bpy.types.Scene.blendmol_lod_auto = BoolProperty(
+        name="Choose by Camera Distance",
+        default=False,
+        description=(
+            "Pick the level of detail of BlendMol objects from their distance "
+            "to the camera whenever the frame changes?"
+        ),
+    )
+    bpy.types.Scene.blendmol_lod_preview_distance = FloatProperty(
+        name="Preview Beyond",
+        default=10.0,
+        min=0.0,
+        subtype="DISTANCE",
+        description="Objects farther than this from the camera use preview meshes",
+    )
+    bpy.types.Scene.blendmol_lod_draft_distance = FloatProperty(
+        name="Draft Beyond",
+        default=30.0,
+        min=0.0,
+        subtype="DISTANCE",
+        description="Objects farther than this from the camera use draft meshes",
+    )
+
+    for cls in classes:
+        register_class(cls)
+
+    bpy.app.handlers.frame_change_post.append(lod_frame_change)
+    bpy.app.handlers.render_pre.append(lod_render_pre)
+    bpy.app.handlers.render_complete.append(lod_render_post)
+    bpy.app.handlers.render_cancel.append(lod_render_post)
+
+
+def unregister():
+    """
+    Unregister the LOD properties, operator, panel and handlers.
+    """
+
+    from bpy.utils import unregister_class
+
+    for handlers, handler in [
+        (bpy.app.handlers.frame_change_post, lod_frame_change),
+        (bpy.app.handlers.render_pre, lod_render_pre),
+        (bpy.app.handlers.render_complete, lod_render_post),
+        (bpy.app.handlers.render_cancel, lod_render_post),
+    ]:
+        if handler in handlers:
+            handlers.remove(handler)
+
+    for cls in reversed(classes):
+        unregister_class(cls)
+
+    del bpy.types.Scene.blendmol_lod_auto
+    del bpy.types.Scene.blendmol_lod_preview_distance
+    del bpy.types.Scene.blendmol_lod_draft_distance
+    for tier in LOD_TIERS:
+        delattr(bpy.types.Object, "blendmol_lod_" + tier)
@@ -0,0 +1,576 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy
+
+# Mesh geometry as plain NumPy arrays, which can be built (and benchmarked)
+# outside of Blender.
+
+# Vertices closer than this (in Angstroms) are merged when removing doubles.
+REMOVE_DOUBLES_THRESHOLD = 0.0001
+
+
+class MeshArrays:
+    """
+    A mesh stored as NumPy arrays, laid out the way Blender's Mesh data API
+    expects them (vertices, loops and polygons).
+    """
+
+    def __init__(
+        self,
+        vertices=None,
+        loop_vertex_indices=None,
+        loop_totals=None,
+        material_indices=None,
+        material_names=None,
+        material_colors=None,
+        smooth=False,
+        chains=None,
+        polygon_chains=None,
+    ):
+        """
+        Initialize the mesh.
+
+        :param numpy.ndarray vertices: (N, 3) float32 vertex coordinates.
+        :param numpy.ndarray loop_vertex_indices: int32 vertex index of every
+                             polygon corner, polygon after polygon.
+        :param numpy.ndarray loop_totals: int32 number of corners per polygon.
+        :param numpy.ndarray material_indices: int32 material slot per
+                             polygon.
+        :param list material_names: The names of the material slots.
+        :param numpy.ndarray material_colors: (M, 4) float32 RGBA color of
+                             each material slot.
+        :param bool smooth: Whether the polygons should be shaded smooth.
+        :param list chains: The chains of a mesh that covers several. Optional.
+        :param numpy.ndarray polygon_chains: int32 index into chains per
+                             polygon (-1 if unknown), or None.
+        """
+
+        if vertices is None:
+            vertices = numpy.zeros((0, 3), dtype=numpy.float32)
+        if loop_vertex_indices is None:
+            loop_vertex_indices = numpy.zeros(0, dtype=numpy.int32)
+        if loop_totals is None:
+            loop_totals = numpy.zeros(0, dtype=numpy.int32)
+        if material_indices is None:
+            material_indices = numpy.zeros(len(loop_totals), dtype=numpy.int32)
+        if material_names is None:
+            material_names = []
+        if material_colors is None:
+            material_colors = numpy.zeros((0, 4), dtype=numpy.float32)
+
+        self.vertices = numpy.asarray(vertices, dtype=numpy.float32).reshape(-1, 3)
+        self.loop_vertex_indices = numpy.asarray(loop_vertex_indices, dtype=numpy.int32)
+        self.loop_totals = numpy.asarray(loop_totals, dtype=numpy.int32)
+        self.material_indices = numpy.asarray(material_indices, dtype=numpy.int32)
+        self.material_names = list(material_names)
+        self.material_colors = numpy.asarray(
+            material_colors, dtype=numpy.float32
+        ).reshape(-1, 4)
+        self.smooth = smooth
+        self.chains = chains
+        self.polygon_chains = polygon_chains
+
+    @property
+    def loop_starts(self):
+        """
+        The index of the first loop (corner) of every polygon.
+
+        :returns: int32 array, one entry per polygon.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        starts = numpy.zeros(len(self.loop_totals), dtype=numpy.int32)
+        if len(self.loop_totals) > 1:
+            numpy.cumsum(self.loop_totals[:-1], out=starts[1:])
+        return starts
+
+    @property
+    def num_vertices(self):
+        """
+        The number of vertices.
+
+        :returns: The count.
+        :rtype: :class:`int`
+        """
+
+        return len(self.vertices)
+
+    @property
+    def num_polygons(self):
+        """
+        The number of polygons (faces).
+
+        :returns: The count.
+        :rtype: :class:`int`
+        """
+
+        return len(self.loop_totals)
+
+    def get_polygon_centers(self):
+        """
+        The center of every polygon (the mean of its corners).
+
+        :returns: (P, 3) float32 coordinates.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        if self.num_polygons == 0:
+            return numpy.zeros((0, 3), dtype=numpy.float32)
+        sums = numpy.add.reduceat(
+            self.vertices[self.loop_vertex_indices], self.loop_starts, axis=0
+        )
+        return sums / self.loop_totals[:, None].astype(numpy.float32)
+
+    def select_polygons(self, keep_polygons):
+        """
+        Keep only some of the polygons, and the vertices they use.
+
+        :param numpy.ndarray keep_polygons: A boolean mask of the polygons to
+                             keep.
+
+        :returns: The smaller mesh.
+        :rtype: :class:`MeshArrays`
+        """
+
+        polygon_ids = numpy.repeat(
+            numpy.arange(self.num_polygons, dtype=numpy.int32), self.loop_totals
+        )
+        loop_vertex_indices = self.loop_vertex_indices[keep_polygons[polygon_ids]]
+        used = numpy.unique(loop_vertex_indices)
+        old_to_new = numpy.full(self.num_vertices, -1, dtype=numpy.int32)
+        old_to_new[used] = numpy.arange(len(used), dtype=numpy.int32)
+
+        return MeshArrays(
+            vertices=self.vertices[used],
+            loop_vertex_indices=old_to_new[loop_vertex_indices],
+            loop_totals=self.loop_totals[keep_polygons],
+            material_indices=self.material_indices[keep_polygons],
+            material_names=self.material_names,
+            material_colors=self.material_colors,
+            smooth=self.smooth,
+            chains=self.chains,
+            polygon_chains=(
+                self.polygon_chains[keep_polygons]
+                if self.polygon_chains is not None
+                else None
+            ),
+        )
+
+    def merge_vertices(self, representatives):
+        """
+        Merge groups of vertices into one vertex each, at the mean of the
+        group. Polygons that collapse are removed.
+
+        :param numpy.ndarray representatives: The vertex each vertex is
+                             merged into (the same for the whole group).
+
+        :returns: The merged mesh.
+        :rtype: :class:`MeshArrays`
+        """
+
+        _, old_to_new = numpy.unique(representatives, return_inverse=True)
+        old_to_new = old_to_new.astype(numpy.int32).ravel()
+        counts = numpy.bincount(old_to_new).astype(numpy.float32)
+        vertices = numpy.zeros((len(counts), 3), dtype=numpy.float32)
+        numpy.add.at(vertices, old_to_new, self.vertices)
+        vertices = vertices / counts[:, None]
+
+        loop_vertex_indices, loop_totals, keep_polygons = self._remove_degenerate(
+            old_to_new[self.loop_vertex_indices]
+        )
+
+        return MeshArrays(
+            vertices=vertices,
+            loop_vertex_indices=loop_vertex_indices,
+            loop_totals=loop_totals,
+            material_indices=self.material_indices[keep_polygons],
+            material_names=self.material_names,
+            material_colors=self.material_colors,
+            smooth=self.smooth,
+            chains=self.chains,
+            polygon_chains=(
+                self.polygon_chains[keep_polygons]
+                if self.polygon_chains is not None
+                else None
+            ),
+        )
+
+    def weld(self, threshold):
+        """
+        Merge vertices that are closer than a threshold (like Blender's
+        "remove doubles"), without entering edit mode. Vertices are snapped
+        to a grid with the threshold as its spacing, and vertices in the same
+        grid cell are merged. Neighboring cells whose vertices are closer
+        than the threshold are merged too. Polygons that collapse are
+        removed.
+
+        :param float threshold: The merge distance.
+
+        :returns: The welded mesh.
+        :rtype: :class:`MeshArrays`
+        """
+
+        if self.num_vertices == 0:
+            return self
+
+        # Quantize the coordinates and sort them, so vertices in the same
+        # cell are next to each other.
+        cells = numpy.floor(self.vertices / threshold + 0.5).astype(numpy.int64)
+        cells = cells - cells.min(axis=0)
+        spans = cells.max(axis=0) + 1
+        if float(spans[0]) * float(spans[1]) * float(spans[2]) < 2**62:
+            # Pack the three cell coordinates into one integer, which sorts
+            # much faster than three separate columns.
+            keys = (cells[:, 0] * spans[1] + cells[:, 1]) * spans[2] + cells[:, 2]
+            order = numpy.argsort(keys, kind="stable")
+            sorted_keys = keys[order]
+            is_new_cell = numpy.ones(len(order), dtype=bool)
+            is_new_cell[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        else:
+            order = numpy.lexsort((cells[:, 2], cells[:, 1], cells[:, 0]))
+            sorted_keys = cells[order]
+            is_new_cell = numpy.ones(len(order), dtype=bool)
+            is_new_cell[1:] = numpy.any(sorted_keys[1:] != sorted_keys[:-1], axis=1)
+
+        # Map each old vertex to its cell. The first vertex in each cell
+        # gives the welded position.
+        cell_ids = numpy.cumsum(is_new_cell) - 1
+        old_to_new = numpy.empty(len(order), dtype=numpy.int32)
+        old_to_new[order] = cell_ids
+        firsts = order[is_new_cell]
+        vertices = self.vertices[firsts]
+
+        # Vertices just either side of a cell boundary can be much closer
+        # than the threshold.
+        groups = self._join_neighboring_cells(vertices, cells[firsts], threshold)
+        if groups is not None:
+            kept_cells, cell_to_group = numpy.unique(groups, return_inverse=True)
+            old_to_new = cell_to_group.astype(numpy.int32).ravel()[old_to_new]
+            vertices = vertices[kept_cells]
+
+        loop_vertex_indices, loop_totals, keep_polygons = self._remove_degenerate(
+            old_to_new[self.loop_vertex_indices]
+        )
+
+        return MeshArrays(
+            vertices=vertices,
+            loop_vertex_indices=loop_vertex_indices,
+            loop_totals=loop_totals,
+            material_indices=self.material_indices[keep_polygons],
+            material_names=self.material_names,
+            material_colors=self.material_colors,
+            smooth=self.smooth,
+            chains=self.chains,
+            polygon_chains=(
+                self.polygon_chains[keep_polygons]
+                if self.polygon_chains is not None
+                else None
+            ),
+        )
+
+    def _join_neighboring_cells(self, vertices, cells, threshold):
+        """
+        Find the weld cells whose vertices are closer than the threshold to
+        those of a neighboring cell. Each cell is compared with the 13
+        neighbors "after" it (the other 13 compare themselves with it).
+
+        :param numpy.ndarray vertices: The first vertex of every cell.
+        :param numpy.ndarray cells: The (N, 3) coordinates of every cell.
+        :param float threshold: The merge distance.
+
+        :returns: The lowest cell each cell is (indirectly) joined to, or None
+                  if no cells are joined.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        # Hash the cell coordinates into one integer. The hash is linear, so
+        # the hash of a neighbor is an offset from the cell's. It can wrap
+        # around for huge meshes, so cells that collide are told apart by the
+        # distance check below.
+        spans = [int(span) for span in cells.max(axis=0) + 2]
+        strides = [spans[1] * spans[2], spans[2], 1]
+        hashes = (cells + 1).astype(numpy.uint64) @ numpy.array(
+            [stride % 2**64 for stride in strides], dtype=numpy.uint64
+        )
+        order = numpy.argsort(hashes, kind="stable")
+        sorted_hashes = hashes[order]
+
+        ends1 = []
+        ends2 = []
+        for offset in [(0, 0, 1), (0, 1, -1), (0, 1, 0), (0, 1, 1)] + [
+            (1, dy, dz) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+        ]:
+            shift = sum([o * stride for o, stride in zip(offset, strides)])
+            neighbor_hashes = hashes + numpy.uint64(shift % 2**64)
+            starts = numpy.searchsorted(sorted_hashes, neighbor_hashes, "left")
+            counts = numpy.searchsorted(sorted_hashes, neighbor_hashes, "right")
+            counts = counts - starts
+            if counts.sum() == 0:
+                continue
+
+            # Expand the ranges into one entry per candidate pair.
+            idxs = numpy.repeat(numpy.arange(len(cells)), counts)
+            offsets = numpy.arange(counts.sum()) - numpy.repeat(
+                numpy.cumsum(counts) - counts, counts
+            )
+            neighbor_idxs = order[numpy.repeat(starts, counts) + offsets]
+            deltas = vertices[idxs] - vertices[neighbor_idxs]
+            close = numpy.einsum("ij,ij->i", deltas, deltas) < threshold * threshold
+            ends1.append(idxs[close])
+            ends2.append(neighbor_idxs[close])
+
+        if sum([len(ends) for ends in ends1]) == 0:
+            return None
+        ends1 = numpy.concatenate(ends1)
+        ends2 = numpy.concatenate(ends2)
+
+        # Every cell joins the group of the lowest cell it is (indirectly)
+        # joined to.
+        groups = numpy.arange(len(cells))
+        while True:
+            merged = groups.copy()
+            numpy.minimum.at(merged, ends1, groups[ends2])
+            numpy.minimum.at(merged, ends2, groups[ends1])
+            merged = merged[merged]
+            if numpy.array_equal(merged, groups):
+                return groups
+            groups = merged
+
+    def make_normals_consistent(self):
+        """
+        Wind the polygons of every connected piece of the mesh the same way,
+        like Blender's normals_make_consistent(). Welding can join polygons
+        that VMD wound differently. Each piece keeps the winding most of its
+        polygons have.
+
+        :returns: The rewound mesh.
+        :rtype: :class:`MeshArrays`
+        """
+
+        num_polygons = self.num_polygons
+        if num_polygons == 0:
+            return self
+
+        starts = self.loop_starts
+        totals = self.loop_totals
+        loop_starts = numpy.repeat(starts, totals)
+        loop_totals = numpy.repeat(totals, totals)
+        polygon_ids = numpy.repeat(
+            numpy.arange(num_polygons, dtype=numpy.int64), totals
+        )
+        corners = numpy.arange(len(self.loop_vertex_indices), dtype=numpy.int64)
+        positions = corners - loop_starts
+
+        # The edge from every corner to the next one in its polygon.
+        following = corners + 1
+        following[positions == loop_totals - 1] = starts
+        edge_starts = self.loop_vertex_indices.astype(numpy.int64)
+        edge_ends = edge_starts[following]
+        forward = edge_starts < edge_ends
+        edge_keys = numpy.minimum(edge_starts, edge_ends) * self.num_vertices + (
+            numpy.maximum(edge_starts, edge_ends)
+        )
+
+        # Polygons that share an edge. If both go along it the same way, one
+        # of them has to be flipped.
+        order = numpy.argsort(edge_keys, kind="stable")
+        shared = edge_keys[order[1:]] == edge_keys[order[:-1]]
+        first = order[:-1][shared]
+        second = order[1:][shared]
+        polygons_a = polygon_ids[first]
+        polygons_b = polygon_ids[second]
+        differ = forward[first] == forward[second]
+        distinct = polygons_a != polygons_b
+        polygons_a = polygons_a[distinct]
+        polygons_b = polygons_b[distinct]
+        differ = differ[distinct]
+
+        # Union-find over all the pieces at once. Every polygon points toward
+        # the root of its piece, with whether it winds the other way.
+        parents = numpy.arange(num_polygons, dtype=numpy.int64)
+        flipped = numpy.zeros(num_polygons, dtype=bool)
+        while True:
+            while True:
+                grandparents = parents[parents]
+                if numpy.array_equal(grandparents, parents):
+                    break
+                flipped = flipped ^ flipped[parents]
+                parents = grandparents
+
+            roots_a = parents[polygons_a]
+            roots_b = parents[polygons_b]
+            unjoined = roots_a != roots_b
+            if not unjoined.any():
+                break
+
+            # Hang the larger root under the smaller one.
+            roots_a = roots_a[unjoined]
+            roots_b = roots_b[unjoined]
+            relative = (
+                flipped[polygons_a[unjoined]]
+                ^ flipped[polygons_b[unjoined]]
+                ^ differ[unjoined]
+            )
+            low = numpy.minimum(roots_a, roots_b)
+            high = numpy.maximum(roots_a, roots_b)
+            parents[high] = low
+            flipped[high] = relative
+
+        # Keep the winding most of each piece already has, so pieces VMD
+        # wound on purpose (like the inside of a cavity) stay as they are.
+        votes = numpy.bincount(
+            parents, numpy.where(flipped, 1, -1), minlength=num_polygons
+        )
+        flipped = flipped ^ (votes[parents] > 0)
+        if not flipped.any():
+            return self
+
+        # Reverse the corners of the flipped polygons.
+        reversed_corners = numpy.where(
+            flipped[polygon_ids], loop_starts + loop_totals - 1 - positions, corners
+        )
+
+        return MeshArrays(
+            vertices=self.vertices,
+            loop_vertex_indices=self.loop_vertex_indices[reversed_corners],
+            loop_totals=self.loop_totals,
+            material_indices=self.material_indices,
+            material_names=self.material_names,
+            material_colors=self.material_colors,
+            smooth=self.smooth,
+            chains=self.chains,
+            polygon_chains=self.polygon_chains,
+        )
+
+    def _remove_degenerate(self, loop_vertex_indices):
+        """
+        Drop repeated consecutive corners (which welding creates), and then
+        the polygons left with fewer than three corners.
+
+        :param numpy.ndarray loop_vertex_indices: The (remapped) vertex index
+                             of every polygon corner.
+
+        :returns: The new loop vertex indices, the new loop totals, and a
+                  boolean mask of the polygons that were kept.
+        :rtype: :class:`tuple`
+        """
+
+        starts = self.loop_starts
+        polygon_ids = numpy.repeat(
+            numpy.arange(self.num_polygons, dtype=numpy.int32), self.loop_totals
+        )
+
+        # The previous corner of every corner, wrapping around within its
+        # polygon.
+        previous = numpy.arange(len(loop_vertex_indices), dtype=numpy.int32) - 1
+        previous[starts] = starts + self.loop_totals - 1
+        keep_loops = loop_vertex_indices != loop_vertex_indices[previous]
+
+        loop_totals = numpy.bincount(
+            polygon_ids[keep_loops], minlength=self.num_polygons
+        ).astype(numpy.int32)
+        keep_polygons = loop_totals >= 3
+        keep_loops = keep_loops & keep_polygons[polygon_ids]
+
+        return (
+            loop_vertex_indices[keep_loops],
+            loop_totals[keep_polygons],
+            keep_polygons,
+        )
+
+
+def concatenate_meshes(meshes, chains=None):
+    """
+    Merge meshes into one, offsetting the vertex indices of each. Material
+    slots with the same name and color are shared.
+
+    :param list meshes: The MeshArrays.
+    :param list chains: The chain of each mesh, for those without
+                polygon_chains. Optional.
+
+    :returns: The merged mesh. Its polygon_chains say which chain each
+              polygon came from, if chains were given or the meshes have
+              them.
+    :rtype: :class:`MeshArrays`
+    """
+
+    if len(meshes) == 0:
+        return MeshArrays()
+
+    track_chains = chains is not None or any(
+        [mesh.polygon_chains is not None for mesh in meshes]
+    )
+
+    slots = {}
+    material_names = []
+    material_colors = []
+    chain_idxs = {}
+    vertices = []
+    loop_vertex_indices = []
+    loop_totals = []
+    material_indices = []
+    polygon_chains = []
+    offset = 0
+    for i, mesh in enumerate(meshes):
+        remap = []
+        for name, color in zip(mesh.material_names, mesh.material_colors):
+            key = (name, tuple(color.tolist()))
+            if not key in slots:
+                slots[key] = len(material_names)
+                material_names.append(name)
+                material_colors.append(color)
+            remap.append(slots[key])
+
+        vertices.append(mesh.vertices)
+        loop_vertex_indices.append(mesh.loop_vertex_indices + offset)
+        loop_totals.append(mesh.loop_totals)
+        if len(remap) > 0:
+            material_indices.append(
+                numpy.array(remap, dtype=numpy.int32)[mesh.material_indices]
+            )
+        else:
+            material_indices.append(mesh.material_indices)
+        offset = offset + mesh.num_vertices
+
+        if not track_chains:
+            continue
+        if mesh.polygon_chains is not None:
+            # The last entry maps -1 (unknown) to itself.
+            lookup = [chain_idxs.setdefault(c, len(chain_idxs)) for c in mesh.chains]
+            lookup = numpy.array(lookup + [-1], dtype=numpy.int32)
+            polygon_chains.append(lookup[mesh.polygon_chains])
+        else:
+            chain_idx = -1
+            if chains is not None:
+                chain_idx = chain_idxs.setdefault(chains[i], len(chain_idxs))
+            polygon_chains.append(
+                numpy.full(mesh.num_polygons, chain_idx, dtype=numpy.int32)
+            )
+
+    return MeshArrays(
+        vertices=numpy.concatenate(vertices),
+        loop_vertex_indices=numpy.concatenate(loop_vertex_indices),
+        loop_totals=numpy.concatenate(loop_totals),
+        material_indices=numpy.concatenate(material_indices),
+        material_names=material_names,
+        material_colors=numpy.array(material_colors, dtype=numpy.float32),
+        smooth=meshes[0].smooth,
+        chains=sorted(chain_idxs, key=chain_idxs.get) if track_chains else None,
+        polygon_chains=numpy.concatenate(polygon_chains) if track_chains else None,
+    )
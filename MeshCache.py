@@ -0,0 +1,264 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import glob
+import shutil
+import hashlib
+import threading
+import collections
+from .BinaryMesh import MESH_EXT
+
+# An on-disk cache of the mesh files VMD produces, so importing the same file
+# with the same settings doesn't run VMD again. Entries are content addressed
+# and evicted least recently used first once the cache grows too big.
+
+# The entries in use (being imported, their binary mesh files maybe
+# memory-mapped), by directory, which evict() keeps. Shared by every
+# MeshCache, since each import makes its own.
+PINNED_ENTRIES = collections.Counter()
+PINNED_LOCK = threading.Lock()
+
+
+class MeshCache:
+    """
+    A directory of cached meshes. Every entry is a subdirectory named after
+    its key.
+    """
+
+    # Placeholder that replaces the (random) temporary directory in the
+    # scripts before they are hashed.
+    TMP_DIR_PLACEHOLDER = "<BLENDMOL_TMP_DIR>"
+
+    # The input files whose meshes are cached. The key only covers the input
+    # file itself, so not VMD state or TCL files, which load others.
+    CACHED_INPUT_EXTS = [".PDB", ".CIF"]
+
+    # File extensions that are moved into a cache entry.
+    CACHED_EXTS = [".OBJ", ".MTL", MESH_EXT.upper()]
+
+    def __init__(self, cache_dir, max_bytes):
+        """
+        Initialize the cache.
+
+        :param str cache_dir: The directory where the cache lives.
+        :param int max_bytes: The maximum total size of the cache.
+        """
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def make_key(self, input_filename, script_texts, exec_path, tmp_dir):
+        """
+        Get the key of a given import. It is the SHA-256 of the input file,
+        the generated scripts (with the temporary directory masked out) and
+        the identity of the VMD executable. Only for the inputs in
+        CACHED_INPUT_EXTS, as files a VMD state file loads in turn would not
+        be part of the key.
+
+        :param str input_filename: The PDB/mmCIF file being imported.
+        :param list script_texts: The text of the generated scripts.
+        :param str exec_path: The path to the VMD executable.
+        :param str tmp_dir: The temporary directory the scripts write to.
+
+        :returns: The key, a hex digest.
+        :rtype: :class:`str`
+        """
+
+        sha = hashlib.sha256()
+
+        with open(input_filename, "rb") as input_file:
+            for block in iter(lambda: input_file.read(1 << 20), b""):
+                sha.update(block)
+
+        tmp_dirs = sorted(
+            set([tmp_dir, tmp_dir.replace("\\", "/"), tmp_dir.replace("\\", "\\\\")]),
+            key=len,
+            reverse=True,
+        )
+        for script_text in script_texts:
+            for path in tmp_dirs:
+                script_text = script_text.replace(path, self.TMP_DIR_PLACEHOLDER)
+            sha.update(script_text.encode("utf-8"))
+
+        sha.update(self.get_exec_id(exec_path).encode("utf-8"))
+
+        return sha.hexdigest()
+
+    def get_exec_id(self, exec_path):
+        """
+        Identify the installed VMD version without starting VMD (which would
+        defeat the point of the cache). The resolved path, size and
+        modification time of the executable change whenever VMD is upgraded.
+
+        :param str exec_path: The path to the VMD executable.
+
+        :returns: An identifying string.
+        :rtype: :class:`str`
+        """
+
+        real_path = os.path.realpath(exec_path)
+        if not os.path.exists(real_path):
+            return real_path
+        stat = os.stat(real_path)
+        return real_path + " " + str(stat.st_size) + " " + str(int(stat.st_mtime))
+
+    def pin(self, key):
+        """
+        Keep an entry from being evicted, until unpin() is called.
+
+        :param str key: The key.
+        """
+
+        with PINNED_LOCK:
+            PINNED_ENTRIES[os.path.join(self.cache_dir, key)] += 1
+
+    def unpin(self, key):
+        """
+        Let an entry be evicted again.
+
+        :param str key: The key, as given to pin() (or a pinning lookup() or
+                   store()).
+        """
+
+        entry_dir = os.path.join(self.cache_dir, key)
+        with PINNED_LOCK:
+            PINNED_ENTRIES[entry_dir] -= 1
+            if PINNED_ENTRIES[entry_dir] <= 0:
+                del PINNED_ENTRIES[entry_dir]
+
+    def lookup(self, key, pin=False):
+        """
+        Look for a cache entry.
+
+        :param str key: The key.
+        :param bool pin: Whether to pin the entry (if there is one), so it
+                    isn't evicted while its meshes are loaded. Call unpin()
+                    once they are. Defaults to False.
+
+        :returns: The directory with the cached mesh files, or None if there
+                  is no such entry.
+        :rtype: :class:`str`
+        """
+
+        entry_dir = os.path.join(self.cache_dir, key)
+        with PINNED_LOCK:
+            if not os.path.isdir(entry_dir):
+                return None
+            if pin:
+                PINNED_ENTRIES[entry_dir] += 1
+
+        # Mark it as recently used.
+        os.utime(entry_dir, None)
+        return entry_dir + os.sep
+
+    def store(self, key, source_dir, pin=False):
+        """
+        Move the mesh files in a directory into a new cache entry.
+
+        :param str key: The key.
+        :param str source_dir: The directory with the mesh files.
+        :param bool pin: Whether to pin the entry, so it isn't evicted while
+                    its meshes are loaded. Call unpin() once they are.
+                    Defaults to False.
+
+        :returns: The directory of the new cache entry.
+        :rtype: :class:`str`
+        """
+
+        entry_dir = os.path.join(self.cache_dir, key)
+        partial_dir = (
+            entry_dir
+            + ".partial-"
+            + str(os.getpid())
+            + "-"
+            + str(threading.get_ident())
+        )
+        if os.path.exists(partial_dir):
+            shutil.rmtree(partial_dir)
+        os.makedirs(partial_dir)
+
+        for filename in glob.glob(os.path.join(source_dir, "*")):
+            _, ext = os.path.splitext(filename)
+            if ext.upper() in self.CACHED_EXTS:
+                shutil.move(filename, partial_dir)
+
+        # Publish the entry in one step, so a half-written entry is never
+        # seen. If another import (e.g., in a batch) already stored the same
+        # meshes, use its entry, which might be in use.
+        with PINNED_LOCK:
+            if os.path.exists(entry_dir):
+                shutil.rmtree(partial_dir)
+            else:
+                try:
+                    os.rename(partial_dir, entry_dir)
+                except OSError:
+                    shutil.rmtree(partial_dir)
+            PINNED_ENTRIES[entry_dir] += 1
+
+        self.evict()
+        if not pin:
+            self.unpin(key)
+        return entry_dir + os.sep
+
+    def get_dir_size(self, dirname):
+        """
+        The total size of the files in a directory.
+
+        :param str dirname: The directory.
+
+        :returns: The size, in bytes.
+        :rtype: :class:`int`
+        """
+
+        total = 0
+        for root, _, filenames in os.walk(dirname):
+            for filename in filenames:
+                total = total + os.path.getsize(os.path.join(root, filename))
+        return total
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in its
+        maximum size. Pinned entries are kept.
+        """
+
+        with PINNED_LOCK:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                entry_dir = os.path.join(self.cache_dir, name)
+                if os.path.isdir(entry_dir) and not ".partial-" in name:
+                    entries.append(
+                        (
+                            os.path.getmtime(entry_dir),
+                            name,
+                            entry_dir,
+                            self.get_dir_size(entry_dir),
+                        )
+                    )
+
+            total = sum([entry[3] for entry in entries])
+            for _, name, entry_dir, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if entry_dir in PINNED_ENTRIES:
+                    continue
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                total = total - size
@@ -0,0 +1,240 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import glob
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .BinaryMesh import MESH_EXT
+
+# Reading VMD's meshes while VMD is still making them. The generated TCL prints
+# a marker line after every "render Wavefront", so each OBJ file can be read
+# (in a thread) as soon as it is complete, while VMD renders the next one. The
+# meshes then wait in a queue until Blender's main thread turns them into
+# objects. Files that never got a marker (e.g., made by the user's own VMD
+# scripts) are read once VMD exits. The scripts also say how many meshes they
+# might render, and which they skipped (empty selections), so the import can
+# show its progress.
+
+# What the generated TCL prints after writing a mesh file, followed by the
+# filename.
+RENDERED_MARKER = "BLENDMOL_RENDERED "
+
+# What it prints before rendering, followed by how many meshes it might
+# render.
+TOTAL_MARKER = "BLENDMOL_TOTAL "
+
+# What it prints instead of rendering an empty selection, followed by how
+# many meshes it didn't render.
+SKIPPED_MARKER = "BLENDMOL_SKIPPED "
+
+# The mesh files VMD can make.
+MESH_EXTS = [".OBJ", ".WRL", MESH_EXT.upper()]
+
+
+class MeshStream:
+    """
+    Mesh files that are read in threads as they appear.
+    """
+
+    def __init__(self, load, max_workers=2):
+        """
+        Initialize the stream.
+
+        :param function load: Reads a mesh file (in a thread). Takes the
+                   filename. What it returns is passed on by get_next().
+        :param int max_workers: How many files to read at the same time.
+                   Defaults to 2.
+        """
+
+        self.load = load
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.ready = queue.Queue()
+        self.lock = threading.Lock()
+
+        self.base_filenames = set()
+        self.futures = []
+        self.num_added = 0
+        self.num_received = 0
+        self.num_skipped = 0
+        self.total = None
+        self.producer = None
+        self.producer_done = False
+        self.cancelled = False
+        self.error = None
+
+    def watch_output(self, line):
+        """
+        Look for a marker in a line of VMD's output. Start reading the file
+        it names, or keep track of the progress.
+
+        :param str line: The line.
+        """
+
+        for marker in [RENDERED_MARKER, TOTAL_MARKER, SKIPPED_MARKER]:
+            index = line.find(marker)
+            if index == -1:
+                continue
+            value = line[index + len(marker) :].strip()
+            if marker == RENDERED_MARKER:
+                self.add(value)
+            elif value.isdigit():
+                # Several VMD processes can each render some of the chains.
+                with self.lock:
+                    if marker == TOTAL_MARKER:
+                        self.total = (self.total or 0) + int(value)
+                    else:
+                        self.num_skipped = self.num_skipped + int(value)
+            return
+
+    def add(self, filename):
+        """
+        Start reading a mesh file, unless it is already being read (perhaps
+        under another extension, once it is converted to a binary mesh
+        file).
+
+        :param str filename: The filename.
+        """
+
+        filename = os.path.normpath(filename)
+        base_filename = os.path.splitext(filename)[0]
+        with self.lock:
+            if base_filename in self.base_filenames or self.cancelled:
+                return
+            self.base_filenames.add(base_filename)
+            self.num_added = self.num_added + 1
+            self.futures.append(self.executor.submit(self.load_one, filename))
+
+    def add_directory(self, directory):
+        """
+        Start reading every mesh file in a directory that isn't already
+        being read.
+
+        :param str directory: The directory.
+        """
+
+        for filename in sorted(glob.glob(os.path.join(directory, "*"))):
+            _, ext = os.path.splitext(filename)
+            if ext.upper() in MESH_EXTS:
+                self.add(filename)
+
+    def load_one(self, filename):
+        """
+        Read a mesh file and queue the result (runs in a thread).
+
+        :param str filename: The filename.
+        """
+
+        try:
+            self.ready.put((filename, self.load(filename), None))
+        except Exception as e:
+            self.ready.put((filename, None, e))
+
+    def start(self, produce):
+        """
+        Make the mesh files in a thread.
+
+        :param function produce: Makes the mesh files (e.g., runs VMD),
+                   calling add() or watch_output() as they are written. The
+                   stream is done once it returns and every file is read.
+        """
+
+        def run():
+            try:
+                produce()
+            except Exception as e:
+                self.error = e
+            finally:
+                self.producer_done = True
+
+        self.producer = threading.Thread(target=run, daemon=True)
+        self.producer.start()
+
+    def get_next(self, timeout=0.0):
+        """
+        The next mesh that was read.
+
+        :param float timeout: How many seconds to wait for one. Defaults to
+                     0.0 (don't wait).
+
+        :returns: The filename and what the load function returned, or None
+                  if no mesh is ready.
+        :rtype: :class:`tuple`
+        """
+
+        if self.error is not None:
+            raise self.error
+
+        try:
+            filename, result, error = self.ready.get(timeout=max(timeout, 0.0001))
+        except queue.Empty:
+            return None
+
+        self.num_received = self.num_received + 1
+        if error is not None:
+            raise error
+        return filename, result
+
+    def is_done(self):
+        """
+        Whether every mesh file has been made and handed out.
+
+        :returns: True if it has, False otherwise.
+        :rtype: :class:`bool`
+        """
+
+        with self.lock:
+            return self.producer_done and self.num_received == self.num_added
+
+    def get_progress(self):
+        """
+        How far along the meshes are: how many were handed out (or skipped),
+        out of how many there might be.
+
+        :returns: The number done, and the total (None if it isn't known
+                  yet).
+        :rtype: :class:`tuple`
+        """
+
+        with self.lock:
+            done = self.num_received + self.num_skipped
+            if self.producer_done:
+                # Every file is known now.
+                return done, self.num_added + self.num_skipped
+            return done, self.total
+
+    def cancel(self):
+        """
+        Stop reading mesh files. Files that are already being read are
+        finished, but not handed out. The producer must be stopped
+        separately (e.g., by killing VMD).
+        """
+
+        with self.lock:
+            self.cancelled = True
+            futures = self.futures
+        for future in futures:
+            future.cancel()
+
+    def close(self):
+        """
+        Wait for the files that are still being read, and stop the threads.
+        """
+
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,520 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import numpy
+from concurrent.futures import ThreadPoolExecutor
+from .MeshArrays import MeshArrays
+from .Symmetry import depends_on_other_chains
+from .NativeSurface import surface_triangles, DEFAULT_GRID_SPACING
+
+# Builds the simple representations (sticks, balls and VDW spheres) directly
+# from PDB atoms, so VMD is only needed for surfaces and ribbons. Every sphere
+# or cylinder is a copy of one template, placed with NumPy broadcasting.
+# Surfaces can be built too (see NativeSurface.py).
+
+# The colors VMD's default "Name" coloring gives, by the first letter of the
+# atom name. Carbons are grey, as in the TCL BlendMol sends to VMD.
+NAME_COLORS = {
+    "C": (0.6, 0.6, 0.6, 1.0),
+    "N": (0.0, 0.0, 1.0, 1.0),
+    "O": (1.0, 0.0, 0.0, 1.0),
+    "S": (1.0, 1.0, 0.0, 1.0),
+    "P": (0.7, 0.56, 0.36, 1.0),
+    "H": (1.0, 1.0, 1.0, 1.0),
+}
+OTHER_COLOR = (1.0, 0.6, 0.6, 1.0)
+
+# Representation settings, matching the ones in VMD.py.
+STICK_RADIUS = 0.3
+BALL_SCALE = 0.2
+VDW_SCALE = 1.0
+SPHERE_SUBDIVISIONS = 2
+CYLINDER_SEGMENTS = 12
+
+
+def icosphere(subdivisions):
+    """
+    A unit icosphere.
+
+    :param int subdivisions: How many times to subdivide the icosahedron.
+
+    :returns: (V, 3) float32 vertices and (F, 3) int32 triangles.
+    :rtype: :class:`tuple`
+    """
+
+    t = (1.0 + 5.0**0.5) / 2.0
+    # fmt: off
+    vertices = [
+        [-1, t, 0], [1, t, 0], [-1, -t, 0], [1, -t, 0],
+        [0, -1, t], [0, 1, t], [0, -1, -t], [0, 1, -t],
+        [t, 0, -1], [t, 0, 1], [-t, 0, -1], [-t, 0, 1],
+    ]
+    faces = [
+        [0, 11, 5], [0, 5, 1], [0, 1, 7], [0, 7, 10], [0, 10, 11],
+        [1, 5, 9], [5, 11, 4], [11, 10, 2], [10, 7, 6], [7, 1, 8],
+        [3, 9, 4], [3, 4, 2], [3, 2, 6], [3, 6, 8], [3, 8, 9],
+        [4, 9, 5], [2, 4, 11], [6, 2, 10], [8, 6, 7], [9, 8, 1],
+    ]
+    # fmt: on
+
+    for _ in range(subdivisions):
+        midpoints = {}
+        new_faces = []
+        for face in faces:
+            mids = []
+            for i in range(3):
+                edge = tuple(sorted([face[i], face[(i + 1) % 3]]))
+                if not edge in midpoints:
+                    midpoints[edge] = len(vertices)
+                    vertices.append(
+                        [
+                            (vertices[edge[0]][k] + vertices[edge[1]][k]) / 2
+                            for k in range(3)
+                        ]
+                    )
+                mids.append(midpoints[edge])
+            new_faces.extend(
+                [
+                    [face[0], mids[0], mids[2]],
+                    [face[1], mids[1], mids[0]],
+                    [face[2], mids[2], mids[1]],
+                    [mids[0], mids[1], mids[2]],
+                ]
+            )
+        faces = new_faces
+
+    vertices = numpy.array(vertices, dtype=numpy.float32)
+    vertices = vertices / numpy.linalg.norm(vertices, axis=1)[:, None]
+    return vertices, numpy.array(faces, dtype=numpy.int32)
+
+
+def open_cylinder(segments):
+    """
+    A cylinder without caps, of radius 1, from z = 0 to z = 1.
+
+    :param int segments: The number of sides.
+
+    :returns: (V, 3) float32 vertices and (F, 4) int32 quads.
+    :rtype: :class:`tuple`
+    """
+
+    angles = numpy.arange(segments) * 2 * numpy.pi / segments
+    ring = numpy.stack([numpy.cos(angles), numpy.sin(angles)], axis=1)
+    vertices = numpy.concatenate(
+        [
+            numpy.hstack([ring, numpy.zeros((segments, 1))]),
+            numpy.hstack([ring, numpy.ones((segments, 1))]),
+        ]
+    ).astype(numpy.float32)
+    i = numpy.arange(segments)
+    j = (i + 1) % segments
+    faces = numpy.stack([i, j, j + segments, i + segments], axis=1)
+    return vertices, faces.astype(numpy.int32)
+
+
+def get_color_ids(names):
+    """
+    Assign each atom one of VMD's "Name" colors.
+
+    :param numpy.ndarray names: The atom names.
+
+    :returns: An int32 color id per atom, and the RGBA color of each id.
+    :rtype: :class:`tuple`
+    """
+
+    palette = list(NAME_COLORS.keys())
+    lookup = {letter: i for i, letter in enumerate(palette)}
+    other = len(palette)
+    color_ids = numpy.array(
+        [lookup.get(name.lstrip("0123456789")[:1], other) for name in names],
+        dtype=numpy.int32,
+    )
+    colors = [NAME_COLORS[letter] for letter in palette] + [OTHER_COLOR]
+    return color_ids, colors
+
+
+def instance_template(template_vertices, template_faces, matrices, offsets):
+    """
+    Place copies of a template mesh.
+
+    :param numpy.ndarray template_vertices: (V, 3) template vertices.
+    :param numpy.ndarray template_faces: (F, K) template polygons, all with K
+                         corners.
+    :param numpy.ndarray matrices: (N, 3, 3) linear transform of each copy.
+    :param numpy.ndarray offsets: (N, 3) translation of each copy.
+
+    :returns: (N * V, 3) vertices and (N * F * K,) loop vertex indices.
+    :rtype: :class:`tuple`
+    """
+
+    num_copies = len(offsets)
+    vertices = (
+        numpy.einsum("nij,vj->nvi", matrices, template_vertices) + offsets[:, None, :]
+    )
+    loops = (
+        template_faces[None, :, :]
+        + (numpy.arange(num_copies) * len(template_vertices))[:, None, None]
+    )
+    return vertices.reshape(-1, 3).astype(numpy.float32), loops.ravel()
+
+
+def make_mesh(pieces, colors, smooth=True):
+    """
+    Combine pieces of geometry that all have polygons with the same number of
+    corners into one mesh.
+
+    :param list pieces: (vertices, loop vertex indices, corners per polygon,
+                polygon color ids) tuples.
+    :param list colors: The RGBA color of each color id.
+    :param bool smooth: Whether to shade smooth. Defaults to True.
+
+    :returns: The mesh.
+    :rtype: :class:`MeshArrays`
+    """
+
+    all_vertices = []
+    all_loops = []
+    all_totals = []
+    all_color_ids = []
+    offset = 0
+    for vertices, loops, corners, color_ids in pieces:
+        all_vertices.append(vertices)
+        all_loops.append(loops + offset)
+        all_totals.append(numpy.full(len(color_ids), corners, dtype=numpy.int32))
+        all_color_ids.append(color_ids)
+        offset = offset + len(vertices)
+
+    if len(all_vertices) == 0:
+        return MeshArrays()
+
+    # Only keep the materials that are used.
+    color_ids = numpy.concatenate(all_color_ids)
+    used, material_indices = numpy.unique(color_ids, return_inverse=True)
+
+    return MeshArrays(
+        vertices=numpy.concatenate(all_vertices),
+        loop_vertex_indices=numpy.concatenate(all_loops),
+        loop_totals=numpy.concatenate(all_totals),
+        material_indices=material_indices.ravel(),
+        material_names=["BlendMol_" + str(i) for i in used],
+        material_colors=[colors[i] for i in used],
+        smooth=smooth,
+    )
+
+
+def sphere_pieces(centers, radii, color_ids):
+    """
+    The geometry of a set of spheres.
+
+    :param numpy.ndarray centers: (N, 3) sphere centers.
+    :param numpy.ndarray radii: (N,) sphere radii.
+    :param numpy.ndarray color_ids: (N,) color id of each sphere.
+
+    :returns: A piece, as taken by make_mesh().
+    :rtype: :class:`tuple`
+    """
+
+    template_vertices, template_faces = icosphere(SPHERE_SUBDIVISIONS)
+    matrices = radii[:, None, None] * numpy.eye(3, dtype=numpy.float32)[None]
+    vertices, loops = instance_template(
+        template_vertices, template_faces, matrices, centers
+    )
+    return (vertices, loops, 3, numpy.repeat(color_ids, len(template_faces)))
+
+
+def cylinder_pieces(starts, ends, radius, color_ids):
+    """
+    The geometry of a set of cylinders.
+
+    :param numpy.ndarray starts: (N, 3) start points.
+    :param numpy.ndarray ends: (N, 3) end points.
+    :param float radius: The radius of all cylinders.
+    :param numpy.ndarray color_ids: (N,) color id of each cylinder.
+
+    :returns: A piece, as taken by make_mesh().
+    :rtype: :class:`tuple`
+    """
+
+    template_vertices, template_faces = open_cylinder(CYLINDER_SEGMENTS)
+
+    # Cylinders without length have no axis, and couldn't be seen anyway.
+    axes = ends - starts
+    has_length = numpy.einsum("ij,ij->i", axes, axes) > 0
+    starts = starts[has_length]
+    axes = axes[has_length]
+    color_ids = color_ids[has_length]
+
+    # Build an orthonormal frame around every axis. The template's z axis is
+    # stretched along the cylinder.
+    lengths = numpy.linalg.norm(axes, axis=1)
+    z = axes / lengths[:, None]
+    helper = numpy.zeros_like(z)
+    helper[:, 0] = 1
+    helper[numpy.abs(z[:, 0]) > 0.9] = [0, 1, 0]
+    x = numpy.cross(z, helper)
+    x = x / numpy.linalg.norm(x, axis=1)[:, None]
+    y = numpy.cross(z, x)
+    matrices = numpy.stack(
+        [x * radius, y * radius, axes], axis=2
+    )  # Columns are the images of the template axes.
+
+    vertices, loops = instance_template(
+        template_vertices, template_faces, matrices, starts
+    )
+    return (vertices, loops, 4, numpy.repeat(color_ids, len(template_faces)))
+
+
+def balls(structure, atom_mask, scale):
+    """
+    The balls (or VDW spheres) representation of some atoms.
+
+    :param PDBStructure structure: The structure.
+    :param numpy.ndarray atom_mask: Boolean mask of the atoms to show.
+    :param float scale: The sphere radius, relative to the VDW radius.
+
+    :returns: The mesh.
+    :rtype: :class:`MeshArrays`
+    """
+
+    color_ids, colors = get_color_ids(structure.names[atom_mask])
+    piece = sphere_pieces(
+        structure.coords[atom_mask], structure.vdw_radii[atom_mask] * scale, color_ids
+    )
+    return make_mesh([piece], colors)
+
+
+def sticks(structure, atom_mask):
+    """
+    The sticks (licorice) representation of some atoms. Each bond is drawn
+    as two half cylinders, colored like the atom at their end, and every
+    atom is a sphere with the same radius.
+
+    :param PDBStructure structure: The structure.
+    :param numpy.ndarray atom_mask: Boolean mask of the atoms to show.
+
+    :returns: The mesh.
+    :rtype: :class:`MeshArrays`
+    """
+
+    color_ids, colors = get_color_ids(structure.names)
+    bonds = structure.bonds
+    bonds = bonds[atom_mask[bonds[:, 0]] & atom_mask[bonds[:, 1]]]
+
+    coords = structure.coords
+    midpoints = (coords[bonds[:, 0]] + coords[bonds[:, 1]]) / 2
+    pieces = [
+        sphere_pieces(
+            coords[atom_mask],
+            numpy.full(atom_mask.sum(), STICK_RADIUS, dtype=numpy.float32),
+            color_ids[atom_mask],
+        ),
+        cylinder_pieces(
+            coords[bonds[:, 0]], midpoints, STICK_RADIUS, color_ids[bonds[:, 0]]
+        ),
+        cylinder_pieces(
+            coords[bonds[:, 1]], midpoints, STICK_RADIUS, color_ids[bonds[:, 1]]
+        ),
+    ]
+    return make_mesh(pieces, colors)
+
+
+def surface(structure, atom_mask, spacing=DEFAULT_GRID_SPACING):
+    """
+    The surface representation of some atoms. Every triangle is colored like
+    the atom nearest its first vertex.
+
+    :param PDBStructure structure: The structure.
+    :param numpy.ndarray atom_mask: Boolean mask of the atoms to surface.
+    :param float spacing: The density grid spacing. Defaults to
+                 DEFAULT_GRID_SPACING.
+
+    :returns: The mesh.
+    :rtype: :class:`MeshArrays`
+    """
+
+    color_ids, colors = get_color_ids(structure.names[atom_mask])
+    vertices, triangles, nearest = surface_triangles(
+        structure.coords[atom_mask], structure.vdw_radii[atom_mask], spacing
+    )
+
+    # Vertices without an atom nearby (there shouldn't be any) get the color
+    # for other atoms.
+    vertex_color_ids = numpy.where(
+        nearest >= 0, color_ids[nearest], len(colors) - 1
+    ).astype(numpy.int32)
+    piece = (vertices, triangles.ravel(), 3, vertex_color_ids[triangles[:, 0]])
+    return make_mesh([piece], colors)
+
+
+class SpherePoints:
+    """
+    Spheres kept as points (center, radius and color), to be instanced in
+    Blender instead of tessellated.
+    """
+
+    def __init__(self, centers, radii, colors):
+        """
+        Initialize the spheres.
+
+        :param numpy.ndarray centers: (N, 3) float32 sphere centers.
+        :param numpy.ndarray radii: (N,) float32 sphere radii.
+        :param numpy.ndarray colors: (N, 4) float32 RGBA colors.
+        """
+
+        self.centers = centers
+        self.radii = radii
+        self.colors = colors
+
+    def to_mesh_arrays(self):
+        """
+        Tessellate the spheres, for when they can't be instanced.
+
+        :returns: The mesh.
+        :rtype: :class:`MeshArrays`
+        """
+
+        colors, color_ids = numpy.unique(self.colors, axis=0, return_inverse=True)
+        piece = sphere_pieces(self.centers, self.radii, color_ids.ravel())
+        return make_mesh([piece], [tuple(c) for c in colors])
+
+
+def sphere_points(structure, atom_mask, scale):
+    """
+    The balls (or VDW spheres) of some atoms, as points.
+
+    :param PDBStructure structure: The structure.
+    :param numpy.ndarray atom_mask: Boolean mask of the atoms to show.
+    :param float scale: The sphere radius, relative to the VDW radius.
+
+    :returns: The spheres.
+    :rtype: :class:`SpherePoints`
+    """
+
+    color_ids, colors = get_color_ids(structure.names[atom_mask])
+    return SpherePoints(
+        structure.coords[atom_mask],
+        structure.vdw_radii[atom_mask] * scale,
+        numpy.array(colors, dtype=numpy.float32)[color_ids],
+    )
+
+
+def get_native_representations(
+    structure,
+    my_operator,
+    sticks_too=True,
+    spheres_too=True,
+    instanced=False,
+    skip_chains=(),
+    surfaces_too=False,
+):
+    """
+    Build the stick, ball, VDW (and surface) representations the user asked
+    for, with the same names VMD.make_vis_script() would give them. The
+    surfaces of different chains are built at the same time, in threads
+    (NumPy releases the GIL for most of the work).
+
+    :param PDBStructure structure: The structure.
+    :param ??? my_operator: The operator, used to access user-parameter
+                variables.
+    :param bool sticks_too: Whether to build sticks. Defaults to True.
+    :param bool spheres_too: Whether to build balls and VDW spheres. Defaults
+                to True.
+    :param bool instanced: Whether to return spheres as points to instance
+                rather than meshes. Defaults to False.
+    :param list skip_chains: Chains that are copies of another chain (see
+                Symmetry.py). Only their representations that depend on
+                other chains are built. Optional.
+    :param bool surfaces_too: Whether to build surfaces. Defaults to False.
+
+    :returns: (name, mesh) tuples. The meshes are MeshArrays, or SpherePoints
+              for instanced spheres.
+    :rtype: :class:`list`
+    """
+
+    def get_spheres(atom_mask, scale):
+        if instanced:
+            return sphere_points(structure, atom_mask, scale)
+        return balls(structure, atom_mask, scale)
+
+    def wanted(filename_id, chain):
+        return not chain in skip_chains or depends_on_other_chains(filename_id)
+
+    # Like the VMD selections (see VMD.make_vis_script()). The residues
+    # near ligands are only looked for if they are shown.
+    resnames = my_operator.ligand_resnames.split()
+    near_ligands = {}
+    if (
+        (sticks_too and my_operator.near_ligand_sticks)
+        or (spheres_too and my_operator.near_ligand_balls)
+        or (spheres_too and my_operator.near_ligand_vdw)
+        or (surfaces_too and my_operator.near_ligand_surface)
+    ):
+        near_ligands = structure.select_near_ligands(
+            structure.unique_chains, my_operator.near_ligand_cutoff, resnames
+        )
+
+    meshes = []
+    surfaces = []
+    for chain in structure.unique_chains:
+        selections = [
+            (structure.select_ligand(chain, resnames), "lig", "ligand"),
+            (structure.select_protein_nucleic(chain), "prot_nuc", "protein"),
+        ]
+        if chain in near_ligands:
+            selections.insert(1, (near_ligands[chain], "intract", "near_ligand"))
+        for atom_mask, prefix, prop_prefix in selections:
+            if not atom_mask.any():
+                continue
+            if not wanted(prefix + "_", chain):
+                continue
+            if surfaces_too and getattr(my_operator, prop_prefix + "_surface"):
+                surfaces.append((prefix + "_surf_" + chain, atom_mask))
+            if sticks_too and getattr(my_operator, prop_prefix + "_sticks"):
+                meshes.append((prefix + "_stks_" + chain, sticks(structure, atom_mask)))
+            if spheres_too and getattr(my_operator, prop_prefix + "_balls"):
+                meshes.append(
+                    (prefix + "_blls_" + chain, get_spheres(atom_mask, BALL_SCALE))
+                )
+            if spheres_too and getattr(my_operator, prop_prefix + "_vdw"):
+                meshes.append(
+                    (prefix + "_vdw_" + chain, get_spheres(atom_mask, VDW_SCALE))
+                )
+
+        metals = structure.select_metals(chain)
+        if (
+            spheres_too
+            and my_operator.metals_vdw == True
+            and metals.any()
+            and wanted("metals", chain)
+        ):
+            meshes.append(("metals_" + chain, get_spheres(metals, VDW_SCALE)))
+
+    if len(surfaces) > 0:
+        spacing = my_operator.native_surface_spacing
+        workers = min(len(surfaces), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            surface_meshes = executor.map(
+                lambda selection: surface(structure, selection[1], spacing),
+                surfaces,
+            )
+            meshes.extend(
+                [(name, mesh) for (name, _), mesh in zip(surfaces, surface_meshes)]
+            )
+
+    return meshes
@@ -0,0 +1,313 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import itertools
+import numpy
+from .SpatialGrid import SpatialGrid
+
+try:
+    from skimage.measure import marching_cubes
+except ImportError:
+    marching_cubes = None
+
+# Molecular surfaces made directly from PDB atoms, so VMD isn't needed for
+# them. Every atom adds a Gaussian to a density grid (only the grid points near
+# the atom are computed), and the surface is where the density is 1: a sphere
+# of the atom's VDW radius for an isolated atom, with the crevices between
+# atoms smoothed over, like VMD's QuickSurf. The surface is found with
+# scikit-image's marching cubes if it is installed, and otherwise with the
+# vectorized marching tetrahedra below.
+
+# How quickly each atom's density falls off. Smaller values smooth the
+# surface more.
+BLOBBINESS = 2.5
+
+# Density below this is left out, which sets how far from each atom the grid
+# is computed.
+DENSITY_CUTOFF = 0.001
+
+# The density of the surface.
+ISOVALUE = 1.0
+
+# The default spacing of the density grid (Angstroms).
+DEFAULT_GRID_SPACING = 0.8
+
+# About how many (atom, grid point) pairs to compute at once, to bound the
+# memory used.
+SPLAT_CHUNK = 4000000
+
+# The corners of a grid cube, the index of a corner being x + 2y + 4z.
+CUBE_CORNERS = numpy.array(
+    [[x, y, z] for z in (0, 1) for y in (0, 1) for x in (0, 1)], dtype=numpy.int64
+)
+
+# The six tetrahedra of a cube, all sharing the diagonal from corner 0 to
+# corner 7. Neighboring cubes split their shared faces the same way, so the
+# surface has no cracks.
+CUBE_TETRAHEDRA = numpy.array(
+    [
+        [0, 1 << a, (1 << a) | (1 << b), 7]
+        for a, b in itertools.permutations(range(3), 2)
+    ],
+    dtype=numpy.int64,
+)
+
+
+def get_tetrahedron_cases():
+    """
+    The triangles marching tetrahedra makes for every combination of
+    tetrahedron corners inside the surface.
+
+    :returns: For each case (the bits of the corners inside), the triangles,
+              each as the three edges it crosses. Edges are (inside corner,
+              outside corner) pairs.
+    :rtype: :class:`list`
+    """
+
+    cases = []
+    for case in range(16):
+        inside = [i for i in range(4) if case >> i & 1]
+        outside = [i for i in range(4) if not case >> i & 1]
+        if len(inside) == 1:
+            triangles = [[(inside[0], o) for o in outside]]
+        elif len(inside) == 3:
+            triangles = [[(i, outside[0]) for i in inside]]
+        elif len(inside) == 2:
+            # A quad, split in two.
+            a, b = inside
+            c, d = outside
+            triangles = [[(a, c), (a, d), (b, d)], [(a, c), (b, d), (b, c)]]
+        else:
+            triangles = []
+        cases.append(triangles)
+    return cases
+
+
+TETRAHEDRON_CASES = get_tetrahedron_cases()
+
+
+def get_cutoff_ratio():
+    """
+    How far (relative to its radius) an atom's density reaches before it
+    drops below DENSITY_CUTOFF.
+
+    :returns: The ratio.
+    :rtype: :class:`float`
+    """
+
+    return (1.0 - numpy.log(DENSITY_CUTOFF) / BLOBBINESS) ** 0.5
+
+
+def gaussian_density(coords, radii, spacing=DEFAULT_GRID_SPACING):
+    """
+    The Gaussian density of some atoms on a grid. Each atom only adds to
+    the grid points near it.
+
+    :param numpy.ndarray coords: (N, 3) atom coordinates.
+    :param numpy.ndarray radii: (N,) atom radii.
+    :param float spacing: The grid spacing. Defaults to DEFAULT_GRID_SPACING.
+
+    :returns: The (X, Y, Z) float32 density, and the coordinates of its first
+              grid point.
+    :rtype: :class:`tuple`
+    """
+
+    coords = numpy.asarray(coords, dtype=numpy.float64).reshape(-1, 3)
+    radii = numpy.asarray(radii, dtype=numpy.float64)
+    cutoff_ratio = get_cutoff_ratio()
+    reach = radii.max() * cutoff_ratio
+
+    # Pad the grid so the surface never touches its edges.
+    origin = coords.min(axis=0) - reach - 2 * spacing
+    shape = tuple(
+        (numpy.ceil((coords.max(axis=0) + reach + 2 * spacing - origin) / spacing))
+        .astype(numpy.int64)
+        .tolist()
+    )
+    size = int(numpy.prod(shape))
+
+    # The grid points around an atom's nearest grid point.
+    steps = int(numpy.ceil(reach / spacing))
+    offsets = numpy.array(
+        list(itertools.product(range(-steps, steps + 1), repeat=3)), dtype=numpy.int64
+    )
+
+    density = numpy.zeros(size, dtype=numpy.float64)
+    chunk = max(1, SPLAT_CHUNK // len(offsets))
+    for start in range(0, len(coords), chunk):
+        chunk_coords = coords[start : start + chunk]
+        chunk_radii = radii[start : start + chunk]
+        nearest = numpy.rint((chunk_coords - origin) / spacing).astype(numpy.int64)
+        points = nearest[:, None, :] + offsets[None, :, :]
+        deltas = points * spacing + origin - chunk_coords[:, None, :]
+        ratios = numpy.einsum("nki,nki->nk", deltas, deltas) / (chunk_radii**2)[:, None]
+        close = ratios < cutoff_ratio**2
+        flat = numpy.ravel_multi_index(points[close].T, shape)
+        density = density + numpy.bincount(
+            flat, numpy.exp(-BLOBBINESS * (ratios[close] - 1.0)), minlength=size
+        )
+
+    return density.reshape(shape).astype(numpy.float32), origin
+
+
+def marching_tetrahedra(values, level):
+    """
+    The isosurface of a grid, with each grid cube split into six tetrahedra.
+    Only the cubes the surface passes through are looked at.
+
+    :param numpy.ndarray values: The (X, Y, Z) grid.
+    :param float level: The value of the isosurface. Grid points with higher
+                 values are inside.
+
+    :returns: (V, 3) float32 vertices, in grid units, and (F, 3) int32
+              triangles, facing out.
+    :rtype: :class:`tuple`
+    """
+
+    shape = values.shape
+    inside = values > level
+
+    # The cubes with corners both inside and outside.
+    corners = [
+        inside[x : shape[0] - 1 + x, y : shape[1] - 1 + y, z : shape[2] - 1 + z]
+        for x, y, z in CUBE_CORNERS
+    ]
+    crossed = numpy.logical_or.reduce(corners) & ~numpy.logical_and.reduce(corners)
+    cubes = numpy.argwhere(crossed)
+    if len(cubes) == 0:
+        return numpy.zeros((0, 3), dtype=numpy.float32), numpy.zeros(
+            (0, 3), dtype=numpy.int32
+        )
+
+    # The grid point of every corner of every tetrahedron.
+    strides = numpy.array([shape[1] * shape[2], shape[2], 1], dtype=numpy.int64)
+    cube_corners = (cubes @ strides)[:, None] + CUBE_CORNERS @ strides
+    tetrahedra = cube_corners[:, CUBE_TETRAHEDRA].reshape(-1, 4)
+
+    flat_values = values.ravel()
+    flat_inside = inside.ravel()
+    cases = (flat_inside[tetrahedra] << numpy.arange(4)).sum(axis=1)
+
+    # The (inside, outside) grid points of the edges each triangle crosses.
+    edge_starts = []
+    edge_ends = []
+    for case, triangles in enumerate(TETRAHEDRON_CASES):
+        case_tetrahedra = tetrahedra[cases == case]
+        if len(triangles) == 0 or len(case_tetrahedra) == 0:
+            continue
+        for triangle in triangles:
+            starts, ends = zip(*triangle)
+            edge_starts.append(case_tetrahedra[:, list(starts)])
+            edge_ends.append(case_tetrahedra[:, list(ends)])
+    edge_starts = numpy.concatenate(edge_starts)
+    edge_ends = numpy.concatenate(edge_ends)
+
+    # One vertex per crossed edge, where the values cross the level.
+    keys, triangles = numpy.unique(
+        edge_starts * flat_values.size + edge_ends, return_inverse=True
+    )
+    triangles = triangles.reshape(-1, 3).astype(numpy.int32)
+    starts = keys // flat_values.size
+    ends = keys % flat_values.size
+    start_values = flat_values[starts]
+    t = (start_values - level) / (start_values - flat_values[ends])
+    start_points = numpy.stack(numpy.unravel_index(starts, shape), axis=1)
+    end_points = numpy.stack(numpy.unravel_index(ends, shape), axis=1)
+    vertices = start_points + t[:, None] * (end_points - start_points)
+
+    # Face every triangle away from the inside end of its first edge.
+    corners = vertices[triangles]
+    normals = numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    first_edge = numpy.stack(numpy.unravel_index(edge_ends[:, 0], shape), axis=1) - (
+        numpy.stack(numpy.unravel_index(edge_starts[:, 0], shape), axis=1)
+    )
+    flip = numpy.einsum("ij,ij->i", normals, first_edge) < 0
+    triangles[flip] = triangles[flip][:, ::-1]
+
+    return vertices.astype(numpy.float32), triangles
+
+
+def contour(density, origin, spacing, level=ISOVALUE):
+    """
+    The isosurface of a density grid, with scikit-image's marching cubes if
+    it is installed.
+
+    :param numpy.ndarray density: The (X, Y, Z) grid.
+    :param numpy.ndarray origin: The coordinates of the first grid point.
+    :param float spacing: The grid spacing.
+    :param float level: The value of the isosurface. Defaults to ISOVALUE.
+
+    :returns: (V, 3) float32 vertices and (F, 3) int32 triangles, facing
+              out.
+    :rtype: :class:`tuple`
+    """
+
+    if marching_cubes is not None:
+        # Its triangles wind the other way.
+        vertices, triangles, _, _ = marching_cubes(density, level)
+        triangles = triangles[:, ::-1]
+    else:
+        vertices, triangles = marching_tetrahedra(density, level)
+    vertices = vertices * spacing + origin
+    return vertices.astype(numpy.float32), triangles.astype(numpy.int32)
+
+
+def surface_triangles(coords, radii, spacing=DEFAULT_GRID_SPACING):
+    """
+    The surface of some atoms, and the atom nearest each vertex.
+
+    :param numpy.ndarray coords: (N, 3) atom coordinates.
+    :param numpy.ndarray radii: (N,) atom radii.
+    :param float spacing: The grid spacing. Defaults to DEFAULT_GRID_SPACING.
+
+    :returns: (V, 3) float32 vertices, (F, 3) int32 triangles, and the index
+              of the nearest atom of each vertex (-1 if there is none
+              nearby).
+    :rtype: :class:`tuple`
+    """
+
+    if len(coords) == 0:
+        # E.g., a selection that matches no atoms.
+        return (
+            numpy.zeros((0, 3), dtype=numpy.float32),
+            numpy.zeros((0, 3), dtype=numpy.int32),
+            numpy.zeros(0, dtype=numpy.int64),
+        )
+
+    density, origin = gaussian_density(coords, radii, spacing)
+    vertices, triangles = contour(density, origin, spacing)
+
+    # Vertices are colored by the atom nearest their nearest grid point, so
+    # each grid point is only looked up once. Most are about an atom radius
+    # from their nearest atom. Only those in filled-in crevices need a wider
+    # (slower) search.
+    grid_points, vertex_points = numpy.unique(
+        numpy.rint((vertices - origin) / spacing).astype(numpy.int64),
+        axis=0,
+        return_inverse=True,
+    )
+    grid_points = grid_points * spacing + origin
+    near = float(numpy.max(radii)) + 2 * spacing
+    nearest = SpatialGrid(coords, near).nearest(grid_points, near)
+    missing = nearest < 0
+    if missing.any():
+        reach = float(numpy.max(radii)) * get_cutoff_ratio()
+        nearest[missing] = SpatialGrid(coords, reach).nearest(
+            grid_points[missing], reach
+        )
+    return vertices, triangles, nearest[vertex_points.ravel()]
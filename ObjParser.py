@@ -0,0 +1,139 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import numpy
+from .MeshArrays import MeshArrays
+
+# A small, purpose-built reader for the Wavefront OBJ files that VMD writes
+# with "render Wavefront". It only keeps what BlendMol uses (vertex positions,
+# polygons and the diffuse color of each material) and skips everything else.
+
+# VMD writes faces with relative indices ("f -3//-3 -2//-2 -1//-1"), but
+# absolute indices are accepted too.
+
+DEFAULT_COLOR = (0.8, 0.8, 0.8, 1.0)
+
+
+def parse_mtl(filename):
+    """
+    Read the diffuse colors from a Wavefront MTL file.
+
+    :param str filename: The MTL filename.
+
+    :returns: A dictionary mapping material names to RGBA tuples.
+    :rtype: :class:`dict`
+    """
+
+    colors = {}
+    if not os.path.exists(filename):
+        return colors
+
+    name = None
+    with open(filename, "r") as mtl_file:
+        for line in mtl_file:
+            parts = line.split()
+            if len(parts) == 0:
+                continue
+            if parts[0] == "newmtl" and len(parts) > 1:
+                name = parts[1]
+                colors[name] = list(DEFAULT_COLOR)
+            elif name is None:
+                continue
+            elif parts[0] == "Kd" and len(parts) >= 4:
+                colors[name][:3] = [float(v) for v in parts[1:4]]
+            elif parts[0] == "d" and len(parts) >= 2:
+                colors[name][3] = float(parts[1])
+
+    return {name: tuple(color) for name, color in colors.items()}
+
+
+def parse_obj(filename):
+    """
+    Parse a Wavefront OBJ file into NumPy arrays. The file is read one line
+    at a time, so the text is never held in memory all at once.
+
+    :param str filename: The OBJ filename.
+
+    :returns: The mesh.
+    :rtype: :class:`MeshArrays`
+    """
+
+    coords = []
+    num_vertices = 0
+    loop_vertex_indices = []
+    loop_totals = []
+    material_indices = []
+    material_names = []
+    material_lookup = {}
+    mtl_colors = {}
+    current_material = -1
+    has_normals = False
+
+    with open(filename, "r") as obj_file:
+        for line in obj_file:
+            if line.startswith("v "):
+                coords.extend(line.split()[1:4])
+                num_vertices = num_vertices + 1
+            elif line.startswith("f "):
+                corners = line.split()[1:]
+                for corner in corners:
+                    index = int(corner.split("/", 1)[0])
+                    if index < 0:
+                        loop_vertex_indices.append(num_vertices + index)
+                    else:
+                        loop_vertex_indices.append(index - 1)
+                loop_totals.append(len(corners))
+                material_indices.append(current_material)
+            elif line.startswith("vn "):
+                has_normals = True
+            elif line.startswith("usemtl"):
+                parts = line.split()
+                name = parts[1] if len(parts) > 1 else "None"
+                if not name in material_lookup:
+                    material_lookup[name] = len(material_names)
+                    material_names.append(name)
+                current_material = material_lookup[name]
+            elif line.startswith("mtllib"):
+                mtl_filename = line.split(None, 1)[1].strip()
+                if not os.path.isabs(mtl_filename) or not os.path.exists(mtl_filename):
+                    # Also covers OBJ files that were moved (e.g., into the
+                    # mesh cache) after they were written.
+                    mtl_filename = os.path.join(
+                        os.path.dirname(filename), os.path.basename(mtl_filename)
+                    )
+                mtl_colors.update(parse_mtl(mtl_filename))
+
+    material_indices = numpy.array(material_indices, dtype=numpy.int32)
+    if len(material_indices) > 0 and material_indices.min() < 0:
+        # Some polygons came before any usemtl line. Give them a default
+        # material.
+        material_indices[material_indices < 0] = len(material_names)
+        material_names.append("None")
+
+    material_colors = [mtl_colors.get(name, DEFAULT_COLOR) for name in material_names]
+
+    return MeshArrays(
+        vertices=numpy.array(coords, dtype=numpy.float32),
+        loop_vertex_indices=numpy.array(loop_vertex_indices, dtype=numpy.int32),
+        loop_totals=numpy.array(loop_totals, dtype=numpy.int32),
+        material_indices=material_indices,
+        material_names=material_names,
+        material_colors=material_colors,
+        smooth=has_normals,
+    )
@@ -0,0 +1,392 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import glob
+import collections
+import gzip
+import json
+import time
+import shutil
+import threading
+import urllib.error
+import urllib.request
+import concurrent.futures
+
+# Downloads PDB IDs into a persistent local mirror, so importing the same ID
+# again never touches the network. Files are fetched gzipped, revalidated with
+# the server (ETag/Last-Modified) only once they are old, and the least
+# recently used ones are removed once the mirror grows too big. The source can
+# be the RCSB, a local HTTP stand-in, or a local directory (e.g., a wwPDB
+# mirror on an offline cluster).
+
+DEFAULT_SOURCE = "https://files.rcsb.org/download/"
+
+# The formats to try, in order. Large structures are only available as
+# mmCIF.
+FORMATS = ["pdb", "cif"]
+
+# The suffix of the file with a mirrored file's HTTP headers.
+META_SUFFIX = ".meta.json"
+
+
+class PDBMirror:
+    """
+    A local mirror of PDB files.
+    """
+
+    def __init__(
+        self,
+        mirror_dir,
+        max_bytes,
+        source=DEFAULT_SOURCE,
+        revalidate_seconds=30 * 24 * 60 * 60,
+        timeout=60,
+    ):
+        """
+        Initialize the mirror.
+
+        :param str mirror_dir: The directory of the mirror.
+        :param int max_bytes: The maximum size of the mirror.
+        :param str source: Where to get files the mirror doesn't have: an
+                   http(s) URL ending in "/", or a local directory (or
+                   file:// URL). Defaults to the RCSB.
+        :param float revalidate_seconds: How old a mirrored file can get
+                     before the server is asked whether it changed. Defaults
+                     to 30 days.
+        :param float timeout: The network timeout, in seconds.
+        """
+
+        self.mirror_dir = mirror_dir
+        self.max_bytes = max_bytes
+        self.source = source
+        if self.source.startswith("file://"):
+            self.source = self.source[len("file://") :]
+        self.revalidate_seconds = revalidate_seconds
+        self.timeout = timeout
+
+        # One lock per file, so two threads asking for the same ID download
+        # it once.
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+
+        # The PDB IDs in use (being fetched and returned, or prefetched),
+        # which evict() keeps. One lock for the whole mirror, so only one
+        # thread evicts at a time.
+        self.pinned = collections.Counter()
+        self.mirror_lock = threading.Lock()
+
+        if not os.path.exists(mirror_dir):
+            os.makedirs(mirror_dir)
+
+    def is_remote(self):
+        """
+        Whether the source is an HTTP server.
+
+        :returns: True if it is, False if it is a local directory.
+        :rtype: :class:`bool`
+        """
+
+        return self.source.startswith("http://") or self.source.startswith("https://")
+
+    def get_lock(self, filename):
+        """
+        The lock of one mirrored file.
+
+        :param str filename: The basename of the file.
+
+        :returns: The lock.
+        :rtype: :class:`threading.Lock`
+        """
+
+        with self.locks_lock:
+            if not filename in self.locks:
+                self.locks[filename] = threading.Lock()
+            return self.locks[filename]
+
+    def pin(self, pdb_ids):
+        """
+        Keep the files of some PDB IDs in the mirror, until unpin() is called
+        with them.
+
+        :param list pdb_ids: The PDB IDs.
+        """
+
+        with self.mirror_lock:
+            for pdb_id in pdb_ids:
+                self.pinned[pdb_id.upper()] += 1
+
+    def unpin(self, pdb_ids):
+        """
+        Let the files of some PDB IDs be evicted again.
+
+        :param list pdb_ids: The PDB IDs, as given to pin().
+        """
+
+        with self.mirror_lock:
+            for pdb_id in pdb_ids:
+                self.pinned[pdb_id.upper()] -= 1
+                if self.pinned[pdb_id.upper()] <= 0:
+                    del self.pinned[pdb_id.upper()]
+
+    def get(self, pdb_id, formats=FORMATS):
+        """
+        Get the local filename of a PDB ID, fetching it if necessary.
+
+        :param str pdb_id: The 4-letter PDB ID.
+        :param list formats: The formats to try, in order. Defaults to PDB,
+                    then mmCIF.
+
+        :returns: The filename (.pdb or .cif).
+        :rtype: :class:`str`
+        """
+
+        pdb_id = pdb_id.upper()
+        errors = []
+        self.pin([pdb_id])
+        try:
+            for file_format in formats:
+                try:
+                    return self.get_format(pdb_id, file_format)
+                except (IOError, urllib.error.URLError) as e:
+                    errors.append(str(e))
+        finally:
+            self.unpin([pdb_id])
+
+        raise IOError("Could not get " + pdb_id + ": " + "; ".join(errors))
+
+    def get_format(self, pdb_id, file_format):
+        """
+        Get the local filename of a PDB ID in one format, fetching it if
+        necessary.
+
+        :param str pdb_id: The 4-letter PDB ID (uppercase).
+        :param str file_format: "pdb" or "cif".
+
+        :returns: The filename.
+        :rtype: :class:`str`
+        """
+
+        if not self.is_remote():
+            local_filename = self.find_in_directory(pdb_id, file_format)
+            if local_filename is not None and not local_filename.endswith(".gz"):
+                # Nothing to download or decompress.
+                return local_filename
+
+        basename = pdb_id + "." + file_format
+        filename = os.path.join(self.mirror_dir, basename)
+        with self.get_lock(basename):
+            meta = self.read_meta(filename)
+            if os.path.exists(filename):
+                if (
+                    not self.is_remote()
+                    or time.time() - meta.get("checked", 0) < self.revalidate_seconds
+                ):
+                    # Mark it as recently used.
+                    os.utime(filename, None)
+                    return filename
+
+            if self.is_remote():
+                self.fetch_remote(pdb_id, file_format, filename, meta)
+            else:
+                if local_filename is None:
+                    raise IOError(
+                        "No "
+                        + file_format
+                        + " file for "
+                        + pdb_id
+                        + " in "
+                        + self.source
+                    )
+                self.copy_decompressed(local_filename, filename)
+
+        self.evict()
+        return filename
+
+    def find_in_directory(self, pdb_id, file_format):
+        """
+        Find a PDB ID in a local source directory. Both flat directories
+        (1XDN.pdb, 1xdn.cif.gz, etc.) and the wwPDB's divided layout
+        (xd/pdb1xdn.ent.gz, xd/1xdn.cif.gz) are searched.
+
+        :param str pdb_id: The 4-letter PDB ID (uppercase).
+        :param str file_format: "pdb" or "cif".
+
+        :returns: The filename, or None if it isn't there.
+        :rtype: :class:`str`
+        """
+
+        lower_id = pdb_id.lower()
+        names = [pdb_id + "." + file_format, lower_id + "." + file_format]
+        if file_format == "pdb":
+            names.append("pdb" + lower_id + ".ent")
+        names = names + [name + ".gz" for name in names]
+
+        for subdir in ["", lower_id[1:3]]:
+            for name in names:
+                filename = os.path.join(self.source, subdir, name)
+                if os.path.exists(filename):
+                    return filename
+        return None
+
+    def read_meta(self, filename):
+        """
+        Read the HTTP headers saved with a mirrored file.
+
+        :param str filename: The mirrored file.
+
+        :returns: The headers, and when the file was last checked.
+        :rtype: :class:`dict`
+        """
+
+        meta_filename = filename + META_SUFFIX
+        if not os.path.exists(meta_filename) or not os.path.exists(filename):
+            return {}
+        try:
+            return json.load(open(meta_filename, "r"))
+        except ValueError:
+            return {}
+
+    def fetch_remote(self, pdb_id, file_format, filename, meta):
+        """
+        Download (or revalidate) a file from the HTTP source. If the server
+        can't be reached, a mirrored copy is used even if it is old.
+
+        :param str pdb_id: The 4-letter PDB ID (uppercase).
+        :param str file_format: "pdb" or "cif".
+        :param str filename: The mirrored filename.
+        :param dict meta: The saved headers of the mirrored file.
+        """
+
+        url = self.source + pdb_id + "." + file_format + ".gz"
+        request = urllib.request.Request(url)
+        if os.path.exists(filename):
+            if "etag" in meta:
+                request.add_header("If-None-Match", meta["etag"])
+            if "last_modified" in meta:
+                request.add_header("If-Modified-Since", meta["last_modified"])
+
+        try:
+            response = urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                # Not modified.
+                meta["checked"] = time.time()
+                self.write_meta(filename, meta)
+                os.utime(filename, None)
+                return
+            if os.path.exists(filename):
+                print("Could not revalidate " + filename + ". Using it anyway.")
+                return
+            raise
+        except urllib.error.URLError:
+            if os.path.exists(filename):
+                print("Could not revalidate " + filename + ". Using it anyway.")
+                return
+            raise
+
+        # Write to a temporary file and move it into place, so a partial
+        # download is never seen.
+        tmp_filename = filename + ".partial-" + str(threading.get_ident())
+        with response:
+            with open(tmp_filename, "wb") as out_file:
+                shutil.copyfileobj(gzip.GzipFile(fileobj=response), out_file)
+            meta = {"checked": time.time(), "url": url}
+            if response.headers.get("ETag") is not None:
+                meta["etag"] = response.headers.get("ETag")
+            if response.headers.get("Last-Modified") is not None:
+                meta["last_modified"] = response.headers.get("Last-Modified")
+        os.replace(tmp_filename, filename)
+        self.write_meta(filename, meta)
+
+    def copy_decompressed(self, source_filename, filename):
+        """
+        Copy a gzipped file from the local source into the mirror,
+        decompressing it.
+
+        :param str source_filename: The gzipped file.
+        :param str filename: The mirrored filename.
+        """
+
+        tmp_filename = filename + ".partial-" + str(threading.get_ident())
+        with gzip.open(source_filename, "rb") as in_file:
+            with open(tmp_filename, "wb") as out_file:
+                shutil.copyfileobj(in_file, out_file)
+        os.replace(tmp_filename, filename)
+        self.write_meta(filename, {"checked": time.time(), "url": source_filename})
+
+    def write_meta(self, filename, meta):
+        """
+        Save the HTTP headers of a mirrored file.
+
+        :param str filename: The mirrored file.
+        :param dict meta: The headers.
+        """
+
+        json.dump(meta, open(filename + META_SUFFIX, "w"))
+
+    def evict(self):
+        """
+        Remove the least recently used files until the mirror fits in its
+        maximum size. The files of pinned PDB IDs are kept.
+        """
+
+        with self.mirror_lock:
+            entries = []
+            for filename in glob.glob(os.path.join(self.mirror_dir, "*")):
+                if filename.endswith(META_SUFFIX) or ".partial-" in filename:
+                    continue
+                size = os.path.getsize(filename)
+                if os.path.exists(filename + META_SUFFIX):
+                    size = size + os.path.getsize(filename + META_SUFFIX)
+                entries.append((os.path.getmtime(filename), filename, size))
+
+            total = sum([entry[2] for entry in entries])
+            for _, filename, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if os.path.basename(filename).split(".")[0].upper() in self.pinned:
+                    continue
+                for name in [filename, filename + META_SUFFIX]:
+                    if os.path.exists(name):
+                        os.remove(name)
+                total = total - size
+
+    def prefetch(self, pdb_ids, max_workers=8):
+        """
+        Start fetching many PDB IDs at the same time, in a thread pool. The
+        results come back as futures, so callers can start using the first
+        files while the rest download.
+
+        :param list pdb_ids: The PDB IDs.
+        :param int max_workers: The number of simultaneous downloads.
+
+        :returns: A dictionary mapping each ID to a future of its filename,
+                  and the executor (call shutdown() on it when done). The IDs
+                  are pinned, so call unpin() with them once their files
+                  have been used.
+        :rtype: :class:`tuple`
+        """
+
+        self.pin(pdb_ids)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        futures = {}
+        for pdb_id in pdb_ids:
+            if not pdb_id.upper() in futures:
+                futures[pdb_id.upper()] = executor.submit(self.get, pdb_id)
+        return futures, executor
@@ -0,0 +1,650 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy
+from .SpatialGrid import SpatialGrid
+
+# A small PDB reader, and the atom selections BlendMol asks VMD for (protein,
+# nucleic, ligand, metals), reproduced with NumPy. Atoms are kept in file order
+# (first model only, all alternate locations), so atom i here is "index i" in
+# VMD.
+
+# Elements that the ligand and metal selections treat as organic.
+ORGANIC_ELEMENTS = set(["N", "C", "O", "P", "S", "SE", "CL", "BR", "F"])
+
+# Elements with a mass of 16 or less. VMD's selections use "mass > 16".
+LIGHT_ELEMENTS = set(["H", "D", "HE", "LI", "BE", "B", "C", "N", "O"])
+
+# fmt: off
+
+# Two-letter elements that can be recognized from a left-justified atom name.
+TWO_LETTER_ELEMENTS = set(
+    [
+        "AL", "AU", "BA", "BE", "BR", "CA", "CD", "CL", "CO", "CR", "CS", "CU",
+        "FE", "GA", "GD", "HG", "IR", "LI", "MG", "MN", "MO", "NA", "NI", "OS",
+        "PB", "PD", "PT", "RB", "RE", "RU", "SE", "SI", "SR", "TB", "TL", "YB",
+        "ZN",
+    ]
+)
+
+# Van der Waals radii (Angstroms), close to the ones VMD assigns.
+VDW_RADII = {
+    "H": 1.0, "C": 1.5, "N": 1.4, "O": 1.3, "F": 1.2, "P": 1.9, "S": 1.9,
+    "SE": 1.9, "CL": 1.75, "BR": 1.85, "I": 1.98, "NA": 2.27, "MG": 1.73,
+    "K": 2.75, "CA": 2.31, "MN": 1.73, "FE": 1.7, "CO": 1.7, "NI": 1.63,
+    "CU": 1.4, "ZN": 1.39, "CD": 1.58, "HG": 1.55,
+}
+DEFAULT_VDW_RADIUS = 1.5
+
+# fmt: on
+
+# Residues with atoms this close (Angstroms) to a small molecule interact
+# with it.
+DEFAULT_NEAR_LIGAND_CUTOFF = 8.0
+
+WATER_RESNAMES = set(
+    ["H2O", "HH0", "OHH", "HOH", "OH2", "SOL", "WAT", "TIP", "TIP2", "TIP3", "TIP4"]
+)
+
+# Nucleotides that BlendMol treats as ligands, not nucleic acids.
+NUCLEOTIDE_RESNAMES = set(
+    "ATP UTP TTP CTP GTP AMP UMP TMP CMP GMP ADP UDP TDP CDP GDP".split()
+)
+
+NUCLEIC_RESNAMES = set(
+    "A C G T U DA DC DG DT DU ADE CYT GUA THY URA RA RC RG RU".split()
+)
+
+NUCLEIC_BACKBONE_NAMES = set(
+    "P O1P O2P OP1 OP2 C3' C3* O3' O3* C4' C4* C5' C5* O5' O5*".split()
+)
+
+
+def get_index_selection(atom_mask):
+    """
+    A VMD selection of atoms by index, with runs of atoms as ranges (e.g.,
+    "index 10 to 25 31 40 to 52"). VMD looks these up instead of searching.
+
+    :param numpy.ndarray atom_mask: Boolean mask of atoms.
+
+    :returns: The selection string ("none" if there are no atoms).
+    :rtype: :class:`str`
+    """
+
+    idxs = numpy.nonzero(atom_mask)[0]
+    if len(idxs) == 0:
+        return "none"
+    breaks = numpy.nonzero(numpy.diff(idxs) > 1)[0]
+    starts = numpy.concatenate([idxs[:1], idxs[breaks + 1]])
+    ends = numpy.concatenate([idxs[breaks], idxs[-1:]])
+    return "index " + " ".join(
+        [
+            str(start) if start == end else str(start) + " to " + str(end)
+            for start, end in zip(starts.tolist(), ends.tolist())
+        ]
+    )
+
+
+def get_class_selection_code(selection_classes):
+    """
+    TCL code that evaluates each class of atoms (e.g., small molecules)
+    once for the whole structure, and keeps the indices of its atoms by
+    chain (in the class_atoms array, e.g., $class_atoms(lig,A)).
+
+    :param list selection_classes: (name, VMD selection) tuples.
+
+    :returns: The TCL code.
+    :rtype: :class:`str`
+    """
+
+    code = """
+            # A VMD selection of sorted atom indices, with runs as
+            # ranges ("index 3 to 9 12"), or "none".
+            proc blendmol_index_sel {indices} {
+                if {[llength $indices] == 0} {
+                    return "none"
+                }
+                set ranges {}
+                set start [lindex $indices 0]
+                set end $start
+                foreach i [concat [lrange $indices 1 end] -1] {
+                    if {$i == $end + 1} {
+                        set end $i
+                        continue
+                    }
+                    if {$start == $end} {
+                        lappend ranges $start
+                    } else {
+                        lappend ranges "$start to $end"
+                    }
+                    set start $i
+                    set end $i
+                }
+                return "index [join $ranges]"
+            }
+
+            # A persistent VMD keeps the globals of earlier imports.
+            catch {array unset class_atoms}
+        """
+    for name, selection in selection_classes:
+        code = (
+            code
+            + """
+            set class_sel [atomselect top \""""
+            + selection
+            + """\"]
+            foreach i [$class_sel get index] c [$class_sel get chain] {
+                lappend class_atoms("""
+            + name
+            + """,$c) $i
+            }
+            $class_sel delete
+        """
+        )
+    return code
+
+
+class PDBStructure:
+    """
+    The atoms (and bonds) of a PDB file, as NumPy arrays.
+    """
+
+    def __init__(self, filename):
+        """
+        Read a PDB file.
+
+        :param str filename: The PDB filename.
+        """
+
+        names = []
+        resnames = []
+        chains = []
+        resids = []
+        icodes = []
+        elements = []
+        coords = []
+        serials = []
+        conect_lines = []
+        remark_350_lines = []
+
+        with open(filename, "r") as pdb_file:
+            for line in pdb_file:
+                record = line[:6]
+                if record == "ATOM  " or record == "HETATM":
+                    serials.append(line[6:11].strip())
+                    name = line[12:16]
+                    names.append(name.strip())
+                    resnames.append(line[17:21].strip())
+                    chains.append(line[21:22].strip() or "X")
+                    resids.append(line[22:26].strip())
+                    icodes.append(line[26:27])
+                    coords.extend([line[30:38], line[38:46], line[46:54]])
+                    elements.append(self.get_element(name, line[76:78]))
+                elif record == "CONECT":
+                    conect_lines.append(line)
+                elif line.startswith("REMARK 350"):
+                    remark_350_lines.append(line)
+                elif record == "ENDMDL":
+                    # Later models are frames, not more atoms.
+                    break
+
+        self.names = numpy.array(names, dtype=object)
+        self.resnames = numpy.array(resnames, dtype=object)
+        self.chains = numpy.array(chains, dtype=object)
+        self.resids = numpy.array(
+            [int(r) if r.lstrip("-").isdigit() else 0 for r in resids],
+            dtype=numpy.int64,
+        )
+        self.elements = numpy.array(elements, dtype=object)
+        self.coords = numpy.array(coords, dtype=numpy.float32).reshape(-1, 3)
+
+        # A unique id for every residue, in file order.
+        residue_keys = [
+            (c, r, i, n) for c, r, i, n in zip(chains, resids, icodes, resnames)
+        ]
+        lookup = {}
+        self.residue_ids = numpy.array(
+            [lookup.setdefault(key, len(lookup)) for key in residue_keys],
+            dtype=numpy.int64,
+        )
+
+        self.vdw_radii = numpy.array(
+            [VDW_RADII.get(e, DEFAULT_VDW_RADIUS) for e in elements],
+            dtype=numpy.float32,
+        )
+
+        self._conect_bonds = self.get_conect_bonds(serials, conect_lines)
+        self.biomt = self.get_biomt(remark_350_lines)
+        self._bonds = None
+        self._is_protein = None
+        self._is_nucleic = None
+
+    @property
+    def num_atoms(self):
+        """
+        The number of atoms.
+
+        :returns: The count.
+        :rtype: :class:`int`
+        """
+
+        return len(self.names)
+
+    @property
+    def num_residues(self):
+        """
+        The number of residues.
+
+        :returns: The count.
+        :rtype: :class:`int`
+        """
+
+        return int(self.residue_ids.max()) + 1 if self.num_atoms > 0 else 0
+
+    def get_element(self, name, element_field):
+        """
+        The element of an atom, from the element columns if present,
+        otherwise guessed from the atom name.
+
+        :param str name: The atom name (columns 13-16, not stripped).
+        :param str element_field: The element columns (77-78).
+
+        :returns: The element, upper case.
+        :rtype: :class:`str`
+        """
+
+        element = element_field.strip().upper()
+        if element != "":
+            return element
+
+        # Two-letter elements are left-justified in the name field.
+        if name[0] != " " and not name[0].isdigit():
+            if name[:2].upper() in TWO_LETTER_ELEMENTS:
+                return name[:2].upper()
+
+        letters = [c for c in name.strip() if c.isalpha()]
+        return letters[0].upper() if len(letters) > 0 else "X"
+
+    def get_conect_bonds(self, serials, conect_lines):
+        """
+        The bonds listed in the CONECT records.
+
+        :param list serials: The serial number of every atom.
+        :param list conect_lines: The CONECT lines.
+
+        :returns: (B, 2) atom indices.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        serial_to_idx = {s: i for i, s in enumerate(serials)}
+        bonds = []
+        for line in conect_lines:
+            fields = [line[i : i + 5].strip() for i in range(6, 31, 5)]
+            if not fields[0] in serial_to_idx:
+                continue
+            idx1 = serial_to_idx[fields[0]]
+            for field in fields[1:]:
+                if field in serial_to_idx:
+                    bonds.append(sorted([idx1, serial_to_idx[field]]))
+        return numpy.array(bonds, dtype=numpy.int64).reshape(-1, 2)
+
+    def get_biomt(self, remark_350_lines):
+        """
+        The operators that build the first biological assembly, from the
+        BIOMT records (REMARK 350).
+
+        :param list remark_350_lines: The REMARK 350 lines.
+
+        :returns: (chains, matrix) tuples, one per operator. The 4x4
+                  matrices map the coordinates of the listed chains to the
+                  copy's.
+        :rtype: :class:`list`
+        """
+
+        operators = []
+        chains = []
+        rows = {}
+        in_first_assembly = False
+        for line in remark_350_lines:
+            text = line[10:].strip()
+            if text.startswith("BIOMOLECULE:"):
+                if in_first_assembly:
+                    break
+                in_first_assembly = True
+            elif not in_first_assembly:
+                continue
+            elif text.startswith("APPLY THE FOLLOWING TO CHAINS:"):
+                # A new set of chains, with its own operators.
+                chains = []
+                rows = {}
+            if "CHAINS:" in text:
+                chains = chains + [
+                    c.strip() for c in text.split(":", 1)[1].split(",") if c.strip()
+                ]
+            elif text.startswith("BIOMT"):
+                fields = text.split()
+                rows.setdefault(fields[1], {})[fields[0][-1]] = fields[2:6]
+                if len(rows[fields[1]]) == 3:
+                    operator_rows = rows.pop(fields[1])
+                    matrix = numpy.identity(4)
+                    for i in range(3):
+                        matrix[i] = [float(v) for v in operator_rows[str(i + 1)]]
+                    operators.append((list(chains), matrix))
+        return operators
+
+    @property
+    def bonds(self):
+        """
+        The bonds, from CONECT records plus distance-based bonds like VMD's
+        (atoms are bonded if closer than 0.6 times the sum of their van der
+        Waals radii, not both hydrogens, and not at the same place).
+
+        :returns: (B, 2) unique atom indices, lower index first.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        if self._bonds is None:
+            max_cutoff = 0.6 * 2 * float(self.vdw_radii.max()) if self.num_atoms else 1
+            grid = SpatialGrid(self.coords, max_cutoff)
+            idx1, idx2 = grid.query_pairs(self.coords, max_cutoff)
+            keep = idx1 < idx2
+            idx1 = idx1[keep]
+            idx2 = idx2[keep]
+
+            deltas = self.coords[idx1] - self.coords[idx2]
+            dists = numpy.sqrt(numpy.einsum("ij,ij->i", deltas, deltas))
+            keep = dists < 0.6 * (self.vdw_radii[idx1] + self.vdw_radii[idx2])
+            is_h = self.elements == "H"
+            keep = keep & ~(is_h[idx1] & is_h[idx2])
+
+            bonds = numpy.concatenate(
+                [numpy.stack([idx1[keep], idx2[keep]], axis=1), self._conect_bonds]
+            )
+            bonds = numpy.unique(bonds, axis=0).reshape(-1, 2)
+
+            # Atoms at the same place (e.g., alternate locations) aren't
+            # bonded.
+            deltas = self.coords[bonds[:, 0]] - self.coords[bonds[:, 1]]
+            self._bonds = bonds[numpy.einsum("ij,ij->i", deltas, deltas) > 0]
+        return self._bonds
+
+    def residues_with_atoms(self, atom_mask):
+        """
+        Expand a selection to whole residues ("same residue as").
+
+        :param numpy.ndarray atom_mask: Boolean mask of atoms.
+
+        :returns: Boolean mask of the atoms in the same residues.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        residue_mask = numpy.zeros(self.num_residues, dtype=bool)
+        residue_mask[self.residue_ids[atom_mask]] = True
+        return residue_mask[self.residue_ids]
+
+    def residues_having_names(self, names, min_count):
+        """
+        The atoms of residues that contain at least some number of atoms
+        with the given names.
+
+        :param set names: The atom names.
+        :param int min_count: How many of the names must be present.
+
+        :returns: Boolean mask of atoms.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        has_name = numpy.array([n in names for n in self.names], dtype=bool)
+        counts = numpy.bincount(self.residue_ids[has_name], minlength=self.num_residues)
+        return counts[self.residue_ids] >= min_count
+
+    @property
+    def is_protein(self):
+        """
+        VMD's "protein": residues with the backbone atoms N, CA, C and O.
+
+        :returns: Boolean mask of atoms.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        if self._is_protein is None:
+            self._is_protein = (
+                self.residues_having_names(set(["N"]), 1)
+                & self.residues_having_names(set(["CA"]), 1)
+                & self.residues_having_names(set(["C"]), 1)
+                & self.residues_having_names(set(["O", "OT1", "OXT"]), 1)
+            )
+        return self._is_protein
+
+    @property
+    def is_nucleic(self):
+        """
+        VMD's "nucleic": standard nucleic-acid residue names, or residues with
+        a nucleic-acid backbone.
+
+        :returns: Boolean mask of atoms.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        if self._is_nucleic is None:
+            by_name = numpy.array(
+                [r in NUCLEIC_RESNAMES for r in self.resnames], dtype=bool
+            )
+            self._is_nucleic = (
+                by_name | self.residues_having_names(NUCLEIC_BACKBONE_NAMES, 4)
+            ) & ~self.is_protein
+        return self._is_nucleic
+
+    def resname_in(self, resnames):
+        """
+        Atoms whose residue name is in a set.
+
+        :param set resnames: The residue names.
+
+        :returns: Boolean mask of atoms.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        return numpy.array([r in resnames for r in self.resnames], dtype=bool)
+
+    @property
+    def is_nucleic_polymer(self):
+        """
+        Nucleic acids, without free nucleotides (which are ligands).
+
+        :returns: Boolean mask of atoms.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        return self.is_nucleic & ~self.resname_in(NUCLEOTIDE_RESNAMES)
+
+    @property
+    def is_heavy_inorganic(self):
+        """
+        Atoms that are not N C O P S Se Cl Br F and have a mass over 16.
+
+        :returns: Boolean mask of atoms.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        return numpy.array(
+            [
+                not e in ORGANIC_ELEMENTS and not e in LIGHT_ELEMENTS
+                for e in self.elements
+            ],
+            dtype=bool,
+        )
+
+    def in_chain(self, chain):
+        """
+        Atoms in a chain.
+
+        :param str chain: The chain ID.
+
+        :returns: Boolean mask of atoms.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        return self.chains == chain
+
+    def select_protein_nucleic(self, chain):
+        """
+        Like BlendMol's VMD selection for proteins and nucleic acids.
+
+        :param str chain: The chain ID.
+
+        :returns: Boolean mask of atoms.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        return self.in_chain(chain) & (
+            self.is_protein | self.is_nucleic_polymer | self.resname_in(set(["MSE"]))
+        )
+
+    def select_ligands(self, resnames=None):
+        """
+        Like BlendMol's VMD selection for small molecules, in every chain.
+
+        :param list resnames: Only residues with these names are small
+                   molecules, or None (the default) for all of them.
+
+        :returns: Boolean mask of atoms.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        ligands = (
+            ~self.is_protein
+            & ~self.is_nucleic_polymer
+            & ~self.resname_in(WATER_RESNAMES)
+            & ~self.is_heavy_inorganic
+            & ~self.resname_in(set(["MSE"]))
+        )
+        if resnames:
+            ligands = ligands & self.resname_in(set(resnames))
+        return ligands
+
+    def select_ligand(self, chain, resnames=None):
+        """
+        Like BlendMol's VMD selection for small molecules.
+
+        :param str chain: The chain ID.
+        :param list resnames: Only residues with these names are small
+                   molecules, or None (the default) for all of them.
+
+        :returns: Boolean mask of atoms.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        return self.in_chain(chain) & self.select_ligands(resnames)
+
+    def select_metals(self, chain):
+        """
+        Like BlendMol's VMD selection for metals.
+
+        :param str chain: The chain ID.
+
+        :returns: Boolean mask of atoms.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        return (
+            self.in_chain(chain)
+            & self.is_heavy_inorganic
+            & ~self.resname_in(set(["MET", "CYS", "MSE"]))
+        )
+
+    def select_near(self, atom_mask, cutoff):
+        """
+        Atoms within a cutoff distance of a selection ("within").
+
+        :param numpy.ndarray atom_mask: Boolean mask of atoms.
+        :param float cutoff: The distance.
+
+        :returns: Boolean mask of atoms.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        near = numpy.zeros(self.num_atoms, dtype=bool)
+        if not atom_mask.any():
+            return near
+        grid = SpatialGrid(self.coords, cutoff)
+        _, point_idxs = grid.query_pairs(self.coords[atom_mask], cutoff)
+        near[point_idxs] = True
+        return near
+
+    def select_near_ligand(
+        self, chain, cutoff=DEFAULT_NEAR_LIGAND_CUTOFF, resnames=None
+    ):
+        """
+        Like BlendMol's VMD selection for the residues that interact with the
+        small molecules of a chain.
+
+        :param str chain: The chain ID.
+        :param float cutoff: The distance. Defaults to
+                     DEFAULT_NEAR_LIGAND_CUTOFF.
+        :param list resnames: Only residues with these names are small
+                   molecules, or None (the default) for all of them.
+
+        :returns: Boolean mask of atoms.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        return self.select_near_ligands([chain], cutoff, resnames)[chain]
+
+    def select_near_ligands(
+        self, chains, cutoff=DEFAULT_NEAR_LIGAND_CUTOFF, resnames=None
+    ):
+        """
+        select_near_ligand() for several chains, with one spatial grid.
+
+        :param list chains: The chain IDs.
+        :param float cutoff: The distance. Defaults to
+                     DEFAULT_NEAR_LIGAND_CUTOFF.
+        :param list resnames: Only residues with these names are small
+                   molecules, or None (the default) for all of them.
+
+        :returns: Maps each chain ID to a boolean mask of atoms.
+        :rtype: :class:`dict`
+        """
+
+        ligands = self.select_ligands(resnames)
+        polymer = self.is_protein | self.is_nucleic_polymer
+        grid = None
+        near_ligands = {}
+        for chain in chains:
+            chain_ligands = ligands & self.in_chain(chain)
+            near = numpy.zeros(self.num_atoms, dtype=bool)
+            if chain_ligands.any():
+                if grid is None:
+                    grid = SpatialGrid(self.coords, cutoff)
+                _, point_idxs = grid.query_pairs(self.coords[chain_ligands], cutoff)
+                near[point_idxs] = True
+                near = polymer & self.residues_with_atoms(near)
+            near_ligands[chain] = near
+        return near_ligands
+
+    @property
+    def unique_chains(self):
+        """
+        The chain IDs, sorted like VMD's "lsort -unique".
+
+        :returns: The chain IDs.
+        :rtype: :class:`list`
+        """
+
+        return sorted(set(self.chains.tolist()))
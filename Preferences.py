@@ -31,8 +31,9 @@ bl_info = {
 
 import bpy
 from bpy.types import Operator, AddonPreferences
-from bpy.props import StringProperty, IntProperty, BoolProperty
+from bpy.props import StringProperty, IntProperty, BoolProperty, EnumProperty
 from . import FileBasedPreferences
+from .PDBDownload import DEFAULT_SOURCE
 
 
 class ExternalProgramPreferences(AddonPreferences):
@@ -76,6 +77,131 @@ class ExternalProgramPreferences(AddonPreferences):
         ),
     )
 
+    vmd_processes: IntProperty(
+        name="VMD Processes",
+        default=1,
+        min=1,
+        max=256,
+        description=(
+            "The number of VMD processes to run at the same time. The chains "
+            "of a PDB file are split between them."
+        ),
+    )
+
+    reuse_vmd: BoolProperty(
+        name="Keep VMD Running",
+        default=True,
+        description=(
+            "Keep VMD running between imports of PDB files, instead of "
+            "starting it again every time."
+        ),
+    )
+
+    vmd_session_jobs: IntProperty(
+        name="Restart VMD After",
+        default=50,
+        min=1,
+        description=(
+            "Restart a running VMD after this many imports, to free the "
+            "memory it uses."
+        ),
+    )
+
+    stream_meshes: BoolProperty(
+        name="Read Meshes While VMD Runs",
+        default=True,
+        description=(
+            "Start reading each mesh as soon as VMD has rendered it, "
+            "instead of waiting for VMD to render them all. Only these "
+            "imports run in the background, and can be cancelled."
+        ),
+    )
+
+    use_mesh_cache: BoolProperty(
+        name="Cache Meshes",
+        default=True,
+        description=(
+            "Keep the meshes VMD makes from PDB/mmCIF files, so importing "
+            "the same file with the same settings again doesn't need to run "
+            "VMD."
+        ),
+    )
+
+    mesh_cache_size_mb: IntProperty(
+        name="Cache Size (MB)",
+        default=2048,
+        min=1,
+        description=(
+            "The maximum size of the mesh cache. The least recently used "
+            "meshes are removed first."
+        ),
+    )
+
+    mesh_compression: EnumProperty(
+        name="Mesh Compression",
+        items=[
+            ("NONE", "None", "Fastest to load (the files are memory-mapped)."),
+            ("ZLIB", "zlib", "Smaller files."),
+            ("LZMA", "LZMA", "Smallest files, but slow to save."),
+            ("ZSTD", "zstd", "Small files, fast (needs the zstandard module)."),
+            ("LZ4", "LZ4", "Fastest compression (needs the lz4 module)."),
+        ],
+        default="NONE",
+        description="How to compress the meshes kept in the cache.",
+    )
+
+    quantize_meshes: BoolProperty(
+        name="Quantize Meshes",
+        default=False,
+        description=(
+            "Store cached vertex coordinates as 16-bit integers, so the "
+            "files are smaller. Positions lose a little precision."
+        ),
+    )
+
+    pdb_mirror_source: StringProperty(
+        name="Download From",
+        default=DEFAULT_SOURCE,
+        description=(
+            "Where to get PDB IDs that aren't in the local mirror yet: a URL "
+            "(the RCSB, or a local stand-in) or a local directory."
+        ),
+    )
+
+    pdb_mirror_size_mb: IntProperty(
+        name="Mirror Size (MB)",
+        default=1024,
+        min=1,
+        description=(
+            "The maximum size of the local mirror of downloaded PDB files. "
+            "The least recently used files are removed first."
+        ),
+    )
+
+    profile_imports: BoolProperty(
+        name="Time Imports",
+        default=False,
+        description=(
+            "Time each stage of every import (download, VMD, OBJ parsing, "
+            "etc.) and save the timings as JSON."
+        ),
+    )
+
+    profiler: EnumProperty(
+        name="Profiler",
+        items=[
+            ("NONE", "None", "Only time the stages."),
+            ("CPROFILE", "cProfile", "Also run cProfile (saves a .prof file)."),
+            (
+                "PYINSTRUMENT",
+                "pyinstrument",
+                "Also run pyinstrument, if it is installed (saves an .html file).",
+            ),
+        ],
+        default="NONE",
+        description="A Python profiler to run during timed imports.",
+    )
+
     last_prefs: StringProperty(name="last_prefs", default="", options={"HIDDEN"})
 
     def get_current_prefs_as_string(self):
@@ -92,6 +218,30 @@ class ExternalProgramPreferences(AddonPreferences):
             # NO MORE PYMOL: + str(self.prefer_vmd) + " " + self.pymol_exec_path + " "
             # NO MORE PYMOL: + " "
             + str(self.vmd_msms_repr)
+            + " "
+            + str(self.vmd_processes)
+            + " "
+            + str(self.reuse_vmd)
+            + " "
+            + str(self.vmd_session_jobs)
+            + " "
+            + str(self.stream_meshes)
+            + " "
+            + str(self.use_mesh_cache)
+            + " "
+            + str(self.mesh_cache_size_mb)
+            + " "
+            + self.mesh_compression
+            + " "
+            + str(self.quantize_meshes)
+            + " "
+            + self.pdb_mirror_source
+            + " "
+            + str(self.pdb_mirror_size_mb)
+            + " "
+            + str(self.profile_imports)
+            + " "
+            + self.profiler
         )
 
     def draw(self, context):
@@ -118,6 +268,37 @@ class ExternalProgramPreferences(AddonPreferences):
         left_col = third_row.column()
         # NO MORE PYMOL: left_col.prop(self, "prefer_vmd")
         left_col.prop(self, "vmd_msms_repr")
+        left_col.prop(self, "vmd_processes")
+        fourth_row = exec_box.row()
+        fourth_row.prop(self, "reuse_vmd")
+        fourth_row.prop(self, "vmd_session_jobs")
+        fifth_row = exec_box.row()
+        fifth_row.prop(self, "stream_meshes")
+
+        cache_box = layout.box()
+        first_row = cache_box.row()
+        first_row.label(text="Mesh Cache")
+        second_row = cache_box.row()
+        second_row.prop(self, "use_mesh_cache")
+        second_row.prop(self, "mesh_cache_size_mb")
+        third_row = cache_box.row()
+        third_row.prop(self, "mesh_compression")
+        third_row.prop(self, "quantize_meshes")
+
+        download_box = layout.box()
+        first_row = download_box.row()
+        first_row.label(text="PDB Downloads")
+        second_row = download_box.row()
+        second_row.prop(self, "pdb_mirror_source")
+        third_row = download_box.row()
+        third_row.prop(self, "pdb_mirror_size_mb")
+
+        profile_box = layout.box()
+        first_row = profile_box.row()
+        first_row.label(text="Profiling")
+        second_row = profile_box.row()
+        second_row.prop(self, "profile_imports")
+        second_row.prop(self, "profiler")
 
         # NO MORE PYMOL: exec_box = layout.box()
         # first_row = exec_box.row()
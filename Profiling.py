@@ -0,0 +1,265 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    # Windows.
+    resource = None
+
+# Timing of the stages of an import (download, TCL generation, VMD, OBJ
+# parsing, etc.). Each stage records its wall-clock and CPU time (BlendMol's
+# and VMD's), the peak memory use so far, and counters such as the bytes of OBJ
+# read and the vertices and faces made. Stages with the same name (e.g.,
+# parsing each OBJ file) are added up. The result can be saved as JSON, along
+# with the output of cProfile or pyinstrument if one was running.
+
+# The profilers that can run during an import.
+PROFILERS = ["NONE", "CPROFILE", "PYINSTRUMENT"]
+
+
+def get_peak_rss_mb():
+    """
+    The peak memory use (resident set size) of this process so far.
+
+    :returns: The peak memory use in MB, or None if it can't be measured.
+    :rtype: :class:`float`
+    """
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # Bytes on macOS, KB elsewhere.
+        return peak / (1024.0 * 1024.0)
+    return peak / 1024.0
+
+
+def get_child_cpu_seconds():
+    """
+    The CPU time used by the finished child processes (VMD) so far.
+
+    :returns: The CPU time in seconds, or 0.0 if it can't be measured.
+    :rtype: :class:`float`
+    """
+
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class ImportProfile:
+    """
+    The timings of the stages of one import.
+    """
+
+    def __init__(self, name, profiler="NONE"):
+        """
+        Start profiling an import.
+
+        :param str name: What is being imported (e.g., the filename).
+        :param str profiler: The profiler to run during the import: "NONE",
+                   "CPROFILE" or "PYINSTRUMENT". Defaults to "NONE".
+        """
+
+        self.name = name
+        self.stages = {}
+        self.stage_order = []
+        self.start = time.perf_counter()
+        self.total_seconds = None
+        self.profiler_kind = profiler
+        self.profiler = None
+
+        # Stages can also run in threads (e.g., reading meshes while VMD
+        # renders).
+        self.lock = threading.Lock()
+
+        if profiler == "CPROFILE":
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif profiler == "PYINSTRUMENT":
+            try:
+                import pyinstrument
+            except ImportError:
+                print("pyinstrument is not installed. Not profiling.")
+                self.profiler_kind = "NONE"
+            else:
+                self.profiler = pyinstrument.Profiler()
+                self.profiler.start()
+
+    def get_stage(self, name):
+        """
+        The totals of a stage, added if it doesn't exist yet.
+
+        :param str name: The stage name.
+
+        :returns: The totals.
+        :rtype: :class:`dict`
+        """
+
+        if not name in self.stages:
+            self.stages[name] = {
+                "calls": 0,
+                "wall_seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "child_cpu_seconds": 0.0,
+            }
+            self.stage_order.append(name)
+        return self.stages[name]
+
+    @contextlib.contextmanager
+    def stage(self, name, **counts):
+        """
+        Time a stage (a "with" block).
+
+        :param str name: The stage name.
+        :param counts: Counters to add to the stage (e.g., obj_bytes=1024).
+        """
+
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        child_cpu = get_child_cpu_seconds()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+            child_cpu = get_child_cpu_seconds() - child_cpu
+            with self.lock:
+                totals = self.get_stage(name)
+                totals["calls"] = totals["calls"] + 1
+                totals["wall_seconds"] += wall
+                totals["cpu_seconds"] += cpu
+                totals["child_cpu_seconds"] += child_cpu
+                totals["peak_rss_mb"] = get_peak_rss_mb()
+            self.count(name, **counts)
+
+    def count(self, name, **counts):
+        """
+        Add to the counters of a stage.
+
+        :param str name: The stage name.
+        :param counts: The counters (e.g., vertices=100, faces=196).
+        """
+
+        with self.lock:
+            totals = self.get_stage(name)
+            for key, value in counts.items():
+                totals[key] = totals.get(key, 0) + value
+
+    def finish(self):
+        """
+        Stop timing (and profiling) the import.
+        """
+
+        if self.total_seconds is not None:
+            return
+        self.total_seconds = time.perf_counter() - self.start
+        if self.profiler_kind == "CPROFILE":
+            self.profiler.disable()
+        elif self.profiler_kind == "PYINSTRUMENT":
+            self.profiler.stop()
+
+    def to_dict(self):
+        """
+        The timings, as a dictionary that can be saved as JSON.
+
+        :returns: The timings.
+        :rtype: :class:`dict`
+        """
+
+        return {
+            "name": self.name,
+            "total_seconds": self.total_seconds,
+            "peak_rss_mb": get_peak_rss_mb(),
+            "stages": [
+                dict(name=name, **self.stages[name]) for name in self.stage_order
+            ],
+        }
+
+    def get_summary(self, max_stages=4):
+        """
+        A one-line summary of where the time went, slowest stages first.
+
+        :param int max_stages: How many stages to list. Defaults to 4.
+
+        :returns: The summary.
+        :rtype: :class:`str`
+        """
+
+        slowest = sorted(
+            self.stage_order, key=lambda name: -self.stages[name]["wall_seconds"]
+        )[:max_stages]
+        return (
+            "Imported in "
+            + "%.2f s" % (self.total_seconds or 0.0)
+            + " ("
+            + ", ".join(
+                [
+                    name + " %.2f s" % self.stages[name]["wall_seconds"]
+                    for name in slowest
+                ]
+            )
+            + ")"
+        )
+
+    def save(self, filename):
+        """
+        Save the timings as JSON. The profiler's output, if any, is saved
+        next to it (.prof for cProfile, .html for pyinstrument).
+
+        :param str filename: The JSON filename.
+        """
+
+        self.finish()
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+        base_filename = os.path.splitext(filename)[0]
+        if self.profiler_kind == "CPROFILE":
+            self.profiler.dump_stats(base_filename + ".prof")
+        elif self.profiler_kind == "PYINSTRUMENT":
+            with open(base_filename + ".html", "w") as f:
+                f.write(self.profiler.output_html())
+
+
+def stage(profile, name, **counts):
+    """
+    Time a stage, if the import is being profiled.
+
+    :param ImportProfile profile: The profile, or None.
+    :param str name: The stage name.
+    :param counts: Counters to add to the stage.
+
+    :returns: A context manager.
+    :rtype: :class:`contextlib.AbstractContextManager`
+    """
+
+    if profile is None:
+        return contextlib.nullcontext()
+    return profile.stage(name, **counts)
@@ -0,0 +1,162 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy
+
+# A uniform grid over 3D points, for finding all the pairs of points within a
+# cutoff distance without comparing every point to every other one.
+
+
+class SpatialGrid:
+    """
+    Points binned into cubic cells. Neighbor searches only look at the 27
+    cells around each query point.
+    """
+
+    def __init__(self, points, cell_size):
+        """
+        Bin the points.
+
+        :param numpy.ndarray points: (N, 3) coordinates.
+        :param float cell_size: The edge length of the cells. Searches are
+                    only correct for cutoffs up to this size.
+        """
+
+        self.points = numpy.asarray(points, dtype=numpy.float32).reshape(-1, 3)
+        self.cell_size = float(cell_size)
+
+        if len(self.points) == 0:
+            self.origin = numpy.zeros(3)
+            self.dims = numpy.ones(3, dtype=numpy.int64)
+        else:
+            self.origin = self.points.min(axis=0) - self.cell_size
+            cells = self._get_cells(self.points)
+            self.dims = cells.max(axis=0) + 2
+
+        keys = self._get_keys(self._get_cells(self.points))
+        self.order = numpy.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+
+    def _get_cells(self, points):
+        """
+        The integer cell coordinates of some points.
+
+        :param numpy.ndarray points: (N, 3) coordinates.
+
+        :returns: (N, 3) int64 cell coordinates.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        return numpy.floor((points - self.origin) / self.cell_size).astype(numpy.int64)
+
+    def _get_keys(self, cells):
+        """
+        A single integer key for every cell.
+
+        :param numpy.ndarray cells: (N, 3) cell coordinates.
+
+        :returns: int64 keys.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        return (cells[:, 0] * self.dims[1] + cells[:, 1]) * self.dims[2] + cells[:, 2]
+
+    def query_pairs(self, query_points, cutoff):
+        """
+        Find every (query point, grid point) pair closer than a cutoff.
+
+        :param numpy.ndarray query_points: (M, 3) coordinates.
+        :param float cutoff: The distance cutoff. Must not be bigger than the
+                    cell size.
+
+        :returns: Two int64 arrays, the indices of the query points and of
+                  the grid points in each pair.
+        :rtype: :class:`tuple`
+        """
+
+        query_points = numpy.asarray(query_points, dtype=numpy.float32).reshape(-1, 3)
+        empty = (numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64))
+        if len(query_points) == 0 or len(self.points) == 0:
+            return empty
+
+        query_cells = self._get_cells(query_points)
+        all_query_idxs = []
+        all_point_idxs = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for dz in (-1, 0, 1):
+                    cells = query_cells + numpy.array([dx, dy, dz])
+                    inside = numpy.all((cells >= 0) & (cells < self.dims), axis=1)
+                    query_idxs = numpy.nonzero(inside)[0]
+                    keys = self._get_keys(cells[query_idxs])
+
+                    # The range of sorted points in each neighboring cell.
+                    starts = numpy.searchsorted(self.sorted_keys, keys, "left")
+                    ends = numpy.searchsorted(self.sorted_keys, keys, "right")
+                    counts = ends - starts
+                    if counts.sum() == 0:
+                        continue
+
+                    # Expand the ranges into one entry per candidate pair.
+                    pair_query_idxs = numpy.repeat(query_idxs, counts)
+                    offsets = numpy.arange(counts.sum()) - numpy.repeat(
+                        numpy.cumsum(counts) - counts, counts
+                    )
+                    pair_point_idxs = self.order[numpy.repeat(starts, counts) + offsets]
+
+                    all_query_idxs.append(pair_query_idxs)
+                    all_point_idxs.append(pair_point_idxs)
+
+        if len(all_query_idxs) == 0:
+            return empty
+
+        query_idxs = numpy.concatenate(all_query_idxs)
+        point_idxs = numpy.concatenate(all_point_idxs)
+        deltas = query_points[query_idxs] - self.points[point_idxs]
+        close = numpy.einsum("ij,ij->i", deltas, deltas) < cutoff * cutoff
+        return query_idxs[close], point_idxs[close]
+
+    def nearest(self, query_points, max_distance):
+        """
+        Find the nearest grid point of each query point.
+
+        :param numpy.ndarray query_points: (M, 3) coordinates.
+        :param float max_distance: Ignore grid points farther than this. Must
+                    not be bigger than the cell size.
+
+        :returns: The index of the nearest grid point of each query point, or
+                  -1 if there is none within max_distance.
+        :rtype: :class:`numpy.ndarray`
+        """
+
+        query_points = numpy.asarray(query_points, dtype=numpy.float32).reshape(-1, 3)
+        nearest_idxs = numpy.full(len(query_points), -1, dtype=numpy.int64)
+        query_idxs, point_idxs = self.query_pairs(query_points, max_distance)
+        if len(query_idxs) == 0:
+            return nearest_idxs
+
+        deltas = query_points[query_idxs] - self.points[point_idxs]
+        dists = numpy.einsum("ij,ij->i", deltas, deltas)
+
+        # Sort by query point, then distance, and keep the first of each.
+        order = numpy.lexsort((dists, query_idxs))
+        query_idxs = query_idxs[order]
+        first = numpy.ones(len(order), dtype=bool)
+        first[1:] = query_idxs[1:] != query_idxs[:-1]
+        nearest_idxs[query_idxs[first]] = point_idxs[order][first]
+        return nearest_idxs
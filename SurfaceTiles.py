@@ -0,0 +1,237 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import heapq
+import itertools
+import numpy
+from .MeshArrays import concatenate_meshes
+from .SpatialGrid import SpatialGrid
+
+# Surfaces of large chains, made a tile at a time. VMD's Surf and MSMS surface
+# a whole selection at once, so a huge chain (or batch of chains) can run out
+# of memory or take an hour. Instead, space is cut into cubic tiles, and VMD
+# surfaces the atoms in and around each tile on its own (spread over the VMD
+# processes). Every tile keeps the polygons whose centers are inside it, and
+# the pieces are stitched back together, welding the vertices where they were
+# cut apart.
+
+# What comes after the chain in the name of a tile's mesh file, followed by
+# the tile (e.g., "prot_nuc_surf_A__tile_0_-1_2").
+TILE_SUFFIX = "__tile_"
+
+# The edge length of the tiles (Angstroms).
+DEFAULT_TILE_SIZE = 40.0
+
+# VMD also gets the atoms this far (Angstroms) outside a tile, so the surface
+# inside the tile is the same as the surface of the whole chain. A surface
+# is never farther than the largest atom radius plus the probe diameter from
+# the atoms that shape it.
+TILE_OVERLAP = 8.0
+
+# Tiles this close (Angstroms) to an atom are surfaced, because the surface
+# around the atom can reach into them.
+TILE_REACH = 5.0
+
+# Only chains (or batches) with at least this many atoms are tiled.
+MIN_TILED_ATOMS = 20000
+
+# Vertices where a tile's mesh was cut are welded to the nearest such vertex
+# of another tile, if it is this close (Angstroms).
+SEAM_WELD_DISTANCE = 0.5
+
+
+def get_tile_name(tile):
+    """
+    The name of a tile, as it appears in mesh filenames.
+
+    :param tuple tile: The (i, j, k) of the tile.
+
+    :returns: The name (e.g., "0_-1_2").
+    :rtype: :class:`str`
+    """
+
+    return "_".join([str(i) for i in tile])
+
+
+def split_tile_name(name):
+    """
+    Split a mesh name into the name of the untiled mesh and its tile.
+
+    :param str name: The name (e.g., "prot_nuc_surf_A__tile_0_-1_2").
+
+    :returns: The untiled name (e.g., "prot_nuc_surf_A") and the (i, j, k)
+              of the tile, or None if it isn't a tile.
+    :rtype: :class:`tuple`
+    """
+
+    if TILE_SUFFIX in name:
+        base, tile_name = name.rsplit(TILE_SUFFIX, 1)
+        parts = tile_name.split("_")
+        if len(parts) == 3 and all([p.lstrip("-").isdigit() for p in parts]):
+            return base, tuple([int(p) for p in parts])
+    return name, None
+
+
+def plan_tiles(coords, tile_size=DEFAULT_TILE_SIZE):
+    """
+    The tiles needed to surface some atoms.
+
+    :param numpy.ndarray coords: (N, 3) atom coordinates.
+    :param float tile_size: The edge length of the tiles. Defaults to
+                 DEFAULT_TILE_SIZE.
+
+    :returns: (tile, lower, upper, num_atoms) tuples: the (i, j, k) of each
+              tile, the corners of the box (tile plus overlap) whose atoms
+              VMD surfaces, and how many atoms are in that box.
+    :rtype: :class:`list`
+    """
+
+    coords = numpy.asarray(coords, dtype=numpy.float64).reshape(-1, 3)
+    if len(coords) == 0:
+        return []
+
+    offsets = numpy.array(
+        list(itertools.product([-TILE_REACH, 0.0, TILE_REACH], repeat=3))
+    )
+    cells = numpy.floor((coords[:, None, :] + offsets[None, :, :]) / tile_size)
+    cells = numpy.unique(cells.reshape(-1, 3).astype(numpy.int64), axis=0)
+
+    tiles = []
+    for cell in cells:
+        lower = cell * tile_size - TILE_OVERLAP
+        upper = (cell + 1) * tile_size + TILE_OVERLAP
+        num_atoms = int(numpy.all((coords > lower) & (coords < upper), axis=1).sum())
+        tiles.append((tuple(cell.tolist()), lower, upper, num_atoms))
+    return tiles
+
+
+def assign_tiles(tiles, num_processes):
+    """
+    Split tiles between VMD processes, so each surfaces about the same
+    number of atoms.
+
+    :param list tiles: (name, tile, lower, upper, num_atoms) tuples, the name
+                being the chain (or batch) the tile belongs to.
+    :param int num_processes: The number of VMD processes.
+
+    :returns: The tiles of each process.
+    :rtype: :class:`list`
+    """
+
+    assigned = [[] for _ in range(num_processes)]
+    heap = [(0, i) for i in range(num_processes)]
+    for tile in sorted(tiles, key=lambda t: (-t[4], t[0], t[1])):
+        num_atoms, i = heapq.heappop(heap)
+        assigned[i].append(tile)
+        heapq.heappush(heap, (num_atoms + tile[4], i))
+    return [sorted(process_tiles, key=lambda t: t[:2]) for process_tiles in assigned]
+
+
+def clip_to_tile(mesh_arrays, tile, tile_size=DEFAULT_TILE_SIZE):
+    """
+    Keep the polygons of a tile's mesh whose centers are inside the tile.
+    The overlapping parts belong to the neighboring tiles.
+
+    :param MeshArrays mesh_arrays: The tile's mesh.
+    :param tuple tile: The (i, j, k) of the tile.
+    :param float tile_size: The edge length of the tiles, in the units of
+                 the mesh. Defaults to DEFAULT_TILE_SIZE.
+
+    :returns: The clipped mesh, and the indices of its vertices where it
+              was cut (shared with a polygon that was removed).
+    :rtype: :class:`tuple`
+    """
+
+    cells = numpy.floor(mesh_arrays.get_polygon_centers() / tile_size)
+    inside = numpy.all(cells == numpy.array(tile), axis=1)
+
+    loop_inside = numpy.repeat(inside, mesh_arrays.loop_totals)
+    kept = numpy.zeros(mesh_arrays.num_vertices, dtype=bool)
+    kept[mesh_arrays.loop_vertex_indices[loop_inside]] = True
+    removed = numpy.zeros(mesh_arrays.num_vertices, dtype=bool)
+    removed[mesh_arrays.loop_vertex_indices[~loop_inside]] = True
+
+    # select_polygons() keeps the used vertices, in order.
+    cut = numpy.cumsum(kept)[kept & removed] - 1
+    return mesh_arrays.select_polygons(inside), cut.astype(numpy.int32)
+
+
+def stitch_tiles(tiles, tile_size=DEFAULT_TILE_SIZE, weld_distance=SEAM_WELD_DISTANCE):
+    """
+    Clip the meshes of the tiles of a surface, and merge them into one,
+    welding each vertex where a tile was cut to the nearest such vertex of
+    another tile. Seams where the tiles' polygons don't line up can keep
+    small cracks.
+
+    :param list tiles: The (i, j, k) and MeshArrays of each tile.
+    :param float tile_size: The edge length of the tiles, in the units of
+                 the meshes. Defaults to DEFAULT_TILE_SIZE.
+    :param float weld_distance: The farthest apart two vertices can be to be
+                 welded. Defaults to SEAM_WELD_DISTANCE.
+
+    :returns: The surface.
+    :rtype: :class:`MeshArrays`
+    """
+
+    meshes = []
+    seams = []
+    offset = 0
+    for tile, mesh_arrays in tiles:
+        mesh_arrays, cut = clip_to_tile(mesh_arrays, tile, tile_size)
+        meshes.append(mesh_arrays)
+        seams.append(cut + offset)
+        offset = offset + mesh_arrays.num_vertices
+
+    mesh_arrays = concatenate_meshes(meshes)
+    if mesh_arrays.num_vertices == 0:
+        return mesh_arrays
+
+    vertex_tiles = numpy.repeat(
+        numpy.arange(len(meshes)), [mesh.num_vertices for mesh in meshes]
+    )
+    boundary = numpy.concatenate(seams)
+    points = mesh_arrays.vertices[boundary]
+
+    # The nearest seam vertex of another tile, for every seam vertex.
+    grid = SpatialGrid(points, weld_distance)
+    query_idxs, point_idxs = grid.query_pairs(points, weld_distance)
+    other = vertex_tiles[boundary[query_idxs]] != vertex_tiles[boundary[point_idxs]]
+    query_idxs = query_idxs[other]
+    point_idxs = point_idxs[other]
+    deltas = points[query_idxs] - points[point_idxs]
+    order = numpy.lexsort((numpy.einsum("ij,ij->i", deltas, deltas), query_idxs))
+    query_idxs = query_idxs[order]
+    point_idxs = point_idxs[order]
+    first = numpy.ones(len(order), dtype=bool)
+    first[1:] = query_idxs[1:] != query_idxs[:-1]
+    ends1 = boundary[query_idxs[first]]
+    ends2 = boundary[point_idxs[first]]
+
+    # Every vertex joins the group of the lowest vertex it is (indirectly)
+    # welded to.
+    representatives = numpy.arange(mesh_arrays.num_vertices)
+    while True:
+        merged = representatives.copy()
+        numpy.minimum.at(merged, ends1, representatives[ends2])
+        numpy.minimum.at(merged, ends2, representatives[ends1])
+        merged = merged[merged]
+        if numpy.array_equal(merged, representatives):
+            break
+        representatives = merged
+
+    return mesh_arrays.merge_vertices(representatives)
@@ -0,0 +1,177 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy
+from .PDBParser import WATER_RESNAMES
+
+# Chains that are copies of each other. Homo-oligomers and capsids have many
+# chains with the same atoms, in nearly the same conformation. Only the first
+# of each (the reference chain) needs meshes; the others become linked
+# duplicates of its objects, placed by the rigid transform that superimposes
+# the reference's CA atoms on theirs (Kabsch). The operators of a PDB file's
+# biological assembly (BIOMT records) are applied the same way.
+
+# Chains are only copies if all their atoms are within this RMSD
+# (Angstroms) of the transformed reference chain.
+DEFAULT_MAX_RMSD = 1.0
+
+
+def kabsch(mobile, target):
+    """
+    The rigid transform that best superimposes one set of points on another
+    (Kabsch algorithm).
+
+    :param numpy.ndarray mobile: (N, 3) points.
+    :param numpy.ndarray target: (N, 3) points, in the same order.
+
+    :returns: A 4x4 matrix that maps the mobile points onto the target
+              points.
+    :rtype: :class:`numpy.ndarray`
+    """
+
+    mobile = numpy.asarray(mobile, dtype=numpy.float64)
+    target = numpy.asarray(target, dtype=numpy.float64)
+    mobile_center = mobile.mean(axis=0)
+    target_center = target.mean(axis=0)
+
+    u, _, vt = numpy.linalg.svd((mobile - mobile_center).T @ (target - target_center))
+
+    # Never a reflection.
+    d = numpy.sign(numpy.linalg.det(vt.T @ u.T)) or 1.0
+    rotation = vt.T @ numpy.diag([1.0, 1.0, d]) @ u.T
+
+    matrix = numpy.identity(4)
+    matrix[:3, :3] = rotation
+    matrix[:3, 3] = target_center - rotation @ mobile_center
+    return matrix
+
+
+def transform_points(matrix, points):
+    """
+    Apply a 4x4 matrix to points.
+
+    :param numpy.ndarray matrix: The matrix.
+    :param numpy.ndarray points: (N, 3) points.
+
+    :returns: (N, 3) transformed points.
+    :rtype: :class:`numpy.ndarray`
+    """
+
+    return points @ matrix[:3, :3].T + matrix[:3, 3]
+
+
+def find_chain_copies(structure, max_rmsd=DEFAULT_MAX_RMSD):
+    """
+    Find the chains that are copies of an earlier chain: the same atoms (by
+    residue and atom name, in the same order, ignoring water), superimposed
+    with an RMSD of at most max_rmsd.
+
+    :param PDBStructure structure: The structure.
+    :param float max_rmsd: The largest all-atom RMSD (Angstroms), after
+                 superimposing the CA atoms. Defaults to DEFAULT_MAX_RMSD.
+
+    :returns: Maps each copy's chain ID to its reference chain ID and the
+              4x4 matrix that moves the reference onto it.
+    :rtype: :class:`dict`
+    """
+
+    # Water is never rendered, and often differs between chains.
+    not_water = ~structure.resname_in(WATER_RESNAMES)
+
+    references = {}
+    copies = {}
+    for chain in structure.unique_chains:
+        atoms = numpy.nonzero(structure.in_chain(chain) & not_water)[0]
+        if len(atoms) == 0:
+            continue
+        signature = tuple(
+            zip(structure.resnames[atoms].tolist(), structure.names[atoms].tolist())
+        )
+        if not signature in references:
+            references[signature] = []
+        for ref_chain, ref_atoms in references[signature]:
+            # Superimpose the CA atoms (or every atom, for chains without
+            # enough of them), then check every atom.
+            fit = structure.is_protein[ref_atoms] & (structure.names[ref_atoms] == "CA")
+            if fit.sum() < 3:
+                fit = numpy.ones(len(ref_atoms), dtype=bool)
+            ref_coords = structure.coords[ref_atoms].astype(numpy.float64)
+            coords = structure.coords[atoms].astype(numpy.float64)
+            matrix = kabsch(ref_coords[fit], coords[fit])
+            deltas = transform_points(matrix, ref_coords) - coords
+            rmsd = numpy.sqrt((deltas**2).sum(axis=1).mean())
+            if rmsd <= max_rmsd:
+                copies[chain] = (ref_chain, matrix)
+                break
+        else:
+            references[signature].append((chain, atoms))
+    return copies
+
+
+def get_assembly_operators(structure):
+    """
+    The operators of a PDB file's biological assembly (BIOMT records) that
+    make new copies, i.e., all but the identity.
+
+    :param PDBStructure structure: The structure.
+
+    :returns: (chains, matrix) tuples.
+    :rtype: :class:`list`
+    """
+
+    return [
+        (chains, matrix)
+        for chains, matrix in structure.biomt
+        if not numpy.allclose(matrix, numpy.identity(4), atol=1e-4)
+    ]
+
+
+def split_object_name(name):
+    """
+    The representation and chain of a BlendMol object, from its name (e.g.,
+    "BldMl__prot_nuc_surf_A" or "BldMl__prot_nuc_surf_A.001").
+
+    :param str name: The object name.
+
+    :returns: The filename id (e.g., "prot_nuc_surf") and chain ID, or None
+              if the name doesn't end in a chain.
+    :rtype: :class:`tuple`
+    """
+
+    name = name.split(".")[0]
+    if name.startswith("BldMl__"):
+        name = name[len("BldMl__") :]
+    if not "_" in name:
+        return None
+    filename_id, chain = name.rsplit("_", 1)
+    return filename_id, chain
+
+
+def depends_on_other_chains(filename_id):
+    """
+    Whether a representation of a chain can include atoms of other chains,
+    so copies of the chain don't look the same. The residues near a chain's
+    ligands can be in any chain.
+
+    :param str filename_id: The filename id (e.g., "intract_stks").
+
+    :returns: True if it can, False otherwise.
+    :rtype: :class:`bool`
+    """
+
+    return filename_id.startswith("intract_")
@@ -0,0 +1,230 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import tempfile
+import bpy
+from bpy.app.handlers import persistent
+from bpy.props import PointerProperty
+from .ExternalInterface import ExternalInterface
+from .MeshArrays import MeshArrays
+from .TrajectoryCache import TrajectoryCache, FRAME_SUFFIX, NUM_FRAMES_FILENAME
+from .Profiling import stage
+
+# Trajectory import. VMD renders the frames in chunks, the meshes of each chunk
+# go into an on-disk TrajectoryCache, and a frame-change handler shows the
+# right frame of every trajectory object. Blender only ever holds one frame of
+# each representation, however long the trajectory.
+
+# Open caches, by directory. They only hold the base meshes.
+_caches = {}
+
+
+def get_trajectory_cache_dir():
+    """
+    Make a new directory for the frames of a trajectory. It is kept (the
+    saved .blend file needs it), in the same place as the mesh cache.
+
+    :returns: The directory.
+    :rtype: :class:`str`
+    """
+
+    parent_dir = bpy.utils.user_resource(
+        "DATAFILES", path="blendmol_trajectories", create=True
+    )
+    return tempfile.mkdtemp(prefix="trajectory_", dir=parent_dir)
+
+
+def get_cache(cache_dir):
+    """
+    The (shared) cache in a directory.
+
+    :param str cache_dir: The directory.
+
+    :returns: The cache.
+    :rtype: :class:`TrajectoryCache`
+    """
+
+    if not cache_dir in _caches:
+        _caches[cache_dir] = TrajectoryCache(cache_dir)
+    return _caches[cache_dir]
+
+
+def import_trajectory(vmd, my_operator, exec_path):
+    """
+    Have VMD render a trajectory, one chunk of frames at a time, and add one
+    object per representation that follows the trajectory as the frame
+    changes.
+
+    :param VMD vmd: The VMD interface, with its temporary directory made.
+    :param ??? my_operator: The operator, used to access user-parameter
+                variables.
+    :param str exec_path: The path to the VMD executable.
+
+    :returns: List of the names of the added objects.
+    :rtype: :class:`str[]`
+    """
+
+    cache = TrajectoryCache(get_trajectory_cache_dir(), vmd.mesh_format)
+    _caches[cache.cache_dir] = cache
+
+    first = my_operator.trajectory_first
+    last = my_operator.trajectory_last
+    stride = my_operator.trajectory_stride
+    chunk_size = my_operator.trajectory_chunk_size
+    frame_idx = 0
+
+    while last < 0 or first <= last:
+        chunk_last = first + (chunk_size - 1) * stride
+        if last >= 0:
+            chunk_last = min(chunk_last, last)
+
+        print("Rendering trajectory frames " + str(first) + "-" + str(chunk_last))
+        with stage(vmd.profile, "make tcl"):
+            vmd.make_vis_script(my_operator, (first, chunk_last, stride, frame_idx))
+        with stage(vmd.profile, "vmd"):
+            vmd.run_external_program(exec_path)
+
+        # Store the chunk, deleting VMD's files as it goes.
+        with stage(vmd.profile, "store frames"):
+            cache.add_frames_from_dir(
+                vmd.tmp_dir, lambda m: vmd.prepare_mesh_arrays(m, my_operator)
+            )
+
+        num_frames_filename = vmd.tmp_dir + NUM_FRAMES_FILENAME
+        num_frames = 0
+        if os.path.exists(num_frames_filename):
+            num_frames = int(open(num_frames_filename, "r").read().strip() or 0)
+            os.remove(num_frames_filename)
+
+        frame_idx = frame_idx + num_frames
+        if num_frames < chunk_size:
+            # The end of the trajectory.
+            break
+        first = first + chunk_size * stride
+
+    # One object per representation.
+    scene = bpy.context.scene
+    new_obj_names = []
+    for name in sorted(cache.num_frames.keys()):
+        obj = vmd.new_mesh_object("BldMl__" + name, cache.get_base(name))
+        obj.blendmol_trajectory_base = obj.data
+        obj["blendmol_trajectory_dir"] = cache.cache_dir
+        obj["blendmol_trajectory_name"] = name
+        obj["blendmol_trajectory_start"] = scene.frame_current
+        obj["blendmol_trajectory_frames"] = frame_idx
+        show_trajectory_frame(obj, scene.frame_current)
+        new_obj_names.append(obj.name)
+
+    if frame_idx > 0:
+        scene.frame_end = max(scene.frame_end, scene.frame_current + frame_idx - 1)
+
+    return new_obj_names
+
+
+def show_trajectory_frame(obj, scene_frame):
+    """
+    Show the trajectory frame that goes with a scene frame. Frames with the
+    base topology update the base mesh in place. Others get a mesh of their
+    own, which is removed when the frame changes again.
+
+    :param bpy.types.Object obj: The trajectory object.
+    :param int scene_frame: The scene frame.
+    """
+
+    frame = scene_frame - obj["blendmol_trajectory_start"]
+    frame = min(max(frame, 0), obj["blendmol_trajectory_frames"] - 1)
+    if obj.get("blendmol_trajectory_frame") == frame:
+        return
+
+    cache = get_cache(obj["blendmol_trajectory_dir"])
+    name = obj["blendmol_trajectory_name"]
+    base_mesh = obj.blendmol_trajectory_base
+    previous_mesh = obj.data
+
+    kind, data = cache.load_frame(name, frame)
+    if kind == "deltas":
+        base_mesh.vertices.foreach_set("co", data.ravel())
+        base_mesh.update()
+        obj.data = base_mesh
+    else:
+        if kind is None:
+            # The representation was empty in this frame.
+            data = MeshArrays()
+
+        interface = ExternalInterface()
+        materials = None
+        if (
+            hasattr(base_mesh, "attributes")
+            and "blendmol_color" in base_mesh.attributes
+        ):
+            # Colored by its attribute, like the base mesh.
+            interface.material_mode = "COLOR_ATTRIBUTE"
+        else:
+            # Reuse the base mesh's materials where the names match.
+            base_names = cache.get_base(name).material_names
+            materials = [
+                (
+                    base_mesh.materials[base_names.index(mat_name)]
+                    if mat_name in base_names
+                    else None
+                )
+                for mat_name in data.material_names
+            ]
+        obj.data = interface.new_mesh(
+            base_mesh.name + FRAME_SUFFIX + str(frame), data, materials
+        )
+
+    if previous_mesh != base_mesh and previous_mesh != obj.data:
+        bpy.data.meshes.remove(previous_mesh)
+    obj["blendmol_trajectory_frame"] = frame
+
+
+@persistent
+def trajectory_frame_change(scene, *args):
+    """
+    Show the current frame of every trajectory object.
+
+    :param bpy.types.Scene scene: The scene.
+    """
+
+    for obj in scene.objects:
+        if obj.type == "MESH" and obj.blendmol_trajectory_base is not None:
+            if os.path.exists(obj["blendmol_trajectory_dir"]):
+                show_trajectory_frame(obj, scene.frame_current)
+
+
+def register():
+    """
+    Register the trajectory property and frame-change handler.
+    """
+
+    bpy.types.Object.blendmol_trajectory_base = PointerProperty(
+        type=bpy.types.Mesh, name="BlendMol trajectory base mesh"
+    )
+    bpy.app.handlers.frame_change_pre.append(trajectory_frame_change)
+
+
+def unregister():
+    """
+    Unregister the trajectory property and frame-change handler.
+    """
+
+    if trajectory_frame_change in bpy.app.handlers.frame_change_pre:
+        bpy.app.handlers.frame_change_pre.remove(trajectory_frame_change)
+    del bpy.types.Object.blendmol_trajectory_base
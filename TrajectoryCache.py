@@ -0,0 +1,253 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import glob
+import json
+import numpy
+from .ObjParser import parse_obj
+from .BinaryMesh import MESH_EXT, MeshFormat, load_mesh
+
+# An on-disk cache of the meshes of every frame of a trajectory. The first
+# frame of each representation is the base mesh. Later frames with the same
+# topology (ribbons, sticks, spheres) are stored as vertex-position deltas from
+# the base. Frames whose topology changes (surfaces, usually) are stored as
+# whole meshes (binary mesh files, see BinaryMesh.py). Only one frame is ever
+# held in memory.
+
+MANIFEST_FILENAME = "manifest.json"
+
+# VMD's mesh files of trajectory frames end in this, plus the frame index
+# (e.g., "prot_nuc_ribb_A__frame_12.obj").
+FRAME_SUFFIX = "__frame_"
+
+# The name of the file VMD writes the number of frames in a chunk to.
+NUM_FRAMES_FILENAME = "num_frames.txt"
+
+# Deltas are stored as float16 (halving the size of the cache) when none is
+# bigger than this, so the rounding error stays under 1/100 of a unit.
+FLOAT16_MAX_DELTA = 16.0
+
+
+def split_frame_name(name):
+    """
+    Split a mesh name into the name of its representation and its frame.
+
+    :param str name: The name (e.g., "prot_nuc_ribb_A__frame_12").
+
+    :returns: The representation name and the frame index (None if the name
+              has no frame suffix).
+    :rtype: :class:`tuple`
+    """
+
+    if FRAME_SUFFIX in name:
+        base, frame = name.rsplit(FRAME_SUFFIX, 1)
+        if frame.isdigit():
+            return base, int(frame)
+    return name, None
+
+
+def same_topology(mesh_arrays1, mesh_arrays2):
+    """
+    Whether two meshes differ only in their vertex positions.
+
+    :param MeshArrays mesh_arrays1: The first mesh.
+    :param MeshArrays mesh_arrays2: The second mesh.
+
+    :returns: True if they do, False otherwise.
+    :rtype: :class:`bool`
+    """
+
+    return (
+        mesh_arrays1.num_vertices == mesh_arrays2.num_vertices
+        and numpy.array_equal(mesh_arrays1.loop_totals, mesh_arrays2.loop_totals)
+        and numpy.array_equal(
+            mesh_arrays1.loop_vertex_indices, mesh_arrays2.loop_vertex_indices
+        )
+        and numpy.array_equal(
+            mesh_arrays1.material_indices, mesh_arrays2.material_indices
+        )
+        and mesh_arrays1.material_names == mesh_arrays2.material_names
+    )
+
+
+class TrajectoryCache:
+    """
+    The per-frame meshes of a trajectory, one set of files per
+    representation.
+    """
+
+    def __init__(self, cache_dir, mesh_format=None):
+        """
+        Open (or start) a cache.
+
+        :param str cache_dir: The directory of the cache.
+        :param MeshFormat mesh_format: How to save whole meshes, or None for
+                   the default.
+        """
+
+        self.cache_dir = cache_dir
+        self.mesh_format = mesh_format if mesh_format is not None else MeshFormat()
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        # The base mesh of each representation, and the number of frames
+        # stored so far.
+        self.bases = {}
+        self.num_frames = {}
+
+        manifest_filename = os.path.join(cache_dir, MANIFEST_FILENAME)
+        if os.path.exists(manifest_filename):
+            with open(manifest_filename, "r") as manifest_file:
+                self.num_frames = json.load(manifest_file)
+
+    def get_base_filename(self, name):
+        """
+        The file with the base mesh of a representation.
+
+        :param str name: The representation name.
+
+        :returns: The filename.
+        :rtype: :class:`str`
+        """
+
+        return os.path.join(self.cache_dir, name + ".base" + MESH_EXT)
+
+    def get_frame_filename(self, name, frame, ext):
+        """
+        The file with one frame of a representation.
+
+        :param str name: The representation name.
+        :param int frame: The frame index.
+        :param str ext: ".npy" for deltas, MESH_EXT for whole meshes.
+
+        :returns: The filename.
+        :rtype: :class:`str`
+        """
+
+        return os.path.join(self.cache_dir, name + "." + str(frame) + ext)
+
+    def add_frame(self, name, frame, mesh_arrays):
+        """
+        Store one frame of a representation.
+
+        :param str name: The representation name.
+        :param int frame: The frame index.
+        :param MeshArrays mesh_arrays: The mesh of that frame.
+        """
+
+        if not name in self.bases:
+            base_filename = self.get_base_filename(name)
+            if os.path.exists(base_filename):
+                self.bases[name] = load_mesh(base_filename)
+            else:
+                self.mesh_format.save(base_filename, mesh_arrays)
+                self.bases[name] = mesh_arrays
+
+        base = self.bases[name]
+        if same_topology(base, mesh_arrays):
+            deltas = mesh_arrays.vertices - base.vertices
+            if len(deltas) > 0 and numpy.abs(deltas).max() < FLOAT16_MAX_DELTA:
+                deltas = deltas.astype(numpy.float16)
+            numpy.save(self.get_frame_filename(name, frame, ".npy"), deltas)
+        else:
+            self.mesh_format.save(
+                self.get_frame_filename(name, frame, MESH_EXT), mesh_arrays
+            )
+
+        self.num_frames[name] = max(self.num_frames.get(name, 0), frame + 1)
+
+    def add_frames_from_dir(self, mesh_dir, prepare=None):
+        """
+        Store the frames VMD rendered to a directory, one OBJ file at a time.
+        The OBJ and MTL files are deleted once they are stored, so a
+        trajectory never needs more than one chunk of them on disk.
+
+        :param str mesh_dir: The directory with the OBJ files.
+        :param function prepare: Called on each mesh before it is stored
+                    (e.g., to weld and scale it). Optional.
+
+        :returns: The indices of the frames that were found.
+        :rtype: :class:`set`
+        """
+
+        frames = set()
+        for filename in sorted(glob.glob(os.path.join(mesh_dir, "*.obj"))):
+            name, frame = split_frame_name(os.path.basename(filename)[:-4])
+            if frame is None:
+                continue
+
+            mesh_arrays = parse_obj(filename)
+            if prepare is not None:
+                mesh_arrays = prepare(mesh_arrays)
+            self.add_frame(name, frame, mesh_arrays)
+            frames.add(frame)
+
+            os.remove(filename)
+            if os.path.exists(filename[:-4] + ".mtl"):
+                os.remove(filename[:-4] + ".mtl")
+
+        self.save_manifest()
+        return frames
+
+    def save_manifest(self):
+        """
+        Save the number of frames of every representation.
+        """
+
+        with open(os.path.join(self.cache_dir, MANIFEST_FILENAME), "w") as f:
+            json.dump(self.num_frames, f)
+
+    def get_base(self, name):
+        """
+        The base mesh of a representation.
+
+        :param str name: The representation name.
+
+        :returns: The mesh.
+        :rtype: :class:`MeshArrays`
+        """
+
+        if not name in self.bases:
+            self.bases[name] = load_mesh(self.get_base_filename(name))
+        return self.bases[name]
+
+    def load_frame(self, name, frame):
+        """
+        Load one frame of a representation.
+
+        :param str name: The representation name.
+        :param int frame: The frame index.
+
+        :returns: ("deltas", (N, 3) float32 vertex positions) if the frame has
+                  the base topology, ("mesh", MeshArrays) if it doesn't, or
+                  (None, None) if the representation was empty in that frame.
+        :rtype: :class:`tuple`
+        """
+
+        deltas_filename = self.get_frame_filename(name, frame, ".npy")
+        if os.path.exists(deltas_filename):
+            deltas = numpy.load(deltas_filename, mmap_mode="r")
+            vertices = self.get_base(name).vertices + deltas.astype(numpy.float32)
+            return "deltas", vertices
+
+        mesh_filename = self.get_frame_filename(name, frame, MESH_EXT)
+        if os.path.exists(mesh_filename):
+            return "mesh", load_mesh(mesh_filename)
+
+        return None, None
@@ -17,19 +17,113 @@ this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from .ExternalInterface import ExternalInterface
+from .LevelOfDetail import LOD_TIERS, LOD_SUFFIX, split_lod_name
+from .TrajectoryCache import FRAME_SUFFIX, NUM_FRAMES_FILENAME
+from .VMDSession import VMDSessionError, VMDCancelled, CANCEL_POLL_SECONDS
+from .MeshStream import RENDERED_MARKER, SKIPPED_MARKER, TOTAL_MARKER
+from .Symmetry import depends_on_other_chains, split_object_name
+from .ChainBatches import make_chain_batches, assign_batches, ChainLabeler
+from .PDBParser import (
+    PDBStructure,
+    get_index_selection,
+    get_class_selection_code,
+    WATER_RESNAMES,
+)
+from .SurfaceTiles import (
+    TILE_SUFFIX,
+    MIN_TILED_ATOMS,
+    plan_tiles,
+    assign_tiles,
+    get_tile_name,
+    split_tile_name,
+)
+from .Profiling import stage
+import bpy
 import os
 import re
 import glob
+import threading
+import numpy
 
 # from pathlib import Path
 import subprocess
 
+# The VMD representation of each level-of-detail tier. The final tiers are
+# the representations BlendMol has always used. Surf's second parameter picks
+# the quick (1) or full (0) surface algorithm.
+REPRESENTATIONS = {
+    "msms": {
+        "draft": "MSMS 1.500000 1.000000 0.000000 0.000000",
+        "preview": "MSMS 1.500000 2.500000 0.000000 0.000000",
+        "final": "MSMS 1.500000 5.000000 0.000000 0.000000",
+    },
+    "surf": {
+        "draft": "Surf 1.400000 1.000000",
+        "preview": "Surf 1.400000 1.000000",
+        "final": "Surf 1.400000 0.000000",
+    },
+    "sticks": {
+        "draft": "Licorice 0.300000 6.000000 6.000000",
+        "preview": "Licorice 0.300000 12.000000 12.000000",
+        "final": "Licorice 0.300000 20.000000 20.000000",
+    },
+    "balls": {
+        "draft": "VDW 0.2000000 6.000000",
+        "preview": "VDW 0.2000000 8.000000",
+        "final": "VDW 0.2000000 12.000000",
+    },
+    "vdw": {
+        "draft": "VDW 1.0000000 6.000000",
+        "preview": "VDW 1.0000000 8.000000",
+        "final": "VDW 1.0000000 12.000000",
+    },
+    "ribbon": {
+        "draft": "NewCartoon 0.300000 4.000000 4.100000 0",
+        "preview": "NewCartoon 0.300000 6.000000 4.100000 0",
+        "final": "NewCartoon 0.300000 10.000000 4.100000 0",
+    },
+}
+
 
 class VMD(ExternalInterface):
     """
     A class to get 3D models using VMD.
     """
 
+    # The level-of-detail tiers to render, and what to add to the name of
+    # every mesh file. make_vis_script() sets these.
+    lod_tiers = ["final"]
+    render_suffix = ""
+
+    # The persistent VMD processes to run the scripts in (a VMDSessionPool),
+    # or None to start a new VMD every time. Scripts that embed a user's
+    # VMD/TCL file always get a new one.
+    session_pool = None
+    can_reuse_session = False
+
+    # Set (a threading.Event) to stop VMD, e.g., when the user cancels the
+    # import.
+    cancel_event = None
+
+    # Chains that are copies of another chain (see Symmetry.py), mapped to
+    # their reference chain and transform. Their meshes aren't rendered,
+    # except those that depend on other chains.
+    chain_copies = {}
+
+    # Maps each batch of chains (see ChainBatches.py) to its chains, for
+    # structures with many chains. make_vis_script() sets this.
+    chain_batches = {}
+
+    # The chains (or batches) whose surfaces are made in tiles (see
+    # SurfaceTiles.py), and what to add to the name of a tile's mesh files.
+    # make_vis_script() sets these.
+    tiled_chains = []
+    tile_suffix = ""
+
+    # The atoms of the PDB file (a PDBStructure), read once when needed.
+    structure = None
+    structure_lock = threading.Lock()
+
     def fix_path_for_tcl(self, path):
         """
         Even in windows, TCL paths must use /.
@@ -46,13 +140,17 @@ class VMD(ExternalInterface):
             path = path.replace("\\", "/")
         return path
 
-    def make_vis_script(self, my_operator):
+    def make_vis_script(self, my_operator, frames=None):
         """
         Make the visualization script to pass to VMD, and save it to the
         temporary directory.
 
         :param ??? my_operator: The operator, used to access user-parameter
                     variables.
+        :param tuple frames: For trajectories, the (first, last, stride) of
+                    the trajectory frames to render, and the index to give the
+                    first of them. Every frame is then rendered to its own
+                    mesh files. If None, only the first frame is rendered.
         """
 
         tcl_script = """
@@ -95,28 +193,108 @@ class VMD(ExternalInterface):
             }
         """
 
+        # Render every representation once per level-of-detail tier, or just
+        # at full resolution?
+        if my_operator.make_lod_tiers == True and frames is None:
+            self.lod_tiers = LOD_TIERS
+        else:
+            self.lod_tiers = ["final"]
+        self.render_suffix = "" if frames is None else FRAME_SUFFIX + "${frame_idx}"
+        self.copy_chains = [] if frames is not None else sorted(self.chain_copies)
+        self.chain_labelers = {}
+
         filename = os.path.abspath(my_operator.filepath)
+        self.pdb_filename = filename
         _, ext = os.path.splitext(filename)
         ext = ext.upper()
         filename = self.fix_path_for_tcl(filename)  # Make path os-specific
 
+        # Structures with many chains render them in batches, so there
+        # aren't thousands of tiny mesh files. Copies of other chains (and
+        # the chains they copy) stay on their own.
+        chain_atoms = {}
+        self.chain_batches = {}
+        keep_separate = set(self.copy_chains) | set(
+            [ref_chain for ref_chain, _ in self.chain_copies.values()]
+        )
         if ext == ".PDB":
+            chain_atoms = self.get_pdb_chain_atoms(filename)
+        if ext == ".PDB" and frames is None:
+            self.chain_batches = make_chain_batches(
+                chain_atoms, my_operator.max_chain_batches, keep_separate
+            )
+        batched = any([len(c) > 1 for c in self.chain_batches.values()])
+
+        # Surfaces can be built by BlendMol itself (see NativeSurface.py)
+        # instead. Not for trajectories.
+        native_surfaces = my_operator.native_surfaces and frames is None
+
+        # The surfaces of large chains (or batches) are made a tile at a
+        # time. Not for trajectories.
+        self.surface_tile_size = my_operator.surface_tile_size
+        surface_tiles = []
+        if (
+            my_operator.tile_surfaces == True
+            and not native_surfaces
+            and ext == ".PDB"
+            and frames is None
+            and (
+                my_operator.protein_surface == True
+                or my_operator.ligand_surface == True
+                or my_operator.near_ligand_surface == True
+            )
+        ):
+            surface_tiles = self.get_surface_tiles(chain_atoms)
+        self.tiled_chains = sorted(set([tile[0] for tile in surface_tiles]))
+
+        # Merge the meshes of every chain into one object per
+        # representation? The same chains stay on their own.
+        self.join_chains = (
+            my_operator.join_chains == True
+            and ext in [".PDB", ".CIF"]
+            and frames is None
+        )
+        self.separate_chains = keep_separate
+        self.material_mode = my_operator.material_mode
+        sel_chains = "$sel_chains" if batched else "$chain"
+
+        if ext in [".PDB", ".CIF"]:
+            # VMD reads mmCIF files with its pdbx plugin.
+            mol_type = "pdb" if ext == ".PDB" else "pdbx"
+
             # Set the selections
             nuc_sel_raw = (
                 "(nucleic and not resname ATP UTP TTP CTP GTP AMP "
                 "UMP TMP CMP GMP ADP UDP TDP CDP GDP)"
             )
 
-            lig_sel_raw = (
-                "((chain $chain) and (not protein and not "
+            resnames = my_operator.ligand_resnames.split()
+            lig_class_raw = (
+                "(not protein and not "
                 + nuc_sel_raw
                 + " and not water) and not "
                 + "((not element N C O P S Se Cl Br F) "
                 + "and mass > 16) and "
-                + "(not resname MSE))"
+                + "(not resname MSE)"
+                + (" and (resname " + " ".join(resnames) + ")" if resnames else "")
             )
-
-            ligand_sel_str = '"' + lig_sel_raw + '"'
+            lig_sel_raw = "((chain " + sel_chains + ") and " + lig_class_raw + ")"
+
+            # Every atom's class is found once per structure (see
+            # get_class_selection_code()). Each chain then selects its atoms
+            # of a class by index, instead of VMD evaluating these
+            # expressions for every chain and representation.
+            selection_classes = [
+                ("lig", lig_class_raw),
+                ("prot_nuc", "protein or " + nuc_sel_raw + " or resname MSE"),
+                (
+                    "metals",
+                    "(not element N C O P S Se Cl Br F) and (mass > 16) "
+                    + "and (not resname MET CYS MSE)",
+                ),
+            ]
+
+            ligand_sel_str = '"$class_sels(lig)"'
 
             # protein_near_lig_sel_str = (
             #     '"(same residue as (protein within 8 of ((chain $chain) ' +
@@ -128,33 +306,57 @@ class VMD(ExternalInterface):
                 '"(protein or '
                 + nuc_sel_raw
                 + ") and (same residue as "
-                + "(all within 8 of "
+                + "(all within "
+                + str(my_operator.near_ligand_cutoff)
+                + " of "
                 + lig_sel_raw
                 + '))"'
             )
 
-            metals_sel_str = (
-                '"(chain $chain) and (not element N C O P S Se Cl Br F) '
-                + 'and (mass > 16) and (not resname MET CYS MSE)"'
-            )
+            # For a PDB file, the interacting residues of each chain (or
+            # batch) are found once, here, and given to VMD by index.
+            # Otherwise VMD searches again for every chain and
+            # representation. Not for trajectories, where they change from
+            # frame to frame.
+            near_ligand_sels = {}
+            if ext == ".PDB" and frames is None and self.uses_near_ligand(my_operator):
+                structure = self.get_structure(self.pdb_filename)
+                with stage(self.profile, "near ligand"):
+                    near_ligands = structure.select_near_ligands(
+                        structure.unique_chains,
+                        my_operator.near_ligand_cutoff,
+                        resnames,
+                    )
+                    for name, chains in self.chain_batches.items():
+                        atom_mask = near_ligands[chains[0]].copy()
+                        for chain in chains[1:]:
+                            atom_mask |= near_ligands[chain]
+                        near_ligand_sels[name] = get_index_selection(atom_mask)
+                protein_near_lig_sel_str = '"$near_ligand_sels($chain)"'
 
-            protein_nuc_sel_str = (
-                '"chain $chain and (protein or ' + nuc_sel_raw + ' or resname MSE)"'
-            )
+            metals_sel_str = '"$class_sels(metals)"'
+            protein_nuc_sel_str = '"$class_sels(prot_nuc)"'
 
             # Load the PDB
-            tcl_script = (
-                tcl_script
-                + """
-                # Load the pdb file
+            if frames is None:
+                tcl_script = (
+                    tcl_script
+                    + """
+                # Load the pdb (or mmCIF) file
                 mol new [concat """
-                + filename
-                + """] type pdb first 0 last -1 step 1 filebonds 1 autobonds 1 waitfor all
+                    + filename
+                    + "] type "
+                    + mol_type
+                    + """ first 0 last -1 step 1 filebonds 1 autobonds 1 waitfor all
 
                 # Go to first frame
                 animate goto 0
             """
-            )
+                )
+            else:
+                tcl_script = tcl_script + self.get_trajectory_load_code(
+                    filename, my_operator.trajectory_path, frames
+                )
 
             tcl_script = tcl_script + reset_viewport_tcl
 
@@ -164,17 +366,121 @@ class VMD(ExternalInterface):
                 # Go through each of the chains and save it separately.
                 set all [atomselect top all]
                 set chains [$all get chain]
+                $all delete
                 set uniq_chains [lsort -unique $chains]
+                BLENDMOL_CHAIN_PARTITION
 
                 # Carbons should be grey
                 color change rgb 10 0.6 0.6 0.6
+            """
+                + get_class_selection_code(selection_classes)
+            )
 
+            if frames is not None:
+                # Render every loaded frame in turn. The representations are
+                # made after each "animate goto", so selections like "within"
+                # are re-evaluated for every frame.
+                tcl_script = (
+                    tcl_script
+                    + """
+                for {set frame 0} {$frame < [molinfo top get numframes]} {incr frame} {
+                animate goto $frame
+                set frame_idx [expr {"""
+                    + str(frames[3])
+                    + """ + $frame}]
+            """
+                )
+
+            if len(self.copy_chains) > 0:
+                # Copies of other chains reuse their meshes.
+                tcl_script = (
+                    tcl_script
+                    + """
+                set copy_chains {"""
+                    + " ".join(self.copy_chains)
+                    + """}
+            """
+                )
+
+            if len(near_ligand_sels) > 0:
+                tcl_script = (
+                    tcl_script
+                    + """
+                array set near_ligand_sels {"""
+                    + " ".join(
+                        [
+                            name + " {" + sel + "}"
+                            for name, sel in sorted(near_ligand_sels.items())
+                        ]
+                    )
+                    + """}
+            """
+                )
+
+            if len(self.tiled_chains) > 0:
+                # Their surfaces are made after the other representations,
+                # a tile at a time.
+                tcl_script = (
+                    tcl_script
+                    + """
+                set tiled_chains {"""
+                    + " ".join(self.tiled_chains)
+                    + """}
+            """
+                )
+
+            if batched:
+                # Each batch is rendered as one "chain".
+                tcl_script = (
+                    tcl_script
+                    + """
+                array set batch_chains {"""
+                    + " ".join(
+                        [
+                            name + " {" + " ".join(chains) + "}"
+                            for name, chains in self.chain_batches.items()
+                        ]
+                    )
+                    + """}
+            """
+                )
+
+            tcl_script = (
+                tcl_script
+                + """
                 foreach chain $uniq_chains {
+                array unset sel_nums
             """
             )
 
+            if batched:
+                tcl_script = (
+                    tcl_script
+                    + """
+                set sel_chains $batch_chains($chain)
+            """
+                )
+
+            tcl_script = tcl_script + self.get_chain_class_code(
+                [name for name, _ in selection_classes], sel_chains
+            )
+
+            # Sticks, balls and VDW spheres can be built by BlendMol itself
+            # (see NativeGeometry.py) instead. Balls and VDW spheres can also
+            # be instanced.
+            # Not for trajectories, which VMD renders frame by frame.
+            native = my_operator.native_geometry and frames is None
+            native_spheres = native or (
+                my_operator.instance_spheres and frames is None
+            )
+
+            # The surfaces, in case some are made in tiles.
+            surface = "msms" if my_operator.vmd_msms_repr == True else "surf"
+            surfaces = []
+
             # Consider ligands
-            if my_operator.ligand_surface == True:
+            if my_operator.ligand_surface == True and not native_surfaces:
+                surfaces.append(("lig_" + surface, ligand_sel_str))
                 if my_operator.vmd_msms_repr == True:
                     tcl_script = tcl_script + self.get_msms_code(
                         "lig_msms", ligand_sel_str
@@ -184,21 +490,22 @@ class VMD(ExternalInterface):
                         "lig_surf", ligand_sel_str
                     )
 
-            if my_operator.ligand_sticks == True:
+            if my_operator.ligand_sticks == True and not native:
                 tcl_script = tcl_script + self.get_stick_code(
                     "lig_stks", ligand_sel_str
                 )
 
-            if my_operator.ligand_balls == True:
+            if my_operator.ligand_balls == True and not native_spheres:
                 tcl_script = tcl_script + self.get_balls_code(
                     "lig_blls", ligand_sel_str
                 )
 
-            if my_operator.ligand_vdw == True:
-                tcl_script = tcl_script + self.get_balls_code("lig_vdw", ligand_sel_str)
+            if my_operator.ligand_vdw == True and not native_spheres:
+                tcl_script = tcl_script + self.get_vdw_code("lig_vdw", ligand_sel_str)
 
             # Consider interacting residues
-            if my_operator.near_ligand_surface == True:
+            if my_operator.near_ligand_surface == True and not native_surfaces:
+                surfaces.append(("intract_" + surface, protein_near_lig_sel_str))
                 if my_operator.vmd_msms_repr == True:
                     tcl_script = tcl_script + self.get_msms_code(
                         "intract_msms", protein_near_lig_sel_str
@@ -208,23 +515,24 @@ class VMD(ExternalInterface):
                         "intract_surf", protein_near_lig_sel_str
                     )
 
-            if my_operator.near_ligand_sticks == True:
+            if my_operator.near_ligand_sticks == True and not native:
                 tcl_script = tcl_script + self.get_stick_code(
                     "intract_stks", protein_near_lig_sel_str
                 )
 
-            if my_operator.near_ligand_balls == True:
+            if my_operator.near_ligand_balls == True and not native_spheres:
                 tcl_script = tcl_script + self.get_balls_code(
                     "intract_blls", protein_near_lig_sel_str
                 )
 
-            if my_operator.near_ligand_vdw == True:
+            if my_operator.near_ligand_vdw == True and not native_spheres:
                 tcl_script = tcl_script + self.get_vdw_code(
                     "intract_vdw", protein_near_lig_sel_str
                 )
 
             # Consider proteins
-            if my_operator.protein_surface == True:
+            if my_operator.protein_surface == True and not native_surfaces:
+                surfaces.append(("prot_nuc_" + surface, protein_nuc_sel_str))
                 if my_operator.vmd_msms_repr == True:
                     tcl_script = tcl_script + self.get_msms_code(
                         "prot_nuc_msms", protein_nuc_sel_str
@@ -234,17 +542,17 @@ class VMD(ExternalInterface):
                         "prot_nuc_surf", protein_nuc_sel_str
                     )
 
-            if my_operator.protein_sticks == True:
+            if my_operator.protein_sticks == True and not native:
                 tcl_script = tcl_script + self.get_stick_code(
                     "prot_nuc_stks", protein_nuc_sel_str
                 )
 
-            if my_operator.protein_balls == True:
+            if my_operator.protein_balls == True and not native_spheres:
                 tcl_script = tcl_script + self.get_balls_code(
                     "prot_nuc_blls", protein_nuc_sel_str
                 )
 
-            if my_operator.protein_vdw == True:
+            if my_operator.protein_vdw == True and not native_spheres:
                 tcl_script = tcl_script + self.get_vdw_code(
                     "prot_nuc_vdw", protein_nuc_sel_str
                 )
@@ -255,7 +563,7 @@ class VMD(ExternalInterface):
                 )
 
             # Consider metals
-            if my_operator.metals_vdw == True:
+            if my_operator.metals_vdw == True and not native_spheres:
                 tcl_script = tcl_script + self.get_vdw_code("metals", metals_sel_str)
 
             tcl_script = (
@@ -264,6 +572,23 @@ class VMD(ExternalInterface):
                 }
             """
             )
+
+            if len(surface_tiles) > 0:
+                tcl_script = tcl_script + self.get_surface_tile_code(
+                    surfaces,
+                    [name for name, _ in selection_classes],
+                    sel_chains,
+                    batched,
+                )
+
+            if frames is not None:
+                # Close the frame loop.
+                tcl_script = (
+                    tcl_script
+                    + """
+                }
+            """
+                )
         else:
             # Must be a VMD or TCL file
             tcl_script = (
@@ -289,62 +614,590 @@ class VMD(ExternalInterface):
             """
             )
 
-        tcl_script = (
-            tcl_script
-            + """
-            quit
+        # The scripts don't end in "quit", so a persistent VMD process can
+        # run them too. run_external_program() tells VMD when to quit.
+        # Scripts that embed a user's VMD/TCL file might quit (or change
+        # VMD's state) themselves, so those always get a fresh VMD.
+        self.can_reuse_session = ext in [".PDB", ".CIF"]
+
+        # Decide how many VMD processes to use. Each one renders a subset of
+        # the chains (or batches) and surface tiles, so there is no point in
+        # having more than there are of those.
+        num_processes = 1
+        if ext == ".PDB":
+            num_processes = max(
+                1,
+                min(
+                    my_operator.vmd_processes,
+                    max(
+                        len(self.chain_batches) if batched else len(chain_atoms),
+                        len(surface_tiles),
+                    ),
+                ),
+            )
+        process_batches = None
+        if batched:
+            process_batches = assign_batches(
+                self.chain_batches, chain_atoms, num_processes
+            )
+        process_tiles = assign_tiles(surface_tiles, num_processes)
+
+        # Each VMD process says how many meshes it might render, so the
+        # import can show its progress.
+        renders_per_chain = tcl_script.count(RENDERED_MARKER)
+        renders_per_tile = 0
+        if len(surface_tiles) > 0:
+            renders_per_tile = sum(
+                [
+                    len(self.get_rendered_tiers(filename_id.rsplit("_", 1)[1]))
+                    for filename_id, _ in surfaces
+                ]
+            )
+            renders_per_chain = renders_per_chain - renders_per_tile
+
+        # Save the VMD TCL script(s).
+        # open(str(Path(self.tmp_dir + "vmd.vmd")), 'w').write(tcl_script)
+        self.vis_script_filenames = []
+        for process_idx in range(num_processes):
+            if num_processes == 1:
+                script_filename = self.tmp_dir + "vmd.vmd"
+            else:
+                script_filename = self.tmp_dir + "vmd_" + str(process_idx) + ".vmd"
+            partition_code = self.get_chain_partition_code(
+                process_idx, num_processes, process_batches
+            )
+            if len(surface_tiles) > 0:
+                partition_code = partition_code + self.get_tile_partition_code(
+                    process_tiles[process_idx]
+                )
+            if ext in [".PDB", ".CIF"] and frames is None:
+                partition_code = partition_code + self.get_total_code(
+                    renders_per_chain,
+                    renders_per_tile * len(process_tiles[process_idx]),
+                )
+            open(script_filename, "w").write(
+                tcl_script.replace("BLENDMOL_CHAIN_PARTITION", partition_code)
+            )
+            self.vis_script_filenames.append(script_filename)
+
+    def get_trajectory_load_code(self, filename, trajectory_path, frames):
+        """
+        TCL code to load a chunk of trajectory frames. The frames come from a
+        separate trajectory file (DCD, XTC, etc.) if one is given, or else
+        from the models of the PDB file.
+
+        :param str filename: The PDB filename (TCL-style path).
+        :param str trajectory_path: The trajectory filename, or "".
+        :param tuple frames: The (first, last, stride) of the frames to load,
+                    and the index of the first of them.
+
+        :returns: The TCL code.
+        :rtype: :class:`str`
         """
+
+        first, last, stride, _ = frames
+        frame_range = (
+            "first " + str(first) + " last " + str(last) + " step " + str(stride)
         )
 
-        # Save the VMD TCL script.
-        # open(str(Path(self.tmp_dir + "vmd.vmd")), 'w').write(tcl_script)
-        open(self.tmp_dir + "vmd.vmd", "w").write(tcl_script)
+        # Tell BlendMol how many frames were loaded. Fewer than asked for
+        # means the end of the trajectory.
+        num_frames_code = (
+            '''
+                set num_frames_file [open "'''
+            + self.fix_path_for_tcl(self.tmp_dir)
+            + NUM_FRAMES_FILENAME
+            + """" w]
+                puts $num_frames_file [molinfo top get numframes]
+                close $num_frames_file
+            """
+        )
 
-    def get_code_start(self, selection):
+        if trajectory_path == "":
+            return (
+                """
+                # Load a chunk of the models of the pdb file
+                mol new [concat """
+                + filename
+                + """] type pdb """
+                + frame_range
+                + """ filebonds 1 autobonds 1 waitfor all
+            """
+                + num_frames_code
+            )
+
+        trajectory_path = os.path.abspath(bpy.path.abspath(trajectory_path))
+        trajectory_type = os.path.splitext(trajectory_path)[1][1:].lower()
+        return (
+            """
+                # Load the pdb file (for its topology), then a chunk of the
+                # trajectory in place of its coordinates
+                mol new [concat """
+            + filename
+            + """] type pdb first 0 last 0 step 1 filebonds 1 autobonds 1 waitfor all
+                animate delete all
+                mol addfile [concat """
+            + self.fix_path_for_tcl(trajectory_path)
+            + """] type """
+            + trajectory_type
+            + " "
+            + frame_range
+            + """ waitfor all
+            """
+            + num_frames_code
+        )
+
+    def get_chain_class_code(self, class_names, sel_chains):
+        """
+        TCL code that makes the index selection of each class of atoms for
+        the current chain (or batch), in the class_sels array (e.g.,
+        $class_sels(lig)).
+
+        :param list class_names: The names of the classes.
+        :param str sel_chains: The TCL for the chains ("$chain", or
+                   "$sel_chains" if the chains are batched).
+
+        :returns: The TCL code.
+        :rtype: :class:`str`
         """
-        TCL code to run before rendering a representation.
+
+        return (
+            """
+                foreach class_name {"""
+            + " ".join(class_names)
+            + """} {
+                    set indices {}
+                    foreach c """
+            + sel_chains
+            + """ {
+                        if {[info exists class_atoms($class_name,$c)]} {
+                            set indices [concat $indices $class_atoms($class_name,$c)]
+                        }
+                    }
+                    set class_sels($class_name) [blendmol_index_sel [lsort -integer $indices]]
+                }
+            """
+        )
+
+    def uses_near_ligand(self, my_operator):
+        """
+        Whether any of the interacting-residue representations are made.
+
+        :param ??? my_operator: The operator, used to access user-parameter
+                    variables.
+
+        :returns: True if any are, False otherwise.
+        :rtype: :class:`bool`
+        """
+
+        return any(
+            [
+                getattr(my_operator, "near_ligand_" + representation) == True
+                for representation in ["surface", "sticks", "balls", "vdw"]
+            ]
+        )
+
+    def get_pdb_chain_atoms(self, filename):
+        """
+        Quickly count the atoms of each chain in a PDB file, without loading
+        it in VMD. Blank chain IDs are "X", like in VMD.
+
+        :param str filename: The PDB filename.
+
+        :returns: The number of atoms of each chain ID.
+        :rtype: :class:`dict`
+        """
+
+        chain_atoms = {}
+        with open(filename, "r") as pdb_file:
+            for line in pdb_file:
+                if line.startswith("ATOM") or line.startswith("HETATM"):
+                    chain = line[21:22].strip() or "X"
+                    chain_atoms[chain] = chain_atoms.get(chain, 0) + 1
+                elif line.startswith("ENDMDL"):
+                    break
+        return chain_atoms
+
+    def get_chain_partition_code(self, process_idx, num_processes, batches=None):
+        """
+        TCL code that keeps only the chains a given VMD process should render.
+        Chains are dealt out round robin, so each process gets a similar
+        number. Batches of chains are split by their atoms instead.
+
+        :param int process_idx: The index of this VMD process.
+        :param int num_processes: The total number of VMD processes.
+        :param list batches: The batches of each process (from
+                   assign_batches()), or None if the chains aren't batched.
+
+        :returns: The TCL code.
+        :rtype: :class:`str`
+        """
+
+        if batches is not None:
+            return (
+                """
+                # The batches of chains this VMD process should render.
+                set uniq_chains {"""
+                + " ".join(batches[process_idx])
+                + """}
+        """
+            )
+
+        if num_processes == 1:
+            return ""
+
+        return (
+            """
+                # Keep only the chains this VMD process should render.
+                set process_chains {}
+                for {set i """
+            + str(process_idx)
+            + """} {$i < [llength $uniq_chains]} {incr i """
+            + str(num_processes)
+            + """} {
+                    lappend process_chains [lindex $uniq_chains $i]
+                }
+                set uniq_chains $process_chains
+        """
+        )
+
+    def get_total_code(self, renders_per_chain, other_renders=0):
+        """
+        TCL code that prints how many meshes the script might render (some
+        selections can be empty).
+
+        :param int renders_per_chain: The number of "render Wavefront"
+                   commands per chain.
+        :param int other_renders: The number of other "render Wavefront"
+                   commands (e.g., of surface tiles). Defaults to 0.
+
+        :returns: The TCL code.
+        :rtype: :class:`str`
+        """
+
+        return (
+            """
+                puts \""""
+            + TOTAL_MARKER
+            + "[expr {[llength $uniq_chains] * "
+            + str(renders_per_chain)
+            + " + "
+            + str(other_renders)
+            + """}]\"
+                flush stdout
+        """
+        )
+
+    def get_surface_tiles(self, chain_atoms):
+        """
+        The tiles of the surfaces of large chains (or batches). Copies of
+        other chains don't need any.
+
+        :param dict chain_atoms: The number of atoms of each chain.
+
+        :returns: (name, tile, lower, upper, num_atoms) tuples, the name
+                  being the chain (or batch). See plan_tiles().
+        :rtype: :class:`list`
+        """
+
+        surface_tiles = []
+        for name, chains in sorted(self.chain_batches.items()):
+            num_atoms = sum([chain_atoms.get(chain, 0) for chain in chains])
+            if num_atoms < MIN_TILED_ATOMS or name in self.copy_chains:
+                continue
+
+            # Water is never surfaced.
+            structure = self.get_structure(self.pdb_filename)
+            atom_mask = ~structure.resname_in(WATER_RESNAMES)
+            in_chains = numpy.zeros(structure.num_atoms, dtype=bool)
+            for chain in chains:
+                in_chains |= structure.in_chain(chain)
+            tiles = plan_tiles(
+                structure.coords[atom_mask & in_chains], self.surface_tile_size
+            )
+            if len(tiles) > 1:
+                surface_tiles.extend([(name,) + tile for tile in tiles])
+        return surface_tiles
+
+    def get_tile_partition_code(self, tiles):
+        """
+        TCL code that sets the surface tiles a VMD process should render.
+
+        :param list tiles: The (name, tile, lower, upper, num_atoms) tuples
+                   of the process's tiles.
+
+        :returns: The TCL code.
+        :rtype: :class:`str`
+        """
+
+        return (
+            """
+                # The surface tiles this VMD process should render: the
+                # chain, the tile, and the box of atoms to surface.
+                set surface_tiles {"""
+            + " ".join(
+                [
+                    "{"
+                    + " ".join(
+                        [name, get_tile_name(tile)]
+                        + ["%.3f" % c for c in list(lower) + list(upper)]
+                    )
+                    + "}"
+                    for name, tile, lower, upper, _ in tiles
+                ]
+            )
+            + """}
+        """
+        )
+
+    def get_surface_tile_code(self, surfaces, class_names, sel_chains, batched):
+        """
+        TCL code that renders the surfaces of the tiled chains (or batches),
+        one tile at a time. Each tile's surface is made from the atoms in a
+        box around it.
+
+        :param list surfaces: The (filename id, selection) of each surface.
+        :param list class_names: The names of the classes of atoms (see
+                   get_chain_class_code()).
+        :param str sel_chains: The TCL for the chains ("$chain", or
+                   "$sel_chains" if the chains are batched).
+        :param bool batched: Whether the chains are batched.
+
+        :returns: The TCL code.
+        :rtype: :class:`str`
+        """
+
+        code = """
+                foreach tile $surface_tiles {
+                lassign $tile chain tile_id x0 y0 z0 x1 y1 z1
+                array unset sel_nums
+                set tile_box "x > $x0 and x < $x1 and y > $y0 and y < $y1 and z > $z0 and z < $z1"
+            """
+        if batched:
+            code = (
+                code
+                + """
+                set sel_chains $batch_chains($chain)
+            """
+            )
+        code = code + self.get_chain_class_code(class_names, sel_chains)
+
+        self.tile_suffix = TILE_SUFFIX + "${tile_id}"
+        for filename_id, selection in surfaces:
+            code = (
+                code
+                + self.get_code_start(
+                    '"(' + selection[1:-1] + ') and ($tile_box)"', filename_id
+                )
+                + self.get_representation_code(
+                    filename_id, filename_id.rsplit("_", 1)[1]
+                )
+            )
+        self.tile_suffix = ""
+
+        return (
+            code
+            + """
+                }
+            """
+        )
+
+    def get_structure(self, filename):
+        """
+        The atoms of the PDB file, read once per import (in any thread).
+
+        :param str filename: The PDB filename.
+
+        :returns: The structure.
+        :rtype: :class:`PDBStructure`
+        """
+
+        with self.structure_lock:
+            if self.structure is None:
+                with stage(
+                    self.profile, "parse pdb", pdb_bytes=os.path.getsize(filename)
+                ):
+                    self.structure = PDBStructure(filename)
+        return self.structure
+
+    def label_chains(self, filename, mesh_arrays):
+        """
+        Set the chain of every polygon of a mesh of a batch of chains (see
+        ChainBatches.py).
+
+        :param str filename: The mesh filename.
+        :param MeshArrays mesh_arrays: The geometry, in Angstroms.
+        """
+
+        name, _ = split_lod_name(os.path.basename(os.path.splitext(filename)[0]))
+        name, _ = split_tile_name(name)
+        name_parts = split_object_name(name)
+        if name_parts is None:
+            return
+        chains = self.chain_batches.get(name_parts[1], [])
+        if len(chains) < 2:
+            return
+
+        structure = self.get_structure(self.pdb_filename)
+        with self.structure_lock:
+            if not name_parts[1] in self.chain_labelers:
+                self.chain_labelers[name_parts[1]] = ChainLabeler(structure, chains)
+            labeler = self.chain_labelers[name_parts[1]]
+        with stage(self.profile, "label chains"):
+            labeler.label(mesh_arrays)
+
+    def get_code_start(self, selection, filename_id, is_surface=False):
+        """
+        TCL code to run before rendering a representation. Chains that are
+        copies of another chain are skipped, unless the representation
+        depends on other chains. So are the surfaces of chains that are made
+        in tiles.
 
         :param str selection: The selection string.
+        :param str filename_id: The filename id to use when saving.
+        :param bool is_surface: Whether the representation is a surface.
+                   Defaults to False.
 
         :returns: The TCL code.
         :rtype: :class:`str`
         """
 
+        condition = "$sel_nums($sel_text) > 0"
+        if len(self.copy_chains) > 0 and not depends_on_other_chains(filename_id):
+            condition = "[lsearch -exact $copy_chains $chain] == -1 && " + condition
+        if is_surface and len(self.tiled_chains) > 0:
+            condition = "[lsearch -exact $tiled_chains $chain] == -1 && " + condition
+
+        # Several representations share a selection, so its atoms are only
+        # counted once per chain. The selection is deleted right away, so
+        # VMD doesn't keep it for the rest of the script.
         return (
             """
-            puts """
+            set sel_text """
             + selection
             + """
-            set sel [atomselect top """
-            + selection
-            + """]
-            if {[$sel num] > 0} {
+            puts $sel_text
+            if {![info exists sel_nums($sel_text)]} {
+                set sel [atomselect top $sel_text]
+                set sel_nums($sel_text) [$sel num]
+                $sel delete
+            }
+            if {"""
+            + condition
+            + """} {
                 mol delrep 0 top
-                mol selection """
-            + selection
+                mol selection $sel_text
+        """
+        )
+
+    def get_rendered_tiers(self, representation):
+        """
+        The level-of-detail tiers VMD renders a representation at. A tier
+        with the same VMD representation as the next one isn't rendered
+        again. It shares that tier's mesh instead (see
+        ExternalInterface.finish_mesh_import()).
+
+        :param str representation: The key of the representation in
+                   REPRESENTATIONS.
+
+        :returns: The tiers.
+        :rtype: :class:`list`
+        """
+
+        tiers = self.lod_tiers
+        return [
+            tier
+            for tier, next_tier in zip(tiers, tiers[1:] + [None])
+            if next_tier is None
+            or REPRESENTATIONS[representation][tier]
+            != REPRESENTATIONS[representation][next_tier]
+        ]
+
+    def get_representation_code(self, filename_id, representation):
+        """
+        TCL code to add a representation and render it once per
+        level-of-detail tier. Closes the block get_code_start() opens.
+
+        :param str filename_id: The filename id to use when saving.
+        :param str representation: The key of the representation in
+                   REPRESENTATIONS.
+
+        :returns: The TCL code.
+        :rtype: :class:`str`
+        """
+
+        code = ""
+        tiers = self.get_rendered_tiers(representation)
+        for i, tier in enumerate(tiers):
+            if i > 0:
+                # Replace the previous tier's representation.
+                code = (
+                    code
+                    + """
+                mol delrep 0 top
+        """
+                )
+            code = (
+                code
+                + """
+            mol representation """
+                + REPRESENTATIONS[representation][tier]
+                + """
+        """
+                + self.get_render_code(filename_id, tier)
+            )
+
+        # Empty selections aren't rendered, but still count towards the
+        # progress.
+        return (
+            code
             + """
+            } else {
+                puts \""""
+            + SKIPPED_MARKER
+            + str(len(tiers))
+            + """\"
+            }
         """
         )
 
-    def get_code_end(self, filename_id):
+    def get_render_code(self, filename_id, tier="final"):
         """
         TCL code to render a representation.
 
         :param str filename_id: The filename id to use when saving.
+        :param str tier: The level-of-detail tier. The meshes of tiers other
+                   than "final" get a suffix.
 
         :returns: The TCL code.
         :rtype: :class:`str`
         """
 
-        return (
-            '''
-                mol addrep top
-                render Wavefront "'''
-            + self.fix_path_for_tcl(self.tmp_dir)
+        suffix = "" if tier == "final" else LOD_SUFFIX + tier
+        obj_filename = (
+            self.fix_path_for_tcl(self.tmp_dir)
             + os.sep
             + filename_id
-            + """_${chain}.obj"
-            }
+            + "_${chain}"
+            + self.tile_suffix
+            + suffix
+            + self.render_suffix
+            + ".obj"
+        )
+
+        # Say when the file is complete, so BlendMol can start reading it
+        # while VMD renders the next one.
+        return (
+            """
+                mol addrep top
+                render Wavefront \""""
+            + obj_filename
+            + """\"
+                puts \""""
+            + RENDERED_MARKER
+            + obj_filename
+            + """\"
+                flush stdout
         """
         )
 
@@ -360,13 +1213,9 @@ class VMD(ExternalInterface):
         :rtype: :class:`str`
         """
 
-        return (
-            self.get_code_start(selection)
-            + """
-            mol representation MSMS 1.500000 5.000000 0.000000 0.000000
-        """
-            + self.get_code_end(filename_id)
-        )
+        return self.get_code_start(
+            selection, filename_id, is_surface=True
+        ) + self.get_representation_code(filename_id, "msms")
 
     def get_surf_code(self, filename_id, selection):
         """
@@ -380,13 +1229,9 @@ class VMD(ExternalInterface):
         :rtype: :class:`str`
         """
 
-        return (
-            self.get_code_start(selection)
-            + """
-            mol representation Surf 1.400000 0.000000
-        """
-            + self.get_code_end(filename_id)
-        )
+        return self.get_code_start(
+            selection, filename_id, is_surface=True
+        ) + self.get_representation_code(filename_id, "surf")
 
     def get_stick_code(self, filename_id, selection):
         """
@@ -400,13 +1245,9 @@ class VMD(ExternalInterface):
         :rtype: :class:`str`
         """
 
-        return (
-            self.get_code_start(selection)
-            + """
-            mol representation Licorice 0.300000 20.000000 20.000000
-        """
-            + self.get_code_end(filename_id)
-        )
+        return self.get_code_start(
+            selection, filename_id
+        ) + self.get_representation_code(filename_id, "sticks")
 
     def get_balls_code(self, filename_id, selection):
         """
@@ -420,13 +1261,9 @@ class VMD(ExternalInterface):
         :rtype: :class:`str`
         """
 
-        return (
-            self.get_code_start(selection)
-            + """
-            mol representation VDW 0.2000000 12.000000
-        """
-            + self.get_code_end(filename_id)
-        )
+        return self.get_code_start(
+            selection, filename_id
+        ) + self.get_representation_code(filename_id, "balls")
 
     def get_vdw_code(self, filename_id, selection):
         """
@@ -440,13 +1277,9 @@ class VMD(ExternalInterface):
         :rtype: :class:`str`
         """
 
-        return (
-            self.get_code_start(selection)
-            + """
-            mol representation VDW 1.0000000 12.000000
-        """
-            + self.get_code_end(filename_id)
-        )
+        return self.get_code_start(
+            selection, filename_id
+        ) + self.get_representation_code(filename_id, "vdw")
 
     def get_ribbon_code(self, filename_id, selection):
         """
@@ -460,29 +1293,119 @@ class VMD(ExternalInterface):
         :rtype: :class:`str`
         """
 
-        return (
-            self.get_code_start(selection)
-            + """
-            mol representation NewCartoon 0.300000 10.000000 4.100000 0
-        """
-            + self.get_code_end(filename_id)
-        )
+        return self.get_code_start(
+            selection, filename_id
+        ) + self.get_representation_code(filename_id, "ribbon")
 
-    def run_external_program(self, exec_path):
+    def run_external_program(self, exec_path, on_output=None):
         """
         Runs the VMD executable with the generated script.
 
         :param str exec_path: The path to the executable.
+        :param function on_output: Called (in a thread) with each line VMD
+                    prints, e.g., to read each mesh as soon as it is
+                    rendered. Optional.
         """
 
-        # Execute VMD to generate the obj files
+        # Execute VMD to generate the obj files. If the chains were split
+        # across several scripts, run one VMD process per script at the same
+        # time. They all write to the same temporary directory.
         # print(open(self.tmp_dir + "vmd.vmd", "r").read())  # For debugging
-        cmd = [
-            self.fix_path_for_tcl(exec_path),
-            "-dispdev",
-            "text",
-            "-e",
-            self.fix_path_for_tcl(self.tmp_dir + "vmd.vmd"),
+        script_filenames = self.vis_script_filenames
+        if self.session_pool is not None and self.can_reuse_session:
+            tcl_filenames = {self.fix_path_for_tcl(f): f for f in script_filenames}
+            try:
+                self.session_pool.run_all(
+                    list(tcl_filenames.keys()),
+                    on_output=on_output,
+                    cancel=self.cancel_event,
+                )
+                return
+            except VMDSessionError as e:
+                # The meshes of the scripts that finished may already be
+                # being read, so only the failed ones are run again, with
+                # fresh VMD processes. Not if they had already printed
+                # something (e.g., rendered a mesh or said how many they
+                # would).
+                if not e.can_retry:
+                    raise
+                print(str(e) + " Starting a new VMD instead.")
+                script_filenames = [tcl_filenames[f] for f in e.failed_scripts]
+
+        processes = []
+        readers = []
+        for script_filename in script_filenames:
+            cmd = [
+                self.fix_path_for_tcl(exec_path),
+                "-dispdev",
+                "text",
+                "-e",
+                self.fix_path_for_tcl(script_filename),
+            ]
+            print(cmd)
+            if on_output is None:
+                process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+            else:
+                process = subprocess.Popen(
+                    cmd,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                )
+                reader = threading.Thread(
+                    target=self.read_output, args=(process, on_output), daemon=True
+                )
+                reader.start()
+                readers.append(reader)
+
+            # VMD reads stdin once the script is done.
+            process.stdin.write(b"quit\n")
+            process.stdin.close()
+            processes.append((cmd, process))
+
+        # Wait for all of them before reporting any failure.
+        return_codes = [
+            self.wait_for(process, processes) for cmd, process in processes
         ]
-        print(cmd)
-        subprocess.check_call(cmd)
+        for reader in readers:
+            reader.join()
+        for (cmd, process), return_code in zip(processes, return_codes):
+            if return_code != 0:
+                raise subprocess.CalledProcessError(return_code, cmd)
+
+    def wait_for(self, process, processes):
+        """
+        Wait for a VMD process to exit. If the import is cancelled in the
+        meantime, all the VMD processes are stopped.
+
+        :param subprocess.Popen process: The VMD process.
+        :param list processes: All the (cmd, process) pairs of the import.
+
+        :returns: The return code.
+        :rtype: :class:`int`
+        """
+
+        while True:
+            try:
+                return process.wait(timeout=CANCEL_POLL_SECONDS)
+            except subprocess.TimeoutExpired:
+                pass
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                for cmd, other_process in processes:
+                    other_process.kill()
+                    other_process.wait()
+                raise VMDCancelled("Cancelled while VMD was running.")
+
+    def read_output(self, process, on_output):
+        """
+        Print what a VMD process prints, and pass each line on (runs in a
+        thread).
+
+        :param subprocess.Popen process: The VMD process.
+        :param function on_output: Called with each line.
+        """
+
+        for line in process.stdout:
+            line = line.decode("utf-8", "replace").rstrip()
+            print(line)
+            on_output(line)
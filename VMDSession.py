@@ -0,0 +1,413 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+import time
+import queue
+import atexit
+import itertools
+import threading
+import subprocess
+
+# Persistent VMD processes. Starting VMD takes longer than rendering a small
+# molecule, so instead of starting a new VMD for every import, a pool of VMD
+# processes is kept running. Each one reads TCL commands from its stdin: a job
+# sources a generated script, prints a completion marker, and deletes its
+# molecules so the next job starts clean. Processes are replaced after a number
+# of jobs (VMD slowly leaks memory) or if they crash.
+
+# What a VMD process prints when a job finishes. The prompt ("vmd > ") may
+# come before it on the same line.
+JOB_MARKER_RE = re.compile(r"BLENDMOL_JOB_(DONE|FAILED) (\d+) ?(.*)")
+
+PROMPT = "vmd > "
+
+# How often (in seconds) a running job checks whether it was cancelled.
+CANCEL_POLL_SECONDS = 0.1
+
+
+class VMDSessionError(Exception):
+    """
+    A job failed, or the VMD process running it died.
+    """
+
+    # Set by VMDSessionPool.run_all(): the scripts that failed, and whether
+    # they can be run again (none of them had printed anything, so nothing
+    # was read from their output yet).
+    failed_scripts = []
+    can_retry = False
+
+
+class VMDCancelled(Exception):
+    """
+    The import was cancelled while VMD was running.
+    """
+
+    pass
+
+
+class VMDSession:
+    """
+    One persistent VMD process.
+    """
+
+    def __init__(self, exec_path):
+        """
+        Start VMD.
+
+        :param str exec_path: The path to the VMD executable.
+        """
+
+        # -eofexit: VMD exits if Blender does (its stdin is closed).
+        self.cmd = [exec_path, "-dispdev", "text", "-eofexit"]
+        self.process = subprocess.Popen(
+            self.cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+            bufsize=1,
+        )
+        self.num_jobs = 0
+        self.job_ids = itertools.count()
+
+        # VMD's output is read in a thread, so a job can time out even if VMD
+        # stops writing. None means VMD closed its stdout (it exited).
+        self.lines = queue.Queue()
+        self.reader = threading.Thread(target=self.read_output, daemon=True)
+        self.reader.start()
+
+    def read_output(self):
+        """
+        Pass VMD's output to the job waiting for it (runs in a thread).
+        """
+
+        for line in self.process.stdout:
+            self.lines.put(line)
+        self.lines.put(None)
+
+    def is_alive(self):
+        """
+        Whether the VMD process is still running.
+
+        :returns: True if it is, False otherwise.
+        :rtype: :class:`bool`
+        """
+
+        return self.process.poll() is None
+
+    def run(self, script_filename, timeout=None, on_output=None, cancel=None):
+        """
+        Run a script, and wait for it to finish.
+
+        :param str script_filename: The TCL script (TCL-style path). It must
+                   not end in "quit".
+        :param float timeout: How many seconds to wait before giving up on
+                     VMD. Defaults to None (wait forever).
+        :param function on_output: Called with each line the script prints.
+                    Optional.
+        :param threading.Event cancel: If set while the script runs, VMD is
+                    stopped and VMDCancelled is raised. Optional.
+        """
+
+        job_id = next(self.job_ids)
+        self.num_jobs = self.num_jobs + 1
+        command = (
+            "if {[catch {source {"
+            + script_filename
+            + "}} blendmol_err]} {set blendmol_status FAILED} "
+            + "else {set blendmol_status DONE; set blendmol_err {}}\n"
+            + "mol delete all\n"
+            + 'puts "BLENDMOL_JOB_${blendmol_status} '
+            + str(job_id)
+            + ' [string map {\\n { }} $blendmol_err]"\n'
+            + "flush stdout\n"
+        )
+        try:
+            self.process.stdin.write(command)
+            self.process.stdin.flush()
+        except (OSError, ValueError):
+            raise VMDSessionError("VMD is no longer running.")
+
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            try:
+                # Check for cancellation every so often.
+                line = self.lines.get(timeout=CANCEL_POLL_SECONDS)
+            except queue.Empty:
+                if cancel is not None and cancel.is_set():
+                    # VMD might be in the middle of a long render, so don't
+                    # wait for it to quit.
+                    self.process.kill()
+                    raise VMDCancelled("Cancelled while VMD ran " + script_filename)
+                if deadline is not None and time.perf_counter() > deadline:
+                    # VMD is stuck, so don't wait for it to quit.
+                    self.process.kill()
+                    raise VMDSessionError(
+                        "VMD did not finish " + script_filename + " in time."
+                    )
+                continue
+            if line is None:
+                raise VMDSessionError(
+                    "VMD exited while running " + script_filename + "."
+                )
+
+            match = JOB_MARKER_RE.search(line)
+            if match is None or int(match.group(2)) != job_id:
+                # VMD's own output.
+                text = line.replace(PROMPT, "").rstrip()
+                if text != "":
+                    print(text)
+                    if on_output is not None:
+                        on_output(text)
+                continue
+
+            if match.group(1) == "FAILED":
+                raise VMDSessionError(
+                    "VMD failed to run " + script_filename + ": " + match.group(3)
+                )
+            return
+
+    def close(self):
+        """
+        Stop VMD.
+        """
+
+        if self.is_alive():
+            try:
+                self.process.stdin.write("quit\n")
+                self.process.stdin.close()
+                self.process.wait(timeout=10)
+            except (OSError, ValueError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+
+
+class VMDSessionPool:
+    """
+    A pool of persistent VMD processes. Safe to use from several threads at
+    once: each job gets a process of its own.
+    """
+
+    def __init__(self, exec_path, max_sessions=1, max_jobs=50):
+        """
+        Initialize the pool. VMD is only started when a job needs it.
+
+        :param str exec_path: The path to the VMD executable.
+        :param int max_sessions: The maximum number of VMD processes. Defaults
+                   to 1.
+        :param int max_jobs: Replace a VMD process after this many jobs.
+                   Defaults to 50.
+        """
+
+        self.exec_path = exec_path
+        self.max_sessions = max_sessions
+        self.max_jobs = max_jobs
+
+        self.idle = []
+        self.num_sessions = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Get an idle VMD process, starting one if there is room, or waiting
+        for one otherwise.
+
+        :returns: The process.
+        :rtype: :class:`VMDSession`
+        """
+
+        with self.condition:
+            while True:
+                while len(self.idle) > 0:
+                    session = self.idle.pop()
+                    if session.is_alive():
+                        return session
+                    self.num_sessions = self.num_sessions - 1
+                if self.num_sessions < self.max_sessions:
+                    self.num_sessions = self.num_sessions + 1
+                    break
+                self.condition.wait()
+
+        try:
+            return VMDSession(self.exec_path)
+        except:
+            self.discard()
+            raise
+
+    def release(self, session, ok=True):
+        """
+        Return a VMD process to the pool after a job. It is stopped instead
+        if the job failed or it has done enough jobs.
+
+        :param VMDSession session: The process.
+        :param bool ok: Whether the job succeeded. Defaults to True.
+        """
+
+        if ok and session.is_alive() and session.num_jobs < self.max_jobs:
+            with self.condition:
+                self.idle.append(session)
+                self.condition.notify()
+        else:
+            session.close()
+            self.discard()
+
+    def discard(self):
+        """
+        Make room in the pool for a new VMD process.
+        """
+
+        with self.condition:
+            self.num_sessions = self.num_sessions - 1
+            self.condition.notify()
+
+    def run(self, script_filename, timeout=None, on_output=None, cancel=None):
+        """
+        Run a script in one of the VMD processes.
+
+        :param str script_filename: The TCL script (TCL-style path). It must
+                   not end in "quit".
+        :param float timeout: How many seconds to wait before giving up on
+                     VMD. Defaults to None (wait forever).
+        :param function on_output: Called with each line the script prints.
+                    Optional.
+        :param threading.Event cancel: If set while the script runs, VMD is
+                    stopped and VMDCancelled is raised. Optional.
+        """
+
+        session = self.acquire()
+        ok = False
+        try:
+            session.run(script_filename, timeout, on_output, cancel)
+            ok = True
+        finally:
+            self.release(session, ok)
+
+    def run_all(self, script_filenames, timeout=None, on_output=None, cancel=None):
+        """
+        Run several scripts at the same time, each in its own VMD process
+        (as far as max_sessions allows), and wait for all of them.
+
+        :param list script_filenames: The TCL scripts (TCL-style paths).
+        :param float timeout: How many seconds to wait for each script.
+                     Defaults to None (wait forever).
+        :param function on_output: Called with each line the scripts print
+                    (from several threads). Optional.
+        :param threading.Event cancel: If set while the scripts run, VMD is
+                    stopped and VMDCancelled is raised. Optional.
+        """
+
+        # (script filename, exception, whether it printed anything) of each
+        # script that failed.
+        failures = []
+
+        def run_one(script_filename):
+            printed = []
+
+            def on_line(line):
+                printed.append(True)
+                if on_output is not None:
+                    on_output(line)
+
+            try:
+                self.run(script_filename, timeout, on_line, cancel)
+            except Exception as e:
+                failures.append((script_filename, e, len(printed) > 0))
+
+        threads = [
+            threading.Thread(target=run_one, args=(script_filename,))
+            for script_filename in script_filenames[1:]
+        ]
+        for thread in threads:
+            thread.start()
+        if len(script_filenames) > 0:
+            run_one(script_filenames[0])
+        for thread in threads:
+            thread.join()
+
+        # Report failures only once every script is done. Cancelling wins,
+        # and other errors come before VMD failures.
+        if len(failures) > 0:
+            errors = [e for _, e, _ in failures]
+            for error in errors:
+                if isinstance(error, VMDCancelled):
+                    raise error
+            for error in errors:
+                if not isinstance(error, VMDSessionError):
+                    raise error
+            error = errors[0]
+            error.failed_scripts = [f for f, _, _ in failures]
+            error.can_retry = not any([printed for _, _, printed in failures])
+            raise error
+
+    def close(self):
+        """
+        Stop all the idle VMD processes.
+        """
+
+        with self.condition:
+            sessions = self.idle
+            self.idle = []
+            self.num_sessions = self.num_sessions - len(sessions)
+        for session in sessions:
+            session.close()
+
+
+# The shared pools, by VMD executable.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(exec_path, max_sessions=1, max_jobs=50):
+    """
+    The shared pool of VMD processes of an executable. The limits are
+    updated if they changed.
+
+    :param str exec_path: The path to the VMD executable.
+    :param int max_sessions: The maximum number of VMD processes. Defaults to
+               1.
+    :param int max_jobs: Replace a VMD process after this many jobs. Defaults
+               to 50.
+
+    :returns: The pool.
+    :rtype: :class:`VMDSessionPool`
+    """
+
+    with _pools_lock:
+        if not exec_path in _pools:
+            _pools[exec_path] = VMDSessionPool(exec_path, max_sessions, max_jobs)
+        pool = _pools[exec_path]
+
+    with pool.condition:
+        pool.max_sessions = max_sessions
+        pool.max_jobs = max_jobs
+        pool.condition.notify_all()
+    return pool
+
+
+@atexit.register
+def close_all_pools():
+    """
+    Stop every persistent VMD process.
+    """
+
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -39,7 +39,8 @@ bl_info = {
 
 import tempfile
 import os
-import urllib.request
+import json
+import time
 from pathlib import Path  # For Windows Paths: Converts / to \.
 import bpy
 from bpy.types import Operator
@@ -52,12 +53,23 @@ from bpy.props import (
     FloatProperty,
 )
 
-from .VMD import VMD
+from .MeshCache import MeshCache
+from .PDBDownload import PDBMirror
+from . import VMDSession
+from .Profiling import ImportProfile, stage
 
 # NO MORE PYMOL: from .PyMol import PyMol
 from . import Preferences
+from . import LevelOfDetail
+from . import Trajectory
+from . import Importer
 from . import FileBasedPreferences
 
+# How often (in seconds) an import running in the background adds meshes, and
+# how long it spends doing so each time.
+MODAL_TIMER_SECONDS = 0.1
+MODAL_STEP_SECONDS = 0.05
+
 
 class ImportVMD(Operator, ImportHelper):
     """
@@ -68,14 +80,25 @@ class ImportVMD(Operator, ImportHelper):
     bl_idname = "import_mesh.vmd"
     # NO MORE PYMOL: bl_label  = "Import PDB/VMD/TCL/PSE"
     bl_label = "Import PDB/VMD/TCL"
+    bl_description = (
+        "Import a PDB, VMD or TCL file. Imports from the dialog run in the "
+        "background (Esc cancels), except trajectories and imports without "
+        '"Read Meshes While VMD Runs", which block Blender until they finish'
+    )
     bl_options = {"PRESET", "UNDO"}
 
+    # The import that modal() finishes, if it runs in the background.
+    _streaming_import = None
+    _orig_path = None
+    _profile = None
+    _timer = None
+
     # Define plugin variables
 
     filename_ext = ".pdb"
     filter_glob: StringProperty(
         # NO MORE PYMOL: default="*.pdb;*.vmd;*.tcl;*.pse", options={"HIDDEN"},
-        default="*.pdb;*.vmd;*.tcl", options={"HIDDEN"},
+        default="*.pdb;*.cif;*.vmd;*.tcl", options={"HIDDEN"},
     )
 
     protein_surface: BoolProperty(
@@ -133,6 +156,23 @@ class ImportVMD(Operator, ImportHelper):
         default=False,
         description="Interacting-residues van-der-Waals representation?",
     )
+    near_ligand_cutoff: FloatProperty(
+        name="Cutoff (Å)",
+        default=8.0,
+        min=0.0,
+        description=(
+            "Residues with an atom this close to a small molecule are "
+            "interacting residues."
+        ),
+    )
+    ligand_resnames: StringProperty(
+        name="Residue Names",
+        default="",
+        description=(
+            "Only these residues (space separated, e.g., ATP HEM) are small "
+            "molecules. Leave empty for all of them."
+        ),
+    )
 
     metals_vdw: BoolProperty(
         name="VDW Spheres",
@@ -145,12 +185,182 @@ class ImportVMD(Operator, ImportHelper):
         default=False,
         description="Remove duplicate vertices from the meshes?",
     )
+    native_geometry: BoolProperty(
+        name="Sticks/Balls Without VMD",
+        default=False,
+        description=(
+            "Build stick, ball and VDW representations of PDB files in "
+            "BlendMol itself. VMD is then only used for surfaces and ribbons."
+        ),
+    )
+    native_surfaces: BoolProperty(
+        name="Surfaces Without VMD",
+        default=False,
+        description=(
+            "Build the surfaces of PDB files in BlendMol itself, from a "
+            "Gaussian density of the atoms. Quicker than VMD's surfaces, "
+            "but smoother."
+        ),
+    )
+    native_surface_spacing: FloatProperty(
+        name="Surface Grid (Å)",
+        default=0.8,
+        min=0.2,
+        description=(
+            "The spacing of the density grid of surfaces built without VMD. "
+            "Smaller values give finer surfaces, with more faces."
+        ),
+    )
+    instance_spheres: BoolProperty(
+        name="Instance Balls/VDW",
+        default=False,
+        description=(
+            "Import ball and VDW representations of PDB files as points with "
+            "one shared, instanced sphere (geometry nodes, Blender 3.0+), "
+            "instead of a full mesh for every atom."
+        ),
+    )
+    make_lod_tiers: BoolProperty(
+        name="Level-of-Detail Tiers",
+        default=False,
+        description=(
+            "Also have VMD make cheaper draft and preview meshes of each "
+            "representation of a PDB file. Objects can switch between them "
+            "(in Object Properties), and renders always use the final mesh."
+        ),
+    )
+    instance_chains: BoolProperty(
+        name="Instance Identical Chains",
+        default=False,
+        description=(
+            "Only make the meshes of one of each set of identical chains in "
+            "a PDB file. The others become linked duplicates, placed by "
+            "superimposing their CA atoms."
+        ),
+    )
+    instance_chains_rmsd: FloatProperty(
+        name="Max RMSD (Å)",
+        default=1.0,
+        min=0.0,
+        description=(
+            "Chains are only identical if all their atoms are within this "
+            "RMSD once superimposed."
+        ),
+    )
+    build_assembly: BoolProperty(
+        name="Biological Assembly",
+        default=False,
+        description=(
+            "Also add the other copies of the biological assembly in a PDB "
+            "file's BIOMT records, as linked duplicates."
+        ),
+    )
+    max_chain_batches: IntProperty(
+        name="Max Chain Batches",
+        default=32,
+        min=1,
+        description=(
+            "PDB files with more chains than this have them rendered in this "
+            "many batches of about the same size, one mesh per batch and "
+            "representation. The chain of every face is kept in the "
+            '"blendmol_chain" attribute.'
+        ),
+    )
+    material_mode: EnumProperty(
+        name="Materials",
+        items=[
+            (
+                "SHARED",
+                "One per Color",
+                "One material per color, shared by every BlendMol object.",
+            ),
+            (
+                "COLOR_ATTRIBUTE",
+                "Color Attribute",
+                'One material for everything, colored by the "blendmol_color" '
+                "attribute.",
+            ),
+            (
+                "PER_MESH",
+                "One per Mesh",
+                "New materials for every mesh (like earlier BlendMol versions).",
+            ),
+        ],
+        default="SHARED",
+        description="How the imported meshes get their colors.",
+    )
+    join_chains: BoolProperty(
+        name="Join Chains",
+        default=False,
+        description=(
+            "Merge the meshes of every chain into one object per "
+            "representation. The chain of every face is kept in the "
+            '"blendmol_chain" attribute.'
+        ),
+    )
+    tile_surfaces: BoolProperty(
+        name="Tile Large Surfaces",
+        default=False,
+        description=(
+            "Have VMD make the surfaces of large chains in a PDB file one "
+            "tile at a time, spread over the VMD processes, and stitch them "
+            "back together. Uses less memory than surfacing a whole chain at "
+            "once."
+        ),
+    )
+    surface_tile_size: FloatProperty(
+        name="Tile Size (Å)",
+        default=40.0,
+        min=10.0,
+        description="The edge length of the surface tiles.",
+    )
     nanometers: BoolProperty(
         name="Use nm, not Å?",
         default=True,
         description=("Use units of nanometers instead of the default " "Angstroms?"),
     )
 
+    import_trajectory: BoolProperty(
+        name="Import Trajectory",
+        default=False,
+        description=(
+            "Import every frame of a PDB file's models (or of the trajectory "
+            "file below). The objects follow the trajectory as the frame "
+            "changes."
+        ),
+    )
+    trajectory_path: StringProperty(
+        name="Trajectory",
+        default="",
+        description=(
+            "A trajectory file VMD can read (e.g., DCD), with the atoms of the "
+            "PDB file. Leave empty to use the models of the PDB file."
+        ),
+        subtype="FILE_PATH",
+    )
+    trajectory_first: IntProperty(
+        name="First Frame", default=0, min=0, description="The first frame to import."
+    )
+    trajectory_last: IntProperty(
+        name="Last Frame",
+        default=-1,
+        min=-1,
+        description="The last frame to import (-1 for the end of the trajectory).",
+    )
+    trajectory_stride: IntProperty(
+        name="Stride", default=1, min=1, description="Import every Nth frame."
+    )
+    trajectory_chunk_size: IntProperty(
+        name="Frames per VMD Run",
+        default=25,
+        min=1,
+        description=(
+            "VMD renders the trajectory this many frames at a time, so "
+            "neither it nor the temporary files grow with the trajectory's "
+            "length."
+        ),
+    )
+
     vmd_exec_path: StringProperty(
         name="VMD",
         default=str(Path("/PATH/TO/VMD/EXECUTABLE")),
@@ -180,6 +390,17 @@ class ImportVMD(Operator, ImportHelper):
         ),
     )
 
+    vmd_processes: IntProperty(
+        name="VMD Processes",
+        default=1,
+        min=1,
+        max=256,
+        description=(
+            "The number of VMD processes to run at the same time. The chains "
+            "of a PDB file are split between them."
+        ),
+    )
+
     first_draw = True
 
     def startup(self):
@@ -194,6 +415,7 @@ class ImportVMD(Operator, ImportHelper):
             # NO MORE PYMOL: self.pymol_exec_path = addon_prefs.pymol_exec_path
             # NO MORE PYMOL: self.prefer_vmd = addon_prefs.prefer_vmd
             self.vmd_msms_repr = addon_prefs.vmd_msms_repr
+            self.vmd_processes = addon_prefs.vmd_processes
 
     def add_instruction_line(self, row, text, height=0.6):
         """
@@ -250,6 +472,7 @@ class ImportVMD(Operator, ImportHelper):
         right_col = second_row.column(align=True)
         right_col.prop(self, "ligand_balls")
         right_col.prop(self, "ligand_vdw")
+        molecule_box.prop(self, "ligand_resnames")
 
         # How to represent interacting residues
         molecule_box = layout.box()
@@ -262,6 +485,7 @@ class ImportVMD(Operator, ImportHelper):
         right_col = second_row.column(align=True)
         right_col.prop(self, "near_ligand_balls")
         right_col.prop(self, "near_ligand_vdw")
+        molecule_box.prop(self, "near_ligand_cutoff")
 
         # Metals
         molecule_box = layout.box()
@@ -278,6 +502,37 @@ class ImportVMD(Operator, ImportHelper):
         left_col = second_row.column()
         left_col.prop(self, "remove_doubles")
         left_col.prop(self, "nanometers")
+        left_col.prop(self, "native_geometry")
+        left_col.prop(self, "native_surfaces")
+        row = left_col.row()
+        row.active = self.native_surfaces
+        row.prop(self, "native_surface_spacing")
+        left_col.prop(self, "instance_spheres")
+        left_col.prop(self, "make_lod_tiers")
+        left_col.prop(self, "instance_chains")
+        row = left_col.row()
+        row.active = self.instance_chains
+        row.prop(self, "instance_chains_rmsd")
+        left_col.prop(self, "build_assembly")
+        left_col.prop(self, "max_chain_batches")
+        left_col.prop(self, "join_chains")
+        left_col.prop(self, "material_mode")
+        left_col.prop(self, "tile_surfaces")
+        row = left_col.row()
+        row.active = self.tile_surfaces
+        row.prop(self, "surface_tile_size")
+
+        # Trajectories
+        trajectory_box = layout.box()
+        first_row = trajectory_box.row()
+        first_row.prop(self, "import_trajectory")
+        second_row = trajectory_box.column()
+        second_row.active = self.import_trajectory
+        second_row.prop(self, "trajectory_path")
+        second_row.prop(self, "trajectory_first")
+        second_row.prop(self, "trajectory_last")
+        second_row.prop(self, "trajectory_stride")
+        second_row.prop(self, "trajectory_chunk_size")
 
         # Executable files
         exec_box = layout.box()
@@ -290,6 +545,7 @@ class ImportVMD(Operator, ImportHelper):
         left_col = third_row.column()
         # NO MORE PYMOL: left_col.prop(self, "prefer_vmd")
         left_col.prop(self, "vmd_msms_repr")
+        left_col.prop(self, "vmd_processes")
 
         # NO MORE PYMOL: exec_box = layout.box()
         # NO MORE PYMOL: first_row = exec_box.row()
@@ -355,6 +611,19 @@ class ImportVMD(Operator, ImportHelper):
         for line in lines:
             self.add_instruction_line(instruction_box.row(), line)
 
+    def needs_vmd(self, filepath):
+        """
+        Whether VMD is needed to import a file. It isn't if BlendMol can build
+        all the requested representations itself.
+
+        :param str filepath: The file to import.
+
+        :returns: True if VMD is needed, False otherwise.
+        :rtype: :class:`bool`
+        """
+
+        return Importer.needs_vmd(self, filepath)
+
     def execute(self, context):
         """
         Code to run when the user presses the import button. This gets the
@@ -370,18 +639,27 @@ class ImportVMD(Operator, ImportHelper):
         # NO MORE PYMOL: user_prefs.pymol_exec_path = self.pymol_exec_path
         # NO MORE PYMOL: user_prefs.prefer_vmd = self.prefer_vmd
         user_prefs.vmd_msms_repr = self.vmd_msms_repr
+        user_prefs.vmd_processes = self.vmd_processes
         FileBasedPreferences.save_preferences_to_file()
 
+        # Time the stages of the import?
+        profile = None
+        if user_prefs.profile_imports:
+            profile = ImportProfile(
+                os.path.basename(self.filepath), user_prefs.profiler
+            )
+
         # If its a 4-letter code without a period in it, assume it's a PDB ID
-        pdb_id = os.path.basename(self.filepath).upper()
         orig_path = None
-        if len(pdb_id) == 4 and not "." in pdb_id:
-            _, pdb_filename = tempfile.mkstemp(suffix=".pdb")
-            url = "http://files.rcsb.org/view/" + pdb_id + ".pdb"
-            with urllib.request.urlopen(url) as response:
-                open(pdb_filename, "wb").write(response.read())
-                orig_path = self.filepath
-                self.filepath = pdb_filename
+        if Importer.is_pdb_id(self.filepath):
+            orig_path = self.filepath
+            pdb_mirror = PDBMirror(
+                get_pdb_mirror_dir(),
+                user_prefs.pdb_mirror_size_mb * 1024 * 1024,
+                user_prefs.pdb_mirror_source,
+            )
+            with stage(profile, "download"):
+                self.filepath = Importer.download_pdb(self.filepath, pdb_mirror)
 
         # This is in order to solve this strange 'relative path' thing.
         filepath_input = bpy.path.abspath(self.filepath)
@@ -397,7 +675,9 @@ class ImportVMD(Operator, ImportHelper):
 
         vmd_path_exists = os.path.exists(vmd_exec_path)
         # NO MORE PYMOL: pymol_path_exists = os.path.exists(pymol_exec_path)
-        if not vmd_path_exists:  # NO MORE PYMOL:  and not pymol_path_exists:
+        if (
+            not vmd_path_exists and self.needs_vmd(filepath_input)
+        ):  # NO MORE PYMOL:  and not pymol_path_exists:
             # NO MORE PYMOL: self.report(
             #    {"ERROR"}, "Neither the VMD nor the PyMol executable paths exist!"
             # )
@@ -461,12 +741,57 @@ class ImportVMD(Operator, ImportHelper):
             os.path.dirname(os.path.realpath(__file__)) + os.sep + "scripts" + os.sep
         )
         if exec_to_use == "VMD":
-            vmd = VMD()
-            vmd.make_tmp_dir()
-            vmd.make_vis_script(self)
-            vmd.run_external_program(vmd_exec_path)
-            new_obj_names = vmd.import_all_mesh_files(self)
-            vmd.del_tmp_dir()
+            mesh_cache = None
+            if user_prefs.use_mesh_cache:
+                mesh_cache = MeshCache(
+                    get_mesh_cache_dir(), user_prefs.mesh_cache_size_mb * 1024 * 1024
+                )
+
+            session_pool = None
+            if user_prefs.reuse_vmd:
+                session_pool = VMDSession.get_pool(
+                    vmd_exec_path, self.vmd_processes, user_prefs.vmd_session_jobs
+                )
+
+            mesh_format = Importer.get_mesh_format(
+                user_prefs.mesh_compression, user_prefs.quantize_meshes
+            )
+
+            if user_prefs.stream_meshes and Importer.can_stream(self, filepath_input):
+                # Add each mesh to the scene while VMD renders the next.
+                self._streaming_import = Importer.StreamingImport(
+                    self,
+                    filepath_input,
+                    vmd_exec_path,
+                    mesh_cache,
+                    session_pool,
+                    profile,
+                    mesh_format,
+                )
+                self._orig_path = orig_path
+                self._profile = profile
+                if self.options.is_invoke and context.window is not None:
+                    # From the import dialog, so keep Blender responsive.
+                    # Scripts still get the objects when the operator
+                    # returns. Trajectories and the non-streaming path below
+                    # always block until the import is done.
+                    return self.start_modal(context)
+                while not self._streaming_import.step():
+                    pass
+                new_obj_names = self._streaming_import.new_obj_names
+            else:
+                vmd = Importer.run_vmd_stage(
+                    self,
+                    filepath_input,
+                    vmd_exec_path,
+                    mesh_cache,
+                    session_pool,
+                    profile,
+                    mesh_format,
+                )
+                new_obj_names = Importer.run_blender_stage(
+                    vmd, self, filepath_input, vmd_exec_path
+                )
         # NO MORE PYMOL: elif exec_to_use == "PYMOL":
         #    pymol = PyMol()
         #
@@ -476,10 +801,145 @@ class ImportVMD(Operator, ImportHelper):
         #    new_obj_names = pymol.import_all_mesh_files(self)
         #    pymol.del_tmp_dir()
 
+        self.finish_import(orig_path, profile)
+        return {"FINISHED"}
+
+    def start_modal(self, context):
+        """
+        Finish the import in the background: the meshes are added on timer
+        ticks (see modal()), so Blender stays responsive, and the user can
+        cancel with Esc.
+
+        :param ??? context: The context.
+
+        :returns: {"RUNNING_MODAL"}
+        :rtype: :class:`set`
+        """
+
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(MODAL_TIMER_SECONDS, window=context.window)
+        wm.progress_begin(0, 100)
+        wm.modal_handler_add(self)
+        self.show_progress(context)
+        return {"RUNNING_MODAL"}
+
+    def modal(self, context, event):
+        """
+        Add the meshes that are ready to the scene, a few at a time, and
+        show the progress. Esc cancels the import.
+
+        :param ??? context: The context.
+        :param ??? event: The event.
+        """
+
+        if event.type == "ESC" and event.value == "PRESS":
+            self._streaming_import.cancel()
+            self.end_modal(context)
+            self.finish_import(self._orig_path, None)
+            self.report({"WARNING"}, "Import cancelled.")
+            return {"CANCELLED"}
+
+        if event.type != "TIMER" or event.timer != self._timer:
+            return {"PASS_THROUGH"}
+
+        try:
+            done = self._streaming_import.step(MODAL_STEP_SECONDS)
+        except Exception as e:
+            self.end_modal(context)
+            self.finish_import(self._orig_path, None)
+            self.report({"ERROR"}, "Import failed: " + str(e))
+            return {"CANCELLED"}
+
+        if done:
+            self.end_modal(context)
+            self.finish_import(self._orig_path, self._profile)
+            return {"FINISHED"}
+
+        self.show_progress(context)
+        return {"RUNNING_MODAL"}
+
+    def show_progress(self, context):
+        """
+        Show how far along the import is, in the progress bar and status bar.
+
+        :param ??? context: The context.
+        """
+
+        done, total = self._streaming_import.get_progress()
+        text = "BlendMol: imported " + str(done)
+        if total:
+            context.window_manager.progress_update(int(100 * done / total))
+            text = text + " of " + str(total)
+        context.workspace.status_text_set(text + " meshes. Press Esc to cancel.")
+
+    def end_modal(self, context):
+        """
+        Remove the timer, progress bar and status text of a modal import.
+
+        :param ??? context: The context.
+        """
+
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        context.workspace.status_text_set(None)
+
+    def finish_import(self, orig_path, profile):
+        """
+        Put back the PDB ID the user typed (if any), and report the timings
+        of the import.
+
+        :param str orig_path: The PDB ID, or None.
+        :param ImportProfile profile: The timings, or None.
+        """
+
         if orig_path is not None:
             self.filepath = orig_path
 
-        return {"FINISHED"}
+        if profile is not None:
+            profile.finish()
+            report_filename = os.path.join(
+                get_profile_dir(),
+                profile.name + "_" + time.strftime("%Y%m%d-%H%M%S") + ".json",
+            )
+            profile.save(report_filename)
+            print(json.dumps(profile.to_dict(), indent=2))
+            self.report(
+                {"INFO"}, profile.get_summary() + ". Details: " + report_filename
+            )
+
+
+def get_mesh_cache_dir():
+    """
+    The directory where the mesh cache is stored.
+
+    :returns: The directory.
+    :rtype: :class:`str`
+    """
+
+    return bpy.utils.user_resource("DATAFILES", path="blendmol_mesh_cache", create=True)
+
+
+def get_profile_dir():
+    """
+    The directory where the timings of profiled imports are saved.
+
+    :returns: The directory.
+    :rtype: :class:`str`
+    """
+
+    return bpy.utils.user_resource("DATAFILES", path="blendmol_profiles", create=True)
+
+
+def get_pdb_mirror_dir():
+    """
+    The directory where downloaded PDB files are kept.
+
+    :returns: The directory.
+    :rtype: :class:`str`
+    """
+
+    return bpy.utils.user_resource("DATAFILES", path="blendmol_pdb_mirror", create=True)
 
 
 def add_menu_func_import(self, context):
@@ -510,6 +970,8 @@ def register():
         register_class(cls)
     bpy.types.TOPBAR_MT_file_import.append(add_menu_func_import)
     Preferences.register()
+    LevelOfDetail.register()
+    Trajectory.register()
 
 
 def unregister():
@@ -524,6 +986,9 @@ def unregister():
         unregister_class(cls)
     bpy.types.TOPBAR_MT_file_import.remove(add_menu_func_import)
     Preferences.unregister()
+    LevelOfDetail.unregister()
+    Trajectory.unregister()
+    VMDSession.close_all_pools()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,444 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import types
+import shutil
+import argparse
+import platform
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+import common
+import synthetic
+
+# Times the stages of an import on synthetic structures, with the fake VMD
+# (fake_vmd.py) standing in for VMD, so it runs the same on any CPU-only Linux
+# box:
+#
+#     blender -b -P benchmarks/bench_import.py -- --json results.json
+#
+# Each scenario (make_vis_script, run_external_program with a new VMD or a
+# persistent one, import_all_mesh_files from OBJ or binary mesh files) runs on
+# structures with 1, 10 and 100 chains (add 1000 with --chains 1 10 100 1000).
+# Compare with an earlier run to find regressions:
+#
+#     blender -b -P benchmarks/bench_import.py -- --baseline old.json
+#
+# or, without Blender, just compare two result files:
+#
+#     python benchmarks/bench_import.py --compare new.json old.json
+#
+# The run_external_program results also count the atom selections the fake VMD
+# evaluated: by expression (selections_searched, each a search over every atom
+# in real VMD) or by index (selections_indexed). Set BLENDMOL_FAKE_VMD_SELECT
+# to give each search a cost per 1000 atoms, so the timings reflect it too.
+
+FAKE_VMD = os.path.join(common.BENCHMARK_DIR, "fake_vmd.py")
+
+# The import dialog's default settings.
+DEFAULT_SETTINGS = {
+    "protein_surface": True,
+    "protein_ribbon": True,
+    "protein_sticks": False,
+    "protein_balls": False,
+    "protein_vdw": False,
+    "ligand_surface": False,
+    "ligand_sticks": True,
+    "ligand_balls": False,
+    "ligand_vdw": False,
+    "near_ligand_surface": False,
+    "near_ligand_sticks": True,
+    "near_ligand_balls": False,
+    "near_ligand_vdw": False,
+    "near_ligand_cutoff": 8.0,
+    "ligand_resnames": "",
+    "metals_vdw": True,
+    "remove_doubles": False,
+    "native_geometry": False,
+    "native_surfaces": False,
+    "native_surface_spacing": 0.8,
+    "instance_spheres": False,
+    "make_lod_tiers": False,
+    "instance_chains": False,
+    "instance_chains_rmsd": 1.0,
+    "build_assembly": False,
+    "max_chain_batches": 32,
+    "join_chains": False,
+    "material_mode": "SHARED",
+    "tile_surfaces": False,
+    "surface_tile_size": 40.0,
+    "nanometers": True,
+    "import_trajectory": False,
+    "trajectory_path": "",
+    "trajectory_first": 0,
+    "trajectory_last": -1,
+    "trajectory_stride": 1,
+    "trajectory_chunk_size": 25,
+    "vmd_msms_repr": False,
+    "vmd_processes": 1,
+}
+
+# Results that differ by less than this many seconds are never regressions
+# (timer noise).
+MIN_DELTA_SECONDS = 0.05
+
+
+def make_settings(filepath, **changes):
+    """
+    Import settings, like the import dialog's.
+
+    :param str filepath: The file to import.
+    :param changes: Settings that differ from the defaults.
+
+    :returns: The settings.
+    :rtype: :class:`types.SimpleNamespace`
+    """
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(changes)
+    return types.SimpleNamespace(filepath=filepath, **settings)
+
+
+def time_runs(func, repeat, setup=None):
+    """
+    Time a function several times.
+
+    :param function func: The function. Its return value (a dictionary of
+                counts, or None) is kept from the last run.
+    :param int repeat: How many times to run it.
+    :param function setup: Called (untimed) before each run. Optional.
+
+    :returns: The result: median, min and every run's seconds, and counts.
+    :rtype: :class:`dict`
+    """
+
+    runs = []
+    counts = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        counts = func()
+        runs.append(time.perf_counter() - start)
+
+    result = {
+        "median_seconds": sorted(runs)[len(runs) // 2],
+        "min_seconds": min(runs),
+        "runs": runs,
+    }
+    if counts is not None:
+        result.update(counts)
+    return result
+
+
+def count_selections(stats_filename):
+    """
+    How many atom selections the fake VMD evaluated, by expression
+    (searching every atom) or by index, and how many it never deleted. Read
+    from (and then delete) the BLENDMOL_FAKE_VMD_STATS file, which every
+    fake VMD process adds a line to.
+
+    :param str stats_filename: The file.
+
+    :returns: The counts. Empty if no fake VMD exited.
+    :rtype: :class:`dict`
+    """
+
+    if not os.path.exists(stats_filename):
+        return {}
+    counts = {
+        "selections_searched": 0,
+        "selections_indexed": 0,
+        "selections_undeleted": 0,
+    }
+    with open(stats_filename, "r") as f:
+        for line in f:
+            stats = json.loads(line)
+            counts["selections_searched"] += stats["searched"]
+            counts["selections_indexed"] += stats["indexed"]
+            counts["selections_undeleted"] += stats["undeleted"]
+    os.remove(stats_filename)
+    return counts
+
+
+def count_meshes(mesh_dir):
+    """
+    The number and size of the OBJ files in a directory.
+
+    :param str mesh_dir: The directory.
+
+    :returns: The counts.
+    :rtype: :class:`dict`
+    """
+
+    filenames = glob.glob(os.path.join(mesh_dir, "*.obj"))
+    return {
+        "obj_files": len(filenames),
+        "obj_bytes": sum([os.path.getsize(f) for f in filenames]),
+    }
+
+
+def clear_blendmol_objects():
+    """
+    Remove the objects (and meshes and materials) the last run added.
+    """
+
+    import bpy
+
+    for obj in list(bpy.data.objects):
+        if obj.name.startswith("BldMl__"):
+            bpy.data.objects.remove(obj, do_unlink=True)
+    for collection in [bpy.data.meshes, bpy.data.materials]:
+        for block in list(collection):
+            if block.users == 0:
+                collection.remove(block)
+
+
+def run_scenarios(structures, repeat, vmd_processes):
+    """
+    Run every scenario on every structure.
+
+    :param dict structures: The filenames of the structures, by number of
+                chains.
+    :param int repeat: How many times to run each scenario.
+    :param int vmd_processes: The "VMD Processes" setting.
+
+    :returns: The results, by scenario name.
+    :rtype: :class:`dict`
+    """
+
+    from blendmol.VMD import VMD
+    from blendmol.VMDSession import VMDSessionPool
+
+    # The fake VMD counts the selections it evaluates (only when it exits,
+    # so not in a persistent session).
+    stats_filename = os.path.join(tempfile.mkdtemp(), "fake_vmd_stats.jsonl")
+    os.environ["BLENDMOL_FAKE_VMD_STATS"] = stats_filename
+
+    results = {}
+    for num_chains, filename in sorted(structures.items()):
+        label = "/" + str(num_chains) + "_chains"
+        settings = make_settings(filename, vmd_processes=vmd_processes)
+
+        vmd = VMD()
+        vmd.make_tmp_dir()
+
+        def make_script():
+            vmd.make_vis_script(settings)
+            return {"scripts": len(vmd.vis_script_filenames)}
+
+        results["make_vis_script" + label] = time_runs(make_script, repeat)
+
+        def clean_tmp_dir():
+            for ext in ["obj", "mtl", "bmm"]:
+                for f in glob.glob(vmd.tmp_dir + "*." + ext):
+                    os.remove(f)
+
+        def run_vmd():
+            vmd.run_external_program(FAKE_VMD)
+            counts = count_meshes(vmd.tmp_dir)
+            counts.update(count_selections(stats_filename))
+            return counts
+
+        results["run_external_program" + label] = time_runs(
+            run_vmd, repeat, clean_tmp_dir
+        )
+
+        # The same, with VMD kept running between runs (one warm-up run).
+        vmd.session_pool = VMDSessionPool(FAKE_VMD, max(1, vmd_processes))
+        vmd.can_reuse_session = True
+        run_vmd()
+        results["run_external_program_session" + label] = time_runs(
+            run_vmd, repeat, clean_tmp_dir
+        )
+        vmd.session_pool.close()
+        vmd.session_pool = None
+
+        # Importing converts the OBJ files to binary mesh files, so keep a
+        # copy to start each run from.
+        obj_dir = tempfile.mkdtemp()
+        for f in glob.glob(vmd.tmp_dir + "*.obj") + glob.glob(vmd.tmp_dir + "*.mtl"):
+            shutil.copy(f, obj_dir)
+
+        def restore_obj_files():
+            clear_blendmol_objects()
+            clean_tmp_dir()
+            for f in glob.glob(os.path.join(obj_dir, "*")):
+                shutil.copy(f, vmd.tmp_dir)
+
+        def import_meshes():
+            import bpy
+
+            new_obj_names = vmd.import_all_mesh_files(settings)
+            vertices = sum(
+                [len(bpy.data.objects[name].data.vertices) for name in new_obj_names]
+            )
+            return {"objects": len(new_obj_names), "vertices": vertices}
+
+        results["import_all_mesh_files" + label] = time_runs(
+            import_meshes, repeat, restore_obj_files
+        )
+        clear_blendmol_objects()
+
+        # The binary mesh files the last run left (e.g., from the cache).
+        results["import_all_mesh_files_binary" + label] = time_runs(
+            import_meshes, repeat, clear_blendmol_objects
+        )
+
+        # Welding while the meshes are read.
+        settings.remove_doubles = True
+        results["import_all_mesh_files_weld" + label] = time_runs(
+            import_meshes, repeat, restore_obj_files
+        )
+        clear_blendmol_objects()
+
+        shutil.rmtree(obj_dir)
+        vmd.del_tmp_dir()
+        for name in sorted(results.keys()):
+            if name.endswith(label):
+                line = "%-50s %8.3f s" % (name, results[name]["median_seconds"])
+                if "selections_searched" in results[name]:
+                    line = line + " (%d selections searched)" % (
+                        results[name]["selections_searched"]
+                    )
+                print(line)
+
+    return results
+
+
+def get_environment():
+    """
+    Where the benchmark ran, so results from different machines aren't
+    compared by mistake.
+
+    :returns: The environment.
+    :rtype: :class:`dict`
+    """
+
+    environment = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "fake_vmd_detail": os.environ.get("BLENDMOL_FAKE_VMD_DETAIL", "1.0"),
+    }
+    if common.IN_BLENDER:
+        import bpy
+
+        environment["blender"] = bpy.app.version_string
+    return environment
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results with a baseline.
+
+    :param dict results: The new results (the "results" of a result file).
+    :param dict baseline: The baseline results.
+    :param float tolerance: How much slower a scenario can get (e.g., 0.2 is
+                 20%) before it counts as a regression.
+
+    :returns: The names of the scenarios that regressed.
+    :rtype: :class:`list`
+    """
+
+    regressions = []
+    for name in sorted(results.keys()):
+        if not name in baseline:
+            print("%-50s %8.3f s (new)" % (name, results[name]["median_seconds"]))
+            continue
+        new = results[name]["median_seconds"]
+        old = baseline[name]["median_seconds"]
+        ratio = new / old if old > 0 else 1.0
+        status = ""
+        if ratio > 1 + tolerance and new - old > MIN_DELTA_SECONDS:
+            status = "REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 - tolerance and old - new > MIN_DELTA_SECONDS:
+            status = "faster"
+        print("%-50s %8.3f s vs %8.3f s (%5.2fx) %s" % (name, new, old, ratio, status))
+    return regressions
+
+
+def main():
+    """
+    Run the benchmark.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chains", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--residues", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--vmd-processes", type=int, default=1)
+    parser.add_argument("--json", help="Save the results to this file.")
+    parser.add_argument("--baseline", help="Compare with these earlier results.")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("NEW", "OLD"),
+        help="Only compare two result files (doesn't need Blender).",
+    )
+    args = parser.parse_args(common.get_script_args())
+
+    if args.compare is not None:
+        new, old = [json.load(open(f, "r"))["results"] for f in args.compare]
+        return 1 if len(compare(new, old, args.tolerance)) > 0 else 0
+
+    if not common.IN_BLENDER:
+        parser.error("Run this with blender -b -P (or use --compare).")
+
+    common.load_blendmol()
+    structure_dir = tempfile.mkdtemp()
+    try:
+        structures = {
+            num_chains: synthetic.write_structure(
+                structure_dir, num_chains, args.residues
+            )
+            for num_chains in args.chains
+        }
+        results = run_scenarios(structures, args.repeat, args.vmd_processes)
+    finally:
+        shutil.rmtree(structure_dir)
+
+    output = {
+        "environment": get_environment(),
+        "chains": args.chains,
+        "residues": args.residues,
+        "results": results,
+    }
+    if args.json is not None:
+        with open(args.json, "w") as json_file:
+            json.dump(output, json_file, indent=2)
+
+    if args.baseline is not None:
+        baseline = json.load(open(args.baseline, "r"))["results"]
+        if len(compare(results, baseline, args.tolerance)) > 0:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    if exit_code != 0:
+        sys.exit(exit_code)
@@ -0,0 +1,162 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import glob
+import time
+import json
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+import common
+
+# Compares the ways BlendMol can remove duplicate vertices, on the surfaces VMD
+# makes for examples/vmd-files/1XDN.pdb:
+#
+#     blender -b -P benchmarks/bench_remove_doubles.py -- --vmd /path/to/vmd
+#
+# or on OBJ files that already exist:
+#
+#     blender -b -P benchmarks/bench_remove_doubles.py -- --obj-dir /path/to/objs
+#
+# Outside of Blender, only the NumPy weld is timed.
+
+SURFACE_TCL = """
+mol new {%s} type pdb waitfor all
+set sel [atomselect top "protein"]
+foreach chain [lsort -unique [$sel get chain]] {
+    mol delrep 0 top
+    mol selection "protein and chain $chain"
+    mol representation Surf 1.400000 0.000000
+    mol addrep top
+    render Wavefront {%s/surf_${chain}.obj}
+}
+quit
+"""
+
+
+def make_surfaces(vmd_exec_path, out_dir):
+    """
+    Use VMD to make the protein surfaces of the example PDB file.
+
+    :param str vmd_exec_path: The path to the VMD executable.
+    :param str out_dir: Where to save the OBJ files.
+    """
+
+    script_filename = os.path.join(out_dir, "surf.vmd")
+    with open(script_filename, "w") as script_file:
+        script_file.write(SURFACE_TCL % (common.EXAMPLE_PDB, out_dir))
+    subprocess.check_call(
+        [vmd_exec_path, "-dispdev", "text", "-e", script_filename],
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def remove_doubles_ops(obj, threshold):
+    """
+    The old way: edit mode and bpy.ops.mesh.remove_doubles().
+
+    :param bpy.types.Object obj: The object.
+    :param float threshold: The merge distance.
+    """
+
+    import bpy
+
+    bpy.ops.object.select_all(action="DESELECT")
+    bpy.context.view_layer.objects.active = obj
+    obj.select_set(state=True)
+    bpy.ops.object.mode_set(mode="EDIT")
+    bpy.ops.mesh.select_all(action="SELECT")
+    bpy.ops.mesh.remove_doubles(threshold=threshold)
+    bpy.ops.mesh.normals_make_consistent()
+    bpy.ops.object.mode_set(mode="OBJECT")
+
+
+def main():
+    """
+    Run the benchmark.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--vmd", help="Path to VMD, to make the OBJ files.")
+    parser.add_argument("--obj-dir", help="Directory with existing OBJ files.")
+    parser.add_argument("--json", help="Save the results to this file.")
+    args = parser.parse_args(common.get_script_args())
+
+    common.load_blendmol()
+    from blendmol.ObjParser import parse_obj
+    from blendmol.MeshArrays import REMOVE_DOUBLES_THRESHOLD
+
+    if common.IN_BLENDER:
+        from blendmol.ExternalInterface import ExternalInterface
+
+    obj_dir = args.obj_dir
+    if obj_dir is None:
+        if args.vmd is None:
+            parser.error("Give either --vmd or --obj-dir.")
+        obj_dir = tempfile.mkdtemp()
+        make_surfaces(args.vmd, obj_dir)
+
+    threshold = REMOVE_DOUBLES_THRESHOLD
+    results = []
+    for filename in sorted(glob.glob(os.path.join(obj_dir, "*.obj"))):
+        mesh_arrays = parse_obj(filename)
+        result = {
+            "file": os.path.basename(filename),
+            "vertices": mesh_arrays.num_vertices,
+            "polygons": mesh_arrays.num_polygons,
+        }
+
+        start = time.perf_counter()
+        welded = mesh_arrays.weld(threshold)
+        result["numpy_weld_s"] = time.perf_counter() - start
+        result["welded_vertices"] = welded.num_vertices
+
+        if common.IN_BLENDER:
+            interface = ExternalInterface()
+
+            start = time.perf_counter()
+            interface.new_mesh_object("numpy", welded)
+            result["numpy_total_s"] = (
+                result["numpy_weld_s"] + time.perf_counter() - start
+            )
+
+            start = time.perf_counter()
+            obj = interface.new_mesh_object("bmesh", mesh_arrays)
+            interface.remove_doubles_bmesh(obj.data, threshold)
+            result["bmesh_total_s"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            obj = interface.new_mesh_object("ops", mesh_arrays)
+            remove_doubles_ops(obj, threshold)
+            result["ops_total_s"] = time.perf_counter() - start
+            result["ops_welded_vertices"] = len(obj.data.vertices)
+
+        print(json.dumps(result))
+        results.append(result)
+
+    if args.json is not None:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import types
+
+# Helpers shared by the benchmark scripts.
+
+BENCHMARK_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+EXAMPLE_PDB = os.path.join(REPO_DIR, "examples", "vmd-files", "1XDN.pdb")
+
+try:
+    import bpy
+
+    IN_BLENDER = True
+except ImportError:
+    IN_BLENDER = False
+
+
+def load_blendmol():
+    """
+    Make the BlendMol modules importable as "blendmol.<Module>", without
+    running the add-on's __init__.py (which registers the operator). This
+    works both inside Blender and in a plain Python interpreter (where only
+    the modules that don't import bpy can be used).
+    """
+
+    if not "blendmol" in sys.modules:
+        package = types.ModuleType("blendmol")
+        package.__path__ = [REPO_DIR]
+        sys.modules["blendmol"] = package
+
+
+def get_script_args():
+    """
+    The command-line arguments meant for the script. When run as
+    "blender -b -P script.py -- args", these are the ones after "--".
+
+    :returns: The arguments.
+    :rtype: :class:`list`
+    """
+
+    if "--" in sys.argv:
+        return sys.argv[sys.argv.index("--") + 1 :]
+    if IN_BLENDER:
+        return []
+    return sys.argv[1:]
@@ -0,0 +1,694 @@
+#!/usr/bin/env python3
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import tkinter
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+import synthetic
+
+# A stand-in for VMD, so BlendMol can be benchmarked (and tried out) without
+# it. Use it as the VMD executable:
+#
+#     fake_vmd.py -dispdev text -e script.vmd
+#     fake_vmd.py -dispdev text -eofexit < commands.tcl
+#
+# It runs the TCL BlendMol generates with Python's own TCL interpreter, and
+# implements just enough of VMD's commands (mol, atomselect, molinfo, animate,
+# render, etc.) for it. Selections are matched by recognizing the kinds
+# BlendMol makes (protein, ligand, near-ligand, metals, chain, index, and a box
+# of coordinates around any of these), not by parsing VMD's selection language.
+# "render Wavefront" writes a deterministic OBJ/MTL pair with a fan of
+# triangles around every selected atom, the number of triangles depending on
+# the representation and its resolution, like VMD's do. Vertices are repeated
+# per triangle, as in VMD's files.
+#
+# Environment variables:
+#
+#     BLENDMOL_FAKE_VMD_DETAIL   Multiplies the triangles per atom (1.0).
+#     BLENDMOL_FAKE_VMD_STARTUP  Seconds to sleep on startup, like VMD's (0).
+#     BLENDMOL_FAKE_VMD_FRAMES   Frames in non-PDB trajectory files (10).
+#     BLENDMOL_FAKE_VMD_SELECT   Seconds per 1000 atoms that a selection
+#                                expression takes to evaluate, like VMD's
+#                                search over every atom (0). Selections by
+#                                index only cost their own atoms.
+#     BLENDMOL_FAKE_VMD_STATS    A file to append how many selections were
+#                                evaluated (by expression or by index) to,
+#                                as a line of JSON, on exit.
+#
+# Needs Python 3 with tkinter (for the TCL interpreter), not Blender.
+
+PROTEIN_RESNAMES = set(
+    "ALA ARG ASN ASP CYS GLN GLU GLY HIS ILE LEU LYS MET PHE PRO SER THR TRP "
+    "TYR VAL HSD HSE HSP HID HIE HIP MSE".split()
+)
+NUCLEIC_RESNAMES = set("A C G U T DA DC DG DT DU ADE CYT GUA URA THY".split())
+WATER_RESNAMES = set("HOH WAT TIP3 TIP3P SOL H2O".split())
+ORGANIC_ELEMENTS = set("H N C O P S Se Cl Br F".split())
+
+ELEMENT_COLORS = {
+    "C": (0.6, 0.6, 0.6),
+    "N": (0.0, 0.0, 1.0),
+    "O": (1.0, 0.0, 0.0),
+    "S": (1.0, 1.0, 0.0),
+    "P": (0.7, 0.3, 0.0),
+    "H": (1.0, 1.0, 1.0),
+}
+
+# "chain A" or "chain A B C", up to the next keyword or parenthesis.
+CHAIN_RE = re.compile(r"chain ((?:(?!and\b|or\b)[^\s()]+\s*)+)")
+
+# "(selection) and (x > 1 and x < 2 and y > 3 and y < 4 and z > 5 and z < 6)",
+# as for a surface tile.
+BOX_RE = re.compile(
+    r"^\((.*)\) and \(x > (\S+) and x < (\S+) and y > (\S+) and y < (\S+) "
+    r"and z > (\S+) and z < (\S+)\)$"
+)
+
+
+def triangles_per_atom(representation):
+    """
+    How many triangles to draw around each atom for a representation.
+
+    :param str representation: The VMD representation (e.g., "VDW 1.0
+               12.0").
+
+    :returns: The number of triangles.
+    :rtype: :class:`int`
+    """
+
+    parts = representation.split()
+    style = parts[0] if len(parts) > 0 else "Lines"
+    params = [float(p) for p in parts[1:]]
+    if style == "Licorice":
+        count = params[1] ** 2 / 10.0 if len(params) > 1 else 40
+    elif style == "VDW":
+        count = params[1] ** 2 / 4.0 if len(params) > 1 else 36
+    elif style == "NewCartoon":
+        count = 2 * params[1] if len(params) > 1 else 20
+    elif style == "Surf":
+        count = 10 if len(params) > 1 and params[1] == 1 else 30
+    elif style in ["MSMS", "QuickSurf"]:
+        count = 6 * params[1] if len(params) > 1 else 30
+    else:
+        count = 4
+    detail = float(os.environ.get("BLENDMOL_FAKE_VMD_DETAIL", "1.0"))
+    return max(3, int(round(count * detail)))
+
+
+class FakeVMD:
+    """
+    The state of the fake VMD: its molecules, the representation being made,
+    and the atom selections.
+    """
+
+    def __init__(self):
+        """
+        Start the TCL interpreter and add VMD's commands to it.
+        """
+
+        self.tcl = tkinter.Tcl()
+        self.molecules = []
+        self.top = None
+        self.representation = "Lines"
+        self.selection = "all"
+        self.reps = []
+        self.selections = {}
+        self.next_selection_id = 0
+        self.stats = {"atomselect": 0, "searched": 0, "indexed": 0, "undeleted": 0}
+        self.select_cost = float(os.environ.get("BLENDMOL_FAKE_VMD_SELECT", "0"))
+
+        for name in [
+            "mol",
+            "molinfo",
+            "atomselect",
+            "animate",
+            "render",
+            "quit",
+            "exit",
+        ]:
+            self.tcl.createcommand(name, getattr(self, "cmd_" + name))
+        for name in ["axes", "color", "display", "material", "light", "scale"]:
+            # Don't affect the geometry.
+            self.tcl.createcommand(name, lambda *args: "")
+
+    # Molecules
+
+    def get_mol(self, mol_id):
+        """
+        A molecule, by ID or "top".
+
+        :param str mol_id: The ID.
+
+        :returns: The molecule.
+        :rtype: :class:`dict`
+        """
+
+        if mol_id == "top":
+            mol_id = self.top
+        for mol in self.molecules:
+            if str(mol["id"]) == str(mol_id):
+                return mol
+        raise tkinter.TclError("invalid molecule " + str(mol_id))
+
+    def read_frames(self, filename, options):
+        """
+        Read the frames of a file, as "mol new" and "mol addfile" would.
+
+        :param str filename: The filename.
+        :param dict options: The command options (type, first, last, step).
+
+        :returns: The coordinates of each frame, and the atoms (None if the
+                  file only has coordinates).
+        :rtype: :class:`tuple`
+        """
+
+        file_type = options.get("type", os.path.splitext(filename)[1][1:])
+        if file_type in ["pdb", "pdbx", "cif"]:
+            models = synthetic.read_structure(filename)
+            atoms = models[0] if len(models) > 0 else []
+            frames = [[(a["x"], a["y"], a["z"]) for a in model] for model in models]
+        else:
+            # Binary trajectories (DCD, XTC, etc.) aren't read. Jiggle the
+            # atoms of the top molecule instead.
+            atoms = None
+            base = self.get_mol("top")["frames"][0]
+            num_frames = int(os.environ.get("BLENDMOL_FAKE_VMD_FRAMES", "10"))
+            frames = [
+                [
+                    (
+                        x + 0.5 * math.sin(0.1 * i + 0.7 * f),
+                        y + 0.5 * math.cos(0.1 * i + 0.7 * f),
+                        z,
+                    )
+                    for i, (x, y, z) in enumerate(base)
+                ]
+                for f in range(num_frames)
+            ]
+
+        first = int(options.get("first", 0))
+        last = int(options.get("last", -1))
+        step = int(options.get("step", 1))
+        if last < 0:
+            last = len(frames) - 1
+        return frames[first : last + 1 : step], atoms
+
+    def parse_options(self, args):
+        """
+        The "name value" options of a mol command.
+
+        :param list args: The arguments after the filename.
+
+        :returns: The options.
+        :rtype: :class:`dict`
+        """
+
+        return dict(zip(args[0::2], args[1::2]))
+
+    def cmd_mol(self, *args):
+        """
+        VMD's "mol" command.
+        """
+
+        if len(args) == 0:
+            return ""
+        sub = args[0]
+        if sub == "new":
+            mol = {"id": len(self.molecules), "frames": [], "frame": 0}
+            frames, atoms = self.read_frames(args[1], self.parse_options(args[2:]))
+            mol["atoms"] = atoms
+            mol["frames"] = frames
+            mol["index"] = self.index_atoms(atoms)
+            mol["grids"] = {}
+            self.molecules.append(mol)
+            self.top = mol["id"]
+            return str(mol["id"])
+        if sub == "addfile":
+            mol = self.get_mol("top")
+            frames, _ = self.read_frames(args[1], self.parse_options(args[2:]))
+            mol["frames"].extend(frames)
+            mol["grids"] = {}
+            return str(mol["id"])
+        if sub == "delete":
+            if args[1] == "all":
+                self.molecules = []
+                self.top = None
+            else:
+                mol = self.get_mol(args[1])
+                self.molecules.remove(mol)
+                self.top = self.molecules[-1]["id"] if self.molecules else None
+            self.stats["undeleted"] = self.stats["undeleted"] + len(self.selections)
+            self.selections = {}
+            return ""
+        if sub == "representation":
+            self.representation = " ".join(args[1:])
+        elif sub == "selection":
+            self.selection = " ".join(args[1:])
+        elif sub == "addrep":
+            self.reps.append((self.representation, self.selection))
+        elif sub == "delrep":
+            if len(self.reps) > 0:
+                self.reps.pop(int(args[1]) if int(args[1]) < len(self.reps) else -1)
+        elif sub == "top":
+            if len(args) > 1:
+                self.top = self.get_mol(args[1])["id"]
+            return str(self.top)
+        return ""
+
+    def cmd_molinfo(self, *args):
+        """
+        VMD's "molinfo" command.
+        """
+
+        if args[0] == "num":
+            return str(len(self.molecules))
+        if args[0] == "top" and len(args) == 1:
+            return str(self.top if self.top is not None else -1)
+        if args[0] == "list":
+            return " ".join([str(mol["id"]) for mol in self.molecules])
+        mol = self.get_mol(args[0])
+        if len(args) > 2 and args[1] == "get":
+            if args[2] == "numframes":
+                return str(len(mol["frames"]))
+            if args[2] == "numatoms":
+                return str(len(mol["atoms"]))
+            if args[2] == "frame":
+                return str(mol["frame"])
+        return ""
+
+    def cmd_animate(self, *args):
+        """
+        VMD's "animate" command.
+        """
+
+        if len(self.molecules) == 0:
+            return ""
+        mol = self.get_mol("top")
+        if args[0] == "goto":
+            frame = args[1]
+            if frame == "end":
+                frame = len(mol["frames"]) - 1
+            mol["frame"] = min(int(frame), len(mol["frames"]) - 1)
+        elif args[0] == "delete" and args[1] == "all":
+            mol["frames"] = []
+            mol["frame"] = 0
+        return ""
+
+    # Selections
+
+    def index_atoms(self, atoms):
+        """
+        Sort a molecule's atoms into the groups BlendMol selects.
+
+        :param list atoms: The atoms.
+
+        :returns: The indices of the atoms in each group.
+        :rtype: :class:`dict`
+        """
+
+        index = {
+            "protein": set(),
+            "water": set(),
+            "metal": set(),
+            "ligand": set(),
+            "chains": {},
+            "residues": {},
+        }
+        for i, atom in enumerate(atoms):
+            index["chains"].setdefault(atom["chain"], set()).add(i)
+            index["residues"].setdefault((atom["chain"], atom["resid"]), []).append(i)
+            if (
+                atom["resname"] in PROTEIN_RESNAMES
+                or atom["resname"] in NUCLEIC_RESNAMES
+            ):
+                index["protein"].add(i)
+            elif atom["resname"] in WATER_RESNAMES:
+                index["water"].add(i)
+            elif not atom["element"] in ORGANIC_ELEMENTS:
+                index["metal"].add(i)
+            else:
+                index["ligand"].add(i)
+        return index
+
+    def near(self, mol, center_indices, cutoff):
+        """
+        Whole protein residues with an atom within a cutoff of some atoms
+        (VMD's "same residue as (protein within ...)").
+
+        :param dict mol: The molecule.
+        :param set center_indices: The atoms to be near.
+        :param float cutoff: The cutoff distance.
+
+        :returns: The indices of the protein atoms.
+        :rtype: :class:`set`
+        """
+
+        coords = mol["frames"][mol["frame"]]
+        atoms = mol["atoms"]
+
+        # The protein atoms, on a grid with cells as big as the cutoff.
+        grid_key = (mol["frame"], cutoff)
+        if not grid_key in mol["grids"]:
+            grid = {}
+            for i in mol["index"]["protein"]:
+                key = tuple([int(math.floor(c / cutoff)) for c in coords[i]])
+                grid.setdefault(key, []).append(i)
+            mol["grids"][grid_key] = grid
+        grid = mol["grids"][grid_key]
+
+        residues = set()
+        for i in center_indices:
+            x, y, z = coords[i]
+            kx, ky, kz = [int(math.floor(c / cutoff)) for c in coords[i]]
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for dz in (-1, 0, 1):
+                        for j in grid.get((kx + dx, ky + dy, kz + dz), []):
+                            cx, cy, cz = coords[j]
+                            if (cx - x) ** 2 + (cy - y) ** 2 + (
+                                cz - z
+                            ) ** 2 <= cutoff**2:
+                                residues.add((atoms[j]["chain"], atoms[j]["resid"]))
+
+        return set(
+            [
+                i
+                for residue in residues
+                for i in mol["index"]["residues"][residue]
+                if i in mol["index"]["protein"]
+            ]
+        )
+
+    def select(self, mol, selection):
+        """
+        The atoms a BlendMol selection picks out.
+
+        :param dict mol: The molecule.
+        :param str selection: The selection.
+
+        :returns: The indices of the atoms, sorted.
+        :rtype: :class:`list`
+        """
+
+        selection = " ".join(selection.split())
+        atoms = mol["atoms"]
+
+        # A box of coordinates is checked against every atom.
+        box_match = BOX_RE.match(selection)
+        if box_match is not None:
+            selection = box_match.group(1)
+        if box_match is None and (
+            selection == "none" or selection.startswith("index ")
+        ):
+            self.stats["indexed"] = self.stats["indexed"] + 1
+        else:
+            self.stats["searched"] = self.stats["searched"] + 1
+            time.sleep(self.select_cost * len(atoms) / 1000.0)
+
+        indices = self.match(mol, selection)
+        if box_match is not None:
+            coords = mol["frames"][mol["frame"]]
+            bounds = [float(b) for b in box_match.groups()[1:]]
+            indices = [
+                i
+                for i in indices
+                if all(
+                    [bounds[2 * k] < coords[i][k] < bounds[2 * k + 1] for k in range(3)]
+                )
+            ]
+        return indices
+
+    def match(self, mol, selection):
+        """
+        The atoms a BlendMol selection (without a box of coordinates) picks
+        out.
+
+        :param dict mol: The molecule.
+        :param str selection: The selection.
+
+        :returns: The indices of the atoms, sorted.
+        :rtype: :class:`list`
+        """
+
+        index = mol["index"]
+        atoms = mol["atoms"]
+
+        if selection == "none":
+            return []
+        if selection.startswith("index "):
+            indices = set()
+            parts = selection[len("index ") :].split()
+            i = 0
+            while i < len(parts):
+                if i + 2 < len(parts) and parts[i + 1] == "to":
+                    indices.update(range(int(parts[i]), int(parts[i + 2]) + 1))
+                    i = i + 3
+                else:
+                    indices.add(int(parts[i]))
+                    i = i + 1
+            return sorted([i for i in indices if i < len(atoms)])
+
+        chain_match = CHAIN_RE.search(selection)
+        if chain_match is not None:
+            chain_atoms = set()
+            for chain in chain_match.group(1).split():
+                chain_atoms = chain_atoms | index["chains"].get(chain, set())
+        else:
+            chain_atoms = set(range(len(atoms)))
+
+        if "within" in selection:
+            cutoff = float(re.search(r"within ([0-9.]+)", selection).group(1))
+            return sorted(self.near(mol, index["ligand"] & chain_atoms, cutoff))
+        if "not protein" in selection:
+            return sorted(index["ligand"] & chain_atoms)
+        if "mass > 16" in selection:
+            return sorted(index["metal"] & chain_atoms)
+        if "protein" in selection:
+            return sorted(index["protein"] & chain_atoms)
+        if "water" in selection:
+            return sorted(index["water"] & chain_atoms)
+        return sorted(chain_atoms)
+
+    def cmd_atomselect(self, *args):
+        """
+        VMD's "atomselect" command. Makes a selection command.
+        """
+
+        mol = self.get_mol(args[0])
+        indices = self.select(mol, args[1])
+        self.stats["atomselect"] = self.stats["atomselect"] + 1
+        name = "atomselect" + str(self.next_selection_id)
+        self.next_selection_id = self.next_selection_id + 1
+        self.selections[name] = (mol, indices)
+
+        def selection_cmd(*sel_args):
+            return self.cmd_selection(name, *sel_args)
+
+        self.tcl.createcommand(name, selection_cmd)
+        return name
+
+    def cmd_selection(self, name, *args):
+        """
+        The methods of a selection ($sel num, $sel get chain, etc.).
+        """
+
+        if not name in self.selections:
+            raise tkinter.TclError("invalid command name " + name)
+        mol, indices = self.selections[name]
+        if args[0] == "num":
+            return str(len(indices))
+        if args[0] == "list":
+            return " ".join([str(i) for i in indices])
+        if args[0] == "delete":
+            # The command itself stays (TCL can't delete a command while it
+            # runs), but fails like VMD's from now on.
+            del self.selections[name]
+            return ""
+        if args[0] == "get":
+            coords = mol["frames"][mol["frame"]]
+            values = []
+            for i in indices:
+                atom = mol["atoms"][i]
+                row = []
+                for key in args[1].split():
+                    if key == "index":
+                        row.append(str(i))
+                    elif key in ["x", "y", "z"]:
+                        row.append("%.3f" % coords[i]["xyz".index(key)])
+                    else:
+                        row.append(str(atom[key]))
+                values.append(row[0] if len(row) == 1 else "{" + " ".join(row) + "}")
+            return " ".join(values)
+        return ""
+
+    # Rendering
+
+    def cmd_render(self, *args):
+        """
+        VMD's "render" command. Only Wavefront is supported.
+        """
+
+        if args[0] != "Wavefront":
+            raise tkinter.TclError("The fake VMD can only render Wavefront.")
+        self.write_obj(args[1])
+        return ""
+
+    def write_obj(self, filename):
+        """
+        Write every representation of the top molecule to an OBJ file (and
+        an MTL file next to it).
+
+        :param str filename: The OBJ filename.
+        """
+
+        mtl_filename = filename[:-4] + ".mtl"
+        elements = set()
+        with open(filename, "w") as f:
+            f.write("# Fake VMD\nmtllib " + os.path.basename(mtl_filename) + "\n")
+            if len(self.molecules) > 0:
+                mol = self.get_mol("top")
+                coords = mol["frames"][mol["frame"]]
+                for representation, selection in self.reps:
+                    num_triangles = triangles_per_atom(representation)
+                    radius = 0.8 if representation.startswith("VDW 1") else 0.3
+                    for i in self.select(mol, selection):
+                        element = mol["atoms"][i]["element"]
+                        elements.add(element)
+                        f.write("usemtl Mat_" + element + "\n")
+                        self.write_fan(f, coords[i], radius, num_triangles)
+
+        with open(mtl_filename, "w") as f:
+            for element in sorted(elements):
+                color = ELEMENT_COLORS.get(element, (0.5, 0.5, 0.8))
+                f.write("newmtl Mat_" + element + "\n")
+                f.write("Kd %.3f %.3f %.3f\nd 1.0\n" % color)
+
+    def write_fan(self, f, center, radius, num_triangles):
+        """
+        Write a fan of triangles around a point, repeating the shared
+        vertices the way VMD does.
+
+        :param file f: The OBJ file.
+        :param tuple center: The point.
+        :param float radius: The radius of the fan.
+        :param int num_triangles: The number of triangles.
+        """
+
+        x, y, z = center
+        apex = "v %.4f %.4f %.4f\nvn 0 0 1\n" % (x, y, z + radius)
+        lines = []
+        for k in range(num_triangles):
+            a1 = 2 * math.pi * k / num_triangles
+            a2 = 2 * math.pi * (k + 1) / num_triangles
+            lines.append(apex)
+            for a in (a1, a2):
+                lines.append(
+                    "v %.4f %.4f %.4f\nvn %.3f %.3f 0\n"
+                    % (
+                        x + radius * math.cos(a),
+                        y + radius * math.sin(a),
+                        z,
+                        math.cos(a),
+                        math.sin(a),
+                    )
+                )
+            lines.append("f -3//-3 -2//-2 -1//-1\n")
+        f.write("".join(lines))
+
+    # Running
+
+    def write_stats(self):
+        """
+        Append the selection counts to the BLENDMOL_FAKE_VMD_STATS file, if
+        there is one. "undeleted" is how many atom selections were never
+        deleted (before their molecule was).
+        """
+
+        filename = os.environ.get("BLENDMOL_FAKE_VMD_STATS")
+        if filename:
+            stats = dict(self.stats)
+            stats["undeleted"] = stats["undeleted"] + len(self.selections)
+            with open(filename, "a") as f:
+                f.write(json.dumps(stats) + "\n")
+
+    def cmd_quit(self, *args):
+        """
+        VMD's "quit" command.
+        """
+
+        self.write_stats()
+        sys.stdout.flush()
+        os._exit(int(args[0]) if len(args) > 0 else 0)
+
+    cmd_exit = cmd_quit
+
+    def run_commands(self, lines, prompt=False):
+        """
+        Run TCL commands one at a time, as VMD does with a script or its
+        console. Errors are printed, and the next command still runs.
+
+        :param iterable lines: The lines of TCL.
+        :param bool prompt: Whether to print VMD's prompt. Defaults to False.
+        """
+
+        command = ""
+        if prompt:
+            sys.stdout.write("vmd > ")
+            sys.stdout.flush()
+        for line in lines:
+            command = command + line
+            if not self.tcl.call("info", "complete", command):
+                continue
+            try:
+                self.tcl.eval(command)
+            except tkinter.TclError as e:
+                print("ERROR) " + str(e))
+            command = ""
+            if prompt:
+                sys.stdout.write("vmd > ")
+                sys.stdout.flush()
+
+
+def main(args):
+    """
+    Run the fake VMD.
+
+    :param list args: The command-line arguments.
+    """
+
+    time.sleep(float(os.environ.get("BLENDMOL_FAKE_VMD_STARTUP", "0")))
+
+    vmd = FakeVMD()
+    if "-e" in args:
+        with open(args[args.index("-e") + 1], "r") as script:
+            vmd.run_commands(script)
+
+    # The console. Like VMD, this waits for more commands after the script.
+    vmd.run_commands(sys.stdin, prompt=True)
+    vmd.write_stats()
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,430 @@
+"""
+BlendMol 1.3: Advanced Molecular Visualization in Blender. Copyright (C)
+2019 Jacob D. Durrant
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import math
+import argparse
+
+# Synthetic structures for the benchmarks: any number of helical protein
+# chains, each with a small-molecule ligand next to it, plus the occasional
+# zinc ion and water. They are deterministic, so the same arguments always make
+# the same file. Structures with more chains than the PDB format allows (62
+# one-character chain IDs) are written as mmCIF, like the PDB itself does.
+#
+#     python benchmarks/synthetic.py --chains 1 10 100 1000 --out-dir structures
+#
+# Also reads PDB and mmCIF files back (for the fake VMD).
+
+# One-character chain IDs, in the order the PDB uses them.
+PDB_CHAIN_IDS = (
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZ" + "abcdefghijklmnopqrstuvwxyz" + "0123456789"
+)
+
+RESIDUE_NAMES = ["ALA", "LEU", "SER", "GLU", "LYS", "VAL", "THR", "ASP"]
+
+# Backbone (and CB) atoms of each residue, as offsets from the CA.
+RESIDUE_ATOMS = [
+    ("N", "N", (-1.2, 0.5, -0.4)),
+    ("CA", "C", (0.0, 0.0, 0.0)),
+    ("C", "C", (1.2, 0.6, 0.3)),
+    ("O", "O", (1.4, 1.8, 0.4)),
+    ("CB", "C", (0.1, -1.5, 0.2)),
+]
+
+# A six-membered ring, for the ligand.
+LIGAND_ATOMS = [
+    (
+        "C" + str(i + 1),
+        "C" if i != 3 else "N",
+        (1.4 * math.cos(a), 1.4 * math.sin(a), 0),
+    )
+    for i, a in enumerate([k * math.pi / 3 for k in range(6)])
+]
+
+# How far apart the chains are.
+CHAIN_SPACING = 30.0
+
+
+def get_chain_id(idx):
+    """
+    The chain ID of a chain: one character while they last, then two.
+
+    :param int idx: The index of the chain.
+
+    :returns: The chain ID.
+    :rtype: :class:`str`
+    """
+
+    if idx < len(PDB_CHAIN_IDS):
+        return PDB_CHAIN_IDS[idx]
+    idx = idx - len(PDB_CHAIN_IDS)
+    return (
+        PDB_CHAIN_IDS[idx // len(PDB_CHAIN_IDS) % 26]
+        + PDB_CHAIN_IDS[idx % len(PDB_CHAIN_IDS)]
+    )
+
+
+def make_atoms(num_chains, residues_per_chain=50, ligands=True, metal_every=5):
+    """
+    Make the atoms of a synthetic structure.
+
+    :param int num_chains: The number of protein chains.
+    :param int residues_per_chain: The residues in each chain. Defaults to
+               50.
+    :param bool ligands: Whether to put a ligand next to each chain. Defaults
+                to True.
+    :param int metal_every: Put a zinc ion next to every this many chains.
+               Defaults to 5.
+
+    :returns: The atoms, as dictionaries.
+    :rtype: :class:`list`
+    """
+
+    atoms = []
+    grid_size = int(math.ceil(num_chains ** (1.0 / 3.0)))
+
+    def add_atom(record, name, resname, chain, resid, element, x, y, z):
+        atoms.append(
+            {
+                "record": record,
+                "serial": len(atoms) + 1,
+                "name": name,
+                "resname": resname,
+                "chain": chain,
+                "resid": resid,
+                "element": element,
+                "x": x,
+                "y": y,
+                "z": z,
+            }
+        )
+
+    for chain_idx in range(num_chains):
+        chain = get_chain_id(chain_idx)
+        origin = (
+            CHAIN_SPACING * (chain_idx % grid_size),
+            CHAIN_SPACING * (chain_idx // grid_size % grid_size),
+            CHAIN_SPACING * (chain_idx // (grid_size * grid_size)),
+        )
+
+        # An alpha helix along z.
+        for resid in range(1, residues_per_chain + 1):
+            angle = math.radians(100.0 * resid)
+            ca = (
+                origin[0] + 2.3 * math.cos(angle),
+                origin[1] + 2.3 * math.sin(angle),
+                origin[2] + 1.5 * resid - 0.75 * residues_per_chain,
+            )
+            resname = RESIDUE_NAMES[resid % len(RESIDUE_NAMES)]
+            for name, element, offset in RESIDUE_ATOMS:
+                add_atom(
+                    "ATOM",
+                    name,
+                    resname,
+                    chain,
+                    resid,
+                    element,
+                    ca[0] + offset[0],
+                    ca[1] + offset[1],
+                    ca[2] + offset[2],
+                )
+
+        if ligands:
+            for name, element, offset in LIGAND_ATOMS:
+                add_atom(
+                    "HETATM",
+                    name,
+                    "LIG",
+                    chain,
+                    residues_per_chain + 1,
+                    element,
+                    origin[0] + 7.0 + offset[0],
+                    origin[1] + offset[1],
+                    origin[2] + offset[2],
+                )
+
+        if metal_every > 0 and chain_idx % metal_every == 0:
+            add_atom(
+                "HETATM",
+                "ZN",
+                "ZN",
+                chain,
+                residues_per_chain + 2,
+                "Zn",
+                origin[0] - 6.0,
+                origin[1],
+                origin[2],
+            )
+
+        add_atom(
+            "HETATM",
+            "O",
+            "HOH",
+            chain,
+            residues_per_chain + 3,
+            "O",
+            origin[0],
+            origin[1] + 8.0,
+            origin[2],
+        )
+
+    return atoms
+
+
+def get_model_coords(atom, model):
+    """
+    The coordinates of an atom in a later model, for multi-model files. Each
+    model moves the atoms a little, the same way every time.
+
+    :param dict atom: The atom.
+    :param int model: The model index (0 is the original coordinates).
+
+    :returns: The coordinates.
+    :rtype: :class:`tuple`
+    """
+
+    if model == 0:
+        return atom["x"], atom["y"], atom["z"]
+    phase = 0.1 * atom["serial"] + 0.7 * model
+    return (
+        atom["x"] + 0.5 * math.sin(phase),
+        atom["y"] + 0.5 * math.cos(phase),
+        atom["z"] + 0.3 * math.sin(2 * phase),
+    )
+
+
+def write_pdb(filename, atoms, num_models=1):
+    """
+    Save atoms as a PDB file.
+
+    :param str filename: The filename.
+    :param list atoms: The atoms. The chain IDs must be one character.
+    :param int num_models: The number of models. Defaults to 1.
+    """
+
+    with open(filename, "w") as f:
+        for model in range(num_models):
+            if num_models > 1:
+                f.write("MODEL     %4d\n" % (model + 1))
+            for atom in atoms:
+                x, y, z = get_model_coords(atom, model)
+                name = atom["name"]
+                if len(name) < 4 and len(atom["element"]) == 1:
+                    name = " " + name
+                f.write(
+                    "%-6s%5d %-4s %3s %1s%4d    %8.3f%8.3f%8.3f%6.2f%6.2f          %2s\n"
+                    % (
+                        atom["record"],
+                        atom["serial"] % 100000,
+                        name,
+                        atom["resname"],
+                        atom["chain"],
+                        atom["resid"] % 10000,
+                        x,
+                        y,
+                        z,
+                        1.0,
+                        0.0,
+                        atom["element"].upper(),
+                    )
+                )
+            if num_models > 1:
+                f.write("ENDMDL\n")
+        f.write("END\n")
+
+
+CIF_COLUMNS = [
+    "group_PDB",
+    "id",
+    "type_symbol",
+    "label_atom_id",
+    "label_comp_id",
+    "label_asym_id",
+    "label_seq_id",
+    "Cartn_x",
+    "Cartn_y",
+    "Cartn_z",
+    "occupancy",
+    "B_iso_or_equiv",
+    "auth_seq_id",
+    "auth_asym_id",
+    "pdbx_PDB_model_num",
+]
+
+
+def write_cif(filename, atoms, num_models=1):
+    """
+    Save atoms as an mmCIF file.
+
+    :param str filename: The filename.
+    :param list atoms: The atoms.
+    :param int num_models: The number of models. Defaults to 1.
+    """
+
+    with open(filename, "w") as f:
+        f.write("data_SYNTHETIC\n#\nloop_\n")
+        for column in CIF_COLUMNS:
+            f.write("_atom_site." + column + "\n")
+        for model in range(num_models):
+            for atom in atoms:
+                x, y, z = get_model_coords(atom, model)
+                f.write(
+                    "%s %d %s %s %s %s %d %.3f %.3f %.3f 1.00 0.00 %d %s %d\n"
+                    % (
+                        atom["record"],
+                        atom["serial"],
+                        atom["element"].upper(),
+                        atom["name"],
+                        atom["resname"],
+                        atom["chain"],
+                        atom["resid"],
+                        x,
+                        y,
+                        z,
+                        atom["resid"],
+                        atom["chain"],
+                        model + 1,
+                    )
+                )
+        f.write("#\n")
+
+
+def write_structure(out_dir, num_chains, residues_per_chain=50, num_models=1):
+    """
+    Make and save a synthetic structure, as PDB if the chain IDs fit and as
+    mmCIF otherwise.
+
+    :param str out_dir: The output directory.
+    :param int num_chains: The number of protein chains.
+    :param int residues_per_chain: The residues in each chain. Defaults to
+               50.
+    :param int num_models: The number of models. Defaults to 1.
+
+    :returns: The filename.
+    :rtype: :class:`str`
+    """
+
+    atoms = make_atoms(num_chains, residues_per_chain)
+    base_filename = os.path.join(
+        out_dir,
+        "synthetic_%dchains_%dres" % (num_chains, residues_per_chain)
+        + ("_%dmodels" % num_models if num_models > 1 else ""),
+    )
+    if num_chains <= len(PDB_CHAIN_IDS):
+        filename = base_filename + ".pdb"
+        write_pdb(filename, atoms, num_models)
+    else:
+        filename = base_filename + ".cif"
+        write_cif(filename, atoms, num_models)
+    return filename
+
+
+def read_structure(filename):
+    """
+    Read the atoms of a PDB or mmCIF file (just what the fake VMD needs).
+
+    :param str filename: The filename.
+
+    :returns: The atoms of each model, as a list of lists of dictionaries.
+    :rtype: :class:`list`
+    """
+
+    if filename.lower().endswith(".cif"):
+        return read_cif(filename)
+
+    models = [[]]
+    with open(filename, "r") as f:
+        for line in f:
+            if line.startswith("ATOM") or line.startswith("HETATM"):
+                element = line[76:78].strip() or line[12:16].strip()[:1]
+                models[-1].append(
+                    {
+                        "record": line[:6].strip(),
+                        "name": line[12:16].strip(),
+                        "resname": line[17:20].strip(),
+                        "chain": line[21:22].strip() or "X",
+                        "resid": int(line[22:26]),
+                        "element": element.capitalize(),
+                        "x": float(line[30:38]),
+                        "y": float(line[38:46]),
+                        "z": float(line[46:54]),
+                    }
+                )
+            elif line.startswith("ENDMDL"):
+                models.append([])
+    return [model for model in models if len(model) > 0]
+
+
+def read_cif(filename):
+    """
+    Read the atoms of an mmCIF file. Only the atom_site loop is read.
+
+    :param str filename: The filename.
+
+    :returns: The atoms of each model.
+    :rtype: :class:`list`
+    """
+
+    columns = []
+    models = {}
+    with open(filename, "r") as f:
+        for line in f:
+            if line.startswith("_atom_site."):
+                columns.append(line.strip()[len("_atom_site.") :])
+            elif len(columns) > 0 and (
+                line.startswith("ATOM") or line.startswith("HETATM")
+            ):
+                values = dict(zip(columns, line.split()))
+                model = int(values.get("pdbx_PDB_model_num", 1))
+                models.setdefault(model, []).append(
+                    {
+                        "record": values["group_PDB"],
+                        "name": values["label_atom_id"],
+                        "resname": values["label_comp_id"],
+                        "chain": values.get("auth_asym_id", values["label_asym_id"]),
+                        "resid": int(values.get("auth_seq_id", 0)),
+                        "element": values["type_symbol"].capitalize(),
+                        "x": float(values["Cartn_x"]),
+                        "y": float(values["Cartn_y"]),
+                        "z": float(values["Cartn_z"]),
+                    }
+                )
+    return [models[model] for model in sorted(models.keys())]
+
+
+def main():
+    """
+    Write synthetic structures from the command line.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chains", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--residues", type=int, default=50)
+    parser.add_argument("--models", type=int, default=1)
+    parser.add_argument("--out-dir", default=".")
+    args = parser.parse_args(sys.argv[1:])
+
+    if not os.path.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+    for num_chains in args.chains:
+        print(write_structure(args.out_dir, num_chains, args.residues, args.models))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+"""
+Lets the tests import BlendMol's modules that don't need Blender (e.g.,
+"from blendmol.PDBParser import PDBStructure") without running the add-on's
+__init__.py, which imports bpy.
+"""
+
+import os
+import sys
+import types
+
+if "blendmol" not in sys.modules:
+    package = types.ModuleType("blendmol")
+    package.__path__ = [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+    sys.modules["blendmol"] = package
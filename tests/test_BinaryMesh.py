@@ -0,0 +1,69 @@
+import numpy
+import pytest
+from blendmol.MeshArrays import MeshArrays
+from blendmol.BinaryMesh import (
+    MESH_EXT,
+    QUANTIZE_BITS,
+    get_available_compressions,
+    load_mesh,
+    save_mesh,
+)
+
+
+def make_mesh(loop_totals):
+    rng = numpy.random.default_rng(0)
+    loop_totals = numpy.array(loop_totals, dtype=numpy.int32)
+    vertices = rng.uniform(-50, 80, (200, 3)).astype(numpy.float32)
+    return MeshArrays(
+        vertices=vertices,
+        loop_vertex_indices=rng.integers(0, len(vertices), loop_totals.sum()),
+        loop_totals=loop_totals,
+        material_indices=rng.integers(0, 3, len(loop_totals)),
+        material_names=["Material0", "Material1", "Material2"],
+        material_colors=rng.uniform(0, 1, (3, 4)),
+        smooth=True,
+    )
+
+
+def assert_same_topology(loaded, mesh):
+    assert loaded.loop_vertex_indices.tolist() == mesh.loop_vertex_indices.tolist()
+    assert loaded.loop_totals.tolist() == mesh.loop_totals.tolist()
+    assert loaded.material_indices.tolist() == mesh.material_indices.tolist()
+    assert loaded.material_names == mesh.material_names
+    numpy.testing.assert_array_equal(loaded.material_colors, mesh.material_colors)
+    assert loaded.smooth == mesh.smooth
+
+
+@pytest.mark.parametrize("compression", get_available_compressions())
+@pytest.mark.parametrize("mmap", [True, False])
+def test_round_trip(tmp_path, compression, mmap):
+    mesh = make_mesh([3, 4, 3, 5] * 30)
+    filename = str(tmp_path / ("mesh" + MESH_EXT))
+    save_mesh(filename, mesh, compression)
+    loaded = load_mesh(filename, mmap)
+
+    numpy.testing.assert_array_equal(loaded.vertices, mesh.vertices)
+    assert_same_topology(loaded, mesh)
+
+
+def test_round_trip_of_constant_arrays(tmp_path):
+    mesh = make_mesh([3] * 100)
+    mesh.material_indices[:] = 1
+    filename = str(tmp_path / ("mesh" + MESH_EXT))
+    save_mesh(filename, mesh)
+    loaded = load_mesh(filename)
+
+    assert_same_topology(loaded, mesh)
+
+
+def test_quantized_vertices_within_half_a_step(tmp_path):
+    mesh = make_mesh([3, 4] * 50)
+    filename = str(tmp_path / ("mesh" + MESH_EXT))
+    save_mesh(filename, mesh, "ZLIB", QUANTIZE_BITS)
+    loaded = load_mesh(filename)
+
+    span = mesh.vertices.max(axis=0) - mesh.vertices.min(axis=0)
+    step = span / (2**QUANTIZE_BITS - 1)
+    errors = numpy.abs(loaded.vertices - mesh.vertices)
+    assert (errors <= step / 2 + 1e-5 * span).all()
+    assert_same_topology(loaded, mesh)
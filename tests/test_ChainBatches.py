@@ -0,0 +1,59 @@
+import numpy
+from blendmol.MeshArrays import MeshArrays
+from blendmol.PDBParser import PDBStructure
+from blendmol.ChainBatches import (
+    BATCH_PREFIX,
+    ChainLabeler,
+    assign_batches,
+    make_chain_batches,
+)
+
+
+def test_few_chains_are_not_batched():
+    batches = make_chain_batches({"A": 10, "B": 20}, 4)
+
+    assert batches == {"A": ["A"], "B": ["B"]}
+
+
+def test_chains_are_batched_by_atom_count():
+    chain_atoms = {"A": 100, "B": 60, "C": 50, "D": 40, "E": 30, "F": 20}
+    batches = make_chain_batches(chain_atoms, 2, keep_separate=["F"])
+
+    assert batches["F"] == ["F"]
+    assert sorted(batches) == ["F", BATCH_PREFIX + "1", BATCH_PREFIX + "2"]
+    batched = sorted(sum([batches[BATCH_PREFIX + str(i)] for i in (1, 2)], []))
+    assert batched == ["A", "B", "C", "D", "E"]
+    sizes = [
+        sum([chain_atoms[chain] for chain in batches[BATCH_PREFIX + str(i)]])
+        for i in (1, 2)
+    ]
+    assert sorted(sizes) == [140, 140]
+
+
+def test_assign_batches_balances_processes():
+    batches = {"b1": ["A"], "b2": ["B"], "b3": ["C", "D"]}
+    chain_atoms = {"A": 90, "B": 50, "C": 30, "D": 15}
+
+    assert assign_batches(batches, chain_atoms, 2) == [["b1"], ["b2", "b3"]]
+
+
+def test_chain_labeler_finds_the_chain_of_every_polygon(tmp_path):
+    lines = [
+        "ATOM      1  CA  ALA A   1       0.000   0.000   0.000  1.00  0.00           C",
+        "ATOM      2  CA  ALA B   1      10.000   0.000   0.000  1.00  0.00           C",
+        "ATOM      3  CA  ALA C   1      20.000   0.000   0.000  1.00  0.00           C",
+    ]
+    filename = tmp_path / "chains.pdb"
+    filename.write_text("\n".join(lines) + "\nEND\n")
+    mesh = MeshArrays(
+        vertices=[[9, 0, 0], [9, 1, 0], [10, 1, 0], [1, 0, 0], [0, 1, 0], [-1, 0, 0]]
+        + [[21, 0, 0], [20, 1, 0], [19, 0, 0], [50, 0, 0], [50, 1, 0], [51, 0, 0]],
+        loop_vertex_indices=numpy.arange(12),
+        loop_totals=[3, 3, 3, 3],
+    )
+
+    # Chain C isn't in the batch, and the last polygon is far from every atom.
+    ChainLabeler(PDBStructure(str(filename)), ["B", "A"]).label(mesh)
+
+    assert mesh.chains == ["B", "A"]
+    assert mesh.polygon_chains.tolist() == [0, 1, -1, -1]
@@ -0,0 +1,109 @@
+import numpy
+from blendmol.MeshArrays import MeshArrays
+
+# A unit cube with its quads facing out.
+CUBE_VERTICES = [[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)]
+CUBE_QUADS = [
+    [0, 1, 3, 2],
+    [4, 6, 7, 5],
+    [0, 4, 5, 1],
+    [2, 3, 7, 6],
+    [0, 2, 6, 4],
+    [1, 5, 7, 3],
+]
+
+
+def make_cubes(flips, offsets):
+    vertices = []
+    quads = []
+    for cube_flips, offset in zip(flips, offsets):
+        for quad, flip in zip(CUBE_QUADS, cube_flips):
+            # Every quad gets its own corners, like VMD's OBJ files.
+            corners = quad[::-1] if flip else quad
+            quads.append(list(range(len(vertices), len(vertices) + 4)))
+            vertices.extend([numpy.add(CUBE_VERTICES[c], offset) for c in corners])
+    return MeshArrays(
+        vertices=numpy.array(vertices, dtype=numpy.float32),
+        loop_vertex_indices=numpy.array(quads, dtype=numpy.int32).ravel(),
+        loop_totals=numpy.full(len(quads), 4, dtype=numpy.int32),
+        material_indices=numpy.zeros(len(quads), dtype=numpy.int32),
+    )
+
+
+def face_normals(mesh):
+    corners = mesh.vertices[mesh.loop_vertex_indices.reshape(-1, 4)]
+    return numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+
+
+def test_make_normals_consistent_follows_most_of_each_piece():
+    flips = [
+        [False, True, False, False, True, False],
+        [True, True, False, True, True, True],
+    ]
+    offsets = [(0, 0, 0), (3, 0, 0)]
+    mesh = make_cubes(flips, offsets).weld(0.0001)
+    mesh = mesh.make_normals_consistent()
+
+    normals = face_normals(mesh)
+    corners = mesh.vertices[mesh.loop_vertex_indices.reshape(-1, 4)]
+    centers = corners.mean(axis=1)
+    cube_centers = numpy.where(centers[:, :1] > 2, 3.5, 0.5)
+    outward = centers - numpy.concatenate(
+        [cube_centers, numpy.full((len(centers), 2), 0.5)], axis=1
+    )
+    facing_out = numpy.einsum("ij,ij->i", normals, outward) > 0
+    assert mesh.num_polygons == 12
+    assert facing_out[:6].all()
+    assert not facing_out[6:].any()
+
+
+def test_make_normals_consistent_keeps_consistent_mesh():
+    mesh = make_cubes([[False] * 6], [(0, 0, 0)]).weld(0.0001)
+
+    assert mesh.make_normals_consistent() is mesh
+
+
+def make_triangles(vertices):
+    return MeshArrays(
+        vertices=numpy.array(vertices, dtype=numpy.float32),
+        loop_vertex_indices=numpy.arange(len(vertices), dtype=numpy.int32),
+        loop_totals=numpy.full(len(vertices) // 3, 3, dtype=numpy.int32),
+        material_indices=numpy.zeros(len(vertices) // 3, dtype=numpy.int32),
+    )
+
+
+def test_weld_merges_pairs_across_cell_boundaries():
+    # The shared corner is split by the cell boundaries at 0.5 (in units of
+    # the threshold), in two axes for the third triangle.
+    mesh = make_triangles(
+        [
+            [0.49, 0, 0],
+            [3, 0, 0],
+            [0, 3, 0],
+            [0.51, 0, 0],
+            [0, -3, 0],
+            [3, 3, 0],
+            [0.49, 0.51, 0],
+            [0, 3, 3],
+            [3, 0, 3],
+        ]
+    )
+    welded = mesh.weld(1.0)
+
+    assert welded.num_vertices == 7
+    assert welded.num_polygons == 3
+    corners = welded.loop_vertex_indices.reshape(-1, 3)
+    assert corners[0, 0] == corners[1, 0] == corners[2, 0]
+
+
+def test_weld_keeps_far_vertices_of_huge_meshes():
+    # So many cells that their hashes wrap around.
+    mesh = make_triangles(
+        [[0.00004, 0, 0], [1e3, 0, 0], [0, 1e3, 1e3]]
+        + [[0.00006, 0, 0], [-1e3, 0, 0], [0, -1e3, 1e3]]
+    )
+
+    welded = mesh.weld(0.0001)
+
+    assert welded.num_vertices == 5
+    assert welded.num_polygons == 2
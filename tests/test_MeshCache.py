@@ -0,0 +1,70 @@
+import os
+from blendmol.MeshCache import MeshCache
+
+
+def make_mesh_dir(tmp_path, name, size):
+    mesh_dir = tmp_path / name
+    mesh_dir.mkdir()
+    (mesh_dir / "prot_nuc_surf_A.bmm").write_bytes(b"x" * size)
+    return str(mesh_dir)
+
+
+def test_evict_keeps_pinned_entries(tmp_path):
+    cache = MeshCache(str(tmp_path / "cache"), 2500)
+    cache.store("a", make_mesh_dir(tmp_path, "a", 1000))
+    entry_dir = cache.lookup("a", pin=True)
+
+    # Storing two more entries goes over the limit, but "a" is in use.
+    cache.store("b", make_mesh_dir(tmp_path, "b", 1000))
+    cache.store("c", make_mesh_dir(tmp_path, "c", 1000))
+    assert os.path.isdir(entry_dir)
+    assert cache.lookup("b") is None
+    assert cache.lookup("c") is not None
+
+    cache.unpin("a")
+    cache.store("d", make_mesh_dir(tmp_path, "d", 1000))
+    assert cache.lookup("a") is None
+
+
+def test_store_keeps_an_existing_entry(tmp_path):
+    cache = MeshCache(str(tmp_path / "cache"), 10000)
+    entry_dir = cache.store("a", make_mesh_dir(tmp_path, "first", 10), pin=True)
+    assert cache.store("a", make_mesh_dir(tmp_path, "second", 20)) == entry_dir
+
+    assert os.path.getsize(os.path.join(entry_dir, "prot_nuc_surf_A.bmm")) == 10
+    assert os.listdir(str(tmp_path / "cache")) == ["a"]
+    cache.unpin("a")
+
+
+def test_make_key_ignores_the_temporary_directory(tmp_path):
+    cache = MeshCache(str(tmp_path / "cache"), 10000)
+    pdb_filename = tmp_path / "1XDN.pdb"
+    pdb_filename.write_text("ATOM\nEND\n")
+    vmd = tmp_path / "vmd"
+    vmd.write_text("#!/bin/sh\n")
+
+    def get_key(tmp_dir, script="mol new 1XDN.pdb"):
+        script_text = script + "\nrender Wavefront " + tmp_dir + "surf.obj\n"
+        return cache.make_key(str(pdb_filename), [script_text], str(vmd), tmp_dir)
+
+    key = get_key("/tmp/tmpabc123/")
+    assert key == get_key("/tmp/tmpxyz789/")
+    assert key != get_key("/tmp/tmpxyz789/", "mol new 1XDN.pdb waitfor all")
+
+    pdb_filename.write_text("HETATM\nEND\n")
+    assert key != get_key("/tmp/tmpabc123/")
+
+
+def test_evict_removes_least_recently_used_first(tmp_path):
+    cache = MeshCache(str(tmp_path / "cache"), 2500)
+    for i, key in enumerate(["a", "b"]):
+        cache.store(key, make_mesh_dir(tmp_path, key, 1000))
+        os.utime(os.path.join(cache.cache_dir, key), (i, i))
+
+    # Using "a" makes "b" the least recently used.
+    assert cache.lookup("a") is not None
+    cache.store("c", make_mesh_dir(tmp_path, "c", 1000))
+
+    assert cache.lookup("b") is None
+    assert cache.lookup("a") is not None
+    assert cache.lookup("c") is not None
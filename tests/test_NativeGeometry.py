@@ -0,0 +1,56 @@
+import numpy
+from blendmol.NativeGeometry import cylinder_pieces, CYLINDER_SEGMENTS
+from blendmol.PDBParser import PDBStructure
+
+
+def test_cylinder_pieces_skips_zero_length_cylinders():
+    starts = numpy.array([[0, 0, 0], [1, 1, 1]], dtype=numpy.float32)
+    ends = numpy.array([[0, 0, 2], [1, 1, 1]], dtype=numpy.float32)
+    vertices, loops, corners, color_ids = cylinder_pieces(
+        starts, ends, 0.3, numpy.array([4, 5], dtype=numpy.int32)
+    )
+
+    assert numpy.isfinite(vertices).all()
+    assert len(vertices) == 2 * CYLINDER_SEGMENTS
+    assert len(loops) == corners * len(color_ids)
+    assert set(color_ids.tolist()) == set([4])
+
+
+def test_bonds_skip_atoms_at_the_same_place(tmp_path):
+    lines = [
+        "ATOM      1  N  AALA A   1       0.000   0.000   0.000  0.50  0.00           N",
+        "ATOM      2  N  BALA A   1       0.000   0.000   0.000  0.50  0.00           N",
+        "ATOM      3  CA  ALA A   1       1.450   0.000   0.000  1.00  0.00           C",
+    ]
+    filename = tmp_path / "altloc.pdb"
+    filename.write_text("\n".join(lines) + "\nEND\n")
+    bonds = PDBStructure(str(filename)).bonds
+
+    assert bonds.tolist() == [[0, 2], [1, 2]]
+
+
+def test_near_ligands_only_looked_for_if_shown(tmp_path):
+    from types import SimpleNamespace
+    from blendmol.NativeGeometry import get_native_representations
+
+    lines = [
+        "ATOM      1  CA  ALA A   1       0.000   0.000   0.000  1.00  0.00           C",
+        "HETATM    2  C1  LIG A   2       3.000   0.000   0.000  1.00  0.00           C",
+    ]
+    filename = tmp_path / "ligand.pdb"
+    filename.write_text("\n".join(lines) + "\nEND\n")
+    structure = PDBStructure(str(filename))
+
+    def fail(*args, **kwargs):
+        raise AssertionError("select_near_ligands() called")
+
+    structure.select_near_ligands = fail
+    settings = SimpleNamespace(ligand_resnames="", near_ligand_cutoff=8.0)
+    for prefix in ["ligand", "near_ligand", "protein"]:
+        for representation in ["surface", "sticks", "balls", "vdw"]:
+            setattr(settings, prefix + "_" + representation, False)
+    settings.metals_vdw = False
+    settings.ligand_vdw = True
+
+    names = [name for name, _ in get_native_representations(structure, settings)]
+    assert names == ["lig_vdw_A"]
@@ -0,0 +1,45 @@
+import numpy
+from blendmol.NativeSurface import surface_triangles
+
+
+def test_surface_of_a_few_atoms_is_watertight():
+    coords = numpy.array(
+        [[0, 0, 0], [1.5, 0, 0], [2.2, 1.3, 0], [8, 0, 0]], dtype=numpy.float32
+    )
+    radii = numpy.array([1.7, 1.55, 1.52, 1.8], dtype=numpy.float32)
+
+    vertices, triangles, nearest = surface_triangles(coords, radii, 0.5)
+
+    assert len(triangles) > 0
+    assert len(nearest) == len(vertices)
+    assert (nearest >= 0).all()
+
+    # Every edge is used once in each direction, so by exactly two triangles
+    # that wind the same way.
+    directed = numpy.stack(
+        [triangles, numpy.roll(triangles, -1, axis=1)], axis=-1
+    ).reshape(-1, 2)
+    assert len(numpy.unique(directed, axis=0)) == len(directed)
+    edges, counts = numpy.unique(
+        numpy.sort(directed, axis=1), axis=0, return_counts=True
+    )
+    assert (counts == 2).all()
+
+    # The far atom makes its own piece, and the volume inside is positive
+    # (the triangles face out).
+    corners = vertices[triangles].astype(numpy.float64)
+    volume = numpy.einsum(
+        "ij,ij->i", corners[:, 0], numpy.cross(corners[:, 1], corners[:, 2])
+    ).sum()
+    assert volume > 0
+    assert set(nearest.tolist()) == set([0, 1, 2, 3])
+
+
+def test_surface_of_no_atoms_is_empty():
+    vertices, triangles, nearest = surface_triangles(
+        numpy.zeros((0, 3), dtype=numpy.float32), numpy.zeros(0, dtype=numpy.float32)
+    )
+
+    assert vertices.shape == (0, 3)
+    assert triangles.shape == (0, 3)
+    assert len(nearest) == 0
@@ -0,0 +1,28 @@
+import os
+import numpy
+from blendmol.ObjParser import parse_obj, DEFAULT_COLOR
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+def test_parse_obj_reads_vmd_output():
+    mesh = parse_obj(os.path.join(DATA_DIR, "triangles.obj"))
+
+    assert mesh.vertices.shape == (4, 3)
+    assert mesh.vertices[3].tolist() == [1.0, 1.0, 0.0]
+    assert mesh.loop_totals.tolist() == [3, 3, 4, 3]
+    # Negative indices count back from the last vertex.
+    assert mesh.loop_vertex_indices.tolist() == [0, 1, 2, 1, 3, 2, 0, 1, 3, 2, 0, 1, 3]
+    assert mesh.smooth
+
+
+def test_parse_obj_reads_materials_from_moved_mtl():
+    mesh = parse_obj(os.path.join(DATA_DIR, "triangles.obj"))
+
+    # The polygon before any usemtl gets a default material, added last.
+    assert mesh.material_names == ["Material0", "Material1", "None"]
+    assert mesh.material_indices.tolist() == [2, 0, 1, 0]
+    numpy.testing.assert_allclose(
+        mesh.material_colors,
+        [[0.25, 0.5, 0.75, 0.5], [1.0, 0.0, 0.0, 1.0], DEFAULT_COLOR],
+    )
@@ -0,0 +1,47 @@
+import gzip
+import os
+from blendmol.PDBDownload import PDBMirror
+
+
+def make_source(tmp_path, pdb_ids):
+    source_dir = tmp_path / "source"
+    source_dir.mkdir()
+    for pdb_id in pdb_ids:
+        with gzip.open(str(source_dir / (pdb_id.lower() + ".pdb.gz")), "wb") as f:
+            f.write(b"ATOM" + b" " * 1000 + b"\nEND\n")
+    return str(source_dir)
+
+
+def test_evict_keeps_pinned_ids(tmp_path):
+    source = make_source(tmp_path, ["1AAA", "2BBB", "3CCC"])
+    mirror = PDBMirror(str(tmp_path / "mirror"), 1500, source)
+
+    mirror.pin(["1AAA"])
+    first = mirror.get("1AAA")
+    second = mirror.get("2BBB")
+    third = mirror.get("3CCC")
+
+    # Only one more file fits, so 2BBB (not the older, pinned 1AAA) goes.
+    assert os.path.exists(first)
+    assert not os.path.exists(second)
+    assert os.path.exists(third)
+
+    mirror.unpin(["1AAA"])
+    mirror.evict()
+    assert not os.path.exists(first)
+    assert os.path.exists(third)
+
+
+def test_prefetched_ids_stay_until_unpinned(tmp_path):
+    pdb_ids = ["1AAA", "2BBB", "3CCC", "4DDD"]
+    source = make_source(tmp_path, pdb_ids)
+    mirror = PDBMirror(str(tmp_path / "mirror"), 1500, source)
+
+    futures, executor = mirror.prefetch(pdb_ids, max_workers=4)
+    filenames = [futures[pdb_id].result() for pdb_id in pdb_ids]
+    executor.shutdown()
+
+    assert all([os.path.exists(filename) for filename in filenames])
+    mirror.unpin(pdb_ids)
+    mirror.evict()
+    assert len([f for f in filenames if os.path.exists(f)]) == 1
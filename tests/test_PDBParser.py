@@ -0,0 +1,63 @@
+import numpy
+from blendmol.PDBParser import PDBStructure
+
+ATOMS = [
+    "ATOM      1  CA  ALA A   1       0.000   0.000   0.000  1.00  0.00           C",
+    "ATOM      2  CA  ALA B   1       5.000   0.000   0.000  1.00  0.00           C",
+]
+
+# Two sets of chains in the first assembly, each with its own operators, and
+# a second assembly that is ignored.
+REMARK_350 = """REMARK 350 BIOMOLECULE: 1
+REMARK 350 APPLY THE FOLLOWING TO CHAINS: A
+REMARK 350   BIOMT1   1  1.000000  0.000000  0.000000        0.00000
+REMARK 350   BIOMT2   1  0.000000  1.000000  0.000000        0.00000
+REMARK 350   BIOMT3   1  0.000000  0.000000  1.000000        0.00000
+REMARK 350   BIOMT1   2 -1.000000  0.000000  0.000000       10.00000
+REMARK 350   BIOMT2   2  0.000000 -1.000000  0.000000        0.00000
+REMARK 350   BIOMT3   2  0.000000  0.000000  1.000000        0.00000
+REMARK 350 APPLY THE FOLLOWING TO CHAINS: B
+REMARK 350   BIOMT1   1  0.000000 -1.000000  0.000000        5.00000
+REMARK 350   BIOMT2   1  1.000000  0.000000  0.000000        0.00000
+REMARK 350   BIOMT3   1  0.000000  0.000000  1.000000        0.00000
+REMARK 350 BIOMOLECULE: 2
+REMARK 350 APPLY THE FOLLOWING TO CHAINS: A, B
+REMARK 350   BIOMT1   1  1.000000  0.000000  0.000000        0.00000
+REMARK 350   BIOMT2   1  0.000000  1.000000  0.000000        0.00000
+REMARK 350   BIOMT3   1  0.000000  0.000000  1.000000        0.00000
+"""
+
+
+def write_pdb(tmp_path, lines):
+    filename = tmp_path / "test.pdb"
+    filename.write_text("\n".join(lines) + "\nEND\n")
+    return str(filename)
+
+
+def test_biomt_keeps_the_operators_of_each_set_of_chains_apart(tmp_path):
+    structure = PDBStructure(write_pdb(tmp_path, REMARK_350.splitlines() + ATOMS))
+
+    assert [chains for chains, _ in structure.biomt] == [["A"], ["A"], ["B"]]
+    _, matrix = structure.biomt[2]
+    numpy.testing.assert_allclose(
+        matrix,
+        [[0, -1, 0, 5], [1, 0, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]],
+    )
+    for _, matrix in structure.biomt:
+        numpy.testing.assert_allclose(
+            matrix[:3, :3] @ matrix[:3, :3].T, numpy.identity(3), atol=1e-6
+        )
+
+
+def test_biomt_continued_chain_lists(tmp_path):
+    lines = [
+        "REMARK 350 BIOMOLECULE: 1",
+        "REMARK 350 APPLY THE FOLLOWING TO CHAINS: A,",
+        "REMARK 350                    AND CHAINS: B",
+        "REMARK 350   BIOMT1   1  1.000000  0.000000  0.000000        0.00000",
+        "REMARK 350   BIOMT2   1  0.000000  1.000000  0.000000        0.00000",
+        "REMARK 350   BIOMT3   1  0.000000  0.000000  1.000000        0.00000",
+    ]
+    structure = PDBStructure(write_pdb(tmp_path, lines + ATOMS))
+
+    assert [chains for chains, _ in structure.biomt] == [["A", "B"]]
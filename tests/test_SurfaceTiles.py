@@ -0,0 +1,69 @@
+import numpy
+from blendmol.MeshArrays import MeshArrays
+from blendmol.SurfaceTiles import (
+    clip_to_tile,
+    get_tile_name,
+    split_tile_name,
+    stitch_tiles,
+)
+
+
+def make_grid(x_start, x_end, jitter=0.0):
+    # A flat sheet of unit quads at z = 5, from x_start to x_end and y = 1
+    # to 4, with every quad's corners its own (like VMD's OBJ files).
+    rng = numpy.random.default_rng(x_start + 100)
+    xs = numpy.arange(x_start, x_end + 1, dtype=numpy.float32)
+    ys = numpy.arange(1, 5, dtype=numpy.float32)
+    points = numpy.stack(numpy.meshgrid(xs, ys, [5.0], indexing="ij"), axis=-1)
+    points = points.reshape(len(xs), len(ys), 3)
+    points = points + rng.uniform(-jitter, jitter, points.shape)
+    quads = []
+    for i in range(len(xs) - 1):
+        for j in range(len(ys) - 1):
+            quads.append([points[i, j], points[i + 1, j], points[i + 1, j + 1]])
+            quads[-1].append(points[i, j + 1])
+    vertices = numpy.array(quads, dtype=numpy.float32).reshape(-1, 3)
+    return MeshArrays(
+        vertices=vertices,
+        loop_vertex_indices=numpy.arange(len(vertices)),
+        loop_totals=numpy.full(len(quads), 4),
+    )
+
+
+def count_boundary_edges(mesh):
+    corners = mesh.loop_vertex_indices.reshape(-1, 4)
+    edges = numpy.sort(
+        numpy.stack([corners, numpy.roll(corners, -1, axis=1)], axis=-1).reshape(-1, 2),
+        axis=1,
+    )
+    _, counts = numpy.unique(edges, axis=0, return_counts=True)
+    return int((counts == 1).sum())
+
+
+def test_tile_names_round_trip():
+    name = "prot_nuc_surf_A__tile_" + get_tile_name((0, -1, 2))
+
+    assert split_tile_name(name) == ("prot_nuc_surf_A", (0, -1, 2))
+    assert split_tile_name("prot_nuc_surf_A") == ("prot_nuc_surf_A", None)
+
+
+def test_clip_to_tile_keeps_polygons_centered_inside():
+    mesh, cut = clip_to_tile(make_grid(-2, 12).weld(0.001), (0, 0, 0), 10.0)
+
+    assert mesh.num_polygons == 10 * 3
+    assert mesh.vertices[:, 0].min() == 0 and mesh.vertices[:, 0].max() == 10
+    assert sorted(set(mesh.vertices[cut, 0].tolist())) == [0.0, 10.0]
+
+
+def test_stitch_tiles_closes_the_seam():
+    tiles = [
+        ((0, 0, 0), make_grid(-2, 12).weld(0.001)),
+        ((1, 0, 0), make_grid(8, 22, jitter=0.05).weld(0.001)),
+    ]
+
+    mesh = stitch_tiles(tiles, 10.0, 0.5)
+
+    assert mesh.num_polygons == 20 * 3
+    assert mesh.num_vertices == 21 * 4
+    # Only the outline of the sheet is left open.
+    assert count_boundary_edges(mesh) == 2 * (20 + 3)
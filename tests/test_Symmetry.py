@@ -0,0 +1,81 @@
+import numpy
+from blendmol.PDBParser import PDBStructure
+from blendmol.Symmetry import find_chain_copies, kabsch, transform_points
+
+
+def get_rotation(axis, angle):
+    axis = numpy.asarray(axis, dtype=numpy.float64) / numpy.linalg.norm(axis)
+    cross = numpy.array(
+        [[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]]
+    )
+    return (
+        numpy.identity(3)
+        + numpy.sin(angle) * cross
+        + (1 - numpy.cos(angle)) * cross @ cross
+    )
+
+
+def test_kabsch_recovers_a_known_transform():
+    rng = numpy.random.default_rng(0)
+    mobile = rng.uniform(-10, 10, (20, 3))
+    rotation = get_rotation([1, 2, 3], 2.0)
+    target = mobile @ rotation.T + [4.0, -5.0, 6.0]
+
+    matrix = kabsch(mobile, target)
+
+    numpy.testing.assert_allclose(matrix[:3, :3], rotation, atol=1e-9)
+    numpy.testing.assert_allclose(matrix[:3, 3], [4.0, -5.0, 6.0], atol=1e-9)
+    numpy.testing.assert_allclose(matrix[3], [0, 0, 0, 1])
+    numpy.testing.assert_allclose(transform_points(matrix, mobile), target, atol=1e-9)
+
+
+def test_kabsch_never_reflects():
+    rng = numpy.random.default_rng(1)
+    mobile = rng.uniform(-10, 10, (20, 3))
+    target = mobile * [-1.0, 1.0, 1.0]
+
+    matrix = kabsch(mobile, target)
+
+    assert numpy.linalg.det(matrix[:3, :3]) > 0
+
+
+def write_chains(filename, chains):
+    lines = []
+    for chain, coords in chains:
+        for i, xyz in enumerate(coords):
+            name = ["N", "CA", "C", "O"][i % 4]
+            lines.append(
+                "ATOM  %5d  %-3s ALA %s%4d    %8.3f%8.3f%8.3f  1.00  0.00           %s"
+                % (
+                    len(lines) + 1,
+                    name,
+                    chain,
+                    i // 4 + 1,
+                    xyz[0],
+                    xyz[1],
+                    xyz[2],
+                    name[0],
+                )
+            )
+    filename.write_text("\n".join(lines) + "\nEND\n")
+
+
+def test_find_chain_copies(tmp_path):
+    rng = numpy.random.default_rng(2)
+    coords = rng.uniform(-5, 5, (12, 3))
+    rotation = get_rotation([0, 0, 1], numpy.pi / 2)
+    moved = coords @ rotation.T + [20.0, 0.0, 0.0]
+    distorted = moved + rng.uniform(-3, 3, moved.shape)
+    filename = tmp_path / "copies.pdb"
+    write_chains(
+        filename,
+        [("A", coords), ("B", moved), ("C", distorted), ("D", coords[:8])],
+    )
+
+    copies = find_chain_copies(PDBStructure(str(filename)))
+
+    # C has the same atoms as A, but doesn't fit. D has fewer atoms.
+    assert sorted(copies) == ["B"]
+    ref_chain, matrix = copies["B"]
+    assert ref_chain == "A"
+    numpy.testing.assert_allclose(transform_points(matrix, coords), moved, atol=0.01)
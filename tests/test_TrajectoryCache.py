@@ -0,0 +1,58 @@
+import numpy
+from blendmol.MeshArrays import MeshArrays
+from blendmol.TrajectoryCache import FLOAT16_MAX_DELTA, TrajectoryCache
+
+
+def make_mesh(vertices):
+    vertices = numpy.asarray(vertices, dtype=numpy.float32)
+    return MeshArrays(
+        vertices=vertices,
+        loop_vertex_indices=numpy.arange(len(vertices), dtype=numpy.int32),
+        loop_totals=numpy.full(len(vertices) // 3, 3, dtype=numpy.int32),
+        material_indices=numpy.zeros(len(vertices) // 3, dtype=numpy.int32),
+    )
+
+
+def test_float16_deltas_round_trip_within_a_hundredth(tmp_path):
+    rng = numpy.random.default_rng(9)
+    base = rng.uniform(-50, 50, (300, 3))
+    moved = base + rng.uniform(-FLOAT16_MAX_DELTA, FLOAT16_MAX_DELTA, base.shape)
+    moved[0] = base[0] + FLOAT16_MAX_DELTA * 0.999
+
+    cache = TrajectoryCache(str(tmp_path))
+    cache.add_frame("prot_nuc_ribb_A", 0, make_mesh(base))
+    cache.add_frame("prot_nuc_ribb_A", 1, make_mesh(moved))
+    cache.save_manifest()
+
+    assert numpy.load(cache.get_frame_filename("prot_nuc_ribb_A", 1, ".npy")).dtype == (
+        numpy.float16
+    )
+    kind, vertices = TrajectoryCache(str(tmp_path)).load_frame("prot_nuc_ribb_A", 1)
+    assert kind == "deltas"
+    assert numpy.abs(vertices - moved.astype(numpy.float32)).max() < 0.01
+
+
+def test_big_deltas_stay_float32(tmp_path):
+    base = numpy.zeros((3, 3))
+    moved = base + [[FLOAT16_MAX_DELTA * 4, 0.001, 0]]
+
+    cache = TrajectoryCache(str(tmp_path))
+    cache.add_frame("prot_nuc_ribb_A", 0, make_mesh(base))
+    cache.add_frame("prot_nuc_ribb_A", 1, make_mesh(moved))
+
+    assert numpy.load(cache.get_frame_filename("prot_nuc_ribb_A", 1, ".npy")).dtype == (
+        numpy.float32
+    )
+    _, vertices = cache.load_frame("prot_nuc_ribb_A", 1)
+    assert numpy.array_equal(vertices, moved.astype(numpy.float32))
+
+
+def test_new_topology_is_stored_whole(tmp_path):
+    cache = TrajectoryCache(str(tmp_path))
+    cache.add_frame("prot_nuc_surf_A", 0, make_mesh(numpy.eye(3)))
+    cache.add_frame("prot_nuc_surf_A", 1, make_mesh(numpy.ones((6, 3))))
+
+    kind, mesh = cache.load_frame("prot_nuc_surf_A", 1)
+    assert kind == "mesh"
+    assert mesh.num_polygons == 2
+    assert cache.load_frame("prot_nuc_surf_A", 2) == (None, None)
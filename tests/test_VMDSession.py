@@ -0,0 +1,89 @@
+import os
+import pytest
+from blendmol.VMDSession import VMDSessionPool, VMDSessionError
+
+
+class FakePool(VMDSessionPool):
+    """
+    Runs jobs without VMD: a script prints its lines, then fails if its name
+    says so.
+    """
+
+    def __init__(self, scripts):
+        VMDSessionPool.__init__(self, "vmd")
+        self.scripts = scripts
+
+    def run(self, script_filename, timeout=None, on_output=None, cancel=None):
+        lines, fails = self.scripts[script_filename]
+        for line in lines:
+            on_output(line)
+        if fails:
+            raise VMDSessionError("VMD died running " + script_filename)
+
+
+def test_run_all_can_retry_failed_scripts_that_printed_nothing():
+    pool = FakePool(
+        {"a.vmd": (["BLENDMOL_RENDERED a.obj"], False), "b.vmd": ([], True)}
+    )
+    lines = []
+    with pytest.raises(VMDSessionError) as info:
+        pool.run_all(["a.vmd", "b.vmd"], on_output=lines.append)
+
+    assert info.value.failed_scripts == ["b.vmd"]
+    assert info.value.can_retry
+    assert lines == ["BLENDMOL_RENDERED a.obj"]
+
+
+def test_run_all_cannot_retry_failed_scripts_that_printed():
+    pool = FakePool({"a.vmd": (["BLENDMOL_TOTAL 3"], True), "b.vmd": ([], False)})
+    with pytest.raises(VMDSessionError) as info:
+        pool.run_all(["a.vmd", "b.vmd"])
+
+    assert info.value.failed_scripts == ["a.vmd"]
+    assert not info.value.can_retry
+
+
+def write_pdb(filename, resnames):
+    lines = [
+        "HETATM%5d  C1  %3s A%4d    %8.3f   0.000   0.000  1.00  0.00           C"
+        % (i + 1, resname, i + 1, 2.0 * i)
+        for i, resname in enumerate(resnames)
+    ]
+    filename.write_text("\n".join(lines) + "\nEND\n")
+
+
+def test_class_atoms_reset_between_jobs_of_a_persistent_vmd(tmp_path):
+    pytest.importorskip("tkinter")
+    from blendmol.PDBParser import get_class_selection_code
+    from blendmol.VMDSession import VMDSession
+
+    fake_vmd = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "benchmarks",
+        "fake_vmd.py",
+    )
+    class_code = get_class_selection_code([("lig", "not protein and not water")])
+    scripts = []
+    for name, resnames in [("big", ["LIG", "LIG", "LIG"]), ("small", ["LIG"])]:
+        pdb_filename = tmp_path / (name + ".pdb")
+        write_pdb(pdb_filename, resnames)
+        script_filename = tmp_path / (name + ".vmd")
+        script_filename.write_text(
+            "mol new {"
+            + str(pdb_filename)
+            + "}\n"
+            + class_code
+            + '\nputs "CLASS_ATOMS $class_atoms(lig,A)"\n'
+        )
+        scripts.append(str(script_filename))
+
+    session = VMDSession(fake_vmd)
+    try:
+        lines = []
+        for script_filename in scripts:
+            session.run(script_filename, timeout=60, on_output=lines.append)
+    finally:
+        session.close()
+
+    class_atoms = [line for line in lines if line.startswith("CLASS_ATOMS")]
+    assert class_atoms == ["CLASS_ATOMS 0 1 2", "CLASS_ATOMS 0"]